@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Benchmark of the ``FileSyncer._files_to_upload`` diff engines.
+
+Builds ``--files`` synthetic local files and the same number of S3 files
+(``--overlap`` of them shared, ``--changed`` of those with a different
+md5sum) and times each diff engine - the default pure-Python ``dict`` loop,
+the sorted ``merge`` join and, if numpy is installed, the vectorized
+``numpy`` engine - checking that they all find the same files to upload.
+Each engine gets the file metadata mappings ``FileSyncer`` would give it:
+dicts, or with ``--compact-metadata`` (which the ``numpy`` engine implies)
+compact tables. They are built for one engine at a time, so that
+``--files 10000000`` fits in memory; ``--engines`` runs only some engines.
+
+Usage: ``python benchmarks/bench_diff.py [--files 1000000]``
+
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+"""
+
+import argparse
+import gc
+import logging
+import os
+import sys
+import time
+from hashlib import md5
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from s3sfe.diff import require_numpy  # noqa
+from s3sfe.filesyncer import FileSyncer  # noqa
+
+if sys.version_info[0] < 3 or sys.version_info[:2] < (3, 4):
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+try:
+    require_numpy()
+    ENGINES = ['dict', 'merge', 'numpy']
+except RuntimeError:
+    ENGINES = ['dict', 'merge']
+
+
+def local_files(num):
+    for i in range(num):
+        yield (
+            '/home/user/dir%d/file-%d.dat' % (i // 100, i),
+            (i, 1489000000.0 + i, md5(str(i).encode('ascii')).hexdigest())
+        )
+
+
+def s3_files(num, overlap, changed):
+    for i in range(num):
+        path = '/home/user/dir%d/file-%d.dat' % (i // 100, i)
+        if i >= overlap:
+            yield (
+                path.replace('/home/', '/old/'),
+                (i, 1.0, md5(str(i).encode('ascii')).hexdigest())
+            )
+            continue
+        digest = md5(str(-i if i < changed else i).encode('ascii'))
+        yield path, (i, 1489000000.0 + i, digest.hexdigest())
+
+
+def make_files(fs, num, overlap, changed):
+    """build the local and S3 mappings as ``fs`` would hold them"""
+    local = fs._meta_table()
+    for k, v in local_files(num):
+        local[k] = v
+    remote = fs._meta_table()
+    for k, v in s3_files(num, overlap, changed):
+        remote[k] = v
+    return local, remote
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--files', default=1000000, type=int,
+                   help='number of local (and of S3) files')
+    p.add_argument('--overlap', default=0.9, type=float,
+                   help='fraction of files in both local and S3')
+    p.add_argument('--changed', default=0.01, type=float,
+                   help='fraction of files in both, with different md5sums')
+    p.add_argument('--compact-metadata', action='store_true',
+                   default=False,
+                   help='give every engine compact tables, not dicts')
+    p.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES,
+                   help='engines to run (default: all available)')
+    p.add_argument('--diff-max-entries', default=1000000, type=int,
+                   help='in-memory sort limit for the merge engine')
+    args = p.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    expected = None
+    print('%-10s%12s%12s%12s' % ('engine', 'build', 'seconds', 'to upload'))
+    for engine in args.engines:
+        # a real FileSyncer, so that every attribute the diff reads is set;
+        # only its S3 connection is mocked out
+        with patch('s3sfe.filesyncer.S3Wrapper', autospec=True):
+            fs = FileSyncer(
+                'bucket', diff_engine=engine,
+                diff_max_items=args.diff_max_entries,
+                compact_metadata=args.compact_metadata
+            )
+        start = time.time()
+        local, remote = make_files(
+            fs, args.files, int(args.files * args.overlap),
+            int(args.files * args.changed)
+        )
+        built = time.time() - start
+        start = time.time()
+        res = fs._files_to_upload(local, remote)
+        elapsed = time.time() - start
+        res = sorted(res.keys())
+        del local, remote
+        gc.collect()
+        if expected is None:
+            expected = res
+        elif res != expected:
+            raise RuntimeError('%s engine result differs' % engine)
+        print('%-10s%11.2fs%11.2fs%12d' % (engine, built, elapsed, len(res)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Per-path matching cost of :py:class:`s3sfe.pathfilter.PathMatcher`.
+
+Builds exclude lists of increasing size, each an equal mix of literal
+prefixes, ``*.ext`` globs, ``**/name/**`` globs and other globs, and times
+matching a fixed set of synthetic paths (most of which match nothing, the
+worst case) against each. The original ``startswith`` loop over every
+prefix is timed for comparison. Prefixes, extensions and names are bisect or
+set lookups and stay flat as the list grows; other globs and regexes share
+anchored globs are only tried for paths beneath their leading directory.
+Unanchored globs (other than ``*.ext`` and ``**/name``) and regexes share one
+compiled alternation; that is a single match call per path, but its cost
+still grows with the number of those patterns, since :py:mod:`re` is a
+backtracking engine. Matcher construction is not included in the timings.
+
+Usage: ``python benchmarks/bench_exclude.py [--paths 100000]``
+
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from s3sfe.pathfilter import PathMatcher  # noqa
+
+
+def make_patterns(num, other_globs=True):
+    res = []
+    for i in range(num):
+        kind = i % 4
+        if kind == 0:
+            res.append('/home/user%d/excluded/' % i)
+        elif kind == 1:
+            res.append('*.ext%d' % i)
+        elif kind == 2:
+            res.append('**/cache%d/**' % i)
+        elif other_globs:
+            res.append('/srv/app%d/**/*.log' % i)
+        else:
+            res.append('/srv/app%d/' % i)
+    return res
+
+
+def make_paths(num):
+    r = random.Random(42)
+    return [
+        '/home/user%d/dir%d/sub%d/file%d.txt' % (
+            r.randint(0, 10000), r.randint(0, 100), r.randint(0, 100), i
+        ) for i in range(num)
+    ]
+
+
+def legacy_match(patterns, paths):
+    for p in paths:
+        for pattern in patterns:
+            if p.startswith(pattern):
+                break
+
+
+def matcher_match(matcher, paths):
+    for p in paths:
+        matcher.match(p)
+
+
+def measure(func, patterns, paths):
+    start = time.time()
+    func(patterns, paths)
+    return (time.time() - start) / len(paths) * 1000000000.0
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--paths', default=100000, type=int,
+                   help='number of paths to match per measurement')
+    p.add_argument('--counts', default='4,40,400,4000',
+                   help='comma-separated exclude list sizes to test')
+    args = p.parse_args()
+    paths = make_paths(args.paths)
+    print('%-10s%20s%20s%20s' % (
+        'patterns', 'startswith loop', 'PathMatcher', 'no other globs'
+    ))
+    for count in [int(x) for x in args.counts.split(',')]:
+        prefixes = ['/home/user%d/excluded/' % i for i in range(count)]
+        print('%-10d%15.0f ns%15.0f ns%15.0f ns' % (
+            count,
+            measure(legacy_match, prefixes, paths),
+            measure(matcher_match, PathMatcher(make_patterns(count)), paths),
+            measure(
+                matcher_match, PathMatcher(make_patterns(count, False)), paths
+            )
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark for :py:func:`s3sfe.utils.md5_file`.
+
+Hashes a synthetic file of each size class with the original 128-byte read
+loop, ``hashlib.file_digest`` (Python 3.11+), and the current ``md5_file``
+(with and without mmap), and prints MB/s for each. Each measurement hashes
+roughly ``--bytes`` bytes in total; the files are read once beforehand so
+the numbers reflect hashing throughput from the page cache rather than disk.
+
+Usage: ``python benchmarks/bench_md5.py [--sizes 4K,1M,64M] [--bytes 512M]``
+
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from s3sfe.utils import md5_file, parse_size  # noqa
+
+
+def legacy_md5_file(path):
+    """the s3sfe <= 0.1.1 implementation of md5_file"""
+    with open(path, 'rb') as fh:
+        m = hashlib.md5()
+        while True:
+            data = fh.read(128)
+            if not data:
+                break
+            m.update(data)
+        return m.hexdigest()
+
+
+def file_digest_md5(path):
+    with open(path, 'rb') as fh:
+        return hashlib.file_digest(fh, 'md5').hexdigest()
+
+
+def mmap_md5_file(path):
+    return md5_file(path, use_mmap=True)
+
+
+def measure(func, path, size, total_bytes):
+    reps = max(1, total_bytes // max(size, 1))
+    start = time.time()
+    for _ in range(reps):
+        func(path)
+    elapsed = time.time() - start
+    return (size * reps) / elapsed / 1000000.0
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--sizes', default='4K,64K,1M,16M,64M,256M',
+                   help='comma-separated file size classes to test')
+    p.add_argument('--bytes', default='512M', type=parse_size,
+                   help='approximate bytes to hash per measurement')
+    p.add_argument('--skip-legacy', action='store_true', default=False,
+                   help='skip the (slow) 128-byte legacy implementation')
+    args = p.parse_args()
+    funcs = []
+    if not args.skip_legacy:
+        funcs.append(('legacy-128B', legacy_md5_file))
+    if hasattr(hashlib, 'file_digest'):
+        funcs.append(('file_digest', file_digest_md5))
+    funcs.append(('md5_file', md5_file))
+    funcs.append(('md5_file-mmap', mmap_md5_file))
+    tmpdir = tempfile.mkdtemp(prefix='s3sfe-bench-')
+    try:
+        print('%-10s' % 'size' + ''.join('%16s' % n for n, _ in funcs))
+        for label in args.sizes.split(','):
+            size = parse_size(label)
+            path = os.path.join(tmpdir, label)
+            with open(path, 'wb') as fh:
+                fh.write(os.urandom(size))
+            legacy_md5_file(path)
+            row = '%-10s' % label
+            for _, func in funcs:
+                row += '%11.1f MB/s' % measure(func, path, size, args.bytes)
+            print(row)
+            os.unlink(path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
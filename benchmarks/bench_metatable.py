@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Memory and lookup benchmark for :py:class:`s3sfe.metatable.FileMetaTable`.
+
+Builds ``--files`` synthetic (path, (size, mtime, md5sum)) entries, spread
+over ``--per-dir`` files per directory, into both a plain dict (as
+``FileSyncer`` uses by default) and a ``FileMetaTable``, and reports the
+memory each holds (measured with :py:mod:`tracemalloc`, so Python 3.4+) and
+the time to look up every entry.
+
+Usage: ``python benchmarks/bench_metatable.py [--files 1000000]``
+
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from hashlib import md5
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from s3sfe.metatable import FileMetaTable  # noqa
+
+
+def entries(num, per_dir):
+    for i in range(num):
+        yield (
+            '/home/user/projects/dir%d/sub%d/file-%d.dat' % (
+                i // (per_dir * 10), i // per_dir, i
+            ),
+            (i * 37, 1489000000.0 + i / 7.0,
+             md5(str(i).encode('ascii')).hexdigest())
+        )
+
+
+def build(cls, num, per_dir):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    res = cls()
+    for k, v in entries(num, per_dir):
+        res[k] = v
+    elapsed = time.time() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return res, size, elapsed
+
+
+def lookup(table, num, per_dir):
+    start = time.time()
+    for k, _ in entries(num, per_dir):
+        table[k]
+    return time.time() - start
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--files', default=1000000, type=int,
+                   help='number of entries')
+    p.add_argument('--per-dir', default=100, type=int,
+                   help='number of files per directory')
+    args = p.parse_args()
+    print('%-15s%14s%14s%12s%12s' % (
+        'type', 'memory', 'bytes/entry', 'build', 'lookup'
+    ))
+    for cls in [dict, FileMetaTable]:
+        table, size, build_s = build(cls, args.files, args.per_dir)
+        lookup_s = lookup(table, args.files, args.per_dir)
+        print('%-15s%11.1f MB%14.0f%11.2fs%11.2fs' % (
+            cls.__name__, size / 1000000.0, size / float(args.files),
+            build_s, lookup_s
+        ))
+        del table
+
+
+if __name__ == '__main__':
+    main()
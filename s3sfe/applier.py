@@ -0,0 +1,231 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import sys
+import argparse
+import logging
+
+from s3sfe.version import PROJECT_URL, VERSION
+from s3sfe.compression import CODECS
+from s3sfe.filesyncer import FileSyncer
+from s3sfe.journal import default_journal_path
+from s3sfe.plan import Plan
+from s3sfe.ratelimit import RateSchedule
+from s3sfe.scheduling import UPLOAD_ORDERS
+from s3sfe.transfer import MB, parse_transfer_profile
+from s3sfe.utils import (
+    set_log_info, set_log_debug, read_keyfile, parse_size, positive_int,
+    positive_size, fraction
+)
+
+FORMAT = "[%(asctime)s %(levelname)s] %(message)s"
+logging.basicConfig(level=logging.WARNING, format=FORMAT)
+logger = logging.getLogger()
+
+# suppress boto3 internal logging below WARNING level
+boto3_log = logging.getLogger("boto3")
+boto3_log.setLevel(logging.WARNING)
+boto3_log.propagate = True
+
+# suppress botocore internal logging below WARNING level
+botocore_log = logging.getLogger("botocore")
+botocore_log.setLevel(logging.WARNING)
+botocore_log.propagate = True
+
+# suppress s3transfer internal logging below WARNING level
+s3transfer_log = logging.getLogger("s3transfer")
+s3transfer_log.setLevel(logging.WARNING)
+s3transfer_log.propagate = True
+
+
+def parse_args(argv):
+    """
+    Use Argparse to parse command-line arguments.
+
+    :param argv: list of arguments to parse (``sys.argv[1:]``)
+    :type argv: list
+    :return: parsed arguments
+    :rtype: :py:class:`argparse.Namespace`
+    """
+    p = argparse.ArgumentParser(
+        description='s3sfe (S3 Sync Filelist Encrypted) plan application '
+                    'script; execute a plan written by s3sfe --plan - <%s>'
+                    % PROJECT_URL
+    )
+    p.add_argument('-d', '--dry-run', dest='dry_run', action='store_true',
+                   default=False,
+                   help='do not actually upload; only log what would be done')
+    p.add_argument('-v', '--verbose', dest='verbose', action='count',
+                   default=0,
+                   help='verbose output. specify twice for debug-level output.')
+    p.add_argument('-V', '--version', action='version',
+                   version='s3sfe v%s <%s>' % (VERSION, PROJECT_URL))
+    p.add_argument('-s', '--summary', dest='summary', action='store_true',
+                   default=False, help='print summary/stats at end of run')
+    p.add_argument('-f', '--key-file', dest='key_file', action='store',
+                   type=str, default=None,
+                   help='path to AES256 key file. This should be a binary file'
+                        ' containing a 32-byte encryption key to use for SSE-C')
+    p.add_argument('--upload-workers', dest='upload_workers', action='store',
+                   type=positive_int, default=1,
+                   help='number of files to upload concurrently (default: 1)')
+    p.add_argument('--upload-order', dest='upload_order', action='store',
+                   choices=UPLOAD_ORDERS, default='path',
+                   help='order in which to start uploads; see s3sfe --help '
+                        '(default: path)')
+    p.add_argument('--transfer-profile', dest='transfer_profiles',
+                   action='append', type=parse_transfer_profile,
+                   default=None,
+                   help='override multipart transfer settings for one file '
+                        'size class; see s3sfe --help. May be given multiple '
+                        'times.')
+    p.add_argument('--max-upload-rate', dest='max_upload_rate',
+                   action='store', type=RateSchedule.parse, default=None,
+                   help='maximum total upload bandwidth, i.e. "50MB/s", or a '
+                        'time-of-day schedule; see s3sfe --help '
+                        '(default: unlimited)')
+    p.add_argument('--bundle-threshold', dest='bundle_threshold',
+                   action='store', type=parse_size, default=None,
+                   help='pack files smaller than this size, e.g. "16K", into '
+                        'bundle objects of about --bundle-size each, instead '
+                        'of uploading each as its own object; much faster '
+                        'and cheaper for many small files. Bundled files are '
+                        'restored individually with ranged GETs. '
+                        '(default: disabled)')
+    p.add_argument('--bundle-size', dest='bundle_size', action='store',
+                   type=positive_size, default=64 * MB,
+                   help='with --bundle-threshold, approximate size of each '
+                        'bundle (default: 64M)')
+    p.add_argument('--bundle-compact-ratio', dest='bundle_compact',
+                   action='store', type=fraction, default=0.5,
+                   help='with --bundle-threshold, repack bundles once at '
+                        'least this fraction of their data belongs to files '
+                        'that have since changed or been deleted '
+                        '(default: 0.5)')
+    p.add_argument('--resumable-uploads', dest='resumable_uploads',
+                   action='store_true', default=False,
+                   help='record the progress of multipart uploads in a local '
+                        'journal, so that a later run resumes an interrupted '
+                        'upload of an unchanged file instead of starting it '
+                        'again')
+    p.add_argument('--upload-journal', dest='upload_journal', action='store',
+                   type=str, default=None,
+                   help='with --resumable-uploads, path to the upload journal '
+                        'database (default: '
+                        '$XDG_CACHE_HOME/s3sfe/uploads.sqlite)')
+    p.add_argument('--abort-orphaned-uploads', dest='abort_orphaned_uploads',
+                   action='store_true', default=False,
+                   help='abort incomplete multipart uploads under the prefix '
+                        'that are over a day old and not being resumed, so '
+                        'that their parts stop incurring storage charges')
+    p.add_argument('--copy-duplicates', dest='copy_duplicates',
+                   action='store_true', default=False,
+                   help='copy files within S3 instead of uploading them when '
+                        'a file with the same content is already in S3 '
+                        'under another path (i.e. after a directory is '
+                        'renamed) or is being uploaded in the same run')
+    p.add_argument('--compress', dest='compression', action='store',
+                   choices=CODECS, default=None,
+                   help='compress files with this codec as they are uploaded, '
+                        'except small files and files that already look '
+                        'compressed (by extension or byte entropy); they are '
+                        'decompressed again when restored. "zstd" requires '
+                        'the zstandard package')
+    p.add_argument('--estimate', dest='estimate', action='store_true',
+                   default=False,
+                   help='do not apply the plan; only print a summary of it, '
+                        'with the estimated upload time at --rate')
+    p.add_argument('--rate', dest='rate', action='store', type=parse_size,
+                   default=None,
+                   help='with --estimate, expected upload throughput per '
+                        'second, e.g. "10M"')
+    p.add_argument('PLAN_PATH', action='store', type=str,
+                   help='Path to the plan file written by s3sfe --plan')
+    args = p.parse_args(argv)
+    if args.key_file is None and not args.estimate:
+        raise RuntimeError('Error: -f|--key-file must be specified.')
+    return args
+
+
+def main(args=None):
+    """
+    Main entry point
+    """
+    # parse args
+    if args is None:
+        args = parse_args(sys.argv[1:])
+
+    # set logging level
+    if args.verbose > 1:
+        set_log_debug(logger)
+    elif args.verbose == 1:
+        set_log_info(logger)
+
+    plan = Plan.read(args.PLAN_PATH)
+    if args.estimate:
+        print(plan.summary(rate=args.rate))
+        return
+    upload_journal_path = None
+    if args.resumable_uploads:
+        upload_journal_path = args.upload_journal
+        if upload_journal_path is None:
+            upload_journal_path = default_journal_path()
+    s = FileSyncer(
+        plan.bucket_name,
+        prefix=plan.prefix,
+        dry_run=args.dry_run,
+        ssec_key=read_keyfile(args.key_file),
+        upload_workers=args.upload_workers,
+        transfer_profiles=args.transfer_profiles,
+        max_upload_rate=args.max_upload_rate,
+        upload_order=args.upload_order,
+        bundle_threshold=args.bundle_threshold,
+        bundle_size=args.bundle_size,
+        bundle_compact=args.bundle_compact,
+        upload_journal_path=upload_journal_path,
+        abort_orphaned_uploads=args.abort_orphaned_uploads,
+        copy_duplicates=args.copy_duplicates,
+        compression=args.compression
+    )
+    stats = s.apply(plan)
+    if args.summary:
+        print(stats.summary)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    main(args)
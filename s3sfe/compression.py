@@ -0,0 +1,252 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import math
+import os
+import zlib
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+#: Names of the codecs files may be compressed with before upload
+CODECS = ['zlib', 'lzma', 'zstd']
+
+#: Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 64 * 1024
+
+#: Number of bytes from the start of a file used to estimate its entropy
+SAMPLE_SIZE = 64 * 1024
+
+#: Files whose sample has more bits of entropy per byte than this are taken
+#: to be already compressed (or encrypted), and are not compressed again
+MAX_ENTROPY = 7.5
+
+#: Extensions (lowercase) of file formats that are already compressed
+COMPRESSED_EXTENSIONS = frozenset([
+    '.7z', '.aac', '.apk', '.avi', '.br', '.bz2', '.deb', '.docx', '.epub',
+    '.flac', '.gif', '.gz', '.heic', '.jar', '.jpeg', '.jpg', '.lz', '.lz4',
+    '.lzma', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4', '.odt', '.ogg',
+    '.opus', '.png', '.pptx', '.rar', '.rpm', '.tbz2', '.tgz', '.txz',
+    '.webm', '.webp', '.whl', '.xlsx', '.xz', '.zip', '.zst'
+])
+
+
+def _lzma():
+    """
+    Import and return the lzma module, which is only in the standard library
+    in Python 3.3+.
+
+    :raises: RuntimeError if lzma isn't available
+    """
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise RuntimeError('The lzma codec requires Python 3.3+ or the '
+                               'backports.lzma package')
+    return lzma
+
+
+def _zstd():
+    """
+    Import and return zstandard, which is only needed by the ``zstd`` codec.
+
+    :raises: RuntimeError if zstandard isn't installed
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('The zstd codec requires zstandard; please '
+                           '"pip install zstandard"')
+    return zstandard
+
+
+def require_codec(codec):
+    """
+    Raise an exception if ``codec`` isn't a known codec, or needs a module
+    that can't be imported.
+
+    :param codec: codec name, one of :py:const:`~.CODECS`
+    :type codec: str
+    :raises: ValueError if the codec is unknown, RuntimeError if it isn't
+      available
+    """
+    if codec not in CODECS:
+        raise ValueError('Unknown compression codec: %s' % codec)
+    if codec == 'lzma':
+        _lzma()
+    elif codec == 'zstd':
+        _zstd()
+
+
+def compressor(codec):
+    """
+    Return a new streaming compressor for ``codec``; an object with
+    ``compress(data)`` and ``flush()`` methods, like
+    :py:func:`zlib.compressobj`.
+
+    :param codec: codec name, one of :py:const:`~.CODECS`
+    :type codec: str
+    """
+    require_codec(codec)
+    if codec == 'zlib':
+        return zlib.compressobj(6)
+    if codec == 'lzma':
+        return _lzma().LZMACompressor()
+    return _zstd().ZstdCompressor().compressobj()
+
+
+def decompressor(codec):
+    """
+    Return a new streaming decompressor for ``codec``; an object with a
+    ``decompress(data)`` method, like :py:func:`zlib.decompressobj`.
+
+    :param codec: codec name, one of :py:const:`~.CODECS`
+    :type codec: str
+    """
+    require_codec(codec)
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    if codec == 'lzma':
+        return _lzma().LZMADecompressor()
+    return _zstd().ZstdDecompressor().decompressobj()
+
+
+def byte_entropy(data):
+    """
+    Return the Shannon entropy of ``data``, in bits per byte; from 0 for a
+    single repeated byte value up to 8 for uniformly random bytes.
+
+    :param data: data to measure
+    :type data: bytes
+    :rtype: float
+    """
+    if len(data) == 0:
+        return 0.0
+    total = float(len(data))
+    return -sum(
+        (n / total) * math.log(n / total, 2)
+        for n in Counter(bytearray(data)).values()
+    )
+
+
+def should_compress(path, size_b):
+    """
+    Decide whether a file is worth compressing before upload. Files smaller
+    than :py:const:`~.MIN_COMPRESS_SIZE`, files with an extension in
+    :py:const:`~.COMPRESSED_EXTENSIONS`, and files whose first
+    :py:const:`~.SAMPLE_SIZE` bytes have more than :py:const:`~.MAX_ENTROPY`
+    bits of entropy per byte are not.
+
+    :param path: path to the file on disk
+    :type path: str
+    :param size_b: size of the file in bytes
+    :type size_b: int
+    :rtype: bool
+    """
+    if size_b < MIN_COMPRESS_SIZE:
+        return False
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    try:
+        with open(path, 'rb') as fh:
+            sample = fh.read(SAMPLE_SIZE)
+    except (IOError, OSError):
+        # let the upload itself report the error
+        return False
+    entropy = byte_entropy(sample)
+    if entropy > MAX_ENTROPY:
+        logger.debug('Not compressing %s; entropy %.2f bits/byte', path,
+                     entropy)
+        return False
+    return True
+
+
+class CompressingReader(object):
+    """
+    Read-only, non-seekable file-like object returning the compressed
+    contents of another file object, compressing it a chunk at a time as it
+    is read, so that a file can be compressed while it is streamed to S3
+    without holding it in memory or writing it to disk.
+    """
+
+    #: Number of bytes read from the underlying file at a time
+    chunk_size = 1024 * 1024
+
+    def __init__(self, fileobj, codec):
+        """
+        :param fileobj: file object to read uncompressed data from
+        :type fileobj: file
+        :param codec: codec name, one of :py:const:`~.CODECS`
+        :type codec: str
+        """
+        self._fh = fileobj
+        self._compressor = compressor(codec)
+        self._buf = b''
+        self._eof = False
+        #: Number of uncompressed bytes read from the underlying file
+        self.bytes_in = 0
+        #: Number of compressed bytes returned
+        self.bytes_out = 0
+
+    def read(self, size=-1):
+        """
+        Return up to ``size`` bytes of compressed data, or all the rest of it
+        if ``size`` is negative. An empty result means the end of the data.
+
+        :param size: maximum number of bytes to return
+        :type size: int
+        :rtype: bytes
+        """
+        while not self._eof and (size is None or size < 0 or
+                                 len(self._buf) < size):
+            data = self._fh.read(self.chunk_size)
+            if len(data) == 0:
+                self._buf += self._compressor.flush()
+                self._eof = True
+            else:
+                self.bytes_in += len(data)
+                self._buf += self._compressor.compress(data)
+        if size is None or size < 0:
+            res, self._buf = self._buf, b''
+        else:
+            res, self._buf = self._buf[:size], self._buf[size:]
+        self.bytes_out += len(res)
+        return res
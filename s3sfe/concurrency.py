@@ -0,0 +1,236 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import random
+import threading
+import time
+
+from s3sfe.utils import dtnow
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempt):
+    """
+    Return the number of seconds to wait before retrying a throttled request
+    for the ``attempt``-th time; exponential with full jitter, capped at 20
+    seconds.
+
+    :param attempt: number of times the request has been throttled
+    :type attempt: int
+    :return: seconds to sleep
+    :rtype: float
+    """
+    return random.uniform(0, min(20.0, 0.1 * (2 ** attempt)))
+
+
+class AdaptiveLimiter(object):
+    """
+    AIMD (additive increase, multiplicative decrease) limit on the number of
+    requests of one kind in flight at once, shared by all the threads making
+    them.
+
+    The limit starts at ``initial`` and is re-evaluated after each window of
+    ``limit`` completed requests. It doubles ("slow start") while each window's
+    throughput is better than the last, until throughput first stops
+    improving; after that it grows by one per improving window, and probes one
+    higher every :py:attr:`~.probe_windows` windows without improvement. When a
+    request is throttled or times out the limit is halved, at most once per
+    window (requests already in flight when the limit was cut don't cut it
+    again), and the request is retried after a jittered exponential backoff.
+
+    Every change of limit is recorded in :py:attr:`~.history`.
+    """
+
+    #: relative throughput gain that counts as an improvement
+    improvement = 0.05
+
+    #: number of windows without improvement after which to try one higher
+    probe_windows = 4
+
+    def __init__(self, name, max_limit, initial=None, retryable=None,
+                 max_retries=10):
+        """
+        :param name: name of the kind of request, for logging
+        :type name: str
+        :param max_limit: maximum number of requests in flight
+        :type max_limit: int
+        :param initial: initial number of requests in flight; defaults to a
+          quarter of ``max_limit``
+        :type initial: int
+        :param retryable: callable taking an exception and returning whether
+          it means we are sending requests too quickly (i.e. throttling or a
+          timeout), so should back off and retry; if None, nothing is retried
+        :type retryable: callable
+        :param max_retries: maximum number of times to retry one request
+        :type max_retries: int
+        """
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        if initial is None:
+            initial = self.max_limit // 4
+        self.limit = min(self.max_limit, max(1, initial))
+        self._retryable = retryable
+        self.max_retries = max_retries
+        self.history = [(dtnow(), self.limit)]
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._epoch = 0
+        self._slow_start = True
+        self._last_rate = None
+        self._held = 0
+        self._start_window()
+
+    def _start_window(self):
+        """
+        Begin a new throughput measurement window. Must hold ``self._cond``.
+        """
+        self._window_start = time.time()
+        self._window_done = 0
+        self._window_bytes = 0
+
+    def _set_limit(self, limit):
+        """
+        Change the limit and record it. Must hold ``self._cond``.
+        """
+        limit = min(self.max_limit, max(1, limit))
+        if limit == self.limit:
+            return
+        logger.debug('%s concurrency %d -> %d', self.name, self.limit, limit)
+        self.limit = limit
+        self.history.append((dtnow(), limit))
+        self._cond.notify_all()
+
+    def acquire(self):
+        """
+        Block until a request may be started.
+
+        :return: token to pass to :py:meth:`~.release`
+        :rtype: int
+        """
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self, token, nbytes=0, throttled=False):
+        """
+        Record the end of a request started with :py:meth:`~.acquire`.
+
+        :param token: return value of :py:meth:`~.acquire`
+        :type token: int
+        :param nbytes: bytes transferred by the request, if any; throughput is
+          measured in bytes if any request transfers any, otherwise in requests
+        :type nbytes: int
+        :param throttled: whether the request was throttled or timed out
+        :type throttled: bool
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+            if throttled:
+                if token == self._epoch:
+                    self._epoch += 1
+                    self._slow_start = False
+                    self._last_rate = None
+                    self._held = 0
+                    self._set_limit(self.limit // 2)
+                    logger.warning('Throttled by S3; reducing %s concurrency '
+                                   'to %d', self.name, self.limit)
+                    self._start_window()
+                return
+            self._window_done += 1
+            self._window_bytes += nbytes
+            if self._window_done >= self.limit:
+                self._end_window()
+
+    def _end_window(self):
+        """
+        Adjust the limit based on the throughput of the window just finished.
+        Must hold ``self._cond``.
+        """
+        elapsed = max(time.time() - self._window_start, 1e-6)
+        rate = (self._window_bytes or self._window_done) / elapsed
+        last = self._last_rate
+        self._last_rate = rate
+        self._start_window()
+        if last is None or rate > last * (1 + self.improvement):
+            self._held = 0
+            if self._slow_start:
+                self._set_limit(self.limit * 2)
+            else:
+                self._set_limit(self.limit + 1)
+            return
+        self._slow_start = False
+        self._held += 1
+        if self._held >= self.probe_windows:
+            self._held = 0
+            self._set_limit(self.limit + 1)
+
+    def run(self, func, args=(), nbytes=0):
+        """
+        Call ``func(*args)`` once a request may be started, retrying it with
+        backoff if it raises a retryable exception. Any other exception, or a
+        retryable one after ``max_retries`` retries, is raised.
+
+        :param func: function making the request
+        :type func: callable
+        :param args: positional arguments to ``func``
+        :type args: tuple
+        :param nbytes: bytes the request transfers
+        :type nbytes: int
+        :return: the return value of ``func``
+        """
+        attempt = 0
+        while True:
+            token = self.acquire()
+            try:
+                res = func(*args)
+            except Exception as ex:
+                if self._retryable is None or not self._retryable(ex):
+                    self.release(token)
+                    raise
+                self.release(token, throttled=True)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                time.sleep(backoff(attempt))
+                continue
+            self.release(token, nbytes=nbytes)
+            return res
@@ -0,0 +1,543 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import heapq
+import logging
+import tempfile
+from binascii import hexlify
+
+try:
+    import cPickle as pickle
+except ImportError:  # python 3
+    import pickle
+
+from .metatable import FileMetaTable
+
+logger = logging.getLogger(__name__)
+
+#: local file is not in S3, or its md5sum differs; it needs uploading
+UPLOAD = 'upload'
+
+#: local file is in S3 with the same md5sum
+UNCHANGED = 'unchanged'
+
+#: file is in S3 but not (or no longer) present locally
+REMOTE_ONLY = 'remote-only'
+
+#: Maximum difference, in seconds, between a local file's mtime and the one
+#: recorded in S3 for them to be considered the same. Not zero, because
+#: python 2 rounds floats to 12 significant digits when converting them to
+#: strings for S3 object metadata.
+MTIME_TOLERANCE = 0.01
+
+
+def same_size_mtime(size, mtime, s3_meta):
+    """
+    Return whether a local file's size and mtime match the metadata recorded
+    for it in S3, which also has an md5sum; if so, the quick ``--compare``
+    modes trust that the file is unchanged, without hashing it.
+
+    :param size: local file size in bytes
+    :type size: int
+    :param mtime: local file modification time as a float timestamp
+    :type mtime: float
+    :param s3_meta: (size, mtime, md5sum) 3-tuple of the file in S3, or None
+    :type s3_meta: tuple
+    :rtype: bool
+    """
+    return (
+        s3_meta is not None and s3_meta[2] is not None and
+        size == s3_meta[0] and abs(mtime - s3_meta[1]) <= MTIME_TOLERANCE
+    )
+
+
+class ExternalSorter(object):
+    """
+    Sort a stream of ``(key, value)`` pairs by key, holding at most
+    ``max_items`` of them in memory. Whenever the in-memory buffer fills up it
+    is sorted and written out to a temporary file as a "run"; iterating the
+    sorter then does an n-way merge of all runs (plus whatever is still
+    buffered), reading each run back sequentially.
+
+    Keys must be unique and mutually comparable, as file paths are. Values
+    must be picklable. Temporary files are deleted when the sorter is closed
+    or garbage collected.
+    """
+
+    def __init__(self, max_items=1000000, tmpdir=None):
+        """
+        :param max_items: maximum number of pairs to buffer in memory before
+          spilling a sorted run to disk
+        :type max_items: int
+        :param tmpdir: directory to write runs to; defaults to the system
+          temporary directory
+        :type tmpdir: str
+        """
+        self._max_items = max(1, max_items)
+        self._tmpdir = tmpdir
+        self._buffer = []
+        self._runs = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def spilled(self):
+        """
+        Return the number of sorted runs written to disk so far.
+
+        :rtype: int
+        """
+        return len(self._runs)
+
+    def add(self, key, value):
+        """
+        Add one pair to the sorter.
+
+        :param key: sort key (i.e. file path)
+        :param value: value to return alongside the key
+        """
+        self._buffer.append((key, value))
+        self._count += 1
+        if len(self._buffer) >= self._max_items:
+            self._spill()
+
+    def extend(self, items):
+        """
+        Add every ``(key, value)`` pair from an iterable.
+
+        :param items: pairs to add
+        :type items: iterable
+        """
+        for k, v in items:
+            self.add(k, v)
+
+    def _spill(self):
+        """
+        Sort the in-memory buffer and write it to a new temporary file.
+        """
+        self._buffer.sort()
+        f = tempfile.TemporaryFile(dir=self._tmpdir)
+        p = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+        for item in self._buffer:
+            p.dump(item)
+            # don't let the pickler memoize every item it writes
+            p.clear_memo()
+        f.seek(0)
+        self._runs.append(f)
+        logger.debug('Spilled run %d of %d items to disk',
+                     len(self._runs), len(self._buffer))
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(f):
+        """
+        Generator yielding every pair in one run file, in order.
+        """
+        u = pickle.Unpickler(f)
+        while True:
+            try:
+                yield u.load()
+            except EOFError:
+                return
+
+    def __iter__(self):
+        """
+        Yield every pair added so far, in key order. Once anything has been
+        spilled to disk, the sorter can only be iterated once.
+        """
+        self._buffer.sort()
+        if len(self._runs) == 0:
+            return iter(self._buffer)
+        return heapq.merge(
+            *([self._read_run(f) for f in self._runs] + [self._buffer])
+        )
+
+    def close(self):
+        """
+        Delete any temporary files and drop buffered pairs.
+        """
+        for f in self._runs:
+            f.close()
+        self._runs = []
+        self._buffer = []
+
+
+def sorted_items(items, max_items=1000000, tmpdir=None):
+    """
+    Return an :py:class:`~.ExternalSorter` over the ``(key, value)`` pairs
+    of ``items`` (either a mapping or an iterable of pairs).
+
+    :param items: mapping or iterable of pairs to sort
+    :param max_items: maximum number of pairs to hold in memory
+    :type max_items: int
+    :param tmpdir: directory to write sorted runs to
+    :type tmpdir: str
+    :rtype: ExternalSorter
+    """
+    if hasattr(items, 'items'):
+        items = items.items()
+    s = ExternalSorter(max_items=max_items, tmpdir=tmpdir)
+    s.extend(items)
+    return s
+
+
+def merge_diff(local_files, s3_files, size_mtime=False):
+    """
+    Compare two path-sorted streams of ``(path, meta)`` pairs, where ``meta``
+    is a 3-tuple of (file size in bytes, file modification time as a float
+    timestamp, and file md5sum as a hex string), with a merge join. Only one
+    entry from each stream is held at a time.
+
+    Yields a ``(action, path, local_meta, s3_meta)`` 4-tuple for every path in
+    either stream, in path order, where ``action`` is one of
+    :py:data:`~.UPLOAD`, :py:data:`~.UNCHANGED` or :py:data:`~.REMOTE_ONLY`.
+    ``local_meta`` is None for remote-only files and ``s3_meta`` is None for
+    files not in S3. Files are compared by md5sum, exactly as in
+    :py:meth:`s3sfe.filesyncer.FileSyncer._files_to_upload`, and if
+    ``size_mtime`` is True, also by size and mtime (see
+    :py:func:`~.same_size_mtime`).
+
+    :param local_files: local files, sorted by path
+    :type local_files: iterable
+    :param s3_files: S3 files, sorted by path
+    :type s3_files: iterable
+    :param size_mtime: whether files whose size or mtime differ from S3 need
+      uploading even if their md5sums match
+    :type size_mtime: bool
+    """
+    local_files = iter(local_files)
+    s3_files = iter(s3_files)
+    done = object()
+    local = next(local_files, done)
+    remote = next(s3_files, done)
+    while local is not done or remote is not done:
+        if remote is done or (local is not done and local[0] < remote[0]):
+            yield UPLOAD, local[0], local[1], None
+            local = next(local_files, done)
+        elif local is done or remote[0] < local[0]:
+            yield REMOTE_ONLY, remote[0], None, remote[1]
+            remote = next(s3_files, done)
+        else:
+            if local[1][2] == remote[1][2] and (
+                not size_mtime or
+                same_size_mtime(local[1][0], local[1][1], remote[1])
+            ):
+                yield UNCHANGED, local[0], local[1], remote[1]
+            else:
+                yield UPLOAD, local[0], local[1], remote[1]
+            local = next(local_files, done)
+            remote = next(s3_files, done)
+
+
+def _numpy():
+    """
+    Import and return numpy, which is only needed by the ``numpy`` diff
+    engine and so isn't a hard dependency.
+
+    :raises: RuntimeError if numpy isn't installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('The numpy diff engine requires numpy; please '
+                           '"pip install numpy"')
+    return numpy
+
+
+def require_numpy():
+    """
+    Raise RuntimeError if numpy, needed by :py:func:`~.numpy_diff`, can't be
+    imported.
+    """
+    _numpy()
+
+
+class TableColumns(object):
+    """
+    numpy views of the columns of a :py:class:`~s3sfe.metatable.FileMetaTable`
+    (see :py:meth:`~s3sfe.metatable.FileMetaTable.columns`), sharing its
+    memory rather than copying it: ``hashes``, ``dirs``, ``starts`` and
+    ``lengths`` of the basenames in ``names``, ``sizes``, ``mtimes``,
+    ``digests`` (each 16-byte md5 digest as two 64-bit words) and ``slots``.
+    Rows whose md5sum isn't a lowercase hex digest are flagged in ``odd``.
+    """
+
+    def __init__(self, np, table):
+        """
+        :param np: the numpy module
+        :param table: table to view
+        :type table: s3sfe.metatable.FileMetaTable
+        """
+        cols = table.columns()
+        self.np = np
+        self.table = table
+        self.dir_names = cols['dirs']
+        self.dir_index = cols['dir_index']
+        self.names = cols['names']
+        self.bytes_keys = cols['bytes_keys']
+        self.hashes = self._view(np, cols['hash'])
+        self.dirs = self._view(np, cols['dir'])
+        self.sizes = self._view(np, cols['size'])
+        self.mtimes = self._view(np, cols['mtime'])
+        self.slots = self._view(np, cols['slots'])
+        ends = self._view(np, cols['name_end']).astype(np.int64)
+        self.starts = np.zeros(len(ends), dtype=np.int64)
+        self.starts[1:] = ends[:-1]
+        self.lengths = ends - self.starts
+        self.digests = np.zeros((0, 2), dtype=np.uint64)
+        if len(ends) > 0:
+            self.digests = np.frombuffer(
+                cols['md5'], dtype=np.uint64
+            ).reshape((len(ends), 2))
+        self.odd = np.zeros(len(ends), dtype=bool)
+        self.odd[list(cols['odd_md5'].keys())] = True
+
+    @staticmethod
+    def _view(np, column):
+        if len(column) == 0:
+            return np.zeros(0, dtype=column.typecode)
+        return np.frombuffer(column, dtype=column.typecode)
+
+    def md5sum(self, row):
+        """
+        Return the md5sum of one row, as stored.
+
+        :param row: row number
+        :type row: int
+        :rtype: str
+        """
+        return self.table.row_value(row)[2]
+
+    def paths(self, rows):
+        """
+        Return the paths of the given rows. Their basenames are gathered
+        into one buffer, separated by NULs (which paths can't contain), and
+        decoded at once.
+
+        :param rows: row numbers
+        :type rows: numpy.ndarray
+        :rtype: list
+        """
+        np = self.np
+        if len(rows) == 0:
+            return []
+        lengths = self.lengths[rows] + 1
+        offsets = np.cumsum(lengths) - lengths
+        src = np.repeat(self.starts[rows] - offsets, lengths)
+        src += np.arange(len(src))
+        names = np.zeros(1, dtype=np.uint8)
+        if len(self.names) > 0:
+            names = np.frombuffer(self.names, dtype=np.uint8)
+        np.minimum(src, len(names) - 1, out=src)
+        buf = names[src]
+        buf[offsets + lengths - 1] = 0
+        names = buf.tobytes()
+        if self.bytes_keys:
+            names = names.split(b'\0')
+        else:
+            names = names.decode('utf-8', 'surrogateescape').split('\0')
+        dirs = self.dir_names
+        return [
+            dirs[d] + n for d, n in zip(self.dirs[rows].tolist(), names)
+        ]
+
+    def values(self, rows):
+        """
+        Return the metadata 3-tuples of the given rows, as stored.
+
+        :param rows: row numbers
+        :type rows: numpy.ndarray
+        :rtype: list
+        """
+        digests = hexlify(self.digests[rows].tobytes()).decode('ascii')
+        md5s = [digests[i:i + 32] for i in range(0, len(digests), 32)]
+        for i in self.np.flatnonzero(self.odd[rows]).tolist():
+            md5s[i] = self.md5sum(rows[i])
+        return list(zip(
+            self.sizes[rows].tolist(), self.mtimes[rows].tolist(), md5s
+        ))
+
+
+def _dir_map(np, local, remote):
+    """
+    Return an array mapping each directory index of ``local`` to the index
+    of the same directory in ``remote``, or -1; its last element, for
+    removed rows, is -1 too.
+    """
+    return np.array(
+        [remote.dir_index.get(d, -1) for d in local.dir_names] + [-1],
+        dtype=np.int64
+    )
+
+
+def _same_paths(np, local, remote, lrows, rrows, dir_map):
+    """
+    Return a boolean array of whether the path of each row in ``lrows`` of
+    ``local`` is exactly that of the same element of ``rrows`` in
+    ``remote``, comparing their directories (mapped by ``dir_map``, from
+    :py:func:`~._dir_map`) and then their basenames, one basename length at
+    a time, as fixed-size byte strings.
+    """
+    rdirs = remote.dirs[rrows]
+    lengths = local.lengths[lrows]
+    same = (
+        (dir_map[local.dirs[lrows]] == rdirs) & (rdirs != -1) &
+        (lengths == remote.lengths[rrows])
+    )
+    idx = np.flatnonzero(same)
+    keys = lengths[idx]
+    if len(keys) > 0 and keys.max() < 65536:
+        # a stable sort of 16-bit values is a radix sort
+        keys = keys.astype(np.uint16)
+    idx = idx[np.argsort(keys, kind='stable')]
+    bounds = np.flatnonzero(np.diff(lengths[idx])) + 1
+    for group in np.split(idx, bounds):
+        if len(group) == 0 or lengths[group[0]] == 0:
+            continue
+        dtype = np.dtype('V%d' % lengths[group[0]])
+        lnames = np.ndarray(
+            (len(local.names) - dtype.itemsize + 1,), dtype=dtype,
+            buffer=local.names, strides=(1,)
+        )
+        rnames = np.ndarray(
+            (len(remote.names) - dtype.itemsize + 1,), dtype=dtype,
+            buffer=remote.names, strides=(1,)
+        )
+        same[group] = (
+            lnames[local.starts[lrows[group]]] ==
+            rnames[remote.starts[rrows[group]]]
+        )
+    return same
+
+
+def _find_rows(np, local, remote, lrows):
+    """
+    Find the row of ``remote`` holding the path of each row in ``lrows`` of
+    ``local``, or -1, by probing ``remote``'s hash index for every row at
+    once, exactly as :py:meth:`s3sfe.metatable.FileMetaTable._find` does
+    for one path. Rows whose hashes match are confirmed with
+    :py:func:`~._same_paths`.
+    """
+    found = np.full(len(lrows), -1, dtype=np.int64)
+    hashes = local.hashes[lrows]
+    mask = len(remote.slots) - 1
+    slots = hashes & mask
+    todo = np.arange(len(lrows))
+    dir_map = _dir_map(np, local, remote)
+    while len(todo) > 0:
+        rows = remote.slots[slots[todo]].astype(np.int64)
+        done = rows == -1
+        cand = np.flatnonzero(~done)
+        cand = cand[remote.hashes[rows[cand]] == hashes[todo[cand]]]
+        match = cand[_same_paths(
+            np, local, remote, lrows[todo[cand]], rows[cand], dir_map
+        )]
+        found[todo[match]] = rows[match]
+        done[match] = True
+        todo = todo[~done]
+        slots[todo] = (slots[todo] + 1) & mask
+    return found
+
+
+def numpy_diff(local_files, s3_files, remote_only=False, size_mtime=False,
+               values=False):
+    """
+    Find the local files that are not in S3, or whose md5sums differ from S3,
+    using vectorized numpy operations on the columns of two
+    :py:class:`~s3sfe.metatable.FileMetaTable` s instead of a per-file loop;
+    other mappings are first copied into tables, which is slow. Every local
+    path is looked up in the S3 table's hash index at once (see
+    :py:func:`~._find_rows`), comparing the stored path hashes and then the
+    paths themselves, so the result is exactly that of the dict comparison
+    in :py:meth:`s3sfe.filesyncer.FileSyncer._files_to_upload`.
+
+    :param local_files: local file paths to current metadata
+    :type local_files: s3sfe.metatable.FileMetaTable
+    :param s3_files: S3 file paths to current metadata
+    :type s3_files: s3sfe.metatable.FileMetaTable
+    :param remote_only: if True, also find the paths that are only in
+      ``s3_files``
+    :type remote_only: bool
+    :param size_mtime: whether files whose size or mtime differ from S3 need
+      uploading even if their md5sums match
+    :type size_mtime: bool
+    :param values: if True, return a dict of the paths to upload to their
+      metadata from ``local_files``, rather than a list of them
+    :type values: bool
+    :return: paths from ``local_files`` that need to be uploaded, or if
+      ``remote_only`` is True, a 2-tuple of that and the paths only in S3
+    :rtype: list
+    """
+    np = _numpy()
+    if not isinstance(local_files, FileMetaTable):
+        local_files = FileMetaTable(local_files)
+    if not isinstance(s3_files, FileMetaTable):
+        s3_files = FileMetaTable(s3_files)
+    local = TableColumns(np, local_files)
+    remote = TableColumns(np, s3_files)
+    lrows = np.flatnonzero(local.dirs != -1)
+    rrows = _find_rows(np, local, remote, lrows)
+    pairs = np.flatnonzero(rrows != -1)
+    pl = lrows[pairs]
+    pr = rrows[pairs]
+    changed = (local.digests[pl] != remote.digests[pr]).any(axis=1)
+    # paths whose md5sums aren't hex digests on either side are compared
+    # exactly
+    for i in np.flatnonzero(local.odd[pl] | remote.odd[pr]):
+        changed[i] = local.md5sum(pl[i]) != remote.md5sum(pr[i])
+    if size_mtime:
+        changed |= (
+            (local.sizes[pl] != remote.sizes[pr]) |
+            (np.abs(local.mtimes[pl] - remote.mtimes[pr]) > MTIME_TOLERANCE)
+        )
+        # as in same_size_mtime(), S3 files without an md5sum never match
+        for i in np.flatnonzero(remote.odd[pr]):
+            if remote.md5sum(pr[i]) is None:
+                changed[i] = True
+    upload = rrows == -1
+    upload[pairs[changed]] = True
+    rows = lrows[upload]
+    res = local.paths(rows)
+    if values:
+        res = dict(zip(res, local.values(rows)))
+    if not remote_only:
+        return res
+    only = remote.dirs != -1
+    only[pr] = False
+    return res, remote.paths(np.flatnonzero(only))
@@ -37,20 +37,70 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 
 import logging
 import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 
+from .compression import require_codec
+from .diff import (
+    ExternalSorter, merge_diff, numpy_diff, require_numpy, same_size_mtime,
+    UPLOAD, REMOTE_ONLY, MTIME_TOLERANCE
+)
+from .hashcache import HashCache
+from .journal import UploadJournal
+from .metatable import FileMetaTable
 from .runstats import RunStats
-from .s3 import S3Wrapper
-from .utils import md5_file, dtnow
+from .s3 import S3Wrapper, make_limiter
+from .scheduling import UPLOAD_ORDERS, order_files, compare_orders
+from .transfer import MB, TransferProfiles
+from .pathfilter import PathMatcher, PrefixMatcher, minimal_paths
+from .pipeline import Pipeline
+from .plan import Plan
+from .utils import md5_file, dtnow, run_bounded
+from .walker import walk_files
 
 logger = logging.getLogger(__name__)
 
+#: ways of deciding whether a local file differs from its copy in S3; see
+#: :py:class:`~.FileSyncer`
+COMPARE_MODES = ['checksum', 'size-mtime', 'size-mtime-then-checksum']
+
+
+def _pool_call(pool, func, *args):
+    """
+    Run ``func(*args)`` in ``pool`` and wait for its result.
+    """
+    return pool.submit(func, *args).result()
+
 
 class FileSyncer(object):
     """
     Main class that handles synchronizing files to S3.
     """
 
-    def __init__(self, bucket_name, prefix=None, dry_run=False, ssec_key=None):
+    #: maximum number of items queued between stages in pipeline mode
+    pipeline_queue_size = 1024
+
+    #: minimum age in seconds of incomplete multipart uploads not in the
+    #: upload journal for them to be aborted as orphaned
+    orphaned_upload_age = 86400
+
+    def __init__(self, bucket_name, prefix=None, dry_run=False, ssec_key=None,
+                 hash_cache_path=None, rehash=False, hash_bufsize=None,
+                 hash_mmap=False, hash_workers=1, hash_processes=False,
+                 upload_workers=1, rebuild_manifest=False, head_workers=1,
+                 pipeline=False, compact_metadata=False, diff_engine='dict',
+                 diff_max_items=1000000, delete=False, max_delete=None,
+                 max_delete_percent=50.0, compare='checksum',
+                 transfer_profiles=None, download_workers=1,
+                 max_upload_rate=None, max_download_rate=None,
+                 upload_order='path', bundle_threshold=None,
+                 bundle_size=64 * MB, bundle_compact=0.5,
+                 upload_journal_path=None, abort_orphaned_uploads=False,
+                 copy_duplicates=False, refresh_metadata=False,
+                 compression=None):
         """
         Initialize the FileSyncer
 
@@ -64,14 +114,194 @@ class FileSyncer(object):
         :type dry_run: bool
         :param ssec_key: 32-bit AES256 SSE-C key (binary)
         :type ssec_key: bytes
+        :param hash_cache_path: path to the persistent hash cache database; if
+          None, no hash cache is used and every file is hashed on every run
+        :type hash_cache_path: str
+        :param rehash: if True, ignore (but refresh) cached hashes
+        :type rehash: bool
+        :param hash_bufsize: read buffer size for hashing files, in bytes; if
+          None, chosen per-file from the file size
+        :type hash_bufsize: int
+        :param hash_mmap: whether to mmap large files when hashing them; see
+          :py:func:`s3sfe.utils.md5_file`
+        :type hash_mmap: bool
+        :param hash_workers: number of files to hash concurrently
+        :type hash_workers: int
+        :param hash_processes: if True, hash files in a pool of
+          ``hash_workers`` processes rather than threads
+        :type hash_processes: bool
+        :param upload_workers: number of files to upload concurrently
+        :type upload_workers: int
+        :param rebuild_manifest: if True, ignore the remote manifest and
+          rebuild it by querying the metadata of every object in S3
+        :type rebuild_manifest: bool
+        :param head_workers: maximum number of concurrent requests when
+          querying the metadata of every object in S3
+        :type head_workers: int
+        :param pipeline: if True, stream files through the listing, hashing,
+          comparison and upload stages concurrently; see
+          :py:meth:`~._run_pipeline`
+        :type pipeline: bool
+        :param compact_metadata: if True, hold local and S3 file metadata in
+          :py:class:`~s3sfe.metatable.FileMetaTable` s instead of dicts, using
+          far less memory for large numbers of files
+        :type compact_metadata: bool
+        :param diff_engine: how to compare local and S3 files; ``dict`` to
+          look each local file up in the S3 files, ``merge`` to merge-join
+          both sides in path order (see :py:mod:`s3sfe.diff`), sorting them
+          on disk if they're larger than ``diff_max_items``, or ``numpy`` to
+          compare them with vectorized numpy operations (see
+          :py:func:`s3sfe.diff.numpy_diff`), which works on the columns of
+          compact tables and so implies ``compact_metadata``
+        :type diff_engine: str
+        :param diff_max_items: for the ``merge`` diff engine, the maximum
+          number of files from each side to sort in memory before spilling
+          sorted runs to temporary files
+        :type diff_max_items: int
+        :param delete: if True, delete files from S3 that no longer exist
+          locally; see :py:meth:`~._delete_files`
+        :type delete: bool
+        :param max_delete: if not None, don't delete anything if more than
+          this many files would be deleted from S3
+        :type max_delete: int
+        :param max_delete_percent: if not None, don't delete anything if more
+          than this percentage of the files in S3 would be deleted
+        :type max_delete_percent: float
+        :param compare: how to decide whether a file in S3 needs updating.
+          ``checksum`` hashes every file and compares md5sums. The quick modes
+          trust that files whose size and mtime match S3 are unchanged,
+          without hashing them; the rest are hashed, and with ``size-mtime``
+          they are all uploaded, while with ``size-mtime-then-checksum`` only
+          those whose md5sums differ are.
+        :type compare: str
+        :param transfer_profiles: overrides of the multipart transfer settings
+          for each file size class, as a list of (class name, settings dict)
+          2-tuples; see :py:class:`s3sfe.transfer.TransferProfiles`
+        :type transfer_profiles: list
+        :param download_workers: maximum number of files to download
+          concurrently when restoring
+        :type download_workers: int
+        :param max_upload_rate: if not None, maximum aggregate upload rate of
+          all concurrent uploads
+        :type max_upload_rate: s3sfe.ratelimit.RateSchedule
+        :param max_download_rate: if not None, maximum aggregate download rate
+          of all concurrent downloads
+        :type max_download_rate: s3sfe.ratelimit.RateSchedule
+        :param upload_order: order in which to start uploads, one of
+          :py:const:`s3sfe.scheduling.UPLOAD_ORDERS`; see
+          :py:func:`s3sfe.scheduling.order_files`. Ignored in pipeline mode,
+          where files are uploaded as they are found.
+        :type upload_order: str
+        :param bundle_threshold: if not None, pack files smaller than this
+          many bytes into bundle objects, rather than uploading each as its
+          own object; see :py:meth:`~._upload_bundles`. Ignored in pipeline
+          mode.
+        :type bundle_threshold: int
+        :param bundle_size: approximate size of each bundle, in bytes
+        :type bundle_size: int
+        :param bundle_compact: when bundling, repack the bundles in which at
+          least this fraction of the data is dead space (files since changed
+          or deleted); see :py:meth:`~._compact_bundles`
+        :type bundle_compact: float
+        :param upload_journal_path: if not None, upload files large enough for
+          multipart uploads resumably, recording their progress in the upload
+          journal database at this path, so that a later run can finish an
+          interrupted upload instead of starting again; see
+          :py:meth:`s3sfe.s3.S3Wrapper._put_file_resumable`
+        :type upload_journal_path: str
+        :param abort_orphaned_uploads: if True, abort the incomplete multipart
+          uploads under the prefix that are not in the upload journal and are
+          older than :py:attr:`~.orphaned_upload_age`; see
+          :py:meth:`~._clean_uploads`
+        :type abort_orphaned_uploads: bool
+        :param copy_duplicates: if True, files to upload whose content is
+          already in S3 under another path, or is being uploaded under another
+          path in the same run, are copied within S3 instead of uploaded; see
+          :py:meth:`~._find_copies`. Ignored in pipeline mode.
+        :type copy_duplicates: bool
+        :param refresh_metadata: if True, files whose content matches S3 but
+          whose size or mtime doesn't (i.e. files that were ``touch`` ed) have
+          the metadata of their S3 objects updated in place, without
+          uploading them; see :py:meth:`~._files_to_refresh`. Ignored in
+          pipeline mode and when making or applying plans.
+        :type refresh_metadata: bool
+        :param compression: if not None, compress files with this codec (one
+          of :py:const:`s3sfe.compression.CODECS`) as they are uploaded,
+          except files that look already compressed; see
+          :py:func:`s3sfe.compression.should_compress`
+        :type compression: str
         """
         if prefix is None:
             prefix = ''
         logger.debug('Using S3 prefix: "%s"', prefix)
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+        profiles = TransferProfiles(transfer_profiles)
+        # the number of requests actually in flight adapts to S3's response,
+        # up to the configured number of workers
+        self._head_limiter = make_limiter('HEAD', head_workers)
+        self._upload_limiter = make_limiter('upload', upload_workers)
+        self._download_limiter = make_limiter('download', download_workers)
+        self._journal = None
+        if upload_journal_path is not None:
+            self._journal = UploadJournal(upload_journal_path)
+        self._abort_orphaned = abort_orphaned_uploads
+        if compression is not None:
+            require_codec(compression)
+        self._compression = compression
+        # every transfer may have max_concurrency part requests in flight
         self.s3 = S3Wrapper(
-            bucket_name, prefix=prefix, dry_run=dry_run, ssec_key=ssec_key
+            bucket_name, prefix=prefix, dry_run=dry_run, ssec_key=ssec_key,
+            head_workers=head_workers, transfer_profiles=profiles,
+            max_connections=max(upload_workers, download_workers) *
+            profiles.max_concurrency,
+            head_limiter=self._head_limiter, upload_rate=max_upload_rate,
+            download_rate=max_download_rate, journal=self._journal,
+            compression=compression
         )
         self._dry_run = dry_run
+        self._hash_bufsize = hash_bufsize
+        self._hash_mmap = hash_mmap
+        self._hash_workers = hash_workers
+        self._hash_processes = hash_processes
+        self._meta_errors = []
+        self._upload_workers = upload_workers
+        self._download_workers = download_workers
+        self._upload_busy = None
+        self._upload_makespans = None
+        if upload_order not in UPLOAD_ORDERS:
+            raise ValueError('Unknown upload order: %s' % upload_order)
+        self._upload_order = upload_order
+        self._bundle_threshold = bundle_threshold
+        self._bundle_size = bundle_size
+        self._bundle_compact = bundle_compact
+        self._bundles_changed = False
+        self._copy_duplicates = copy_duplicates
+        self._copied = None
+        self._copied_bytes = 0
+        self._refresh_metadata = refresh_metadata
+        self._rebuild_manifest = rebuild_manifest
+        self._pipeline = pipeline
+        if diff_engine not in ['dict', 'merge', 'numpy']:
+            raise ValueError('Unknown diff engine: %s' % diff_engine)
+        if diff_engine == 'numpy':
+            require_numpy()
+        self._compact_metadata = compact_metadata or diff_engine == 'numpy'
+        self._diff_engine = diff_engine
+        self._diff_max_items = diff_max_items
+        self._delete = delete
+        self._max_delete = max_delete
+        self._max_delete_percent = max_delete_percent
+        self._remote_only = []
+        # paths that could not be listed this run; nothing under them is
+        # deleted from S3
+        self._list_errors = []
+        if compare not in COMPARE_MODES:
+            raise ValueError('Unknown compare mode: %s' % compare)
+        self._compare = compare
+        self._hash_cache = None
+        if hash_cache_path is not None:
+            self._hash_cache = HashCache(hash_cache_path, rehash=rehash)
 
     def run(self, file_paths, exclude_paths=[]):
         """
@@ -80,38 +310,101 @@ class FileSyncer(object):
         :param file_paths: list of file paths to synchronize. Can be files or
           directories; directories will be synced recursively.
         :type file_paths: list
-        :param exclude_paths: list of path starting substrings to exclude from
-          backups. Any path beginning with one of these strings will be
-          excluded from the backup.
+        :param exclude_paths: list of exclude patterns; path prefixes, globs or
+          regexes as described in :py:class:`~s3sfe.pathfilter.PathMatcher`.
         :type exclude_paths: list
         :return: statistics about the synchronization operation.
         :rtype: s3sfe.runstats.RunStats
         """
+        self._clean_uploads()
+        if self._pipeline:
+            return self._run_pipeline(file_paths, exclude_paths)
         logger.debug('Starting run...')
         start_dt = dtnow()
-        all_files = self._list_all_files(file_paths)
-        if len(exclude_paths) > 0:
-            all_files = self._filter_filelist(all_files, exclude_paths)
+        all_files = self._list_all_files(
+            file_paths, exclude_paths=exclude_paths
+        )
         meta_dt = dtnow()
-        files = self._file_meta(all_files)
-        total_size = sum(files[f][0] for f in files.keys())
-        logger.info('Source: %d files total, %d bytes total',
-                    len(files), total_size)
-        query_dt = dtnow()
-        s3files = self._s3_files()
-        logger.info('S3: %d files total', len(s3files))
+        if self._compare == 'checksum':
+            files = self._file_meta(all_files)
+            total_size = sum(files[f][0] for f in files.keys())
+            logger.info('Source: %d files total, %d bytes total',
+                        len(files), total_size)
+            query_dt = dtnow()
+            s3files = self._s3_files()
+            logger.info('S3: %d files total', len(s3files))
+        else:
+            # the quick compare modes need the S3 files to decide which local
+            # files to hash, so query S3 first
+            s3files = self._s3_files()
+            logger.info('S3: %d files total', len(s3files))
+            s3_dt = dtnow()
+            files = self._file_meta(all_files, s3_files=s3files)
+            total_size = sum(files[f][0] for f in files.keys())
+            logger.info('Source: %d files total, %d bytes total',
+                        len(files), total_size)
+            # RunStats times each step by the start of the next; shift the
+            # query start so that both durations are reported correctly
+            query_dt = meta_dt + (dtnow() - s3_dt)
         calc_dt = dtnow()
         to_upload = self._files_to_upload(files, s3files)
+        to_refresh = {}
+        if self._refresh_metadata:
+            to_refresh = self._files_to_refresh(files, s3files, to_upload)
         upload_dt = dtnow()
-        errors, uploaded_bytes = self._upload_files(to_upload)
+        errors, uploaded_bytes = self._upload_files(
+            to_upload, s3_files=s3files
+        )
+        refreshed = refresh_errors = None
+        if self._refresh_metadata:
+            refreshed, refresh_errors = self._refresh_files(to_refresh)
+            for f in refresh_errors:
+                del to_refresh[f]
+        deleted = delete_errors = None
+        delete_refused = 0
+        if self._delete:
+            deleted, delete_errors, delete_refused = self._delete_files(
+                s3files, file_paths, exclude_paths
+            )
+        if self._bundle_threshold is not None:
+            self._compact_bundles(s3files)
+        self._update_manifest(
+            s3files, to_upload, errors, deleted=deleted, refreshed=to_refresh
+        )
+        cache_hits = cache_misses = None
+        if self._hash_cache is not None:
+            self._hash_cache.evict(set(files.keys()))
+            cache_hits = self._hash_cache.hits
+            cache_misses = self._hash_cache.misses
         end_dt = dtnow()
         logger.debug('Ending run...')
         return RunStats(
             start_dt, meta_dt, query_dt, calc_dt, upload_dt, end_dt,
             len(all_files), len(to_upload), errors, total_size, uploaded_bytes,
-            dry_run=self._dry_run
+            dry_run=self._dry_run, hash_cache_hits=cache_hits,
+            hash_cache_misses=cache_misses, meta_errors=self._meta_errors,
+            upload_busy_seconds=self._upload_busy, deleted_files=deleted,
+            delete_errors=delete_errors, delete_refused=delete_refused,
+            concurrency_history=self._concurrency_history(),
+            upload_order=self._upload_order,
+            upload_makespans=self._upload_makespans,
+            copied_files=self._copied, copied_size_b=self._copied_bytes,
+            refreshed_files=refreshed, refresh_errors=refresh_errors,
+            wire_size_b=self._bytes_sent()
         )
 
+    def _meta_table(self):
+        """
+        Return a new, empty mapping to hold file path to metadata 3-tuples;
+        a :py:class:`~s3sfe.metatable.FileMetaTable` if ``compact_metadata``
+        is enabled, otherwise a dict.
+
+        :rtype: dict
+        """
+        if self._compact_metadata:
+            return FileMetaTable()
+        return {}
+
     def _s3_files(self):
         """
         Return a dict of files currently in S3, where keys are local file
@@ -121,8 +414,12 @@ class FileSyncer(object):
         :return: mapping of file paths to file metadata
         :rtype: dict
         """
-        files = {}
-        for k, d in self.s3.get_filelist().items():
+        files = self._meta_table()
+        raw = self.s3.get_filelist(rebuild_manifest=self._rebuild_manifest)
+        # pop entries as they're converted, so that the raw metadata isn't
+        # held in full alongside the (possibly compact) result
+        while len(raw) > 0:
+            k, d = raw.popitem()
             files[k] = (
                 int(d.get('size_b', 0)),
                 float(d.get('mtime', 0)),
@@ -130,9 +427,381 @@ class FileSyncer(object):
             )
         return files
 
+    def _run_pipeline(self, file_paths, exclude_paths):
+        """
+        Run the sync as a :py:class:`~s3sfe.pipeline.Pipeline`. Rather than
+        completing each step for every file before starting the next, files
+        stream through these stages concurrently, connected by bounded queues:
+
+        1. **scan** - list files (:py:meth:`~._iter_all_files`)
+        2. **cache check** - look up each file in the hash cache, if any (or
+           with a quick ``compare`` mode, first check its size and mtime
+           against S3)
+        3. **hash** - hash cache misses, in ``hash_workers`` threads
+        4. **compare** - compare against the files in S3
+        5. **upload** - upload new or changed files, in ``upload_workers``
+           threads
+
+        The S3 file list is queried (**S3 query**) concurrently with the scan;
+        the compare stage (and in the quick compare modes, the cache check
+        stage) waits for it. Uploads begin as soon as the first
+        changed file has been hashed, and memory use is bounded by the queue
+        sizes (:py:attr:`~.pipeline_queue_size`) rather than by the number of
+        files; only the S3 file list and the files to upload are held in full.
+        With a hash cache or ``delete``, the set of every local path seen is
+        also kept, to evict stale cache entries and to find the paths only in
+        S3 at the end, so memory use still grows with the number of local
+        files, though by only a path each rather than their full metadata.
+
+        :param file_paths: list of file paths to synchronize. Can be files or
+          directories; directories will be synced recursively.
+        :type file_paths: list
+        :param exclude_paths: list of exclude patterns
+        :type exclude_paths: list
+        :return: statistics about the synchronization operation.
+        :rtype: s3sfe.runstats.RunStats
+        """
+        logger.debug('Starting pipelined run...')
+        start_dt = dtnow()
+        self._meta_errors = []
+        self._upload_busy = 0.0
+        cache = self._hash_cache
+        hasher = self._hasher()
+        pool = None
+        if self._hash_processes and self._hash_workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self._hash_workers)
+            hasher = partial(_pool_call, pool, hasher)
+        s3_ready = threading.Event()
+        lock = threading.Lock()
+        totals = {'files': 0, 'size': 0, 'uploaded': 0}
+        state = {'s3files': None}
+        to_upload = {}
+        errors = []
+        seen = set()
+        pl = Pipeline(queue_size=self.pipeline_queue_size)
+
+        def scan():
+            for item in self._iter_all_files(file_paths, exclude_paths):
+                if pl.failed:
+                    break
+                totals['files'] += 1
+                check.put(item)
+
+        def query_s3():
+            try:
+                state['s3files'] = self._s3_files()
+            finally:
+                s3_ready.set()
+
+        def cache_check(item):
+            md5sum = None
+            if self._compare != 'checksum':
+                s3_ready.wait()
+                s3meta = (state['s3files'] or {}).get(item[0])
+                if same_size_mtime(item[1].st_size, item[1].st_mtime, s3meta):
+                    compare.put((item[0], item[1], s3meta[2]))
+                    return
+            if cache is not None:
+                md5sum = cache.get(item[0], item[1])
+            if md5sum is None:
+                hashing.put(item)
+            else:
+                compare.put((item[0], item[1], md5sum))
+
+        def hash_file(item):
+            path, st = item
+            try:
+                md5sum = hasher(path)
+            except Exception as ex:
+                logger.error('Error hashing file %s: %s', path, ex)
+                self._meta_errors.append(path)
+                return
+            if cache is not None:
+                cache.set(path, st, md5sum)
+            compare.put((path, st, md5sum))
+
+        def compare_file(item):
+            path, st, md5sum = item
+            s3_ready.wait()
+            if state['s3files'] is None:
+                # querying S3 failed; run() will raise that error
+                return
+            totals['size'] += st.st_size
+            if cache is not None or self._delete:
+                seen.add(path)
+            s3meta = state['s3files'].get(path)
+            if s3meta is not None and s3meta[2] == md5sum and (
+                self._compare != 'size-mtime' or
+                same_size_mtime(st.st_size, st.st_mtime, s3meta)
+            ):
+                return
+            meta = (st.st_size, st.st_mtime, md5sum)
+            to_upload[path] = meta
+            upload.put((path, meta))
+
+        def upload_file(item):
+            path, meta = item
+            try:
+                busy = self._put_file(path, meta)
+            except Exception as ex:
+                logger.error('Error uploading file %s: %s',
+                             path, ex, exc_info=True)
+                with lock:
+                    errors.append(path)
+                return
+            with lock:
+                self._upload_busy += busy
+                totals['uploaded'] += meta[0]
+
+        scanner = pl.source('scan', scan)
+        pl.source('S3 query', query_s3)
+        check = pl.stage('cache check', cache_check)
+        hashing = pl.stage(
+            'hash', hash_file, workers=max(1, self._hash_workers)
+        )
+        compare = pl.stage('compare', compare_file)
+        upload = pl.stage(
+            'upload', upload_file, workers=max(1, self._upload_workers)
+        )
+        scanner.feeds(check)
+        check.feeds(hashing, compare)
+        hashing.feeds(compare)
+        compare.feeds(upload)
+        try:
+            pl.run()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if cache is not None:
+                cache.commit()
+        logger.info('Source: %d files total, %d bytes total',
+                    totals['files'], totals['size'])
+        if len(self._meta_errors) > 0:
+            logger.error('Could not read %d files', len(self._meta_errors))
+        deleted = delete_errors = None
+        delete_refused = 0
+        if self._delete:
+            self._remote_only = [
+                k for k in state['s3files'] if k not in seen
+            ]
+            deleted, delete_errors, delete_refused = self._delete_files(
+                state['s3files'], file_paths, exclude_paths
+            )
+        self._update_manifest(
+            state['s3files'], to_upload, errors, deleted=deleted
+        )
+        cache_hits = cache_misses = None
+        if cache is not None:
+            cache.evict(seen)
+            cache_hits = cache.hits
+            cache_misses = cache.misses
+        end_dt = dtnow()
+        logger.debug('Ending pipelined run...')
+        return RunStats(
+            start_dt, start_dt, start_dt, start_dt, upload.start_dt, end_dt,
+            totals['files'], len(to_upload), errors, totals['size'],
+            totals['uploaded'], dry_run=self._dry_run,
+            hash_cache_hits=cache_hits, hash_cache_misses=cache_misses,
+            meta_errors=self._meta_errors,
+            upload_busy_seconds=self._upload_busy,
+            stage_times=pl.stage_times, deleted_files=deleted,
+            delete_errors=delete_errors, delete_refused=delete_refused,
+            concurrency_history=self._concurrency_history(),
+            wire_size_b=self._bytes_sent()
+        )
+
+    def _bytes_sent(self):
+        """
+        Return the bytes sent to S3 for uploads, after compression, for
+        :py:class:`~s3sfe.runstats.RunStats`.
+
+        :return: bytes sent, or None if compression isn't enabled
+        :rtype: int
+        """
+        if self._compression is None:
+            return None
+        return self.s3.bytes_sent
+
+    def _concurrency_history(self):
+        """
+        Return the history of each adaptive concurrency limit that could
+        change (i.e. has a maximum above 1), for
+        :py:class:`~s3sfe.runstats.RunStats`.
+
+        :return: dict of request kind to list of (datetime, limit) 2-tuples, or
+          None if no limit could change
+        :rtype: dict
+        """
+        res = dict(
+            (lim.name, lim.history) for lim in [
+                self._head_limiter, self._upload_limiter
+            ] if lim.max_limit > 1
+        )
+        if len(res) == 0:
+            return None
+        return res
+
+    def _update_manifest(self, s3_files, uploaded, errors, deleted=None,
+                         refreshed=None):
+        """
+        Write the remote manifest to reflect the files uploaded (and deleted)
+        in this run. The manifest is left alone if it was read successfully
+        and nothing (including the bundles) changed.
+
+        :param s3_files: files in S3 at the start of the run, in the format
+          returned by :py:meth:`~._s3_files`
+        :type s3_files: dict
+        :param uploaded: files we attempted to upload, in the same format
+        :type uploaded: dict
+        :param errors: paths in ``uploaded`` that failed to upload
+        :type errors: list
+        :param deleted: paths deleted from S3
+        :type deleted: list
+        :param refreshed: files whose metadata was refreshed in S3, in the same
+          format as ``s3_files``
+        :type refreshed: dict
+        """
+        if deleted is None:
+            deleted = []
+        if refreshed is None:
+            refreshed = {}
+        if (
+            self.s3.manifest_loaded and len(uploaded) == len(errors) and
+            len(deleted) == 0 and len(refreshed) == 0 and
+            not self._bundles_changed
+        ):
+            logger.debug('No changes; not rewriting manifest')
+            return
+        files = s3_files
+        if not isinstance(s3_files, FileMetaTable):
+            # a compact table is updated in place rather than copied
+            files = dict(s3_files)
+        errors = set(errors)
+        for k, v in uploaded.items():
+            if k not in errors:
+                files[k] = v
+        for k, v in refreshed.items():
+            files[k] = v
+        for k in deleted:
+            del files[k]
+        try:
+            self.s3.put_manifest(files)
+        except Exception as ex:
+            # not fatal; the next run will just rebuild it
+            logger.error('Error writing manifest: %s', ex, exc_info=True)
+
+    def plan(self, file_paths, exclude_paths=[]):
+        """
+        Do everything :py:meth:`~.run` does up to uploading - list, hash and
+        compare files - and return the uploads (and with ``delete``, the
+        deletions) that would be made, as a :py:class:`~s3sfe.plan.Plan` to be
+        executed later by :py:meth:`~.apply`.
+
+        :param file_paths: list of file paths to synchronize. Can be files or
+          directories; directories will be synced recursively.
+        :type file_paths: list
+        :param exclude_paths: list of exclude patterns
+        :type exclude_paths: list
+        :return: the planned uploads and deletions
+        :rtype: s3sfe.plan.Plan
+        """
+        logger.debug('Starting plan...')
+        all_files = self._list_all_files(
+            file_paths, exclude_paths=exclude_paths
+        )
+        if self._compare == 'checksum':
+            files = self._file_meta(all_files)
+            s3files = self._s3_files()
+        else:
+            s3files = self._s3_files()
+            files = self._file_meta(all_files, s3_files=s3files)
+        to_upload = self._files_to_upload(files, s3files)
+        deletes = []
+        if self._delete:
+            deletes, _ = self._paths_to_delete(
+                s3files, file_paths, exclude_paths
+            )
+        if self._hash_cache is not None:
+            self._hash_cache.evict(set(files.keys()))
+        return Plan(
+            self._bucket_name, prefix=self._prefix, uploads=to_upload,
+            deletes=deletes
+        )
+
+    def apply(self, plan):
+        """
+        Execute a :py:class:`~s3sfe.plan.Plan` made by :py:meth:`~.plan`.
+        Each file is stat'ed again first, and skipped if it has been removed
+        or its size or mtime has changed since it was planned; the next run
+        will pick it up. Likewise, planned deletions of files that exist again
+        locally are skipped. The manifest is updated as in :py:meth:`~.run`.
+
+        :param plan: plan to execute
+        :type plan: s3sfe.plan.Plan
+        :return: statistics about the operation
+        :rtype: s3sfe.runstats.RunStats
+        """
+        logger.debug('Applying plan...')
+        self._clean_uploads()
+        start_dt = dtnow()
+        self._meta_errors = []
+        files = self._meta_table()
+        skipped = []
+        for path, meta in plan.uploads.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                skipped.append(path)
+                continue
+            if (
+                st.st_size != meta[0] or
+                abs(st.st_mtime - meta[1]) > MTIME_TOLERANCE
+            ):
+                skipped.append(path)
+                continue
+            files[path] = meta
+        deletes = []
+        for path in plan.deletes:
+            if os.path.lexists(path):
+                skipped.append(path)
+            else:
+                deletes.append(path)
+        if len(skipped) > 0:
+            logger.warning('Skipping %d files that changed since planning',
+                           len(skipped))
+        query_dt = dtnow()
+        s3files = self._s3_files()
+        upload_dt = dtnow()
+        errors, uploaded_bytes = self._upload_files(files, s3_files=s3files)
+        deleted = delete_errors = None
+        if len(deletes) > 0:
+            delete_errors = self.s3.delete_files(
+                deletes, workers=self._upload_workers
+            )
+            failed = set(delete_errors)
+            deleted = [p for p in deletes if p not in failed]
+        if self._bundle_threshold is not None:
+            self._compact_bundles(s3files)
+        self._update_manifest(s3files, files, errors, deleted=deleted)
+        end_dt = dtnow()
+        logger.debug('Done applying plan')
+        return RunStats(
+            start_dt, start_dt, query_dt, upload_dt, upload_dt, end_dt,
+            len(plan.uploads), len(files), errors, plan.upload_bytes,
+            uploaded_bytes, dry_run=self._dry_run,
+            upload_busy_seconds=self._upload_busy, deleted_files=deleted,
+            delete_errors=delete_errors, skipped_files=skipped,
+            concurrency_history=self._concurrency_history(),
+            upload_order=self._upload_order,
+            upload_makespans=self._upload_makespans,
+            copied_files=self._copied, copied_size_b=self._copied_bytes,
+            wire_size_b=self._bytes_sent()
+        )
+
     def restore(self, local_prefix, file_paths):
         """
-        Restore one or more files.
+        Restore one or more files, downloading up to ``download_workers`` at
+        a time.
 
         :param local_prefix: local filesystem prefix to restore files under
         :type local_prefix: str
@@ -149,16 +818,22 @@ class FileSyncer(object):
         )
         restore_files = self._make_restore_file_list(file_paths, s3files)
         logger.info('Found %d files to restore', len(restore_files))
-        success = 0
         errors = []
-        for fpath in restore_files:
-            try:
-                self.s3.get_file(fpath, local_prefix)
-                success += 1
-            except Exception as ex:
-                logger.error('Error downloading file %s: %s',
-                             fpath, ex, exc_info=True)
-                errors.append(fpath)
+        jobs = (
+            (f, self._get_file,
+             (f, local_prefix, int(s3files[f].get('size_b', 0))))
+            for f in restore_files
+        )
+        with ThreadPoolExecutor(max_workers=self._download_workers) as pool:
+            for fpath, fut in run_bounded(
+                pool, jobs, self._download_workers * 4
+            ):
+                try:
+                    fut.result()
+                except Exception as ex:
+                    logger.error('Error downloading file %s: %s',
+                                 fpath, ex, exc_info=True)
+                    errors.append(fpath)
         if len(errors) > 0:
             logger.error(
                 'ERROR: Failed downloading %d of %d files',
@@ -170,6 +845,23 @@ class FileSyncer(object):
             )
         return errors
 
+    def _get_file(self, path, local_prefix, size_b):
+        """
+        Download one file from S3, once ``self._download_limiter`` allows
+        (retrying if throttled).
+
+        :param path: local file path to download from S3
+        :type path: str
+        :param local_prefix: prefix to download under locally
+        :type local_prefix: str
+        :param size_b: size of the file in bytes
+        :type size_b: int
+        """
+        self._download_limiter.run(
+            partial(self.s3.get_file, path, local_prefix, size_b=size_b),
+            nbytes=size_b
+        )
+
     def _make_restore_file_list(self, restore_paths, s3_files):
         """
         Given a list of paths the user asked to restore and a the files in
@@ -199,100 +891,194 @@ class FileSyncer(object):
                 logger.debug('Found %d files in S3 under path %s', subs, s3path)
         return res
 
-    def _list_all_files(self, paths):
+    def _list_all_files(self, paths, exclude_paths=[]):
         """
-        Given a list of paths on the local filesystem, return a list of all
+        Given a list of paths on the local filesystem, return a dict of all
         files in ``paths`` that exist, and for any directories in ``paths`` that
-        exist, all files recursively contained in them.
+        exist, all files recursively contained in them, to their stat results.
+        See :py:meth:`~._iter_all_files`.
 
         :param paths: list of file/directory paths to check
         :type paths: list
-        :return: list of all extant files contained under those paths
-        :rtype: list
+        :param exclude_paths: list of exclude patterns; path prefixes, globs or
+          regexes as described in :py:class:`~s3sfe.pathfilter.PathMatcher`.
+        :type exclude_paths: list
+        :return: dict of all extant files contained under those paths to their
+          :py:func:`os.stat` results
+        :rtype: dict
+        """
+        return dict(self._iter_all_files(paths, exclude_paths=exclude_paths))
+
+    def _iter_all_files(self, paths, exclude_paths=[]):
+        """
+        Generator over all files in ``paths`` that exist, and for any
+        directories in ``paths`` that exist, all files recursively contained in
+        them, yielding a 2-tuple of (path, stat result) for each.
+
+        ``paths`` is first reduced to a minimal covering set, so that a path
+        beneath another listed path isn't walked twice. Files matching
+        ``exclude_paths`` are omitted, and excluded directories are skipped
+        without being listed. Paths that can't be stat'ed (i.e. an unmounted
+        volume) and directories that can't be listed are recorded in
+        ``self._list_errors``, so that :py:meth:`~._paths_to_delete` doesn't
+        mistake their files for deleted ones.
+
+        :param paths: list of file/directory paths to check
+        :type paths: list
+        :param exclude_paths: list of exclude patterns; path prefixes, globs or
+          regexes as described in :py:class:`~s3sfe.pathfilter.PathMatcher`.
+        :type exclude_paths: list
+        :return: generator of (path, :py:func:`os.stat` result) 2-tuples
+        :rtype: generator
         """
-        files = []
+        exclude = None
+        if len(exclude_paths) > 0:
+            exclude = PathMatcher(exclude_paths)
+        paths = minimal_paths(paths)
+        self._list_errors = []
+
+        def onerror(path, ex):
+            self._list_errors.append(path)
+
         logger.info('Listing files under %d paths', len(paths))
         for p in paths:
-            if not os.path.exists(p):
-                logger.warning('Skipping non-existent path: %s', p)
+            excluded_by = None if exclude is None else exclude.match(p)
+            if excluded_by is not None:
+                logger.debug('Excluding %s based on exclude path %s',
+                             p, excluded_by)
+                continue
+            try:
+                st = os.stat(p)
+            except OSError as ex:
+                logger.warning('Skipping path that could not be read: %s (%s)',
+                               p, ex)
+                self._list_errors.append(p)
                 continue
-            if os.path.isfile(p):
-                files.append(p)
-            elif os.path.isdir(p):
-                dirs = self._listdir(p)
-                logger.debug('Found %d files under %s', len(dirs), p)
-                files.extend(dirs)
+            if stat.S_ISREG(st.st_mode):
+                yield p, st
+            elif stat.S_ISDIR(st.st_mode):
+                if exclude is not None and exclude.match_dir(p):
+                    logger.debug('Excluding directory %s based on exclude '
+                                 'path %s', p, exclude.match_dir(p))
+                    continue
+                count = 0
+                for item in walk_files(p, exclude=exclude, onerror=onerror):
+                    count += 1
+                    yield item
+                logger.debug('Found %d files under %s', count, p)
             else:
                 logger.warning('Skipping unknown path type: %s', p)
         logger.debug('Done finding candidate files.')
-        return list(set(files))
 
-    def _listdir(self, path):
-        """
-        Given the path to a directory, return a list of all file paths under
-        that directory (recursively).
-
-        :param path: path to directory
-        :type path: str
-        :return: list of regular file paths under that directory
-        :rtype: list
+    def _file_meta(self, files, s3_files=None):
         """
-        files = []
-        for root, _, filenames in os.walk(path):
-            for fn in filenames:
-                p = os.path.join(root, fn)
-                if os.path.isfile(p):
-                    files.append(p)
-        return files
-
-    def _file_meta(self, files):
-        """
-        Given a list of local file paths, return a dict where keys are those
+        Given a dict of local file paths to their stat results (as returned by
+        :py:meth:`~._list_all_files`), return a dict where keys are those
         paths and values are 3-tuples of (file size in bytes, file modification
         time as a float timestamp, and file md5sum as a hex string).
 
-        :param files: files to get metadata for
-        :type files: list
+        Files are not stat'ed again; the stat results from listing are used.
+        If a hash cache is in use, files whose stat information matches their
+        cache entry reuse the cached md5sum instead of being read. The rest are
+        hashed by :py:meth:`~._hash_files`. Files that can't be read are left
+        out of the result and recorded in ``self._meta_errors``.
+
+        If ``s3_files`` is given (for the quick ``compare`` modes), files whose
+        size and mtime match their metadata in S3 are not hashed at all; the
+        md5sum recorded in S3 is used.
+
+        :param files: files to get metadata for, to their stat results
+        :type files: dict
+        :param s3_files: files in S3, as returned by :py:meth:`~._s3_files`
+        :type s3_files: dict
         :return: mapping of file paths to file metadata
         :rtype: dict
         """
         logger.info('Finding metadata for all %d files', len(files))
-        meta = {}
-        for f in files:
+        meta = self._meta_table()
+        self._meta_errors = []
+        to_hash = []
+        trusted = 0
+        for f, st in files.items():
             logger.debug('Checking metadata for: %s', f)
-            meta[f] = (
-                os.path.getsize(f),
-                os.path.getmtime(f),
-                md5_file(f)
-            )
+            md5sum = None
+            if s3_files is not None:
+                s3meta = s3_files.get(f)
+                if same_size_mtime(st.st_size, st.st_mtime, s3meta):
+                    meta[f] = (st.st_size, st.st_mtime, s3meta[2])
+                    trusted += 1
+                    continue
+            if self._hash_cache is not None:
+                md5sum = self._hash_cache.get(f, st)
+            if md5sum is None:
+                to_hash.append((f, st))
+                continue
+            meta[f] = (st.st_size, st.st_mtime, md5sum)
+        if s3_files is not None:
+            logger.info('%d files unchanged by size and mtime; hashing %d',
+                        trusted, len(to_hash))
+        for f, st, md5sum in self._hash_files(to_hash):
+            if self._hash_cache is not None:
+                self._hash_cache.set(f, st, md5sum)
+            meta[f] = (st.st_size, st.st_mtime, md5sum)
+        if self._hash_cache is not None:
+            self._hash_cache.commit()
+            logger.info('Hash cache: %d hits, %d misses',
+                        self._hash_cache.hits, self._hash_cache.misses)
+        if len(self._meta_errors) > 0:
+            logger.error('Could not read %d files', len(self._meta_errors))
         return meta
 
-    def _filter_filelist(self, all_files, exclude_paths):
+    def _hasher(self):
         """
-        Given a list of all candidate files and a list of path prefixes to
-        exclude, return all files from ``all_files`` that do not begin with an
-        excluded path.
+        Return a function that takes a file path and returns its md5sum, using
+        the configured hashing options.
 
-        :param all_files: list of all candidate local files
-        :type all_files: list
-        :param exclude_paths: list of path starting substrings to exclude from
-          backups. Any path beginning with one of these strings will be
-          excluded from the backup.
-        :type exclude_paths: list
-        :return: all files not excluded
-        :rtype: list
+        :return: hashing function
+        :rtype: callable
         """
-        res = []
-        for f in all_files:
-            for path in exclude_paths:
-                if f.startswith(path):
-                    # excluded; ignore
-                    logger.debug('Excluding %s based on exclude path %s',
-                                 f, path)
-                    break
-            else:
-                res.append(f)
-        return res
+        return partial(
+            md5_file, bufsize=self._hash_bufsize, use_mmap=self._hash_mmap
+        )
+
+    def _hash_files(self, files):
+        """
+        Generator that hashes files, yielding a 3-tuple of (path, stat result,
+        md5sum hex digest) for each file as it completes. With more than one
+        hash worker, files are hashed concurrently in a thread or process pool
+        and results are yielded in completion order. Files that fail to hash
+        are logged, appended to ``self._meta_errors`` and skipped.
+
+        :param files: list of (path, stat result) 2-tuples to hash
+        :type files: list
+        :return: generator of (path, stat result, md5sum) 3-tuples
+        :rtype: generator
+        """
+        hasher = self._hasher()
+        if self._hash_workers <= 1:
+            for f, st in files:
+                try:
+                    yield f, st, hasher(f)
+                except Exception as ex:
+                    logger.error('Error hashing file %s: %s', f, ex)
+                    self._meta_errors.append(f)
+            return
+        pool_cls = ThreadPoolExecutor
+        if self._hash_processes:
+            pool_cls = ProcessPoolExecutor
+        logger.info('Hashing %d files with %d %s', len(files),
+                    self._hash_workers,
+                    'processes' if self._hash_processes else 'threads')
+        jobs = (((f, st), hasher, (f, )) for f, st in files)
+        with pool_cls(max_workers=self._hash_workers) as pool:
+            for (f, st), fut in run_bounded(
+                pool, jobs, self._hash_workers * 4
+            ):
+                try:
+                    yield f, st, fut.result()
+                except Exception as ex:
+                    logger.error('Error hashing file %s: %s', f, ex)
+                    self._meta_errors.append(f)
 
     def _files_to_upload(self, local_files, s3_files):
         """
@@ -302,8 +1088,15 @@ class FileSyncer(object):
         string), return the subset of ``local_files`` that are not in, or do
         not have md5sums matching, ``s3_files``.
 
-        If ``exclude_paths`` is not empty, any local file with a path beginning
-        with an entry in ``exclude_paths`` will be omitted.
+        With the ``merge`` diff engine, this is done by
+        :py:meth:`~._merge_files_to_upload` instead, and with the ``numpy``
+        engine by :py:func:`s3sfe.diff.numpy_diff`; the result is the same.
+
+        With the ``size-mtime`` compare mode, files whose size or mtime
+        differ from S3 are also uploaded, even if their md5sums match.
+
+        If ``delete`` is enabled, the paths only in ``s3_files`` are also
+        found, and stored in ``self._remote_only``.
 
         :param local_files: local file paths to current metadata
         :type local_files: dict
@@ -315,37 +1108,685 @@ class FileSyncer(object):
         """
         logger.debug('Comparing %d local files with %d S3 files',
                      len(local_files), len(s3_files))
+        if self._diff_engine == 'merge':
+            return self._merge_files_to_upload(
+                local_files.items(), s3_files.items()
+            )
+        size_mtime = self._compare == 'size-mtime'
+        if self._diff_engine == 'numpy':
+            files = numpy_diff(
+                local_files, s3_files, remote_only=self._delete,
+                size_mtime=size_mtime, values=True
+            )
+            if self._delete:
+                files, self._remote_only = files
+            logger.info('Found %d files to upload', len(files))
+            return files
         files = {}
         for k in local_files.keys():
             if k not in s3_files:
                 files[k] = local_files[k]
             elif local_files[k][2] != s3_files[k][2]:
                 files[k] = local_files[k]
+            elif size_mtime and not same_size_mtime(
+                local_files[k][0], local_files[k][1], s3_files[k]
+            ):
+                files[k] = local_files[k]
+        if self._delete:
+            self._remote_only = [k for k in s3_files if k not in local_files]
         logger.info('Found %d files to upload', len(files))
         return files
 
-    def _upload_files(self, files):
+    def _merge_files_to_upload(self, local_items, s3_items):
+        """
+        Find the local files that need uploading by sorting both sides with
+        :py:class:`~s3sfe.diff.ExternalSorter` (which spills to disk beyond
+        ``diff_max_items`` files) and merge-joining them with
+        :py:func:`~s3sfe.diff.merge_diff`, so that neither side needs to be
+        indexed in memory.
+
+        :param local_items: iterable of (path, metadata 3-tuple) for local
+          files, in any order
+        :type local_items: iterable
+        :param s3_items: iterable of (path, metadata 3-tuple) for S3 files,
+          in any order
+        :type s3_items: iterable
+        :return: files that are not in S3, or need to be updated in S3
+        :rtype: dict
+        """
+        files = self._meta_table()
+        self._remote_only = []
+        counts = {}
+        local = ExternalSorter(max_items=self._diff_max_items)
+        remote = ExternalSorter(max_items=self._diff_max_items)
+        try:
+            local.extend(local_items)
+            remote.extend(s3_items)
+            logger.debug('Sorted %d local files (%d runs on disk) and %d S3 '
+                         'files (%d runs on disk)', len(local), local.spilled,
+                         len(remote), remote.spilled)
+            for action, path, meta, _ in merge_diff(
+                local, remote, size_mtime=self._compare == 'size-mtime'
+            ):
+                counts[action] = counts.get(action, 0) + 1
+                if action == UPLOAD:
+                    files[path] = meta
+                elif action == REMOTE_ONLY and self._delete:
+                    self._remote_only.append(path)
+        finally:
+            local.close()
+            remote.close()
+        logger.debug('%d files only in S3', counts.get(REMOTE_ONLY, 0))
+        logger.info('Found %d files to upload', len(files))
+        return files
+
+    def _files_to_refresh(self, local_files, s3_files, to_upload):
+        """
+        Find the local files that are not being uploaded, because their
+        md5sums match S3, but whose size or mtime differ from the metadata
+        recorded in S3; i.e. files that were ``touch`` ed, or copied back into
+        place. Left alone, the quick ``--compare`` modes would hash these on
+        every run.
+
+        :param local_files: local file paths to current metadata
+        :type local_files: dict
+        :param s3_files: S3 file paths to current metadata
+        :type s3_files: dict
+        :param to_upload: files being uploaded, as returned by
+          :py:meth:`~._files_to_upload`
+        :type to_upload: dict
+        :return: subset of local_files whose S3 metadata should be refreshed
+        :rtype: dict
+        """
+        files = {}
+        for k, meta in local_files.items():
+            if k in to_upload or k not in s3_files or meta[2] is None:
+                continue
+            s3_meta = s3_files[k]
+            if meta[2] != s3_meta[2]:
+                continue
+            if not same_size_mtime(meta[0], meta[1], s3_meta):
+                files[k] = meta
+        logger.info('Found %d files with out-of-date metadata in S3',
+                    len(files))
+        return files
+
+    def _refresh_files(self, files):
+        """
+        Refresh the metadata in S3 of the given files, with up to
+        ``self._upload_workers`` concurrent requests; see
+        :py:meth:`~._refresh_file`. Files in bundles have no metadata of their
+        own, only their manifest entries, so need no request.
+
+        :param files: files to refresh, as returned by
+          :py:meth:`~._files_to_refresh`
+        :type files: dict
+        :return: 2-tuple of (list of file paths refreshed, list of file paths
+          that errored)
+        :rtype: tuple
+        """
+        refreshed = []
+        errored = []
+        jobs = []
+        for f in sorted(files.keys()):
+            if f in self.s3.bundled:
+                refreshed.append(f)
+            else:
+                jobs.append((f, self._refresh_file, (f, files[f])))
+        if len(jobs) > 0:
+            logger.info('Refreshing metadata of %d files in S3', len(jobs))
+        with ThreadPoolExecutor(max_workers=self._upload_workers) as pool:
+            for f, fut in run_bounded(
+                pool, iter(jobs), self._upload_workers * 4
+            ):
+                try:
+                    fut.result()
+                    refreshed.append(f)
+                except Exception as ex:
+                    logger.error('Error refreshing metadata of %s: %s',
+                                 f, ex, exc_info=True)
+                    errored.append(f)
+        return refreshed, errored
+
+    def _refresh_file(self, path, meta):
+        """
+        Replace the metadata of a file's object in S3 by copying the object
+        onto itself with new metadata (see
+        :py:meth:`s3sfe.s3.S3Wrapper.copy_file`), once
+        ``self._upload_limiter`` allows (retrying if throttled). The content
+        is copied within S3; nothing is uploaded.
+
+        :param path: local file path
+        :type path: str
+        :param meta: 3-tuple of (file size in bytes, file modification time as
+          a float timestamp, and file md5sum as a hex string)
+        :type meta: tuple
+        """
+        self._upload_limiter.run(
+            self.s3.copy_file, (path, path, meta[0], meta[1], meta[2])
+        )
+
+    def _delete_files(self, s3_files, file_paths, exclude_paths):
         """
-        Upload the specified files to S3.
+        Delete from S3 the files that no longer exist locally, as chosen by
+        :py:meth:`~._paths_to_delete`.
+
+        :param s3_files: files in S3 at the start of the run
+        :type s3_files: dict
+        :param file_paths: list of file paths being synchronized
+        :type file_paths: list
+        :param exclude_paths: list of exclude patterns
+        :type exclude_paths: list
+        :return: 3-tuple of (list of paths deleted, or that would be deleted
+          in a dry run; list of paths that failed to delete; number of paths
+          not deleted because a limit was exceeded)
+        :rtype: tuple
+        """
+        paths, refused = self._paths_to_delete(
+            s3_files, file_paths, exclude_paths
+        )
+        if len(paths) == 0:
+            return [], [], refused
+        errors = self.s3.delete_files(paths, workers=self._upload_workers)
+        failed = set(errors)
+        return [p for p in paths if p not in failed], errors, 0
+
+    def _paths_to_delete(self, s3_files, file_paths, exclude_paths):
+        """
+        Return the files to delete from S3 because they no longer exist
+        locally, out of those found by :py:meth:`~._files_to_upload`
+        (``self._remote_only``).
+
+        Like ``rsync --delete``, only files under one of ``file_paths`` and
+        not matched by ``exclude_paths`` are deleted; files that are merely no
+        longer selected for backup are kept, as are files that exist but could
+        not be read this run. Files under a path that could not be stat'ed
+        (i.e. an unmounted volume) or a directory that could not be listed
+        (``self._list_errors``) are kept too, as rsync skips deletion on I/O
+        errors; otherwise a temporarily unavailable path would look deleted.
+        If the number of files to delete exceeds ``max_delete``, or
+        ``max_delete_percent`` of the files in S3, nothing is deleted.
+
+        :param s3_files: files in S3 at the start of the run
+        :type s3_files: dict
+        :param file_paths: list of file paths being synchronized
+        :type file_paths: list
+        :param exclude_paths: list of exclude patterns
+        :type exclude_paths: list
+        :return: 2-tuple of (sorted list of paths to delete, number of paths
+          not deleted because a limit was exceeded)
+        :rtype: tuple
+        """
+        roots = minimal_paths(file_paths)
+        under = PrefixMatcher([p.rstrip('/') + '/' for p in roots])
+        roots = set(roots)
+        exclude = PathMatcher(exclude_paths)
+        unreadable = set(self._meta_errors)
+        unreadable.update(self._list_errors)
+        unlisted = PrefixMatcher([
+            p.rstrip('/') + '/' for p in self._list_errors
+        ])
+        paths = []
+        kept = 0
+        for p in sorted(self._remote_only):
+            if p not in roots and under.match(p) is None:
+                continue
+            if exclude.match(p) is not None:
+                continue
+            if p in unreadable or unlisted.match(p) is not None:
+                kept += 1
+                continue
+            paths.append(p)
+        if kept > 0:
+            logger.warning('Not deleting %d files from S3 that are under '
+                           'paths that could not be read this run', kept)
+        logger.info('Found %d files to delete from S3', len(paths))
+        if len(paths) == 0:
+            return [], 0
+        reason = None
+        if self._max_delete is not None and len(paths) > self._max_delete:
+            reason = 'more than the maximum of %d' % self._max_delete
+        pct = len(paths) * 100.0 / max(1, len(s3_files))
+        if (
+            self._max_delete_percent is not None and
+            pct > self._max_delete_percent
+        ):
+            reason = '%.1f%% of files in S3; more than the maximum of ' \
+                     '%s%%' % (pct, self._max_delete_percent)
+        if reason is not None:
+            logger.error('Refusing to delete %d files from S3: %s',
+                         len(paths), reason)
+            return [], len(paths)
+        return paths, 0
+
+    def _clean_uploads(self):
+        """
+        Abort the interrupted multipart uploads in the upload journal whose
+        local files have since been removed or changed size or mtime, as they
+        can't be resumed. If ``abort_orphaned_uploads`` is set, also abort the
+        incomplete uploads under the prefix that the journal doesn't know
+        about (left by runs without a journal, or with a journal since lost)
+        and that are at least :py:attr:`~.orphaned_upload_age` seconds old.
+        """
+        keep = set()
+        if self._journal is not None:
+            for key, upload_id, path, size_b, mtime in self._journal.uploads(
+                self._bucket_name
+            ):
+                try:
+                    st = os.stat(path)
+                    changed = (
+                        st.st_size != size_b or
+                        abs(st.st_mtime - mtime) > MTIME_TOLERANCE
+                    )
+                except OSError:
+                    changed = True
+                if not changed:
+                    keep.add(upload_id)
+                    continue
+                logger.info('Aborting interrupted upload of %s; the file has '
+                            'been removed or changed', path)
+                self.s3.abort_upload(key, upload_id)
+        if not self._abort_orphaned:
+            return
+        try:
+            count = self.s3.abort_orphaned_uploads(
+                keep_ids=keep, min_age=self.orphaned_upload_age
+            )
+        except Exception:
+            logger.error('Error aborting orphaned uploads', exc_info=True)
+            return
+        if count > 0:
+            logger.warning('Aborted %d orphaned multipart uploads', count)
+
+    def _upload_files(self, files, s3_files=None):
+        """
+        Upload the specified files to S3, in ``self._upload_order``, using up
+        to ``self._upload_workers`` concurrent uploads. The total time spent
+        inside successful uploads (summed across workers) is stored in
+        ``self._upload_busy``, for calculating effective concurrency. From the
+        resulting per-upload throughput, the time the uploads would have taken
+        in each possible order is estimated and stored in
+        ``self._upload_makespans``.
+
+        If ``copy_duplicates`` is set, files with the same content as another
+        file already in S3, or as one uploaded earlier in this call, are then
+        copied within S3 instead; see :py:meth:`~._find_copies`. The paths and
+        total size of the files copied are stored in ``self._copied`` and
+        ``self._copied_bytes``; they don't count towards the bytes uploaded.
+
+        If ``bundle_threshold`` is set, files smaller than it are then packed
+        into bundles by :py:meth:`~._upload_bundles`.
 
         :param files: dict of files that need to be uploaded to S3. Keys are
           local file paths, values are 3-tuples of (file size in bytes,
           file modification time as a float timestamp, and file md5sum as a hex
           string)
         :type files: dict
+        :param s3_files: files in S3 at the start of the run, in the format
+          returned by :py:meth:`~._s3_files`
+        :type s3_files: dict
         :return: 2-tuple of (list of file paths that errored uploading, total
           bytes uploaded)
         :rtype: tuple
         """
-        logger.info('Beginning upload of %d files', len(files))
+        small = {}
+        if self._bundle_threshold is not None:
+            small = dict(
+                (p, files[p]) for p in files.keys()
+                if files[p][0] < self._bundle_threshold
+            )
+            if len(small) > 0:
+                files = dict(
+                    (p, files[p]) for p in files.keys() if p not in small
+                )
+        copies = {}
+        self._copied = None
+        self._copied_bytes = 0
+        if self._copy_duplicates:
+            copies = self._find_copies(files, s3_files)
+            self._copied = []
+            if len(copies) > 0:
+                to_copy = files
+                files = dict(
+                    (p, files[p]) for p in files.keys() if p not in copies
+                )
+        logger.info('Beginning upload of %d files with %d workers in %s '
+                    'order',
+                    len(files), self._upload_workers, self._upload_order)
         errored = []
         total_bytes = 0
-        for f in sorted(files.keys()):
+        self._upload_busy = 0.0
+        self._upload_makespans = None
+        jobs = (
+            (f, self._put_file, (f, files[f]))
+            for f in order_files(files, self._upload_order)
+        )
+        with ThreadPoolExecutor(max_workers=self._upload_workers) as pool:
+            for f, fut in run_bounded(pool, jobs, self._upload_workers * 4):
+                try:
+                    self._upload_busy += fut.result()
+                    total_bytes += files[f][0]
+                except Exception as ex:
+                    logger.error('Error uploading file %s: %s',
+                                 f, ex, exc_info=True)
+                    errored.append(f)
+        if total_bytes > 0 and self._upload_busy > 0:
+            self._upload_makespans = compare_orders(
+                files, self._upload_workers, total_bytes / self._upload_busy
+            )
+        if len(copies) > 0:
+            logger.info('Copying %d files with content already in S3',
+                        len(copies))
+            failed = set(errored)
+            jobs = (
+                (f, self._copy_file,
+                 (f, copies[f], to_copy[f], copies[f] in failed))
+                for f in sorted(copies.keys())
+            )
+            with ThreadPoolExecutor(max_workers=self._upload_workers) as pool:
+                for f, fut in run_bounded(
+                    pool, jobs, self._upload_workers * 4
+                ):
+                    try:
+                        secs = fut.result()
+                    except Exception as ex:
+                        logger.error('Error uploading file %s: %s',
+                                     f, ex, exc_info=True)
+                        errored.append(f)
+                        continue
+                    if secs is None:
+                        self._copied.append(f)
+                        self._copied_bytes += to_copy[f][0]
+                    else:
+                        self._upload_busy += secs
+                        total_bytes += to_copy[f][0]
+        if len(small) > 0:
+            bundle_errors, bundle_bytes = self._upload_bundles(
+                small, s3_files=s3_files
+            )
+            errored.extend(bundle_errors)
+            total_bytes += bundle_bytes
+        return errored, total_bytes
+
+    def _find_copies(self, files, s3_files):
+        """
+        Find the files to upload whose content (size and md5sum) is the same
+        as that of a file already in S3 as its own object, or of another file
+        to upload that comes before it in path order, so that they can be
+        copied within S3 rather than uploaded; after a directory is renamed,
+        for instance, every file under it is new but already in S3.
+
+        Files in S3 that are being uploaded again are not used as sources, as
+        their content is about to change, nor are files in bundles. Empty
+        files, and files small enough to be bundled, are always uploaded.
+
+        :param files: dict of files that need to be uploaded to S3, in the
+          same format as for :py:meth:`~._upload_files`
+        :type files: dict
+        :param s3_files: files in S3 at the start of the run, in the format
+          returned by :py:meth:`~._s3_files`, or None
+        :type s3_files: dict
+        :return: dict of the paths of files to copy, to the path of the file
+          in S3 to copy each from
+        :rtype: dict
+        """
+        min_size = max(1, self._bundle_threshold or 0)
+        wanted = set(
+            (meta[0], meta[2]) for meta in files.values()
+            if meta[2] is not None and meta[0] >= min_size
+        )
+        if len(wanted) == 0:
+            return {}
+        sources = {}
+        if s3_files is not None:
+            for path, meta in s3_files.items():
+                content = (meta[0], meta[2])
+                if (
+                    content in wanted and content not in sources and
+                    path not in files and path not in self.s3.bundled
+                ):
+                    sources[content] = path
+        copies = {}
+        for path in sorted(files.keys()):
+            meta = files[path]
+            content = (meta[0], meta[2])
+            if content not in wanted:
+                continue
+            if content in sources:
+                copies[path] = sources[content]
+            else:
+                # upload the first file with this content; copy the rest
+                sources[content] = path
+        return copies
+
+    def _copy_file(self, path, src, meta, upload=False):
+        """
+        Copy the object of file ``src`` in S3 to that of ``path``, once
+        ``self._upload_limiter`` allows (retrying if throttled). If the copy
+        fails, or if ``upload`` is True because ``src`` itself failed to
+        upload, the file is uploaded instead.
+
+        :param path: local file path
+        :type path: str
+        :param src: path of the file with the same content to copy from
+        :type src: str
+        :param meta: 3-tuple of (file size in bytes, file modification time as
+          a float timestamp, and file md5sum as a hex string)
+        :type meta: tuple
+        :param upload: whether to upload the file without trying to copy it
+        :type upload: bool
+        :return: None if the file was copied, otherwise the seconds spent
+          uploading it
+        :rtype: float
+        """
+        if not upload:
             try:
-                self.s3.put_file(f, files[f][0], files[f][1], files[f][2])
-                total_bytes += files[f][0]
+                self._upload_limiter.run(
+                    self.s3.copy_file, (src, path, meta[0], meta[1], meta[2])
+                )
+                return None
             except Exception as ex:
-                logger.error('Error uploading file %s: %s',
-                             f, ex, exc_info=True)
-                errored.append(f)
+                logger.warning('Error copying %s to %s in S3; uploading it '
+                               'instead: %s', src, path, ex)
+        return self._put_file(path, meta)
+
+    def _upload_bundles(self, files, s3_files=None):
+        """
+        Pack small files into new bundle objects of about ``bundle_size``
+        bytes each (in path order, so that files restored together are near
+        each other), and upload them with up to ``self._upload_workers``
+        concurrent uploads; see :py:meth:`s3sfe.s3.S3Wrapper.put_bundle`.
+        Files that were stored as their own objects are then deleted from S3.
+        Copies of the files in older bundles become dead space, reclaimed by
+        :py:meth:`~._compact_bundles`.
+
+        :param files: dict of files to bundle, in the same format as for
+          :py:meth:`~._upload_files`
+        :type files: dict
+        :param s3_files: files in S3 at the start of the run, in the format
+          returned by :py:meth:`~._s3_files`
+        :type s3_files: dict
+        :return: 2-tuple of (list of file paths that errored uploading, total
+          bytes uploaded)
+        :rtype: tuple
+        """
+        chunks = [[]]
+        nbytes = 0
+        for path in sorted(files.keys()):
+            if nbytes >= self._bundle_size:
+                chunks.append([])
+                nbytes = 0
+            chunks[-1].append(path)
+            nbytes += files[path][0]
+        logger.info('Packing %d small files into %d bundles', len(files),
+                    len(chunks))
+        objects = []
+        if s3_files is not None:
+            objects = [
+                p for p in files.keys()
+                if p in s3_files and p not in self.s3.bundled
+            ]
+        errored = []
+        total_bytes = 0
+        jobs = (
+            (i, self._put_bundle, (chunk, files))
+            for i, chunk in enumerate(chunks)
+        )
+        with ThreadPoolExecutor(max_workers=self._upload_workers) as pool:
+            for i, fut in run_bounded(pool, jobs, self._upload_workers * 2):
+                try:
+                    failed, secs = fut.result()
+                except Exception as ex:
+                    logger.error('Error uploading bundle of %d files: %s',
+                                 len(chunks[i]), ex, exc_info=True)
+                    errored.extend(chunks[i])
+                    continue
+                errored.extend(failed)
+                self._upload_busy += secs
+                failed = set(failed)
+                total_bytes += sum(
+                    files[p][0] for p in chunks[i] if p not in failed
+                )
+        errored_set = set(errored)
+        objects = [p for p in objects if p not in errored_set]
+        if len(objects) > 0:
+            logger.info('Deleting %d objects of files now in bundles',
+                        len(objects))
+            for p in self.s3.delete_objects(
+                objects, workers=self._upload_workers
+            ):
+                logger.warning('Could not delete object of bundled file %s',
+                               p)
         return errored, total_bytes
+
+    def _put_bundle(self, paths, files):
+        """
+        Read the given files and upload them as one bundle, once
+        ``self._upload_limiter`` allows (retrying if throttled). Files that
+        can't be read, or whose size has changed since they were hashed, are
+        left out.
+
+        :param paths: paths of the files to bundle
+        :type paths: list
+        :param files: dict of file path to 3-tuple of (file size in bytes,
+          file modification time as a float timestamp, and file md5sum as a
+          hex string)
+        :type files: dict
+        :return: 2-tuple of (list of paths left out, seconds spent uploading)
+        :rtype: tuple
+        """
+        members = []
+        failed = []
+        for path in paths:
+            try:
+                with open(path, 'rb') as fh:
+                    data = fh.read()
+            except (IOError, OSError) as ex:
+                logger.error('Error reading %s: %s', path, ex)
+                failed.append(path)
+                continue
+            if len(data) != files[path][0]:
+                logger.error('File %s changed size since it was hashed; not '
+                             'uploading', path)
+                failed.append(path)
+                continue
+            members.append((path, files[path], data))
+        if len(members) == 0:
+            return failed, 0.0
+
+        def put():
+            start = time.time()
+            self.s3.put_bundle(members)
+            return time.time() - start
+
+        secs = self._upload_limiter.run(
+            put, nbytes=sum(len(m[2]) for m in members)
+        )
+        return failed, secs
+
+    def _compact_bundles(self, s3_files):
+        """
+        Reclaim the dead space in bundles left by bundled files that have
+        since changed (and been stored elsewhere) or been deleted. Bundles in
+        which no files are still needed are deleted; the files still needed
+        from bundles that are at least ``bundle_compact`` dead space are
+        repacked together into new bundles, and the old bundles deleted.
+
+        Errors are logged; the dead space is left for the next run to
+        reclaim. Sets ``self._bundles_changed`` if any bundles changed. In a
+        dry run, the bundles that would be repacked or deleted are only
+        logged, without downloading them.
+
+        :param s3_files: files in S3 at the start of the run, in the format
+          returned by :py:meth:`~._s3_files`; the metadata of the live files
+          in the bundles
+        :type s3_files: dict
+        """
+        live = {}
+        for path, (bid, offset, size_b) in self.s3.bundled.items():
+            live.setdefault(bid, []).append((offset, size_b, path))
+        empty = []
+        sparse = []
+        for bid, data_size in self.s3.bundles.items():
+            used = sum(m[1] for m in live.get(bid, []))
+            if used == 0:
+                empty.append(bid)
+            elif (
+                data_size > 0 and
+                (data_size - used) / float(data_size) >= self._bundle_compact
+            ):
+                sparse.append(bid)
+        if len(sparse) + len(empty) == 0:
+            return
+        logger.info('Compacting %d bundles; deleting %d empty bundles',
+                    len(sparse), len(empty))
+        if self._dry_run:
+            for bid in sorted(sparse):
+                logger.warning('DRY RUN; would repack %d files (%d bytes) '
+                               'from bundle %s', len(live[bid]),
+                               sum(m[1] for m in live[bid]), bid)
+            for bid in sorted(empty):
+                logger.warning('DRY RUN; would delete empty bundle %s', bid)
+            return
+        try:
+            members = []
+            nbytes = 0
+            for bid in sorted(sparse):
+                data = self.s3.read_bundle(bid)
+                for offset, size_b, path in sorted(live[bid]):
+                    members.append(
+                        (path, s3_files[path], data[offset:offset + size_b])
+                    )
+                    nbytes += size_b
+                    if nbytes >= self._bundle_size:
+                        self.s3.put_bundle(members)
+                        self._bundles_changed = True
+                        members = []
+                        nbytes = 0
+            if len(members) > 0:
+                self.s3.put_bundle(members)
+            self.s3.delete_bundles(sorted(empty + sparse))
+            self._bundles_changed = True
+        except Exception as ex:
+            logger.error('Error compacting bundles: %s', ex, exc_info=True)
+
+    def _put_file(self, path, meta):
+        """
+        Upload one file to S3, once ``self._upload_limiter`` allows (retrying
+        if throttled), and return how long the upload itself took.
+
+        :param path: local file path
+        :type path: str
+        :param meta: 3-tuple of (file size in bytes, file modification time as
+          a float timestamp, and file md5sum as a hex string)
+        :type meta: tuple
+        :return: seconds spent uploading
+        :rtype: float
+        """
+        def put():
+            start = time.time()
+            self.s3.put_file(path, meta[0], meta[1], meta[2])
+            return time.time() - start
+
+        return self._upload_limiter.run(put, nbytes=meta[0])
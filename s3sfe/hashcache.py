@@ -0,0 +1,235 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Don't cache the MD5 of a file modified less than this many seconds before
+#: it was hashed; a write landing in the same mtime tick as our read would
+#: otherwise go undetected on the next run.
+RACY_SECONDS = 2
+
+
+def default_cache_path():
+    """
+    Return the default path to the hash cache database,
+    ``$XDG_CACHE_HOME/s3sfe/hashcache.sqlite`` (where ``XDG_CACHE_HOME``
+    defaults to ``~/.cache``).
+
+    :return: default hash cache database path
+    :rtype: str
+    """
+    base = os.environ.get('XDG_CACHE_HOME', '')
+    if base == '':
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 's3sfe', 'hashcache.sqlite')
+
+
+def stat_ns(st, name):
+    """
+    Return the ``mtime`` or ``ctime`` of a stat result in integer nanoseconds,
+    falling back to the float timestamp on Pythons without ``st_*time_ns``.
+
+    :param st: stat result
+    :type st: os.stat_result
+    :param name: ``mtime`` or ``ctime``
+    :type name: str
+    :return: timestamp in nanoseconds
+    :rtype: int
+    """
+    ns = getattr(st, 'st_%s_ns' % name, None)
+    if ns is None:
+        ns = int(getattr(st, 'st_%s' % name) * 1000000000)
+    return ns
+
+
+class HashCache(object):
+    """
+    Persistent sqlite-backed cache of file MD5 sums. Entries are keyed by
+    path and are only considered valid while the file's device, inode, size,
+    mtime and ctime all still match what they were when it was hashed.
+
+    A HashCache may be shared between threads; all database access is
+    serialized by an internal lock.
+    """
+
+    #: number of writes to batch into one transaction
+    commit_every = 1000
+
+    def __init__(self, path=None, rehash=False):
+        """
+        Open (creating if needed) the hash cache database.
+
+        :param path: path to the sqlite database; defaults to
+          :py:func:`~.default_cache_path`
+        :type path: str
+        :param rehash: if True, ignore all cached sums (every lookup is a
+          miss) but still store freshly-computed ones
+        :type rehash: bool
+        """
+        if path is None:
+            path = default_cache_path()
+        self._path = path
+        self._rehash = rehash
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        d = os.path.dirname(path)
+        if d != '' and not os.path.exists(d):
+            logger.debug('Creating hash cache directory: %s', d)
+            os.makedirs(d)
+        logger.debug('Opening hash cache: %s (rehash=%s)', path, rehash)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'path TEXT PRIMARY KEY, st_dev INTEGER, st_ino INTEGER, '
+            'size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, md5 TEXT)'
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _validator(st):
+        """
+        Return the tuple of stat fields that a cache entry is validated by.
+
+        :param st: stat result
+        :type st: os.stat_result
+        :return: (st_dev, st_ino, size, mtime_ns, ctime_ns)
+        :rtype: tuple
+        """
+        return (
+            st.st_dev, st.st_ino, st.st_size,
+            stat_ns(st, 'mtime'), stat_ns(st, 'ctime')
+        )
+
+    def get(self, path, st):
+        """
+        Return the cached MD5 sum for ``path`` if its stat information still
+        matches ``st``, otherwise None.
+
+        :param path: file path
+        :type path: str
+        :param st: current stat result for the file
+        :type st: os.stat_result
+        :return: cached md5sum hex digest, or None
+        :rtype: str
+        """
+        with self._lock:
+            if self._rehash:
+                self.misses += 1
+                return None
+            row = self._conn.execute(
+                'SELECT st_dev, st_ino, size, mtime_ns, ctime_ns, md5 '
+                'FROM hashes WHERE path=?', (path, )
+            ).fetchone()
+            if row is None or tuple(row[:5]) != self._validator(st):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[5]
+
+    def set(self, path, st, md5sum):
+        """
+        Store the MD5 sum of ``path``, as it was when stat'ed as ``st``.
+
+        :param path: file path
+        :type path: str
+        :param st: stat result for the file, taken before hashing it
+        :type st: os.stat_result
+        :param md5sum: md5sum hex digest
+        :type md5sum: str
+        """
+        if st.st_mtime > time.time() - RACY_SECONDS:
+            logger.debug('Not caching hash of recently-modified file: %s', path)
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO hashes (path, st_dev, st_ino, size, '
+                'mtime_ns, ctime_ns, md5) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, ) + self._validator(st) + (md5sum, )
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self.commit()
+
+    def commit(self):
+        """
+        Commit any pending writes to disk.
+        """
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def evict(self, current_paths):
+        """
+        Remove entries for files that no longer exist. Paths in
+        ``current_paths`` are known to exist and are not checked, so only
+        entries outside the current run cost a ``stat``.
+
+        :param current_paths: paths seen during the current run
+        :type current_paths: set
+        :return: number of entries removed
+        :rtype: int
+        """
+        gone = []
+        with self._lock:
+            for (path, ) in self._conn.execute('SELECT path FROM hashes'):
+                if path in current_paths:
+                    continue
+                if not os.path.exists(path):
+                    gone.append((path, ))
+            if len(gone) > 0:
+                self._conn.executemany(
+                    'DELETE FROM hashes WHERE path=?', gone
+                )
+            self.commit()
+        logger.debug('Evicted %d missing files from hash cache', len(gone))
+        return len(gone)
+
+    def close(self):
+        """
+        Commit pending writes and close the database.
+        """
+        with self._lock:
+            self.commit()
+            self._conn.close()
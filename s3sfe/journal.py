@@ -0,0 +1,238 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def default_journal_path():
+    """
+    Return the default path to the upload journal database,
+    ``$XDG_CACHE_HOME/s3sfe/uploads.sqlite`` (where ``XDG_CACHE_HOME``
+    defaults to ``~/.cache``).
+
+    :return: default upload journal database path
+    :rtype: str
+    """
+    base = os.environ.get('XDG_CACHE_HOME', '')
+    if base == '':
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 's3sfe', 'uploads.sqlite')
+
+
+class UploadJournal(object):
+    """
+    Persistent sqlite-backed record of the multipart uploads in progress, so
+    that an upload interrupted by the process being killed can be resumed by
+    a later run instead of starting again from the first byte.
+
+    Each upload is recorded with the file's path, size, mtime and md5sum when
+    it started, its part size, and the number and ETag of every part
+    uploaded so far. Every change is committed immediately, since the point
+    is to survive the process dying.
+
+    An UploadJournal may be shared between threads; all database access is
+    serialized by an internal lock.
+    """
+
+    def __init__(self, path=None):
+        """
+        Open (creating if needed) the upload journal database.
+
+        :param path: path to the sqlite database; defaults to
+          :py:func:`~.default_journal_path`
+        :type path: str
+        """
+        if path is None:
+            path = default_journal_path()
+        self._path = path
+        d = os.path.dirname(path)
+        if d != '' and not os.path.exists(d):
+            logger.debug('Creating upload journal directory: %s', d)
+            os.makedirs(d)
+        logger.debug('Opening upload journal: %s', path)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'bucket TEXT, key TEXT, upload_id TEXT, path TEXT, '
+            'part_size INTEGER, size INTEGER, mtime REAL, md5 TEXT, '
+            'PRIMARY KEY (bucket, key))'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS parts ('
+            'upload_id TEXT, part_number INTEGER, etag TEXT, '
+            'PRIMARY KEY (upload_id, part_number))'
+        )
+        self._conn.commit()
+
+    def get(self, bucket, key):
+        """
+        Return the upload in progress to ``key`` in ``bucket``, if any.
+
+        :param bucket: bucket name
+        :type bucket: str
+        :param key: S3 key being uploaded to
+        :type key: str
+        :return: dict with ``upload_id``, ``path``, ``part_size``, ``size``,
+          ``mtime``, ``md5`` and ``parts`` (part number to ETag) keys, or None
+        :rtype: dict
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT upload_id, path, part_size, size, mtime, md5 '
+                'FROM uploads WHERE bucket=? AND key=?', (bucket, key)
+            ).fetchone()
+            if row is None:
+                return None
+            parts = dict(self._conn.execute(
+                'SELECT part_number, etag FROM parts WHERE upload_id=?',
+                (row[0], )
+            ).fetchall())
+        return {
+            'upload_id': row[0],
+            'path': row[1],
+            'part_size': row[2],
+            'size': row[3],
+            'mtime': row[4],
+            'md5': row[5],
+            'parts': parts
+        }
+
+    def start(self, bucket, key, upload_id, path, part_size, size_b, mtime,
+              md5sum):
+        """
+        Record a newly-created multipart upload, replacing any previous one
+        to the same key.
+
+        :param bucket: bucket name
+        :type bucket: str
+        :param key: S3 key being uploaded to
+        :type key: str
+        :param upload_id: multipart upload ID
+        :type upload_id: str
+        :param path: local path of the file being uploaded
+        :type path: str
+        :param part_size: size of each part (but the last) in bytes
+        :type part_size: int
+        :param size_b: file size in bytes
+        :type size_b: int
+        :param mtime: file modification time as a float timestamp
+        :type mtime: float
+        :param md5sum: file md5sum as a hex string
+        :type md5sum: str
+        """
+        with self._lock:
+            self._delete(bucket, key)
+            self._conn.execute(
+                'INSERT INTO uploads (bucket, key, upload_id, path, part_size, '
+                'size, mtime, md5) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (bucket, key, upload_id, path, part_size, size_b, mtime,
+                 md5sum)
+            )
+            self._conn.commit()
+
+    def add_part(self, upload_id, part_number, etag):
+        """
+        Record that a part of an upload has been uploaded.
+
+        :param upload_id: multipart upload ID
+        :type upload_id: str
+        :param part_number: part number, starting at 1
+        :type part_number: int
+        :param etag: the part's ETag, as returned by UploadPart
+        :type etag: str
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO parts (upload_id, part_number, etag) '
+                'VALUES (?, ?, ?)', (upload_id, part_number, etag)
+            )
+            self._conn.commit()
+
+    def finish(self, bucket, key):
+        """
+        Forget the upload to ``key`` in ``bucket``, once it has been completed
+        or aborted.
+
+        :param bucket: bucket name
+        :type bucket: str
+        :param key: S3 key that was being uploaded to
+        :type key: str
+        """
+        with self._lock:
+            self._delete(bucket, key)
+            self._conn.commit()
+
+    def _delete(self, bucket, key):
+        """
+        Delete the upload to ``key`` in ``bucket`` and its parts, without
+        committing.
+        """
+        self._conn.execute(
+            'DELETE FROM parts WHERE upload_id IN (SELECT upload_id FROM '
+            'uploads WHERE bucket=? AND key=?)', (bucket, key)
+        )
+        self._conn.execute(
+            'DELETE FROM uploads WHERE bucket=? AND key=?', (bucket, key)
+        )
+
+    def uploads(self, bucket):
+        """
+        Return all of the uploads in progress to ``bucket``.
+
+        :param bucket: bucket name
+        :type bucket: str
+        :return: list of (key, upload ID, local path, size, mtime) 5-tuples
+        :rtype: list
+        """
+        with self._lock:
+            return [tuple(r) for r in self._conn.execute(
+                'SELECT key, upload_id, path, size, mtime FROM uploads '
+                'WHERE bucket=? ORDER BY key', (bucket, )
+            ).fetchall()]
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._conn.close()
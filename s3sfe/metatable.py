@@ -0,0 +1,328 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+from array import array
+from binascii import hexlify, unhexlify
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
+
+#: md5 column value for entries whose md5sum isn't a 32-character hex string
+_NO_DIGEST = b'\x00' * 16
+
+
+def _encode(s):
+    """
+    Encode a path to bytes, losslessly (undecodable bytes in paths from the
+    filesystem survive as surrogate escapes on python 3).
+    """
+    if isinstance(s, bytes):
+        return s
+    try:
+        return s.encode('utf-8', 'surrogateescape')
+    except LookupError:  # python 2 unicode
+        return s.encode('utf-8')
+
+
+def _decode(b, as_bytes):
+    if as_bytes:
+        return b
+    return b.decode('utf-8', 'surrogateescape')
+
+
+def md5_digest(md5sum):
+    """
+    Return the 16-byte binary digest of ``md5sum`` if it's a lowercase hex
+    md5sum (as :py:func:`s3sfe.utils.md5_file` returns), so that it converts
+    back to exactly the same string; otherwise return None.
+
+    :param md5sum: md5sum to convert
+    :type md5sum: str
+    :rtype: bytes
+    """
+    if md5sum is None or len(md5sum) != 32:
+        return None
+    try:
+        digest = unhexlify(md5sum)
+    except (TypeError, ValueError):
+        return None
+    if hexlify(digest).decode('ascii') != md5sum:
+        return None
+    return digest
+
+
+class FileMetaTable(Mapping):
+    """
+    Compact, array-backed mapping of file path to a 3-tuple of (file size in
+    bytes, file modification time as a float timestamp, file md5sum as a hex
+    string); a drop-in replacement for the ``{path: (size, mtime, md5sum)}``
+    dicts used by :py:class:`~s3sfe.filesyncer.FileSyncer` for very large
+    file sets.
+
+    Instead of a string, a tuple, a float and a 32-character hex string per
+    entry, each entry is stored as columns in flat arrays:
+
+    * an index into a list of interned directory names (shared by every file
+      in the directory), and the basename, as bytes in one shared buffer
+    * size as an int64, and mtime as a float64 (the same float timestamp that
+      was stored, so values round-trip exactly)
+    * the md5sum as 16 binary bytes
+
+    Lookups go through an open-addressing hash index of row numbers, which
+    compares the stored path only on a hash match. Each row's path hash is
+    also stored, so that :py:meth:`~.columns` can be searched in bulk. All
+    told, an entry takes roughly 70 bytes plus the length of its basename,
+    compared to several hundred for a dict entry. Value tuples are built on
+    access.
+
+    Entries can be added, replaced and removed; the space of removed entries
+    is not reclaimed.
+    """
+
+    def __init__(self, items=None):
+        """
+        :param items: optional mapping or iterable of (path, value) pairs to
+          populate the table with
+        :type items: dict
+        """
+        self._dirs = []
+        self._dir_index = {}
+        self._row_dir = array('i')
+        self._name_end = array('I')
+        self._names = bytearray()
+        self._hash = array('q')
+        self._size = array('q')
+        self._mtime = array('d')
+        self._md5 = bytearray()
+        self._odd_md5 = {}
+        self._bytes_keys = None
+        self._slots = array('i', [-1]) * 8
+        self._len = 0
+        if items is not None:
+            if hasattr(items, 'items'):
+                items = items.items()
+            for k, v in items:
+                self[k] = v
+
+    def __len__(self):
+        return self._len
+
+    def _split(self, path):
+        """
+        Split ``path`` into (interned directory index or None, directory,
+        basename bytes). The directory keeps its trailing separator, so that
+        the path is exactly its directory plus its basename.
+        """
+        if self._bytes_keys is None:
+            self._bytes_keys = isinstance(path, bytes)
+        i = path.rfind(b'/' if isinstance(path, bytes) else '/') + 1
+        d = path[:i]
+        return self._dir_index.get(d), d, _encode(path[i:])
+
+    def _name(self, row):
+        start = 0 if row == 0 else self._name_end[row - 1]
+        return bytes(self._names[start:self._name_end[row]])
+
+    def _path(self, row):
+        return self._dirs[self._row_dir[row]] + _decode(
+            self._name(row), self._bytes_keys
+        )
+
+    def _find(self, path, split=None):
+        """
+        Return (slot, row) for ``path``; row is -1 (and slot is the empty slot
+        it would go in) if ``path`` is not in the table.
+        """
+        dir_idx, _, name = split or self._split(path)
+        mask = len(self._slots) - 1
+        slot = hash(path) & mask
+        while True:
+            row = self._slots[slot]
+            if row == -1:
+                return slot, -1
+            if (
+                dir_idx is not None and self._row_dir[row] == dir_idx and
+                self._name(row) == name
+            ):
+                return slot, row
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        slots = array('i', [-1]) * (len(self._slots) * 2)
+        mask = len(slots) - 1
+        for row in self._rows():
+            slot = self._hash[row] & mask
+            while slots[slot] != -1:
+                slot = (slot + 1) & mask
+            slots[slot] = row
+        self._slots = slots
+
+    def __getitem__(self, path):
+        _, row = self._find(path)
+        if row == -1:
+            raise KeyError(path)
+        return self._value(row)
+
+    def __contains__(self, path):
+        return self._find(path)[1] != -1
+
+    def _value(self, row):
+        md5sum = self._odd_md5.get(row)
+        if md5sum is None and row not in self._odd_md5:
+            md5sum = hexlify(bytes(self._md5[row * 16:row * 16 + 16]))
+            md5sum = md5sum.decode('ascii')
+        return (
+            self._size[row], self._mtime[row], md5sum
+        )
+
+    def _set_value(self, row, value):
+        size, mtime, md5sum = value
+        self._size[row] = int(size)
+        self._mtime[row] = float(mtime)
+        digest = md5_digest(md5sum)
+        if digest is None:
+            # not a lowercase hex digest; keep it verbatim
+            self._odd_md5[row] = md5sum
+            digest = _NO_DIGEST
+        else:
+            self._odd_md5.pop(row, None)
+        self._md5[row * 16:row * 16 + 16] = digest
+
+    def __setitem__(self, path, value):
+        split = self._split(path)
+        slot, row = self._find(path, split)
+        if row != -1:
+            self._set_value(row, value)
+            return
+        dir_idx, d, name = split
+        if dir_idx is None:
+            dir_idx = len(self._dirs)
+            self._dirs.append(d)
+            self._dir_index[d] = dir_idx
+        row = len(self._row_dir)
+        self._row_dir.append(dir_idx)
+        self._names += name
+        self._name_end.append(len(self._names))
+        self._hash.append(hash(path))
+        self._size.append(0)
+        self._mtime.append(0.0)
+        self._md5 += _NO_DIGEST
+        self._set_value(row, value)
+        self._slots[slot] = row
+        self._len += 1
+        if len(self._row_dir) * 2 > len(self._slots):
+            self._grow()
+
+    def __delitem__(self, path):
+        _, row = self._find(path)
+        if row == -1:
+            raise KeyError(path)
+        # the row keeps its slot, so that probing past it still works, but
+        # no longer belongs to any directory and so never matches
+        self._row_dir[row] = -1
+        self._odd_md5.pop(row, None)
+        self._len -= 1
+
+    def _rows(self):
+        """
+        Generator of the row numbers of every entry that hasn't been removed.
+        """
+        for row in range(len(self._row_dir)):
+            if self._row_dir[row] != -1:
+                yield row
+
+    def __iter__(self):
+        for row in self._rows():
+            yield self._path(row)
+
+    def items(self):
+        for row in self._rows():
+            yield self._path(row), self._value(row)
+
+    def row_value(self, row):
+        """
+        Return the metadata 3-tuple of one row of :py:meth:`~.columns`.
+
+        :param row: row number
+        :type row: int
+        :rtype: tuple
+        """
+        return self._value(row)
+
+    def columns(self):
+        """
+        Return the table's columns themselves, not copies, so that they can
+        be processed in bulk (i.e. by :py:func:`s3sfe.diff.numpy_diff`). The
+        table must not be changed while buffers exported from them are in
+        use. The result is a dict of:
+
+        * ``hash``: each row's path hash (``array('q')``)
+        * ``dir``: each row's index into ``dirs``, or -1 if it was removed
+          (``array('i')``)
+        * ``dirs``: the interned directory names, and ``dir_index``, mapping
+          each back to its index
+        * ``name_end``: the offset in ``names`` of the end of each row's
+          basename (``array('I')``); it starts at the previous row's end
+        * ``names``: the encoded basenames (``bytearray``)
+        * ``size``, ``mtime``: ``array('q')`` and ``array('d')``
+        * ``md5``: each row's 16-byte digest (``bytearray``), all zeros for
+          rows in ``odd_md5``, a dict of row to the md5sums that aren't
+          lowercase hex digests
+        * ``slots``: the hash index (``array('i')``); the row of a path is
+          found by probing from slot ``hash & (len(slots) - 1)`` to the next
+          -1
+        * ``bytes_keys``: whether paths are bytes rather than str, or None if
+          the table has always been empty
+
+        :rtype: dict
+        """
+        return {
+            'hash': self._hash,
+            'dir': self._row_dir,
+            'dirs': self._dirs,
+            'dir_index': self._dir_index,
+            'name_end': self._name_end,
+            'names': self._names,
+            'size': self._size,
+            'mtime': self._mtime,
+            'md5': self._md5,
+            'odd_md5': self._odd_md5,
+            'slots': self._slots,
+            'bytes_keys': self._bytes_keys
+        }
@@ -0,0 +1,424 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import re
+from bisect import bisect_right
+
+#: characters that make an exclude line a glob rather than a literal prefix
+GLOB_CHARS = '*?['
+
+#: prefix that makes an exclude line a regular expression
+REGEX_PREFIX = 're:'
+
+#: maximum number of groups in one compiled alternation of exclude patterns;
+#: Python 2.7's ``re`` refuses patterns with more than 100
+MAX_GROUPS = 99
+
+_ext_glob = re.compile(r'^\*\.([^*?\[/.]+)$')
+_name_glob = re.compile(r'^\*\*/([^*?\[/]+)(/\*\*)?$')
+
+
+class PrefixMatcher(object):
+    """
+    Matches paths against a set of string prefixes (i.e. the lines of an
+    exclude file) in ``O(log n)`` rather than testing every prefix in turn.
+
+    The prefixes are reduced to a sorted, prefix-free set: any prefix that
+    begins with another prefix in the set is redundant and is dropped. In a
+    sorted prefix-free set, the only candidate that can be a prefix of a given
+    path is the greatest entry less than or equal to it, which is found with
+    :py:func:`bisect.bisect_right`.
+    """
+
+    def __init__(self, prefixes):
+        """
+        :param prefixes: path starting substrings to match
+        :type prefixes: list
+        """
+        self._prefixes = []
+        for p in sorted(set(prefixes)):
+            if len(self._prefixes) > 0 and p.startswith(self._prefixes[-1]):
+                continue
+            self._prefixes.append(p)
+
+    @property
+    def prefixes(self):
+        """
+        Return the minimal sorted list of prefixes being matched.
+
+        :rtype: list
+        """
+        return self._prefixes
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def match(self, path):
+        """
+        Return the prefix that ``path`` begins with, or None if it doesn't
+        begin with any of them.
+
+        :param path: path to check
+        :type path: str
+        :rtype: ``str`` or ``None``
+        """
+        i = bisect_right(self._prefixes, path) - 1
+        if i >= 0 and path.startswith(self._prefixes[i]):
+            return self._prefixes[i]
+        return None
+
+    def match_dir(self, path):
+        """
+        Return the prefix that every path beneath the directory ``path`` begins
+        with, or None. If this returns a prefix, the whole directory can be
+        skipped without being listed.
+
+        :param path: path to the directory to check
+        :type path: str
+        :rtype: ``str`` or ``None``
+        """
+        return self.match(path.rstrip('/') + '/')
+
+
+def minimal_paths(paths):
+    """
+    Given a list of file and directory paths to back up, return the sorted
+    minimal subset that covers all of them, dropping duplicates and any path
+    that is the same as, or beneath, another path in the list (i.e. given
+    ``/data`` and ``/data/sub``, only ``/data`` is returned).
+
+    :param paths: file and directory paths
+    :type paths: list
+    :return: minimal covering subset of ``paths``
+    :rtype: list
+    """
+    keyed = sorted((p.rstrip('/') + '/', p) for p in paths)
+    res = []
+    last = None
+    for key, p in keyed:
+        # all paths beneath ``last`` sort contiguously right after it
+        if last is not None and key.startswith(last):
+            continue
+        res.append(p)
+        last = key
+    return res
+
+
+def glob_to_regex(pattern):
+    """
+    Translate a gitignore-style glob to a regular expression (string) to be
+    matched against the start of a full path with :py:func:`re.match`.
+
+    * ``*`` matches anything except ``/``, and ``?`` any single character
+      except ``/``; ``[...]`` is a character class (``[!...]`` negated).
+    * ``**/`` matches zero or more directories, a trailing ``/**`` matches
+      everything beneath a directory, and any other ``**`` matches anything.
+    * A pattern beginning with ``/`` is anchored at the filesystem root;
+      anything else may match at any depth (i.e. ``*.tmp`` or
+      ``build/*.o``).
+    * A pattern ending in ``/`` only matches directories (i.e. the paths
+      beneath them); otherwise a matching directory also matches everything
+      beneath it.
+
+    :param pattern: glob pattern
+    :type pattern: str
+    :return: regular expression string
+    :rtype: str
+    """
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if pattern.startswith('/'):
+        res = ''
+    elif pattern.startswith('**/'):
+        res = '(?:.*/)?'
+        pattern = pattern[3:]
+    else:
+        res = '(?:.*/)?'
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('/**/', i):
+            res += '/(?:.*/)?'
+            i += 4
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            res += '/.*'
+            i += 3
+        elif pattern.startswith('**', i):
+            res += '.*'
+            i += 2
+        elif c == '*':
+            res += '[^/]*'
+            i += 1
+        elif c == '?':
+            res += '[^/]'
+            i += 1
+        elif c == '[':
+            j = pattern.find(']', i + 2)
+            if j == -1:
+                res += re.escape(c)
+                i += 1
+                continue
+            body = pattern[i + 1:j]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            res += '[%s]' % body.replace('\\', '\\\\')
+            i = j + 1
+        else:
+            res += re.escape(c)
+            i += 1
+    if dir_only:
+        return res + '/.*$'
+    return res + '(?:/.*)?$'
+
+
+class PathMatcher(object):
+    """
+    Matches paths against the lines of an exclude file, evaluating all of the
+    patterns at once instead of testing each one in turn. Each line is one of:
+
+    * ``re:REGEX`` - a regular expression, matched against the start of the
+      full path (:py:func:`re.match`); add ``$`` to anchor the end.
+    * a gitignore-style glob (any line containing ``*``, ``?`` or ``[``);
+      see :py:func:`~.glob_to_regex`.
+    * anything else is a literal path prefix, matched with ``startswith``.
+
+    Literal prefixes go in a :py:class:`~.PrefixMatcher`. The most common
+    glob shapes, ``*.ext`` and ``**/name`` / ``**/name/**``, become set
+    lookups on the path's components. Globs anchored at the root are grouped
+    by the directory before their first wildcard, and each group is compiled
+    into one alternation that is only tried for paths beneath that directory.
+    The remaining globs and all regexes are each joined into compiled
+    alternations of up to :py:const:`~.MAX_GROUPS` patterns, so each path is
+    matched against a handful of regexes rather than one per pattern.
+    """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: exclude lines
+        :type patterns: list
+        :raises: RuntimeError if a regex or glob can't be compiled
+        """
+        prefixes = []
+        self._extensions = {}
+        self._names = {}
+        self._dir_names = {}
+        anchored = {}
+        globs = []
+        regexes = []
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PREFIX):
+                regexes.append((pattern, pattern[len(REGEX_PREFIX):]))
+                continue
+            if not any(c in pattern for c in GLOB_CHARS):
+                prefixes.append(pattern)
+                continue
+            m = _ext_glob.match(pattern)
+            if m is not None:
+                self._extensions.setdefault('.' + m.group(1), pattern)
+                continue
+            m = _name_glob.match(pattern)
+            if m is not None:
+                if m.group(2) is None:
+                    self._names.setdefault(m.group(1), pattern)
+                else:
+                    self._dir_names.setdefault(m.group(1), pattern)
+                continue
+            if pattern.startswith('/'):
+                first = min(
+                    pattern.find(c) for c in GLOB_CHARS if c in pattern
+                )
+                d = pattern[:pattern.rfind('/', 0, first) + 1]
+                anchored.setdefault(d, []).append(
+                    (pattern, glob_to_regex(pattern))
+                )
+                continue
+            globs.append((pattern, glob_to_regex(pattern)))
+        self._all_names = frozenset(self._names) | frozenset(self._dir_names)
+        self._prefixes = PrefixMatcher(prefixes)
+        self._anchored = dict(
+            (d, self._compile(items)) for d, items in anchored.items()
+        )
+        self._globs = self._compile(globs)
+        self._regexes = self._compile(regexes)
+        self._count = len(patterns)
+
+    @staticmethod
+    def _compile(items):
+        """
+        Compile a list of (pattern, regex string) pairs into as few
+        alternations as possible. Each alternative is wrapped in a named
+        group, so the pattern that matched can be found from
+        :py:attr:`re.Match.lastgroup`. Python 2.7's ``re`` only allows 100
+        groups in a pattern, so each alternation holds at most
+        :py:const:`~.MAX_GROUPS` groups, counting those in the regexes
+        themselves.
+
+        :param items: list of (pattern, regex string) 2-tuples
+        :type items: list
+        :return: list of (dict of group name to pattern, compiled regex)
+          2-tuples, empty if there are no items
+        :rtype: list
+        :raises: RuntimeError if a regex can't be compiled
+        """
+        chunks = []
+        names = {}
+        parts = []
+        groups = 0
+        for idx, (pattern, regex) in enumerate(items):
+            try:
+                ngroups = re.compile(regex).groups + 1
+            except (re.error, AssertionError) as ex:
+                raise RuntimeError(
+                    'Invalid exclude pattern %r: %s' % (pattern, ex)
+                )
+            if len(parts) > 0 and groups + ngroups > MAX_GROUPS:
+                chunks.append(PathMatcher._compile_chunk(names, parts))
+                names = {}
+                parts = []
+                groups = 0
+            names['_p%d' % idx] = pattern
+            parts.append('(?P<_p%d>%s)' % (idx, regex))
+            groups += ngroups
+        if len(parts) > 0:
+            chunks.append(PathMatcher._compile_chunk(names, parts))
+        return chunks
+
+    @staticmethod
+    def _compile_chunk(names, parts):
+        try:
+            return names, re.compile('|'.join(parts))
+        except (re.error, AssertionError) as ex:
+            raise RuntimeError(
+                'Invalid exclude patterns %s: %s' % (
+                    ', '.join(repr(names[k]) for k in sorted(names)), ex
+                )
+            )
+
+    @staticmethod
+    def _match_chunks(chunks, path):
+        for names, regex in chunks:
+            m = regex.match(path)
+            if m is not None:
+                return names[m.lastgroup]
+        return None
+
+    def __len__(self):
+        return self._count
+
+    def _match_anchored(self, path):
+        i = path.find('/')
+        while i != -1:
+            chunks = self._anchored.get(path[:i + 1])
+            if chunks is not None:
+                res = self._match_chunks(chunks, path)
+                if res is not None:
+                    return res
+            i = path.find('/', i + 1)
+        return None
+
+    def _match_components(self, path, is_dir):
+        parts = path.split('/')
+        if not self._all_names.isdisjoint(parts):
+            for part in parts:
+                if part in self._names:
+                    return self._names[part]
+            dirs = parts if is_dir else parts[:-1]
+            for part in dirs:
+                if part in self._dir_names:
+                    return self._dir_names[part]
+        if len(self._extensions) > 0:
+            for part in parts:
+                # like the glob's regex, ``*`` may be empty, so ``*.tmp``
+                # also matches a dotfile named ``.tmp``
+                dot = part.rfind('.')
+                if dot >= 0 and part[dot:] in self._extensions:
+                    return self._extensions[part[dot:]]
+        return None
+
+    def match(self, path):
+        """
+        Return the exclude pattern that matches the file ``path``, or None if
+        no pattern matches it.
+
+        :param path: path to check
+        :type path: str
+        :rtype: ``str`` or ``None``
+        """
+        res = self._prefixes.match(path)
+        if res is not None:
+            return res
+        if len(self._all_names) > 0 or len(self._extensions) > 0:
+            res = self._match_components(path, False)
+            if res is not None:
+                return res
+        if len(self._anchored) > 0:
+            res = self._match_anchored(path)
+            if res is not None:
+                return res
+        res = self._match_chunks(self._globs, path)
+        if res is not None:
+            return res
+        return self._match_chunks(self._regexes, path)
+
+    def match_dir(self, path):
+        """
+        Return the exclude pattern that matches every path beneath the
+        directory ``path``, or None. If this returns a pattern, the whole
+        directory can be skipped without being listed.
+
+        Regexes are not considered here, since a regex matching a directory
+        says nothing about the paths beneath it; files beneath a directory
+        are still matched against them individually.
+
+        :param path: path to the directory to check
+        :type path: str
+        :rtype: ``str`` or ``None``
+        """
+        res = self._prefixes.match_dir(path)
+        if res is not None:
+            return res
+        path = path.rstrip('/')
+        if len(self._all_names) > 0 or len(self._extensions) > 0:
+            res = self._match_components(path, True)
+            if res is not None:
+                return res
+        if len(self._anchored) > 0:
+            res = self._match_anchored(path + '/')
+            if res is not None:
+                return res
+        return self._match_chunks(self._globs, path + '/')
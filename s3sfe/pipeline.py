@@ -0,0 +1,292 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import threading
+
+try:
+    from queue import Queue
+except ImportError:  # python 2
+    from Queue import Queue
+
+from .utils import dtnow
+
+logger = logging.getLogger(__name__)
+
+#: end-of-stream marker passed through stage queues
+_DONE = object()
+
+
+class Stage(object):
+    """
+    One stage of a :py:class:`~.Pipeline`; a function run by one or more
+    worker threads. A source stage (created without ``producers``) calls its
+    function once, with no arguments, and is expected to :py:meth:`~.put`
+    items to downstream stages itself. Any other stage reads items from a
+    bounded input queue and calls its function once per item.
+
+    Each stage records when it started working (its first item, or when a
+    source began) and when its last worker finished, so that the timings of
+    overlapping stages can be reported.
+    """
+
+    def __init__(self, pipeline, name, func, workers=1, source=False):
+        """
+        :param pipeline: the pipeline this stage belongs to
+        :type pipeline: Pipeline
+        :param name: stage name, for logging and timing
+        :type name: str
+        :param func: function to run; called with no arguments for a source
+          stage, or with each item otherwise
+        :type func: callable
+        :param workers: number of worker threads
+        :type workers: int
+        :param source: whether this is a source stage
+        :type source: bool
+        """
+        self.pipeline = pipeline
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.source = source
+        self.queue = None
+        if not source:
+            self.queue = Queue(maxsize=pipeline.queue_size)
+        self.start_dt = None
+        self.end_dt = None
+        self.items = 0
+        self._producers = 0
+        self._received = 0
+        self._active = workers
+        self._downstream = []
+        self._lock = threading.Lock()
+
+    def feeds(self, *stages):
+        """
+        Declare that this stage puts items to ``stages``. Each downstream stage
+        finishes once every stage feeding it has finished.
+
+        :param stages: downstream stages
+        :type stages: Stage
+        :return: this stage
+        :rtype: Stage
+        """
+        for s in stages:
+            s._producers += 1
+            self._downstream.append(s)
+        return self
+
+    def put(self, item):
+        """
+        Put an item on this stage's input queue, blocking while it is full.
+
+        :param item: item to process
+        """
+        self.queue.put(item)
+
+    def _started(self):
+        with self._lock:
+            if self.start_dt is None:
+                self.start_dt = dtnow()
+
+    def _next(self):
+        """
+        Return the next item from the input queue, or ``_DONE`` once every
+        upstream stage has finished. The worker that sees the last upstream
+        end-of-stream marker passes one on to each of its sibling workers.
+        """
+        while True:
+            item = self.queue.get()
+            if item is not _DONE:
+                return item
+            with self._lock:
+                self._received += 1
+                received = self._received
+            if received < self._producers:
+                continue
+            if received == self._producers:
+                for _ in range(self.workers - 1):
+                    self.queue.put(_DONE)
+            return _DONE
+
+    def _work(self):
+        """
+        Worker thread body. Errors are reported to the pipeline; after any
+        stage fails, remaining input is drained and discarded so that upstream
+        stages never block on a full queue.
+        """
+        try:
+            if self.source:
+                self._started()
+                self._call()
+                return
+            while True:
+                item = self._next()
+                if item is _DONE:
+                    break
+                self._started()
+                if self.pipeline.failed:
+                    continue
+                self._call(item)
+        finally:
+            with self._lock:
+                self._active -= 1
+                last = self._active == 0
+            if last:
+                self.end_dt = dtnow()
+                if self.start_dt is None:
+                    self.start_dt = self.end_dt
+                logger.debug('Pipeline stage %s finished (%d items)',
+                             self.name, self.items)
+                for s in self._downstream:
+                    s.put(_DONE)
+
+    def _call(self, *args):
+        try:
+            self.func(*args)
+            with self._lock:
+                self.items += 1
+        except Exception as ex:
+            self.pipeline.fail(self, ex)
+
+
+class Pipeline(object):
+    """
+    A set of :py:class:`~.Stage` s connected by bounded queues, each running in
+    its own thread(s), so that items stream through every stage concurrently
+    and no more than ``queue_size`` items wait between any two stages.
+    """
+
+    def __init__(self, queue_size=1024):
+        """
+        :param queue_size: maximum number of items queued in front of each
+          stage
+        :type queue_size: int
+        """
+        self.queue_size = queue_size
+        self.stages = []
+        self.error = None
+        self._lock = threading.Lock()
+
+    def source(self, name, func):
+        """
+        Add a source stage, which calls ``func()`` once.
+
+        :param name: stage name
+        :type name: str
+        :param func: function to run
+        :type func: callable
+        :return: the new stage
+        :rtype: Stage
+        """
+        stage = Stage(self, name, func, source=True)
+        self.stages.append(stage)
+        return stage
+
+    def stage(self, name, func, workers=1):
+        """
+        Add a stage that calls ``func(item)`` for each item put to it, in
+        ``workers`` threads.
+
+        :param name: stage name
+        :type name: str
+        :param func: function to run on each item
+        :type func: callable
+        :param workers: number of worker threads
+        :type workers: int
+        :return: the new stage
+        :rtype: Stage
+        """
+        stage = Stage(self, name, func, workers=workers)
+        self.stages.append(stage)
+        return stage
+
+    @property
+    def failed(self):
+        """
+        Whether any stage has failed.
+
+        :rtype: bool
+        """
+        return self.error is not None
+
+    def fail(self, stage, ex):
+        """
+        Record that ``stage`` raised ``ex``. The first error is re-raised by
+        :py:meth:`~.run` once every stage has stopped.
+
+        :param stage: the stage that failed
+        :type stage: Stage
+        :param ex: the exception raised
+        :type ex: Exception
+        """
+        logger.error('Pipeline stage %s failed: %s', stage.name, ex,
+                     exc_info=True)
+        with self._lock:
+            if self.error is None:
+                self.error = ex
+
+    def run(self):
+        """
+        Start every stage and wait for all of them to finish.
+
+        :raises: the first exception raised by any stage
+        """
+        threads = []
+        for stage in self.stages:
+            for i in range(stage.workers):
+                t = threading.Thread(
+                    target=stage._work, name='%s-%d' % (stage.name, i)
+                )
+                t.daemon = True
+                t.start()
+                threads.append(t)
+        for t in threads:
+            t.join()
+        if self.error is not None:
+            raise self.error
+
+    @property
+    def stage_times(self):
+        """
+        Return the start and end time of each stage, in the order they were
+        added.
+
+        :return: list of (stage name, start datetime, end datetime) 3-tuples
+        :rtype: list
+        """
+        return [(s.name, s.start_dt, s.end_dt) for s in self.stages]
@@ -0,0 +1,225 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from humanize import intcomma, naturalsize
+
+logger = logging.getLogger(__name__)
+
+
+class Plan(object):
+    """
+    The uploads and deletions one s3sfe run would make, computed by
+    :py:meth:`s3sfe.filesyncer.FileSyncer.plan` so that they can be applied
+    later with :py:meth:`s3sfe.filesyncer.FileSyncer.apply` (``s3sfe-apply``).
+
+    A plan file is a gzipped sequence of JSON documents, one per line: a
+    header describing the plan, then one ``["u", path, size, mtime, md5sum]``
+    line per file to upload and one ``["d", path]`` line per file to delete,
+    and finally ``{"sha256": ...}``, the SHA-256 of every line before it. The
+    file is written and read an entry at a time.
+    """
+
+    #: plan file format version; plans with any other version can't be read
+    version = 1
+
+    def __init__(self, bucket_name, prefix='', uploads=None, deletes=None,
+                 created=None):
+        """
+        :param bucket_name: name of the S3 bucket the plan is for
+        :type bucket_name: str
+        :param prefix: S3 prefix the plan is for
+        :type prefix: str
+        :param uploads: files to upload; dict of local path to a 3-tuple of
+          (file size in bytes, file modification time as a float timestamp,
+          file md5sum as a hex string)
+        :type uploads: dict
+        :param deletes: local file paths to delete from S3
+        :type deletes: list
+        :param created: when the plan was made, as a float timestamp;
+          defaults to now
+        :type created: float
+        """
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        if uploads is None:
+            uploads = {}
+        self.uploads = uploads
+        if deletes is None:
+            deletes = []
+        self.deletes = deletes
+        if created is None:
+            created = time.time()
+        self.created = created
+
+    @property
+    def upload_bytes(self):
+        """
+        Return the total size of the files to upload.
+
+        :rtype: int
+        """
+        return sum(meta[0] for meta in self.uploads.values())
+
+    def estimate(self, rate):
+        """
+        Estimate how long uploading the plan's files would take.
+
+        :param rate: upload throughput, in bytes per second
+        :type rate: int
+        :return: estimated upload time
+        :rtype: datetime.timedelta
+        """
+        return timedelta(seconds=int(self.upload_bytes / float(rate)))
+
+    def summary(self, rate=None):
+        """
+        Return a human-readable summary of the plan.
+
+        :param rate: if not None, also estimate the upload time at this many
+          bytes per second
+        :type rate: int
+        :rtype: str
+        """
+        s = "s3sfe plan for s3://%s/%s, created %s\n" % (
+            self.bucket_name, self.prefix,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.created))
+        )
+        s += "Upload %s files; %s\n" % (
+            intcomma(len(self.uploads)), naturalsize(self.upload_bytes)
+        )
+        s += "Delete %s files\n" % intcomma(len(self.deletes))
+        if rate is not None:
+            s += "Estimated upload time at %s/s: %s\n" % (
+                naturalsize(rate), self.estimate(rate)
+            )
+        return s
+
+    def _lines(self):
+        """
+        Generator of the lines of the plan file, excluding the checksum.
+        """
+        yield json.dumps({
+            'format': 's3sfe-plan',
+            'version': self.version,
+            'bucket': self.bucket_name,
+            'prefix': self.prefix,
+            'created': self.created
+        }, sort_keys=True)
+        for path in sorted(self.uploads.keys()):
+            size, mtime, md5sum = self.uploads[path]
+            yield json.dumps(['u', path, size, mtime, md5sum])
+        for path in sorted(self.deletes):
+            yield json.dumps(['d', path])
+
+    def write(self, path):
+        """
+        Write the plan to a file.
+
+        :param path: path to write the plan to
+        :type path: str
+        """
+        checksum = hashlib.sha256()
+        with gzip.open(path, 'wb') as fh:
+            for line in self._lines():
+                line = (line + '\n').encode('utf-8')
+                checksum.update(line)
+                fh.write(line)
+            fh.write(('%s\n' % json.dumps(
+                {'sha256': checksum.hexdigest()}
+            )).encode('utf-8'))
+        logger.info('Wrote plan to upload %d files and delete %d to %s',
+                    len(self.uploads), len(self.deletes), path)
+
+    @classmethod
+    def read(cls, path):
+        """
+        Read a plan file written by :py:meth:`~.write`.
+
+        :param path: path to the plan file
+        :type path: str
+        :return: the plan
+        :rtype: Plan
+        :raises: ValueError if the file is not a valid plan, is an unknown
+          version, or fails its checksum
+        """
+        checksum = hashlib.sha256()
+        plan = None
+        expected = None
+        with gzip.open(path, 'rb') as raw:
+            for line in raw:
+                if expected is not None:
+                    raise ValueError('Invalid plan %s: data after checksum'
+                                     % path)
+                data = json.loads(line.decode('utf-8'))
+                if plan is None:
+                    plan = cls._from_header(path, data)
+                elif isinstance(data, dict):
+                    expected = data.get('sha256')
+                    continue
+                elif data[0] == 'u':
+                    plan.uploads[data[1]] = (data[2], data[3], data[4])
+                elif data[0] == 'd':
+                    plan.deletes.append(data[1])
+                else:
+                    raise ValueError('Invalid plan %s: unknown entry %r'
+                                     % (path, data))
+                checksum.update(line)
+        if plan is None or expected is None:
+            raise ValueError('Invalid plan %s: truncated' % path)
+        if checksum.hexdigest() != expected:
+            raise ValueError('Invalid plan %s: checksum mismatch' % path)
+        return plan
+
+    @classmethod
+    def _from_header(cls, path, data):
+        """
+        Return a new, empty plan from the header line of a plan file.
+        """
+        if not isinstance(data, dict) or data.get('format') != 's3sfe-plan':
+            raise ValueError('Invalid plan %s: not an s3sfe plan' % path)
+        if data['version'] != cls.version:
+            raise ValueError('Invalid plan %s: unknown version %s'
+                             % (path, data['version']))
+        return cls(data['bucket'], prefix=data['prefix'],
+                   created=data['created'])
@@ -0,0 +1,197 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import re
+import threading
+import time
+
+from s3sfe.utils import dtnow, parse_size
+
+logger = logging.getLogger(__name__)
+
+_window_re = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+
+
+def parse_rate(value):
+    """
+    Parse a transfer rate such as ``50MB/s``, ``10M`` or ``unlimited`` into
+    bytes per second.
+
+    :param value: rate string; a size as accepted by
+      :py:func:`s3sfe.utils.parse_size`, optionally followed by ``/s``
+    :type value: str
+    :return: bytes per second, or None for ``unlimited``
+    :rtype: int
+    """
+    value = value.strip()
+    if value.lower() == 'unlimited':
+        return None
+    if value.lower().endswith('/s'):
+        value = value[:-2]
+    rate = parse_size(value)
+    if rate <= 0:
+        raise ValueError('Invalid rate: %s' % value)
+    return rate
+
+
+class RateSchedule(object):
+    """
+    A maximum transfer rate that may vary by local time of day.
+    """
+
+    def __init__(self, windows=None, default=None):
+        """
+        :param windows: list of (start minute, end minute, rate) 3-tuples;
+          minutes are minutes after midnight, local time, and ``rate`` is
+          bytes per second or None for unlimited. A window whose end is before
+          its start wraps past midnight. The first window containing the
+          current time applies.
+        :type windows: list
+        :param default: rate outside of all windows, in bytes per second, or
+          None for unlimited
+        :type default: int
+        """
+        self.windows = windows or []
+        self.default = default
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Parse a rate schedule from the command line. This is a comma-separated
+        list of ``RATE@HH:MM-HH:MM`` entries and at most one plain ``RATE``,
+        which applies at all other times (unlimited if omitted). i.e. ``50MB/s``
+        for a constant limit, or ``10MB/s@09:00-18:00`` for 10 MB/s during
+        business hours and full speed otherwise.
+
+        :param value: schedule string
+        :type value: str
+        :rtype: RateSchedule
+        """
+        windows = []
+        default = None
+        for entry in value.split(','):
+            rate, _, window = entry.strip().partition('@')
+            if window == '':
+                default = parse_rate(rate)
+                continue
+            m = _window_re.match(window.strip())
+            if m is None:
+                raise ValueError('Invalid time window "%s"; must be '
+                                 'HH:MM-HH:MM' % window)
+            h1, m1, h2, m2 = [int(x) for x in m.groups()]
+            if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59:
+                raise ValueError('Invalid time window "%s"' % window)
+            windows.append((h1 * 60 + m1, h2 * 60 + m2, parse_rate(rate)))
+        return cls(windows=windows, default=default)
+
+    def rate_at(self, dt):
+        """
+        Return the maximum rate at the given time.
+
+        :param dt: local time
+        :type dt: datetime.datetime
+        :return: bytes per second, or None for unlimited
+        :rtype: int
+        """
+        minute = dt.hour * 60 + dt.minute
+        for start, end, rate in self.windows:
+            if start <= end:
+                if start <= minute < end:
+                    return rate
+            elif minute >= start or minute < end:
+                return rate
+        return self.default
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting the aggregate rate of all the transfers sharing it.
+    :py:meth:`~.consume` is passed as the ``Callback`` of boto3 transfers,
+    which s3transfer calls from each transfer thread with the number of bytes
+    just sent or received; blocking in it slows the transfer down.
+
+    Up to one second's worth of bytes may be sent in a burst. A transfer that
+    takes more than the bucket holds goes into debt, and it (and any other
+    transfer consuming before the debt is repaid) sleeps until the rate allows.
+    """
+
+    def __init__(self, schedule, burst_seconds=1.0):
+        """
+        :param schedule: maximum rate, possibly varying by time of day
+        :type schedule: RateSchedule
+        :param burst_seconds: how many seconds' worth of bytes at the current
+          rate the bucket holds
+        :type burst_seconds: float
+        """
+        self.schedule = schedule
+        self._burst_seconds = burst_seconds
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.time()
+        self._rate = None
+
+    def consume(self, nbytes):
+        """
+        Take ``nbytes`` from the bucket, sleeping until the rate allows them.
+
+        :param nbytes: number of bytes transferred; s3transfer reports
+          negative amounts when a part is retried, which are ignored
+        :type nbytes: int
+        """
+        if nbytes <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            rate = self.schedule.rate_at(dtnow())
+            if rate != self._rate:
+                logger.info('Transfer rate limit is now %s',
+                            'unlimited' if rate is None else
+                            '%d bytes/s' % rate)
+                self._rate = rate
+                self._tokens = 0.0
+            if rate is None:
+                self._last = now
+                return
+            self._tokens = min(
+                rate * self._burst_seconds,
+                self._tokens + (now - self._last) * rate
+            ) - nbytes
+            self._last = now
+            wait = -self._tokens / rate
+        if wait > 0:
+            time.sleep(wait)
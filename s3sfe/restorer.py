@@ -41,8 +41,10 @@ import logging
 
 from s3sfe.version import PROJECT_URL, VERSION
 from s3sfe.filesyncer import FileSyncer
+from s3sfe.ratelimit import RateSchedule
+from s3sfe.transfer import parse_transfer_profile
 from s3sfe.utils import (
-    set_log_info, set_log_debug, read_filelist, read_keyfile
+    set_log_info, set_log_debug, read_filelist, read_keyfile, positive_int
 )
 
 FORMAT = "[%(asctime)s %(levelname)s] %(message)s"
@@ -93,6 +95,25 @@ def parse_args(argv):
                    type=str, default=None,
                    help='path to AES256 key file. This should be a binary file'
                         'containing a 32-byte encryption key to use for SSE-C')
+    p.add_argument('--download-workers', dest='download_workers',
+                   action='store', type=positive_int, default=1,
+                   help='maximum number of files to download concurrently; '
+                        'the number actually in flight adapts to throughput '
+                        'and S3 throttling (default: 1)')
+    p.add_argument('--transfer-profile', dest='transfer_profiles',
+                   action='append', type=parse_transfer_profile,
+                   default=None,
+                   help='override multipart transfer settings for one file '
+                        'size class; see s3sfe --help. May be given multiple '
+                        'times.')
+    p.add_argument('--max-download-rate', dest='max_download_rate',
+                   action='store', type=RateSchedule.parse, default=None,
+                   help='maximum total download bandwidth across all '
+                        'concurrent downloads, i.e. "50MB/s". May instead be '
+                        'a comma-separated time-of-day schedule of '
+                        'RATE@HH:MM-HH:MM windows and an optional default '
+                        'rate, i.e. "10MB/s@09:00-18:00,100MB/s" '
+                        '(default: unlimited)')
     p.add_argument('-l', '--filelist-path', dest='FILELIST_PATH', type=str,
                    action='store', default=None,
                    help='Path to filelist specifying which files or paths to '
@@ -140,7 +161,10 @@ def main(args=None):
         args.BUCKET_NAME,
         prefix=args.prefix,
         dry_run=args.dry_run,
-        ssec_key=read_keyfile(args.key_file)
+        ssec_key=read_keyfile(args.key_file),
+        transfer_profiles=args.transfer_profiles,
+        download_workers=args.download_workers,
+        max_download_rate=args.max_download_rate
     )
     if args.FILELIST_PATH is not None:
         files = read_filelist(args.FILELIST_PATH)
@@ -40,9 +40,16 @@ import argparse
 import logging
 
 from s3sfe.version import PROJECT_URL, VERSION
-from s3sfe.filesyncer import FileSyncer
+from s3sfe.compression import CODECS
+from s3sfe.filesyncer import FileSyncer, COMPARE_MODES
+from s3sfe.hashcache import default_cache_path
+from s3sfe.journal import default_journal_path
+from s3sfe.ratelimit import RateSchedule
+from s3sfe.scheduling import UPLOAD_ORDERS
+from s3sfe.transfer import MB, parse_transfer_profile
 from s3sfe.utils import (
-    set_log_info, set_log_debug, read_filelist, read_keyfile
+    set_log_info, set_log_debug, read_filelist, read_keyfile, parse_size,
+    positive_int, positive_size, fraction
 )
 
 FORMAT = "[%(asctime)s %(levelname)s] %(message)s"
@@ -101,7 +108,193 @@ def parse_args(argv):
                    help='File specifying paths to exclude from backup, one per '
                         'line, in the same format as FILELIST_PATH. Any paths '
                         'beginning with (substring/startswith) a line from '
-                        'this file will be excluded from the backup')
+                        'this file will be excluded from the backup. Lines '
+                        'containing "*", "?" or "[" are gitignore-style '
+                        'globs (i.e. "*.tmp" or "**/.cache/**"), and lines '
+                        'beginning with "re:" are regular expressions matched '
+                        'against the start of the path.')
+    p.add_argument('--hash-cache', dest='hash_cache', action='store',
+                   type=str, default=None,
+                   help='path to the local hash cache database, used to avoid '
+                        're-reading unchanged files (default: %s)' %
+                        default_cache_path())
+    p.add_argument('--no-hash-cache', dest='no_hash_cache',
+                   action='store_true', default=False,
+                   help='do not use the local hash cache; hash every file')
+    p.add_argument('--rehash', dest='rehash', action='store_true',
+                   default=False,
+                   help='ignore cached hashes and re-hash every file, '
+                        'refreshing the hash cache')
+    p.add_argument('--hash-buffer-size', dest='hash_bufsize', action='store',
+                   type=positive_size, default=None,
+                   help='read buffer size to use when hashing files, e.g. '
+                        '"1M" (default: chosen per-file from file size)')
+    p.add_argument('--hash-mmap', dest='hash_mmap', action='store_true',
+                   default=False,
+                   help='mmap large files when hashing them. Faster on some '
+                        'systems, but a file truncated while being hashed '
+                        'will crash s3sfe')
+    p.add_argument('--hash-workers', dest='hash_workers', action='store',
+                   type=positive_int, default=1,
+                   help='number of files to hash concurrently (default: 1)')
+    p.add_argument('--hash-processes', dest='hash_processes',
+                   action='store_true', default=False,
+                   help='hash files in a pool of --hash-workers processes '
+                        'instead of threads')
+    p.add_argument('--upload-workers', dest='upload_workers', action='store',
+                   type=positive_int, default=1,
+                   help='maximum number of files to upload concurrently; the '
+                        'number actually in flight adapts to throughput and '
+                        'S3 throttling (default: 1)')
+    p.add_argument('--upload-order', dest='upload_order', action='store',
+                   choices=UPLOAD_ORDERS, default='path',
+                   help='order in which to start uploads. "path" uploads in '
+                        'path order; "largest-first" starts the largest files '
+                        'first and fills in with smaller ones, which usually '
+                        'finishes soonest with several --upload-workers; '
+                        '"newest-first" starts the most recently modified '
+                        'files first. The run summary estimates how long each '
+                        'order would have taken (default: path)')
+    p.add_argument('--rebuild-manifest', dest='rebuild_manifest',
+                   action='store_true', default=False,
+                   help='ignore the manifest of files in S3 and rebuild it by '
+                        'querying the metadata of every object')
+    p.add_argument('--head-workers', dest='head_workers', action='store',
+                   type=positive_int, default=1,
+                   help='maximum number of concurrent requests when querying '
+                        'the metadata of every object in S3, i.e. when '
+                        'rebuilding the manifest; the number actually in '
+                        'flight adapts to throughput and S3 throttling '
+                        '(default: 1)')
+    p.add_argument('--pipeline', dest='pipeline', action='store_true',
+                   default=False,
+                   help='stream files through listing, hashing, comparison '
+                        'and upload concurrently, instead of finishing each '
+                        'step for all files before starting the next. Uploads '
+                        'start sooner and memory use is bounded.')
+    p.add_argument('--compact-metadata', dest='compact_metadata',
+                   action='store_true', default=False,
+                   help='hold file metadata in compact array-backed tables '
+                        'instead of dicts; several times less memory for '
+                        'millions of files, at some cost in CPU time')
+    p.add_argument('--diff-engine', dest='diff_engine', action='store',
+                   choices=['dict', 'merge', 'numpy'], default='dict',
+                   help='how to compare local files with files in S3: "dict" '
+                        'looks up each local file in an in-memory index of S3 '
+                        'files, and needs the least extra memory; "merge" '
+                        'sorts both lists (on disk, beyond --diff-max-entries '
+                        'files) and merges them in path order, bounding its '
+                        'memory use; "numpy" (requires numpy) compares the '
+                        'compact tables of --compact-metadata, which it '
+                        'implies, with vectorized array operations, faster '
+                        'than "dict" for millions of files (default: dict)')
+    p.add_argument('--diff-max-entries', dest='diff_max_items',
+                   action='store', type=int, default=1000000,
+                   help='for --diff-engine=merge, maximum number of files '
+                        'from each side to sort in memory before spilling to '
+                        'temporary files (default: 1000000)')
+    p.add_argument('--compare', dest='compare', action='store',
+                   choices=COMPARE_MODES, default='checksum',
+                   help='how to decide which files have changed. "checksum" '
+                        'hashes every file and compares md5sums. '
+                        '"size-mtime" trusts that files whose size and mtime '
+                        'match S3 are unchanged, and only hashes (and uploads) '
+                        'the rest; "size-mtime-then-checksum" also hashes '
+                        'only those, but uploads only the ones whose md5sum '
+                        'differs (default: checksum)')
+    p.add_argument('--delete', dest='delete', action='store_true',
+                   default=False,
+                   help='delete files from S3 that no longer exist locally. '
+                        'Only files under a path in FILELIST_PATH and not '
+                        'excluded are deleted.')
+    p.add_argument('--max-delete', dest='max_delete', action='store',
+                   type=int, default=None,
+                   help='with --delete, do not delete anything if more than '
+                        'this many files would be deleted')
+    p.add_argument('--max-delete-percent', dest='max_delete_percent',
+                   action='store', type=float, default=50.0,
+                   help='with --delete, do not delete anything if more than '
+                        'this percentage of the files in S3 would be deleted '
+                        '(default: 50)')
+    p.add_argument('--transfer-profile', dest='transfer_profiles',
+                   action='append', type=parse_transfer_profile,
+                   default=None,
+                   help='override multipart transfer settings for one file '
+                        'size class (small, medium or huge), as '
+                        'CLASS:SETTING=VALUE[,SETTING=VALUE...]; settings are '
+                        'max_size (upper bound of the class), threshold '
+                        '(multipart threshold), chunksize (part size), '
+                        'concurrency (parts transferred at once per file) and '
+                        'io_queue. i.e. "huge:chunksize=256M,concurrency=16". '
+                        'May be given multiple times.')
+    p.add_argument('--max-upload-rate', dest='max_upload_rate',
+                   action='store', type=RateSchedule.parse, default=None,
+                   help='maximum total upload bandwidth across all concurrent '
+                        'uploads, i.e. "50MB/s". May instead be a '
+                        'comma-separated time-of-day schedule of '
+                        'RATE@HH:MM-HH:MM windows and an optional default '
+                        'rate, i.e. "10MB/s@09:00-18:00,100MB/s" '
+                        '(default: unlimited)')
+    p.add_argument('--bundle-threshold', dest='bundle_threshold',
+                   action='store', type=parse_size, default=None,
+                   help='pack files smaller than this size, e.g. "16K", into '
+                        'bundle objects of about --bundle-size each, instead '
+                        'of uploading each as its own object; much faster '
+                        'and cheaper for many small files. Bundled files are '
+                        'restored individually with ranged GETs. '
+                        '(default: disabled)')
+    p.add_argument('--bundle-size', dest='bundle_size', action='store',
+                   type=positive_size, default=64 * MB,
+                   help='with --bundle-threshold, approximate size of each '
+                        'bundle (default: 64M)')
+    p.add_argument('--bundle-compact-ratio', dest='bundle_compact',
+                   action='store', type=fraction, default=0.5,
+                   help='with --bundle-threshold, repack bundles once at '
+                        'least this fraction of their data belongs to files '
+                        'that have since changed or been deleted '
+                        '(default: 0.5)')
+    p.add_argument('--resumable-uploads', dest='resumable_uploads',
+                   action='store_true', default=False,
+                   help='record the progress of multipart uploads in a local '
+                        'journal, so that a later run resumes an interrupted '
+                        'upload of an unchanged file instead of starting it '
+                        'again')
+    p.add_argument('--upload-journal', dest='upload_journal', action='store',
+                   type=str, default=None,
+                   help='with --resumable-uploads, path to the upload journal '
+                        'database (default: '
+                        '$XDG_CACHE_HOME/s3sfe/uploads.sqlite)')
+    p.add_argument('--abort-orphaned-uploads', dest='abort_orphaned_uploads',
+                   action='store_true', default=False,
+                   help='abort incomplete multipart uploads under the prefix '
+                        'that are over a day old and not being resumed, so '
+                        'that their parts stop incurring storage charges')
+    p.add_argument('--copy-duplicates', dest='copy_duplicates',
+                   action='store_true', default=False,
+                   help='copy files within S3 instead of uploading them when '
+                        'a file with the same content is already in S3 '
+                        'under another path (i.e. after a directory is '
+                        'renamed) or is being uploaded in the same run')
+    p.add_argument('--compress', dest='compression', action='store',
+                   choices=CODECS, default=None,
+                   help='compress files with this codec as they are uploaded, '
+                        'except small files and files that already look '
+                        'compressed (by extension or byte entropy); they are '
+                        'decompressed again when restored. "zstd" requires '
+                        'the zstandard package')
+    p.add_argument('--refresh-metadata', dest='refresh_metadata',
+                   action='store_true', default=False,
+                   help='update the size and mtime recorded in S3 for files '
+                        'whose content is unchanged but whose metadata '
+                        'differs (i.e. files that were touched), by copying '
+                        'each object onto itself with new metadata instead '
+                        'of uploading it')
+    p.add_argument('--plan', dest='plan', action='store', type=str,
+                   default=None,
+                   help='do not upload or delete anything; instead write the '
+                        'uploads and deletions that would be made to a plan '
+                        'file at this path, to be reviewed and executed later '
+                        'with s3sfe-apply')
     p.add_argument('BUCKET_NAME', action='store', type=str,
                    help='Name of S3 bucket to upload to')
     p.add_argument('FILELIST_PATH', action='store', type=str,
@@ -111,6 +304,23 @@ def parse_args(argv):
     args = p.parse_args(argv)
     if args.key_file is None:
         raise RuntimeError('Error: -f|--key-file must be specified.')
+    if args.plan is not None and args.pipeline:
+        raise RuntimeError('Error: --plan cannot be used with --pipeline.')
+    if args.upload_order != 'path' and args.pipeline:
+        raise RuntimeError('Error: --upload-order cannot be used with '
+                           '--pipeline.')
+    if args.bundle_threshold is not None and args.pipeline:
+        raise RuntimeError('Error: --bundle-threshold cannot be used with '
+                           '--pipeline.')
+    if args.copy_duplicates and args.pipeline:
+        raise RuntimeError('Error: --copy-duplicates cannot be used with '
+                           '--pipeline.')
+    if args.refresh_metadata and args.pipeline:
+        raise RuntimeError('Error: --refresh-metadata cannot be used with '
+                           '--pipeline.')
+    if args.refresh_metadata and args.plan is not None:
+        raise RuntimeError('Error: --refresh-metadata cannot be used with '
+                           '--plan.')
     return args
 
 
@@ -128,16 +338,60 @@ def main(args=None):
     elif args.verbose == 1:
         set_log_info(logger)
 
+    hash_cache_path = None
+    if not args.no_hash_cache:
+        hash_cache_path = args.hash_cache
+        if hash_cache_path is None:
+            hash_cache_path = default_cache_path()
+    upload_journal_path = None
+    if args.resumable_uploads:
+        upload_journal_path = args.upload_journal
+        if upload_journal_path is None:
+            upload_journal_path = default_journal_path()
     s = FileSyncer(
         args.BUCKET_NAME,
         prefix=args.prefix,
         dry_run=args.dry_run,
-        ssec_key=read_keyfile(args.key_file)
+        ssec_key=read_keyfile(args.key_file),
+        hash_cache_path=hash_cache_path,
+        rehash=args.rehash,
+        hash_bufsize=args.hash_bufsize,
+        hash_mmap=args.hash_mmap,
+        hash_workers=args.hash_workers,
+        hash_processes=args.hash_processes,
+        upload_workers=args.upload_workers,
+        rebuild_manifest=args.rebuild_manifest,
+        head_workers=args.head_workers,
+        pipeline=args.pipeline,
+        compact_metadata=args.compact_metadata,
+        diff_engine=args.diff_engine,
+        diff_max_items=args.diff_max_items,
+        delete=args.delete,
+        max_delete=args.max_delete,
+        max_delete_percent=args.max_delete_percent,
+        compare=args.compare,
+        transfer_profiles=args.transfer_profiles,
+        max_upload_rate=args.max_upload_rate,
+        upload_order=args.upload_order,
+        bundle_threshold=args.bundle_threshold,
+        bundle_size=args.bundle_size,
+        bundle_compact=args.bundle_compact,
+        upload_journal_path=upload_journal_path,
+        abort_orphaned_uploads=args.abort_orphaned_uploads,
+        copy_duplicates=args.copy_duplicates,
+        refresh_metadata=args.refresh_metadata,
+        compression=args.compression
     )
     files = read_filelist(args.FILELIST_PATH)
     exclude = []
     if args.exclude_file is not None:
         exclude = read_filelist(args.exclude_file)
+    if args.plan is not None:
+        plan = s.plan(files, exclude_paths=exclude)
+        plan.write(args.plan)
+        if args.summary:
+            print(plan.summary())
+        return
     stats = s.run(files, exclude_paths=exclude)
     if args.summary:
         print(stats.summary)
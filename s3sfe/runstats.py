@@ -37,6 +37,7 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 
 import logging
 from s3sfe.version import VERSION
+from datetime import timedelta
 from platform import node
 from getpass import getuser
 from humanize import intcomma, naturalsize
@@ -51,7 +52,14 @@ class RunStats(object):
 
     def __init__(self, start_dt, meta_dt, query_dt, calc_dt, upload_dt, end_dt,
                  total_files, files_to_upload, errors, total_size_b,
-                 uploaded_size_b, dry_run=False):
+                 uploaded_size_b, dry_run=False, hash_cache_hits=None,
+                 hash_cache_misses=None, meta_errors=None,
+                 upload_busy_seconds=None, stage_times=None,
+                 deleted_files=None, delete_errors=None, delete_refused=0,
+                 skipped_files=None, concurrency_history=None,
+                 upload_order=None, upload_makespans=None,
+                 copied_files=None, copied_size_b=0, refreshed_files=None,
+                 refresh_errors=None, wire_size_b=None):
         """
 
         :param start_dt: when the run began; before listing all files
@@ -79,6 +87,57 @@ class RunStats(object):
         :param dry_run: if true, do not actually upload; print what would be
           done
         :type dry_run: bool
+        :param hash_cache_hits: number of files whose md5sum was taken from the
+          hash cache, or None if no hash cache was used
+        :type hash_cache_hits: int
+        :param hash_cache_misses: number of files that had to be hashed despite
+          the hash cache, or None if no hash cache was used
+        :type hash_cache_misses: int
+        :param meta_errors: list of files that could not be stat'ed or hashed,
+          and so were skipped
+        :type meta_errors: list
+        :param upload_busy_seconds: total time spent in individual file
+          uploads, summed across all upload workers
+        :type upload_busy_seconds: float
+        :param stage_times: for a pipelined run, whose stages overlap, a list
+          of (stage name, start datetime, end datetime) 3-tuples
+        :type stage_times: list
+        :param deleted_files: files deleted from S3 (or that would have been,
+          in a dry run), or None if deletion wasn't enabled
+        :type deleted_files: list
+        :param delete_errors: files that failed to delete from S3
+        :type delete_errors: list
+        :param delete_refused: number of files that should have been deleted
+          from S3, but weren't because a deletion limit was exceeded
+        :type delete_refused: int
+        :param skipped_files: when applying a plan, files that were skipped
+          because they changed after the plan was made
+        :type skipped_files: list
+        :param concurrency_history: for each kind of request whose concurrency
+          adapted during the run (i.e. ``upload``), a list of (datetime, number
+          of requests allowed in flight) 2-tuples, one per change
+        :type concurrency_history: dict
+        :param upload_order: order in which uploads were started; see
+          :py:func:`s3sfe.scheduling.order_files`
+        :type upload_order: str
+        :param upload_makespans: estimated upload time, in seconds, had the
+          uploads been started in each possible order; see
+          :py:func:`s3sfe.scheduling.compare_orders`
+        :type upload_makespans: dict
+        :param copied_files: files to upload that were instead copied within
+          S3 from another file with the same content, or None if copying
+          wasn't enabled
+        :type copied_files: list
+        :param copied_size_b: total size of the copied files in bytes
+        :type copied_size_b: int
+        :param refreshed_files: files whose metadata was refreshed in S3
+          without uploading them, or None if refreshing wasn't enabled
+        :type refreshed_files: list
+        :param refresh_errors: files whose metadata failed to refresh
+        :type refresh_errors: list
+        :param wire_size_b: bytes actually sent to S3 for uploads, after
+          compression, or None if compression wasn't enabled
+        :type wire_size_b: int
         """
         self._start_dt = start_dt
         self._meta_dt = meta_dt
@@ -92,6 +151,31 @@ class RunStats(object):
         self._uploaded_size_b = uploaded_size_b
         self._errors = errors
         self._dry_run = dry_run
+        self._hash_cache_hits = hash_cache_hits
+        self._hash_cache_misses = hash_cache_misses
+        if meta_errors is None:
+            meta_errors = []
+        self._meta_errors = meta_errors
+        self._upload_busy_seconds = upload_busy_seconds
+        self._stage_times = stage_times
+        self._deleted_files = deleted_files
+        if delete_errors is None:
+            delete_errors = []
+        self._delete_errors = delete_errors
+        self._delete_refused = delete_refused
+        if skipped_files is None:
+            skipped_files = []
+        self._skipped_files = skipped_files
+        self._concurrency_history = concurrency_history
+        self._upload_order = upload_order
+        self._upload_makespans = upload_makespans
+        self._copied_files = copied_files
+        self._copied_size_b = copied_size_b
+        self._refreshed_files = refreshed_files
+        if refresh_errors is None:
+            refresh_errors = []
+        self._refresh_errors = refresh_errors
+        self._wire_size_b = wire_size_b
 
     @property
     def time_total(self):
@@ -209,6 +293,231 @@ class RunStats(object):
         """
         return self._errors
 
+    @property
+    def upload_throughput(self):
+        """
+        Return the aggregate upload throughput, in bytes per second of upload
+        wall-clock time.
+
+        :return: upload throughput in bytes per second, or None if no time was
+          spent uploading
+        :rtype: float
+        """
+        secs = self.time_upload.total_seconds()
+        if secs <= 0:
+            return None
+        return self.bytes_uploaded / secs
+
+    @property
+    def upload_concurrency(self):
+        """
+        Return the effective upload concurrency; the total time spent in
+        individual uploads divided by the upload wall-clock time, i.e. the
+        average number of uploads in flight.
+
+        :return: effective upload concurrency, or None if unknown
+        :rtype: float
+        """
+        secs = self.time_upload.total_seconds()
+        if self._upload_busy_seconds is None or secs <= 0:
+            return None
+        return self._upload_busy_seconds / secs
+
+    @property
+    def meta_error_files(self):
+        """
+        Return a list of local file paths that could not be stat'ed or hashed,
+        and were therefore skipped.
+
+        :return: local paths that could not be read
+        :rtype: list
+        """
+        return self._meta_errors
+
+    @property
+    def hash_cache_hits(self):
+        """
+        Return the number of files whose md5sum came from the hash cache.
+
+        :return: hash cache hits, or None if no hash cache was used
+        :rtype: int
+        """
+        return self._hash_cache_hits
+
+    @property
+    def hash_cache_misses(self):
+        """
+        Return the number of files that were not in the hash cache (or whose
+        cache entry was stale) and had to be hashed.
+
+        :return: hash cache misses, or None if no hash cache was used
+        :rtype: int
+        """
+        return self._hash_cache_misses
+
+    @property
+    def deleted_files(self):
+        """
+        Return the files deleted from S3 (or, in a dry run, that would have
+        been deleted).
+
+        :return: deleted file paths, or None if deletion wasn't enabled
+        :rtype: list
+        """
+        return self._deleted_files
+
+    @property
+    def delete_error_files(self):
+        """
+        Return a list of file paths that failed to delete from S3.
+
+        :return: file paths that failed to delete
+        :rtype: list
+        """
+        return self._delete_errors
+
+    @property
+    def delete_refused(self):
+        """
+        Return the number of files that should have been deleted from S3, but
+        weren't because a deletion limit was exceeded.
+
+        :return: number of files not deleted
+        :rtype: int
+        """
+        return self._delete_refused
+
+    @property
+    def skipped_files(self):
+        """
+        Return a list of file paths that were skipped when applying a plan,
+        because they changed after the plan was made.
+
+        :return: skipped file paths
+        :rtype: list
+        """
+        return self._skipped_files
+
+    @property
+    def concurrency_history(self):
+        """
+        Return how the concurrency of each kind of request adapted over the
+        run, relative to the start of the run.
+
+        :return: dict of request kind to list of (offset, number of requests
+          allowed in flight) 2-tuples, with offsets as
+          :py:class:`datetime.timedelta`, or None if no concurrency adapted
+        :rtype: dict
+        """
+        if self._concurrency_history is None:
+            return None
+        return dict(
+            (name, [(dt - self._start_dt, limit) for dt, limit in hist])
+            for name, hist in self._concurrency_history.items()
+        )
+
+    @property
+    def upload_order(self):
+        """
+        Return the order in which uploads were started.
+
+        :return: upload order name, or None if unknown
+        :rtype: str
+        """
+        return self._upload_order
+
+    @property
+    def upload_makespans(self):
+        """
+        Return the estimated time the uploads would have taken had they been
+        started in each possible order, from the measured per-upload
+        throughput.
+
+        :return: dict of upload order name to estimated upload time, as
+          :py:class:`datetime.timedelta`, or None if not estimated
+        :rtype: dict
+        """
+        if self._upload_makespans is None:
+            return None
+        return dict(
+            (order, timedelta(seconds=round(secs)))
+            for order, secs in self._upload_makespans.items()
+        )
+
+    @property
+    def stage_times(self):
+        """
+        For a pipelined run, return the start and end of each stage, relative
+        to the start of the run.
+
+        :return: list of (stage name, start offset, end offset) 3-tuples, with
+          offsets as :py:class:`datetime.timedelta`, or None if the run was not
+          pipelined
+        :rtype: list
+        """
+        if self._stage_times is None:
+            return None
+        return [
+            (name, start - self._start_dt, end - self._start_dt)
+            for name, start, end in self._stage_times
+        ]
+
+    @property
+    def copied_files(self):
+        """
+        Return the files that were copied within S3 instead of uploaded.
+        These are included in :py:attr:`~.files_uploaded`, but not in
+        :py:attr:`~.bytes_uploaded`.
+
+        :return: copied file paths, or None if copying wasn't enabled
+        :rtype: list
+        """
+        return self._copied_files
+
+    @property
+    def bytes_copied(self):
+        """
+        Return the total size of the files copied within S3 instead of
+        uploaded.
+
+        :return: bytes copied within S3
+        :rtype: int
+        """
+        return self._copied_size_b
+
+    @property
+    def bytes_sent(self):
+        """
+        Return the number of bytes actually sent to S3 for uploads, after
+        compression, as opposed to the uncompressed size of the uploaded
+        files (:py:attr:`~.bytes_uploaded`).
+
+        :return: bytes sent, or None if compression wasn't enabled
+        :rtype: int
+        """
+        return self._wire_size_b
+
+    @property
+    def refreshed_files(self):
+        """
+        Return the files whose metadata was refreshed in S3 without uploading
+        them (or, in a dry run, that would have been).
+
+        :return: refreshed file paths, or None if refreshing wasn't enabled
+        :rtype: list
+        """
+        return self._refreshed_files
+
+    @property
+    def refresh_error_files(self):
+        """
+        Return a list of file paths whose metadata failed to refresh in S3.
+
+        :return: file paths that failed to refresh
+        :rtype: list
+        """
+        return self._refresh_errors
+
     @property
     def summary(self):
         """
@@ -227,11 +536,16 @@ class RunStats(object):
         if self._dry_run:
             s += "-- DRY RUN - NO FILES ACTUALLY UPLOADED --\n"
         s += "Total Run Time: %s\n" % self.time_total
-        s += "Time Listing Files: %s\n" % self.time_listing
-        s += "Time Getting Metadata: %s\n" % self.time_meta
-        s += "Time Querying S3: %s\n" % self.time_s3_query
-        s += "Time Calculating Uploads: %s\n" % self.time_calc
-        s += "Time Uploading Files: %s\n" % self.time_upload
+        if self.stage_times is not None:
+            s += "Pipeline Stages (start - end):\n"
+            for name, start, end in self.stage_times:
+                s += "  %s: %s - %s\n" % (name, start, end)
+        else:
+            s += "Time Listing Files: %s\n" % self.time_listing
+            s += "Time Getting Metadata: %s\n" % self.time_meta
+            s += "Time Querying S3: %s\n" % self.time_s3_query
+            s += "Time Calculating Uploads: %s\n" % self.time_calc
+            s += "Time Uploading Files: %s\n" % self.time_upload
         s += "\n"
         s += "Backed-up files on disk: %s files; %s\n" % (
             intcomma(self.total_files), naturalsize(self.total_bytes)
@@ -239,12 +553,89 @@ class RunStats(object):
         s += "Uploaded %s files; %s\n" % (
             intcomma(self.files_uploaded), naturalsize(self.bytes_uploaded)
         )
+        if self.bytes_sent is not None and self.bytes_uploaded > 0:
+            s += "Sent %s to S3 after compression (%.1f%% of uploaded)\n" % (
+                naturalsize(self.bytes_sent),
+                100.0 * self.bytes_sent / self.bytes_uploaded
+            )
+        if self.copied_files:
+            s += "Copied %s files within S3 instead of uploading; %s\n" % (
+                intcomma(len(self.copied_files)),
+                naturalsize(self.bytes_copied)
+            )
+        if self.upload_concurrency is not None:
+            s += "Upload throughput: %s/s; effective concurrency %.1f\n" % (
+                naturalsize(self.upload_throughput), self.upload_concurrency
+            )
+        if self.concurrency_history is not None:
+            for name, hist in sorted(self.concurrency_history.items()):
+                limits = [limit for _, limit in hist]
+                cuts = len([
+                    1 for a, b in zip(limits, limits[1:]) if b < a
+                ])
+                s += "%s concurrency: %d-%d; final %d; reduced %d times\n" % (
+                    name[0].upper() + name[1:], min(limits), max(limits),
+                    limits[-1], cuts
+                )
+        if self.upload_makespans is not None:
+            s += "Estimated upload time by order:"
+            for order, td in sorted(
+                self.upload_makespans.items(), key=lambda x: (x[1], x[0])
+            ):
+                s += " %s %s%s;" % (
+                    order, td, ' (used)' if order == self.upload_order else ''
+                )
+            s = s[:-1] + "\n"
+        if self.deleted_files is not None:
+            s += "Deleted %s files from S3\n" % intcomma(
+                len(self.deleted_files)
+            )
+        if self.refreshed_files is not None:
+            s += "Refreshed metadata of %s files in S3\n" % intcomma(
+                len(self.refreshed_files)
+            )
+        if self.hash_cache_hits is not None:
+            s += "Hash cache: %s hits; %s misses\n" % (
+                intcomma(self.hash_cache_hits),
+                intcomma(self.hash_cache_misses)
+            )
         if len(self.error_files) < 1:
             s += "\nAll files uploaded successfully.\n"
         else:
             s += "\n%d files failed uploading:\n" % len(self.error_files)
             for f in sorted(self.error_files):
                 s += "%s\n" % f
+        if len(self.meta_error_files) > 0:
+            s += "\n%d files could not be read:\n" % len(self.meta_error_files)
+            for f in sorted(self.meta_error_files):
+                s += "%s\n" % f
+        if len(self.skipped_files) > 0:
+            s += "\n%d files changed since planning and were skipped:\n" % (
+                len(self.skipped_files)
+            )
+            for f in sorted(self.skipped_files):
+                s += "%s\n" % f
+        if self.delete_refused > 0:
+            s += "\nRefused to delete %d files from S3; more than the " \
+                 "maximum allowed\n" % self.delete_refused
+        if len(self.delete_error_files) > 0:
+            s += "\n%d files failed deleting:\n" % len(
+                self.delete_error_files
+            )
+            for f in sorted(self.delete_error_files):
+                s += "%s\n" % f
+        if len(self.refresh_error_files) > 0:
+            s += "\n%d files failed refreshing metadata:\n" % len(
+                self.refresh_error_files
+            )
+            for f in sorted(self.refresh_error_files):
+                s += "%s\n" % f
+        if self._dry_run and self.deleted_files:
+            s += "\nWould delete %d files from S3:\n" % len(
+                self.deleted_files
+            )
+            for f in sorted(self.deleted_files):
+                s += "%s\n" % f
         if self._dry_run:
             s += "-- DRY RUN - NO FILES ACTUALLY UPLOADED --\n"
         return s
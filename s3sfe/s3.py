@@ -36,15 +36,136 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 """
 
 import boto3
+import calendar
+import gzip
+import json
 import logging
 import os
+import time
 from base64 import b64encode
+from boto3.exceptions import S3UploadFailedError
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError, ConnectTimeoutError, ReadTimeoutError
+)
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
+from io import BytesIO
+from uuid import uuid4
+from s3sfe.compression import (
+    CompressingReader, decompressor, should_compress
+)
+from s3sfe.concurrency import AdaptiveLimiter, backoff
+from s3sfe.diff import MTIME_TOLERANCE
+from s3sfe.ratelimit import TokenBucket
+from s3sfe.transfer import TransferProfiles
+from s3sfe.utils import FileSlice, dtnow, run_bounded
 from s3sfe.version import VERSION
 import re
+import threading
 
 logger = logging.getLogger(__name__)
 
+#: S3 error codes that indicate we're sending requests too quickly
+THROTTLE_ERROR_CODES = [
+    'SlowDown', '503', 'Throttling', 'ThrottlingException',
+    'RequestLimitExceeded', 'TooManyRequests', 'RequestThrottled'
+]
+
+#: S3 error codes other than throttling that indicate a congested connection
+CONGESTION_ERROR_CODES = ['RequestTimeout']
+
+#: Matches the error code in the message of a ClientError, as included in the
+#: message of the S3UploadFailedError that boto3's managed uploads raise
+_error_code_re = re.compile(r'An error occurred \((\w+)\)')
+
+
+def _error_code(ex):
+    """
+    Return the S3 error code and HTTP status of an exception raised by a
+    boto3 call, or ``(None, None)`` if it isn't an S3 error response.
+
+    boto3's managed uploads (``upload_file``) re-raise a ``ClientError`` as
+    an ``S3UploadFailedError``, so for those the ``ClientError`` is found in
+    the exception's ``__cause__`` or ``__context__``; failing that (as on
+    Python 2, which doesn't chain exceptions) the code is taken from the
+    message, which includes the ``ClientError``'s.
+
+    :param ex: exception raised by a boto3 call
+    :type ex: Exception
+    :return: 2-tuple of (error code, HTTP status code)
+    :rtype: tuple
+    """
+    seen = set()
+    cur = ex
+    while cur is not None and id(cur) not in seen:
+        if isinstance(cur, ClientError):
+            return (
+                cur.response.get('Error', {}).get('Code'),
+                cur.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            )
+        seen.add(id(cur))
+        cur = getattr(cur, '__cause__', None) or getattr(
+            cur, '__context__', None
+        )
+    if isinstance(ex, S3UploadFailedError):
+        codes = _error_code_re.findall(str(ex))
+        if len(codes) > 0:
+            return codes[-1], None
+    return None, None
+
+
+def is_throttle_error(ex):
+    """
+    Return whether or not an exception is S3 telling us to slow down (i.e.
+    ``503 SlowDown``), including when a managed upload wrapped it in an
+    ``S3UploadFailedError``.
+
+    :param ex: exception raised by a boto3 call
+    :type ex: Exception
+    :return: whether ``ex`` is a throttling error
+    :rtype: bool
+    """
+    code, status = _error_code(ex)
+    return code in THROTTLE_ERROR_CODES or status == 503
+
+
+def is_congestion_error(ex):
+    """
+    Return whether or not an exception means we are sending requests faster
+    than S3 or the network can handle; throttling or a timeout. Such requests
+    should be retried with fewer requests in flight.
+
+    :param ex: exception raised by a boto3 call
+    :type ex: Exception
+    :return: whether ``ex`` is a throttling or timeout error
+    :rtype: bool
+    """
+    if isinstance(ex, (ConnectTimeoutError, ReadTimeoutError)):
+        return True
+    if _error_code(ex)[0] in CONGESTION_ERROR_CODES:
+        return True
+    return is_throttle_error(ex)
+
+
+def make_limiter(name, max_limit, initial=None):
+    """
+    Return an :py:class:`~s3sfe.concurrency.AdaptiveLimiter` for S3 requests,
+    which backs off and retries on throttling and timeouts.
+
+    :param name: name of the kind of request, for logging
+    :type name: str
+    :param max_limit: maximum number of requests in flight
+    :type max_limit: int
+    :param initial: initial number of requests in flight
+    :type initial: int
+    :rtype: s3sfe.concurrency.AdaptiveLimiter
+    """
+    return AdaptiveLimiter(
+        name, max_limit, initial=initial, retryable=is_congestion_error,
+        max_retries=S3Wrapper.max_throttle_retries
+    )
+
 
 class S3Wrapper(object):
     """
@@ -54,7 +175,46 @@ class S3Wrapper(object):
 
     slash_re = re.compile('\/+')
 
-    def __init__(self, bucket_name, prefix='', dry_run=False, ssec_key=None):
+    #: Name of the manifest object, stored directly under the prefix. The
+    #: manifest is a gzipped JSON document mapping every file path in S3 to
+    #: its (size, mtime, md5sum), so the remote file list can be loaded with
+    #: one GET instead of one HEAD per object.
+    manifest_name = '.s3sfe-manifest.json.gz'
+
+    #: Manifest format version; manifests with any other version are ignored
+    #: and rebuilt.
+    manifest_version = 1
+
+    #: Path, under the prefix, of the bundle objects that small files are
+    #: packed into; see :py:meth:`~.put_bundle`.
+    bundle_prefix = '.s3sfe-bundles/'
+
+    #: Path, under the prefix, of the object listing the dead entries in the
+    #: bundles' indexes (files since stored elsewhere or deleted), so that
+    #: rebuilding the manifest doesn't bring them back; see
+    #: :py:meth:`~.put_manifest`.
+    tombstones_name = '.s3sfe-bundle-tombstones.json.gz'
+
+    #: Maximum number of times to retry a throttled request
+    max_throttle_retries = 10
+
+    #: Maximum number of keys per DeleteObjects request (the S3 API limit)
+    delete_batch_size = 1000
+
+    #: Bytes read at a time when downloading and decompressing a compressed
+    #: object
+    download_chunk_size = 1024 * 1024
+
+    #: Maximum number of parts in a multipart upload (the S3 API limit)
+    max_parts = 10000
+
+    #: botocore's default maximum number of pooled connections
+    default_max_connections = 10
+
+    def __init__(self, bucket_name, prefix='', dry_run=False, ssec_key=None,
+                 head_workers=1, transfer_profiles=None,
+                 max_connections=None, head_limiter=None, upload_rate=None,
+                 download_rate=None, journal=None, compression=None):
         """
         Connect to S3 and setup the file storage backend.
 
@@ -68,16 +228,76 @@ class S3Wrapper(object):
         :type dry_run: bool
         :param ssec_key: 32-bit AES256 SSE-C key (binary)
         :type ssec_key: bytes
+        :param head_workers: maximum number of concurrent HEAD requests when
+          querying object metadata
+        :type head_workers: int
+        :param transfer_profiles: multipart transfer settings to use for each
+          file size class; defaults to
+          :py:data:`s3sfe.transfer.DEFAULT_PROFILES`
+        :type transfer_profiles: s3sfe.transfer.TransferProfiles
+        :param max_connections: number of concurrent requests expected, used
+          to size the S3 client connection pool. The pool is never smaller than
+          ``head_workers`` or botocore's default of 10.
+        :type max_connections: int
+        :param head_limiter: adaptive limit on concurrent HEAD requests;
+          defaults to one with a maximum of ``head_workers``
+        :type head_limiter: s3sfe.concurrency.AdaptiveLimiter
+        :param upload_rate: if not None, maximum aggregate upload rate
+        :type upload_rate: s3sfe.ratelimit.RateSchedule
+        :param download_rate: if not None, maximum aggregate download rate
+        :type download_rate: s3sfe.ratelimit.RateSchedule
+        :param journal: if not None, files large enough for a multipart upload
+          are uploaded resumably, recording their progress in this journal;
+          see :py:meth:`~._put_file_resumable`
+        :type journal: s3sfe.journal.UploadJournal
+        :param compression: if not None, compress files that
+          :py:func:`s3sfe.compression.should_compress` accepts with this
+          codec while uploading them; see :py:meth:`~.put_file`
+        :type compression: str
         """
         logger.debug('Initializing S3: bucket_name=%s prefix=%s dry_run=%s',
                      bucket_name, prefix, dry_run)
         self._bucket_name = bucket_name
         self._prefix = prefix
         self._dry_run = dry_run
+        self._head_workers = head_workers
+        if transfer_profiles is None:
+            transfer_profiles = TransferProfiles()
+        self._transfer = transfer_profiles
+        if head_limiter is None:
+            head_limiter = make_limiter('HEAD', head_workers)
+        self._head_limiter = head_limiter
+        self._upload_bucket = self._download_bucket = None
+        if upload_rate is not None:
+            self._upload_bucket = TokenBucket(upload_rate)
+        if download_rate is not None:
+            self._download_bucket = TokenBucket(download_rate)
+        self._journal = journal
+        self._compression = compression
+        self._sent_lock = threading.Lock()
+        #: total bytes of file data sent to S3 (after any compression)
+        self.bytes_sent = 0
+        max_connections = max(
+            self.default_max_connections, head_workers, max_connections or 0
+        )
         self._key, self._keymd5 = self._encode_key(ssec_key)
-        logger.debug('Connecting to S3')
-        self._s3 = boto3.resource('s3')
-        self._s3client = boto3.client('s3')
+        self.manifest_loaded = False
+        #: bundle ID to the size of the packed file data it holds
+        self.bundles = {}
+        #: path of each file packed in a bundle to 3-tuple of (bundle ID,
+        #: offset of the file's data in the bundle, file size in bytes)
+        self.bundled = {}
+        #: path of each file stored compressed to the codec used
+        self.compressed = {}
+        #: bundle ID to the set of paths in its index that are no longer
+        #: stored in it
+        self.dead = {}
+        self._dead_changed = False
+        self._dead_lock = threading.Lock()
+        logger.debug('Connecting to S3 (max_connections=%d)', max_connections)
+        self._config = Config(max_pool_connections=max_connections)
+        self._s3 = boto3.resource('s3', config=self._config)
+        self._s3client = boto3.client('s3', config=self._config)
 
     def _encode_key(self, key):
         """
@@ -93,7 +313,7 @@ class S3Wrapper(object):
         m = b64encode(md5(key).digest()).decode('utf-8')
         return k, m
 
-    def get_filelist(self):
+    def get_filelist(self, rebuild_manifest=False):
         """
         Return all files currently stored in the backend, as a dict of the file
         path/key to a 3-tuple of the file size in bytes, file modification time
@@ -101,6 +321,18 @@ class S3Wrapper(object):
         not the encrypted file). File paths/keys are excluding ``self.prefix``,
         i.e. the same paths as they would have on the filesystem.
 
+        The list is read from the manifest object if one exists and is valid
+        (setting ``self.manifest_loaded`` to True); otherwise, or if
+        ``rebuild_manifest`` is True, it is built by listing the bucket and
+        querying the metadata of every object. Either way, the locations of
+        files packed into bundles are stored in ``self.bundles`` and
+        ``self.bundled``, the dead entries in the bundles' indexes in
+        ``self.dead``, and the codecs of compressed files in
+        ``self.compressed``.
+
+        :param rebuild_manifest: if True, ignore any existing manifest and
+          query every object's metadata
+        :type rebuild_manifest: bool
         :return: dict of files currently in S3. Keys are the file path excluding
           ``self.prefix`` (the path to the file on local disk). Values are
           3-tuples of size in bytes of the file's unencrypted contents, file
@@ -109,18 +341,301 @@ class S3Wrapper(object):
           contents as a hex string.
         :rtype: dict
         """
+        self.manifest_loaded = False
+        self.bundles = {}
+        self.bundled = {}
+        self.compressed = {}
+        self.dead = {}
+        self._dead_changed = False
+        if not rebuild_manifest:
+            files = self._read_manifest()
+            if files is not None:
+                self.manifest_loaded = True
+                return files
         logger.debug('Listing all objects in bucket, under given prefix')
         files = {}
+        skip = set([
+            self._key_for_path(self.manifest_name),
+            self._key_for_path(self.tombstones_name)
+        ])
         bkt = self._s3.Bucket(self._bucket_name)
         if self._prefix == '':
             objects = bkt.objects.all()
         else:
             objects = bkt.objects.filter(Prefix=self._prefix)
-        for obj in objects:
-            files[self._path_for_key(obj.key)] = self._get_metadata(obj.key)
+        bundle_key = self._key_for_path(self.bundle_prefix)
+        bundles = {}
+        keys = (obj.key for obj in objects if obj.key not in skip)
+        for key, meta in self._get_metadata_concurrent(keys):
+            if key.startswith(bundle_key):
+                bundles[key[len(bundle_key):]] = meta
+                continue
+            path = self._path_for_key(key)
+            files[path] = meta
+            if 'codec' in meta:
+                self.compressed[path] = meta['codec']
         logger.debug('Found %d matching objects', len(files))
+        if len(bundles) > 0:
+            self.dead = self._read_tombstones()
+        self._read_bundle_indexes(bundles, files)
+        return files
+
+    def _read_bundle_indexes(self, bundles, files):
+        """
+        Read the index of each bundle found when rebuilding the file list,
+        adding the files packed in them to ``files`` and ``self.bundled``.
+        Bundle IDs sort by creation time, and a file in several bundles is
+        taken from the newest one; a file also stored as its own object was
+        uploaded after it was bundled, and the object is used. Entries listed
+        in ``self.dead`` are skipped, and ``self.dead`` is pruned of bundles
+        that no longer exist.
+
+        :param bundles: bundle ID to the bundle object's metadata
+        :type bundles: dict
+        :param files: file path to metadata dict of the individual objects
+          found, as returned by :py:meth:`~._get_metadata`; updated in place
+        :type files: dict
+        """
+        individual = set(files.keys())
+        for bid in sorted(bundles.keys()):
+            offset = int(bundles[bid]['bundle_index_offset'])
+            index = json.loads(
+                self.read_bundle(bid, start=offset).decode('utf-8')
+            )
+            self.bundles[bid] = offset
+            dead = self.dead.get(bid, set())
+            for path, (size_b, mtime, md5sum, pos) in index.items():
+                if path in individual or path in dead:
+                    continue
+                files[path] = {
+                    'size_b': '%s' % size_b,
+                    'mtime': '%s' % mtime,
+                    'md5sum': md5sum
+                }
+                self.bundled[path] = (bid, pos, size_b)
+        for bid in list(self.dead.keys()):
+            if bid not in bundles:
+                del self.dead[bid]
+                self._dead_changed = True
+        logger.debug('Found %d files in %d bundles', len(self.bundled),
+                     len(self.bundles))
+
+    def _read_tombstones(self):
+        """
+        Read the object listing the dead entries in the bundles' indexes,
+        written by :py:meth:`~.put_manifest`. Return an empty dict if it
+        doesn't exist or can't be parsed (in which case a warning is logged).
+
+        :return: bundle ID to set of dead paths in its index
+        :rtype: dict
+        """
+        key = self._key_for_path(self.tombstones_name)
+        try:
+            body = self._s3client.get_object(
+                Bucket=self._bucket_name,
+                Key=key,
+                SSECustomerAlgorithm='AES256',
+                SSECustomerKey=self._key,
+                SSECustomerKeyMD5=self._keymd5
+            )['Body'].read()
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in ['NoSuchKey', '404']:
+                return {}
+            raise
+        try:
+            with gzip.GzipFile(fileobj=BytesIO(body), mode='rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+            return dict((bid, set(paths)) for bid, paths in data.items())
+        except Exception as ex:
+            logger.warning('Invalid bundle tombstones at %s (%s); ignoring',
+                           key, ex)
+            return {}
+
+    def _forget_bundled(self, path):
+        """
+        Forget the copy of ``path`` in a bundle, if there is one, and record
+        it as a dead entry of that bundle in ``self.dead``.
+
+        :param path: file path
+        :type path: str
+        """
+        with self._dead_lock:
+            entry = self.bundled.pop(path, None)
+            if entry is not None:
+                self.dead.setdefault(entry[0], set()).add(path)
+                self._dead_changed = True
+
+    def _get_metadata_concurrent(self, keys):
+        """
+        Generator that queries the metadata of each key in ``keys`` using up to
+        ``self._head_workers`` concurrent HEAD requests, yielding a 2-tuple of
+        (key, metadata dict) for each as it completes. ``keys`` is consumed
+        lazily, so listing pages are fetched as the workers need them.
+
+        The number of requests actually in flight is adapted to S3's response
+        by ``self._head_limiter``; throttled requests are retried. Any other
+        error is raised.
+
+        :param keys: iterable of S3 keys
+        :type keys: iterable
+        :return: generator of (key, metadata dict) 2-tuples
+        :rtype: generator
+        """
+        jobs = (
+            (key, self._head_limiter.run, (self._get_metadata, (key,)))
+            for key in keys
+        )
+        with ThreadPoolExecutor(max_workers=self._head_workers) as pool:
+            for key, fut in run_bounded(pool, jobs, self._head_workers * 2):
+                yield key, fut.result()
+
+    def _read_manifest(self):
+        """
+        Read and parse the manifest object. Return None if it doesn't exist,
+        or if it can't be parsed or is an unknown version (in which case a
+        warning is logged).
+
+        :return: dict of file path to metadata dict (in the same format as
+          :py:meth:`~._get_metadata`), or None
+        :rtype: dict
+        """
+        key = self._key_for_path(self.manifest_name)
+        logger.debug('Reading manifest from s3://%s/%s',
+                     self._bucket_name, key)
+        try:
+            body = self._s3client.get_object(
+                Bucket=self._bucket_name,
+                Key=key,
+                SSECustomerAlgorithm='AES256',
+                SSECustomerKey=self._key,
+                SSECustomerKeyMD5=self._keymd5
+            )['Body'].read()
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in ['NoSuchKey', '404']:
+                logger.info('No manifest found at %s; will rebuild', key)
+                return None
+            raise
+        try:
+            with gzip.GzipFile(fileobj=BytesIO(body), mode='rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+            if data['version'] != self.manifest_version:
+                raise ValueError(
+                    'unknown manifest version %s' % data['version']
+                )
+            files = {}
+            bundled = {}
+            for path, entry in data['files'].items():
+                size_b, mtime, md5sum = entry[:3]
+                files[path] = {
+                    'size_b': '%s' % size_b,
+                    'mtime': '%s' % mtime,
+                    'md5sum': md5sum
+                }
+                if len(entry) > 3:
+                    bundled[path] = (entry[3], entry[4], size_b)
+            bundles = data.get('bundles', {})
+            compressed = data.get('compressed', {})
+            dead = dict(
+                (bid, set(paths))
+                for bid, paths in data.get('dead', {}).items()
+            )
+        except Exception as ex:
+            logger.warning('Invalid manifest at %s (%s); will rebuild', key, ex)
+            return None
+        self.bundles = bundles
+        self.bundled = bundled
+        self.compressed = compressed
+        self.dead = dead
+        logger.info('Read manifest with %d files', len(files))
         return files
 
+    def put_manifest(self, files):
+        """
+        Write the manifest object, describing every file currently in S3.
+        The entries of files packed in bundles also hold their bundle ID and
+        offset, from ``self.bundled``, and the codecs of compressed files are
+        recorded from ``self.compressed``. The dead entries in the bundles'
+        indexes, from ``self.dead``, are recorded both in the manifest and,
+        if they changed, in a separate object that survives the manifest
+        being lost or rebuilt.
+
+        :param files: dict of file path to 3-tuple of (file size in bytes,
+          file modification time as a float timestamp, file md5sum as a hex
+          string), describing every file currently in S3
+        :type files: dict
+        """
+        key = self._key_for_path(self.manifest_name)
+        if self._dry_run:
+            logger.warning('DRY RUN; would write manifest of %d files to %s',
+                           len(files), key)
+            return
+        dead = dict((bid, sorted(paths)) for bid, paths in self.dead.items())
+        if self._dead_changed:
+            self._put_tombstones(dead)
+            self._dead_changed = False
+        buf = BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as fh:
+            # written entry by entry, rather than with one json.dumps() call,
+            # so that the whole document is never held in memory as a string
+            compressed = dict(
+                (p, c) for p, c in self.compressed.items() if p in files
+            )
+            head = (
+                '{"version":%d,"bundles":%s,"dead":%s,"compressed":%s,'
+                '"files":{' % (
+                    self.manifest_version,
+                    json.dumps(self.bundles, separators=(',', ':')),
+                    json.dumps(dead, separators=(',', ':')),
+                    json.dumps(compressed, separators=(',', ':'))
+                )
+            )
+            fh.write(head.encode('utf-8'))
+            sep = ''
+            for path, meta in files.items():
+                meta = list(meta)
+                if path in self.bundled:
+                    meta.extend(self.bundled[path][:2])
+                fh.write(('%s%s:%s' % (
+                    sep, json.dumps(path),
+                    json.dumps(meta, separators=(',', ':'))
+                )).encode('utf-8'))
+                sep = ','
+            fh.write(b'}}')
+        logger.info('Writing manifest of %d files to %s', len(files), key)
+        self._s3client.put_object(
+            Bucket=self._bucket_name,
+            Key=key,
+            Body=buf.getvalue(),
+            ACL='private',
+            SSECustomerAlgorithm='AES256',
+            SSECustomerKey=self._key,
+            SSECustomerKeyMD5=self._keymd5,
+            Metadata={'UploadedBy': 's3sfe-%s' % VERSION}
+        )
+
+    def _put_tombstones(self, dead):
+        """
+        Write the object listing the dead entries in the bundles' indexes.
+
+        :param dead: bundle ID to list of dead paths in its index
+        :type dead: dict
+        """
+        key = self._key_for_path(self.tombstones_name)
+        buf = BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as fh:
+            fh.write(json.dumps(dead, separators=(',', ':')).encode('utf-8'))
+        logger.debug('Writing tombstones of %d bundles to %s', len(dead), key)
+        self._s3client.put_object(
+            Bucket=self._bucket_name,
+            Key=key,
+            Body=buf.getvalue(),
+            ACL='private',
+            SSECustomerAlgorithm='AES256',
+            SSECustomerKey=self._key,
+            SSECustomerKeyMD5=self._keymd5,
+            Metadata={'UploadedBy': 's3sfe-%s' % VERSION}
+        )
+
     def _path_for_key(self, key):
         """
         Given a key in S3, return the filesystem path it corresponds to
@@ -186,14 +701,422 @@ class S3Wrapper(object):
         :param md5sum: md5sum of the file contents on disk, as a hex string
         :type md5sum: str
         """
-        bkt = self._s3.Bucket(self._bucket_name)
         key = self._key_for_path(path)
         if self._dry_run:
             logger.warning("DRY RUN; would upload %s to %s", path, key)
             return
         logger.debug('Uploading %s to %s', path, key)
-        bkt.upload_file(
-            path,
+        config = self._transfer.config_for(size_b)
+        codec = None
+        if self._compression is not None and should_compress(path, size_b):
+            codec = self._compression
+        sent = size_b
+        if codec is not None:
+            sent = self._put_file_compressed(
+                path, key, size_b, mtime, md5sum, codec, config
+            )
+        elif (
+            self._journal is not None and
+            size_b >= config.multipart_threshold
+        ):
+            sent = self._put_file_resumable(
+                path, key, size_b, mtime, md5sum, config
+            )
+        else:
+            kwargs = {}
+            if self._upload_bucket is not None:
+                kwargs['Callback'] = self._upload_bucket.consume
+            # use the client rather than the resource; clients are thread-safe
+            # and this may be called concurrently from FileSyncer's upload pool
+            self._s3client.upload_file(
+                path,
+                self._bucket_name,
+                key,
+                ExtraArgs={
+                    'ACL': 'private',
+                    'SSECustomerAlgorithm': 'AES256',
+                    'SSECustomerKey': self._key,
+                    'SSECustomerKeyMD5': self._keymd5,
+                    'Metadata': self._file_metadata(size_b, mtime, md5sum)
+                },
+                Config=config,
+                **kwargs
+            )
+        with self._sent_lock:
+            self.bytes_sent += sent
+        # any copy of the file in a bundle is now dead space
+        self._forget_bundled(path)
+        if codec is None:
+            self.compressed.pop(path, None)
+        else:
+            self.compressed[path] = codec
+
+    def _put_file_compressed(self, path, key, size_b, mtime, md5sum, codec,
+                             config):
+        """
+        Upload a file compressed with ``codec``, compressing it as it is
+        streamed to S3 (see :py:class:`s3sfe.compression.CompressingReader`).
+        The codec is recorded in the object's ``codec`` metadata, alongside
+        the original size in ``size_b``, and :py:meth:`~.get_file`
+        decompresses the file again when restoring it.
+
+        :param path: The path to the file on disk.
+        :type path: str
+        :param key: S3 key to upload to
+        :type key: str
+        :param size_b: size of the file on disk in bytes
+        :type size_b: int
+        :param mtime: modification time of the file on disk
+        :type mtime: float
+        :param md5sum: md5sum of the file contents on disk, as a hex string
+        :type md5sum: str
+        :param codec: codec name, one of :py:const:`s3sfe.compression.CODECS`
+        :type codec: str
+        :param config: transfer configuration for the file's size class
+        :type config: boto3.s3.transfer.TransferConfig
+        :return: compressed size in bytes
+        :rtype: int
+        """
+        kwargs = {}
+        if self._upload_bucket is not None:
+            kwargs['Callback'] = self._upload_bucket.consume
+        with open(path, 'rb') as fh:
+            reader = CompressingReader(fh, codec)
+            self._s3client.upload_fileobj(
+                reader,
+                self._bucket_name,
+                key,
+                ExtraArgs={
+                    'ACL': 'private',
+                    'SSECustomerAlgorithm': 'AES256',
+                    'SSECustomerKey': self._key,
+                    'SSECustomerKeyMD5': self._keymd5,
+                    'Metadata': self._file_metadata(
+                        size_b, mtime, md5sum, codec=codec
+                    )
+                },
+                Config=config,
+                **kwargs
+            )
+        logger.debug('Compressed %s with %s from %d to %d bytes', path, codec,
+                     reader.bytes_in, reader.bytes_out)
+        return reader.bytes_out
+
+    def copy_file(self, src_path, path, size_b, mtime, md5sum):
+        """
+        Create the object for a file by copying, within S3, the object of
+        another file with identical content, rather than uploading it. The
+        copy is done with CopyObject, or UploadPartCopy for files over the
+        multipart threshold of their size class, so the data never leaves S3.
+        The new object gets its own file's metadata, and the same compression
+        codec (if any) as the source.
+
+        :param src_path: path of the file whose object to copy
+        :type src_path: str
+        :param path: The path to the file on disk.
+        :type path: str
+        :param size_b: size of the file on disk in bytes
+        :type size_b: int
+        :param mtime: modification time of the file on disk, as a float
+          timestamp
+        :type mtime: float
+        :param md5sum: md5sum of the file contents on disk, as a hex string
+        :type md5sum: str
+        """
+        key = self._key_for_path(path)
+        src_key = self._key_for_path(src_path)
+        if self._dry_run:
+            logger.warning("DRY RUN; would copy %s to %s", src_key, key)
+            return
+        logger.debug('Copying %s to %s', src_key, key)
+        codec = self.compressed.get(src_path)
+        self._s3client.copy(
+            {'Bucket': self._bucket_name, 'Key': src_key},
+            self._bucket_name,
+            key,
+            ExtraArgs={
+                'ACL': 'private',
+                'MetadataDirective': 'REPLACE',
+                'SSECustomerAlgorithm': 'AES256',
+                'SSECustomerKey': self._key,
+                'SSECustomerKeyMD5': self._keymd5,
+                'CopySourceSSECustomerAlgorithm': 'AES256',
+                'CopySourceSSECustomerKey': self._key,
+                'CopySourceSSECustomerKeyMD5': self._keymd5,
+                'Metadata': self._file_metadata(
+                    size_b, mtime, md5sum, codec=codec
+                )
+            },
+            Config=self._transfer.config_for(size_b)
+        )
+        self._forget_bundled(path)
+        if codec is None:
+            self.compressed.pop(path, None)
+        else:
+            self.compressed[path] = codec
+
+    def _file_metadata(self, size_b, mtime, md5sum, codec=None):
+        """
+        Return the user metadata to store on the object for a file.
+
+        :param size_b: size of the file on disk in bytes
+        :type size_b: int
+        :param mtime: modification time of the file on disk
+        :type mtime: float
+        :param md5sum: md5sum of the file contents on disk, as a hex string
+        :type md5sum: str
+        :param codec: if the object is compressed, the codec used
+        :type codec: str
+        :return: object metadata
+        :rtype: dict
+        """
+        meta = {
+            'UploadedBy': 's3sfe-%s' % VERSION,
+            'size_b': '%s' % size_b,
+            'mtime': '%s' % mtime,
+            'md5sum': '%s' % md5sum
+        }
+        if codec is not None:
+            meta['codec'] = codec
+        return meta
+
+    def _put_file_resumable(self, path, key, size_b, mtime, md5sum, config):
+        """
+        Upload a file with explicit multipart upload calls, recording the
+        upload ID and each completed part in ``self._journal`` so that an
+        upload interrupted by the process dying can be resumed by a later run.
+
+        If the journal has an upload in progress to ``key`` for the same file
+        size, mtime and md5sum, only its missing parts are uploaded. If the
+        file has changed since, that upload is aborted and a new one started.
+
+        :param path: The path to the file on disk.
+        :type path: str
+        :param key: S3 key to upload to
+        :type key: str
+        :param size_b: size of the file on disk in bytes
+        :type size_b: int
+        :param mtime: modification time of the file on disk
+        :type mtime: float
+        :param md5sum: md5sum of the file contents on disk, as a hex string
+        :type md5sum: str
+        :param config: transfer configuration for the file's size class; its
+          ``multipart_chunksize`` and ``max_concurrency`` are used
+        :type config: boto3.s3.transfer.TransferConfig
+        :return: number of bytes uploaded by this call, not counting parts
+          uploaded before an interruption
+        :rtype: int
+        """
+        entry = self._journal.get(self._bucket_name, key)
+        if entry is not None and (
+            entry['size'] != size_b or entry['md5'] != md5sum or
+            abs(entry['mtime'] - mtime) > MTIME_TOLERANCE
+        ):
+            logger.info('%s has changed since its interrupted upload; '
+                        'aborting upload %s', path, entry['upload_id'])
+            self.abort_upload(key, entry['upload_id'])
+            entry = None
+        if entry is not None:
+            logger.info('Resuming interrupted upload of %s (%d parts already '
+                        'uploaded)', path, len(entry['parts']))
+            try:
+                return self._upload_parts(path, key, size_b, entry, config)
+            except ClientError as ex:
+                if ex.response['Error']['Code'] != 'NoSuchUpload':
+                    raise
+                logger.warning('Interrupted upload of %s no longer exists in '
+                               'S3; starting again', path)
+                self._journal.finish(self._bucket_name, key)
+        res = self._s3client.create_multipart_upload(
+            Bucket=self._bucket_name,
+            Key=key,
+            ACL='private',
+            SSECustomerAlgorithm='AES256',
+            SSECustomerKey=self._key,
+            SSECustomerKeyMD5=self._keymd5,
+            Metadata=self._file_metadata(size_b, mtime, md5sum)
+        )
+        # parts must be large enough that the file fits in the maximum count
+        part_size = max(
+            config.multipart_chunksize,
+            (size_b + self.max_parts - 1) // self.max_parts
+        )
+        self._journal.start(
+            self._bucket_name, key, res['UploadId'], path, part_size, size_b,
+            mtime, md5sum
+        )
+        entry = {
+            'upload_id': res['UploadId'], 'part_size': part_size, 'parts': {}
+        }
+        return self._upload_parts(path, key, size_b, entry, config)
+
+    def _upload_parts(self, path, key, size_b, entry, config):
+        """
+        Upload the parts of a multipart upload that are not yet in
+        ``entry['parts']``, then complete the upload and remove it from the
+        journal.
+
+        :param path: The path to the file on disk.
+        :type path: str
+        :param key: S3 key being uploaded to
+        :type key: str
+        :param size_b: size of the file on disk in bytes
+        :type size_b: int
+        :param entry: journal entry for the upload, as returned by
+          :py:meth:`s3sfe.journal.UploadJournal.get`
+        :type entry: dict
+        :param config: transfer configuration for the file's size class
+        :type config: boto3.s3.transfer.TransferConfig
+        :return: number of bytes in the parts uploaded
+        :rtype: int
+        """
+        upload_id = entry['upload_id']
+        part_size = entry['part_size']
+        etags = dict(entry['parts'])
+        num_parts = max(1, (size_b + part_size - 1) // part_size)
+
+        def upload_part(num):
+            with FileSlice(path, (num - 1) * part_size, part_size) as body:
+                sent = len(body)
+                if self._upload_bucket is not None:
+                    self._upload_bucket.consume(len(body))
+                res = self._s3client.upload_part(
+                    Bucket=self._bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=num,
+                    Body=body,
+                    SSECustomerAlgorithm='AES256',
+                    SSECustomerKey=self._key,
+                    SSECustomerKeyMD5=self._keymd5
+                )
+            self._journal.add_part(upload_id, num, res['ETag'])
+            return num, res['ETag'], sent
+
+        todo = [n for n in range(1, num_parts + 1) if n not in etags]
+        total = 0
+        if len(todo) > 0:
+            workers = max(1, min(config.max_concurrency, len(todo)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for num, etag, sent in executor.map(upload_part, todo):
+                    etags[num] = etag
+                    total += sent
+        self._s3client.complete_multipart_upload(
+            Bucket=self._bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': n, 'ETag': etags[n]} for n in sorted(etags)
+            ]}
+        )
+        self._journal.finish(self._bucket_name, key)
+        return total
+
+    def abort_upload(self, key, upload_id):
+        """
+        Abort a multipart upload, and remove it from the journal if there is
+        one. An upload that no longer exists in S3 is not an error.
+
+        :param key: S3 key being uploaded to
+        :type key: str
+        :param upload_id: multipart upload ID
+        :type upload_id: str
+        :return: whether the upload was aborted (or already gone)
+        :rtype: bool
+        """
+        if self._dry_run:
+            logger.warning('DRY RUN; would abort upload %s to %s',
+                           upload_id, key)
+            return True
+        logger.debug('Aborting upload %s to %s', upload_id, key)
+        try:
+            self._s3client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id
+            )
+        except ClientError as ex:
+            if ex.response['Error']['Code'] != 'NoSuchUpload':
+                logger.error('Error aborting upload %s to %s: %s',
+                             upload_id, key, ex)
+                return False
+        if self._journal is not None:
+            self._journal.finish(self._bucket_name, key)
+        return True
+
+    def abort_orphaned_uploads(self, keep_ids=None, min_age=86400):
+        """
+        Abort the incomplete multipart uploads under our prefix that are not
+        in ``keep_ids``, so that their parts stop accruing storage charges.
+        Uploads started less than ``min_age`` seconds ago are left alone, as
+        they may belong to a run that is still going.
+
+        :param keep_ids: multipart upload IDs not to abort
+        :type keep_ids: set
+        :param min_age: minimum age in seconds of uploads to abort
+        :type min_age: int
+        :return: number of uploads aborted
+        :rtype: int
+        """
+        if keep_ids is None:
+            keep_ids = set()
+        cutoff = time.time() - min_age
+        count = 0
+        paginator = self._s3client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(
+            Bucket=self._bucket_name, Prefix=self._key_for_path('')
+        ):
+            for upload in page.get('Uploads', []):
+                if upload['UploadId'] in keep_ids:
+                    continue
+                started = calendar.timegm(upload['Initiated'].utctimetuple())
+                if started > cutoff:
+                    continue
+                logger.info('Aborting orphaned upload %s to %s (started %s)',
+                            upload['UploadId'], upload['Key'],
+                            upload['Initiated'])
+                if self.abort_upload(upload['Key'], upload['UploadId']):
+                    count += 1
+        return count
+
+    def put_bundle(self, members):
+        """
+        Pack several (small) files into one new bundle object, and record
+        where each is in ``self.bundles`` and ``self.bundled``. The object is
+        the files' contents concatenated, followed by a JSON index of each
+        file's path to its [size, mtime, md5sum, offset]; the offset of the
+        index is stored in the object's metadata, so that the bundle can be
+        read back when the manifest is rebuilt. Any copies of the files in
+        other bundles become dead space.
+
+        :param members: list of (file path, 3-tuple of (file size in bytes,
+          file modification time as a float timestamp, and file md5sum as a
+          hex string), file contents) 3-tuples
+        :type members: list
+        :return: the new bundle's ID
+        :rtype: str
+        """
+        bid = '%s-%s' % (dtnow().strftime('%Y%m%d%H%M%S'), uuid4().hex[:12])
+        key = self._key_for_path(self.bundle_prefix + bid)
+        if self._dry_run:
+            logger.warning('DRY RUN; would pack %d files into bundle %s',
+                           len(members), key)
+            return bid
+        buf = BytesIO()
+        index = {}
+        for path, meta, data in members:
+            index[path] = [meta[0], meta[1], meta[2], buf.tell()]
+            buf.write(data)
+        data_size = buf.tell()
+        buf.write(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+        size_b = buf.tell()
+        buf.seek(0)
+        logger.debug('Uploading bundle of %d files (%d bytes) to %s',
+                     len(members), size_b, key)
+        kwargs = {}
+        if self._upload_bucket is not None:
+            kwargs['Callback'] = self._upload_bucket.consume
+        self._s3client.upload_fileobj(
+            buf,
+            self._bucket_name,
             key,
             ExtraArgs={
                 'ACL': 'private',
@@ -202,27 +1125,206 @@ class S3Wrapper(object):
                 'SSECustomerKeyMD5': self._keymd5,
                 'Metadata': {
                     'UploadedBy': 's3sfe-%s' % VERSION,
-                    'size_b': '%s' % size_b,
-                    'mtime': '%s' % mtime,
-                    'md5sum': '%s' % md5sum
+                    'bundle_index_offset': '%s' % data_size
                 }
-            }
+            },
+            Config=self._transfer.config_for(size_b),
+            **kwargs
         )
+        with self._sent_lock:
+            self.bytes_sent += size_b
+        self.bundles[bid] = data_size
+        for path, (fsize, _, _, offset) in index.items():
+            self._forget_bundled(path)
+            self.bundled[path] = (bid, offset, fsize)
+            self.compressed.pop(path, None)
+        return bid
+
+    def read_bundle(self, bid, start=None, end=None):
+        """
+        Read all of a bundle object, or the inclusive byte range ``start`` to
+        ``end`` of it.
+
+        :param bid: bundle ID
+        :type bid: str
+        :param start: first byte to read, or None to read the whole bundle
+        :type start: int
+        :param end: last byte to read, or None to read to the end
+        :type end: int
+        :return: bundle contents
+        :rtype: bytes
+        """
+        kwargs = {}
+        if start is not None:
+            kwargs['Range'] = 'bytes=%d-%s' % (
+                start, '' if end is None else end
+            )
+        return self._s3client.get_object(
+            Bucket=self._bucket_name,
+            Key=self._key_for_path(self.bundle_prefix + bid),
+            SSECustomerAlgorithm='AES256',
+            SSECustomerKey=self._key,
+            SSECustomerKeyMD5=self._keymd5,
+            **kwargs
+        )['Body'].read()
+
+    def delete_bundles(self, bids):
+        """
+        Delete bundle objects that no longer hold any files that are still
+        needed, and forget them.
+
+        :param bids: IDs of the bundles to delete
+        :type bids: list
+        :return: the IDs of the bundles that could not be deleted
+        :rtype: list
+        """
+        keys = dict(
+            (self._key_for_path(self.bundle_prefix + bid), bid) for bid in bids
+        )
+        if self._dry_run:
+            for key in sorted(keys.keys()):
+                logger.warning('DRY RUN; would delete bundle %s', key)
+            return []
+        failed = [keys[k] for k in self._delete_batch(sorted(keys.keys()))]
+        for bid in bids:
+            if bid not in failed:
+                self.bundles.pop(bid, None)
+                if self.dead.pop(bid, None) is not None:
+                    self._dead_changed = True
+        return failed
+
+    def delete_files(self, paths, workers=1):
+        """
+        Delete the objects for the given local file paths, in DeleteObjects
+        requests of up to :py:attr:`~.delete_batch_size` keys, with up to
+        ``workers`` requests in flight at once. Files packed in bundles are
+        just forgotten and recorded as dead entries of their bundles, leaving
+        dead space in them; in a dry run they are only logged, and the bundle
+        state is left unchanged.
 
-    def get_file(self, path, local_prefix=None):
+        :param paths: local file paths to delete from S3
+        :type paths: list
+        :param workers: maximum number of concurrent DeleteObjects requests
+        :type workers: int
+        :return: the paths that could not be deleted
+        :rtype: list
+        """
+        objects = [p for p in paths if p not in self.bundled]
+        for p in paths:
+            if p not in self.bundled:
+                continue
+            if self._dry_run:
+                logger.warning('DRY RUN; would forget bundled file %s', p)
+            else:
+                self._forget_bundled(p)
+        return self.delete_objects(objects, workers=workers)
+
+    def delete_objects(self, paths, workers=1):
+        """
+        Delete the objects for the given local file paths, like
+        :py:meth:`~.delete_files`, but without regard to whether the files
+        are also packed in bundles; i.e. to remove the objects of files that
+        have since been bundled.
+
+        :param paths: local file paths to delete the objects of
+        :type paths: list
+        :param workers: maximum number of concurrent DeleteObjects requests
+        :type workers: int
+        :return: the paths that could not be deleted
+        :rtype: list
+        """
+        keys = dict((self._key_for_path(p), p) for p in paths)
+        ordered = sorted(keys.keys())
+        if self._dry_run:
+            for key in ordered:
+                logger.warning('DRY RUN; would delete %s', key)
+            return []
+        if len(ordered) == 0:
+            return []
+        n = self.delete_batch_size
+        batches = [ordered[i:i + n] for i in range(0, len(ordered), n)]
+        logger.info('Deleting %d objects in %d requests', len(ordered),
+                    len(batches))
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for res in pool.map(self._delete_batch, batches):
+                failed.extend(keys[k] for k in res)
+        return failed
+
+    def _delete_batch(self, keys):
+        """
+        Delete up to :py:attr:`~.delete_batch_size` keys with one
+        DeleteObjects request. If the request, or the deletion of some keys, is
+        throttled, those keys are retried after a backoff. Any other error is
+        logged.
+
+        :param keys: keys to delete
+        :type keys: list
+        :return: the keys that could not be deleted
+        :rtype: list
+        """
+        failed = []
+        attempt = 0
+        while len(keys) > 0:
+            try:
+                res = self._s3client.delete_objects(
+                    Bucket=self._bucket_name,
+                    Delete={
+                        'Objects': [{'Key': k} for k in keys],
+                        'Quiet': True
+                    }
+                )
+            except Exception as ex:
+                if (
+                    not is_throttle_error(ex) or
+                    attempt >= self.max_throttle_retries
+                ):
+                    logger.error('Error deleting %d objects: %s', len(keys),
+                                 ex, exc_info=True)
+                    return failed + list(keys)
+                res = {'Errors': [
+                    {'Key': k, 'Code': 'SlowDown'} for k in keys
+                ]}
+            throttled = []
+            for err in res.get('Errors', []):
+                if (
+                    err.get('Code') in THROTTLE_ERROR_CODES and
+                    attempt < self.max_throttle_retries
+                ):
+                    throttled.append(err['Key'])
+                    continue
+                logger.error('Error deleting %s: %s %s', err['Key'],
+                             err.get('Code'), err.get('Message'))
+                failed.append(err['Key'])
+            keys = throttled
+            if len(keys) > 0:
+                attempt += 1
+                logger.warning('Throttled by S3 deleting %d objects; retrying',
+                               len(keys))
+                time.sleep(backoff(attempt))
+        return failed
+
+    def get_file(self, path, local_prefix=None, size_b=None):
         """
         Download a file that was originally at ``path`` locally. If
         ``local_prefix`` is not None, the local file will be replaced with the
         downloaded one. Otherwise, the download path will be prefixed with
-        ``local_prefix``.
+        ``local_prefix``. Files packed in a bundle are read from it with a
+        ranged GET, and compressed files are decompressed as they are
+        downloaded.
 
         :param path: local file path to download from S3
         :type path: str
         :param local_prefix: prefix to download under locally
         :type local_prefix: str
+        :param size_b: size of the file in bytes, if known, to choose its
+          transfer settings
+        :type size_b: int
         """
         bkt = self._s3.Bucket(self._bucket_name)
         key = self._key_for_path(path)
+        bundled = self.bundled.get(path)
+        codec = self.compressed.get(path)
         if local_prefix is None:
             real_path = os.path.abspath(path)
         else:
@@ -237,6 +1339,15 @@ class S3Wrapper(object):
         if not os.path.exists(dldir):
             logger.debug('Creating download directory: %s', dldir)
             os.makedirs(dldir)
+        if bundled is not None:
+            self._get_bundled_file(bundled, real_path)
+            return
+        if codec is not None:
+            self._get_compressed_file(key, codec, real_path)
+            return
+        kwargs = {}
+        if self._download_bucket is not None:
+            kwargs['Callback'] = self._download_bucket.consume
         bkt.download_file(
             key,
             real_path,
@@ -244,5 +1355,60 @@ class S3Wrapper(object):
                 'SSECustomerAlgorithm': 'AES256',
                 'SSECustomerKey': self._key,
                 'SSECustomerKeyMD5': self._keymd5
-            }
+            },
+            Config=self._transfer.config_for(size_b),
+            **kwargs
         )
+
+    def _get_bundled_file(self, bundled, real_path):
+        """
+        Download a file packed in a bundle to ``real_path``.
+
+        :param bundled: 3-tuple of (bundle ID, offset of the file in the
+          bundle, file size in bytes), as stored in ``self.bundled``
+        :type bundled: tuple
+        :param real_path: local path to write the file to
+        :type real_path: str
+        """
+        bid, offset, size_b = bundled
+        logger.debug('Reading %d bytes at %d from bundle %s', size_b, offset,
+                     bid)
+        data = b''
+        if size_b > 0:
+            data = self.read_bundle(bid, start=offset, end=offset + size_b - 1)
+        if self._download_bucket is not None:
+            self._download_bucket.consume(len(data))
+        with open(real_path, 'wb') as fh:
+            fh.write(data)
+
+    def _get_compressed_file(self, key, codec, real_path):
+        """
+        Download a compressed object to ``real_path``, decompressing it a
+        chunk at a time as it is read.
+
+        :param key: S3 key to download
+        :type key: str
+        :param codec: codec the object was compressed with
+        :type codec: str
+        :param real_path: local path to write the file to
+        :type real_path: str
+        """
+        logger.debug('Downloading %s compressed with %s', key, codec)
+        body = self._s3client.get_object(
+            Bucket=self._bucket_name,
+            Key=key,
+            SSECustomerAlgorithm='AES256',
+            SSECustomerKey=self._key,
+            SSECustomerKeyMD5=self._keymd5
+        )['Body']
+        dec = decompressor(codec)
+        with open(real_path, 'wb') as fh:
+            while True:
+                data = body.read(self.download_chunk_size)
+                if len(data) == 0:
+                    break
+                if self._download_bucket is not None:
+                    self._download_bucket.consume(len(data))
+                fh.write(dec.decompress(data))
+            if hasattr(dec, 'flush'):
+                fh.write(dec.flush())
@@ -0,0 +1,125 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import heapq
+
+#: orders in which :py:class:`~s3sfe.filesyncer.FileSyncer` can start uploads;
+#: see :py:func:`~.order_files`
+UPLOAD_ORDERS = ['path', 'largest-first', 'newest-first']
+
+
+def order_files(files, order='path'):
+    """
+    Return the paths of ``files`` in the order their uploads should start.
+
+    * ``path`` - lexical path order.
+    * ``largest-first`` - largest files first (the "longest processing time"
+      rule). With several upload workers, each worker that frees up takes the
+      largest remaining file, so the huge files all start early and the small
+      ones fill in around them at the end, instead of one huge file starting
+      last and running on alone.
+    * ``newest-first`` - most recently modified files first, so the freshest
+      data reaches S3 soonest.
+
+    Ties are broken by path, so the order is deterministic.
+
+    :param files: dict of file path to 3-tuple of (file size in bytes, file
+      modification time as a float timestamp, and file md5sum as a hex string)
+    :type files: dict
+    :param order: one of :py:const:`~.UPLOAD_ORDERS`
+    :type order: str
+    :return: file paths
+    :rtype: list
+    """
+    if order == 'path':
+        return sorted(files.keys())
+    if order == 'largest-first':
+        field = 0
+    elif order == 'newest-first':
+        field = 1
+    else:
+        raise ValueError('Unknown upload order: %s' % order)
+    return [
+        p for _, p in sorted((-files[p][field], p) for p in files.keys())
+    ]
+
+
+def simulate_makespan(sizes, workers, rate):
+    """
+    Estimate the wall-clock time to upload files of the given sizes, started
+    in the given order, with ``workers`` concurrent uploads each moving
+    ``rate`` bytes per second. Each file is started by whichever worker frees
+    up first.
+
+    :param sizes: file sizes in bytes, in upload order
+    :type sizes: list
+    :param workers: number of concurrent uploads
+    :type workers: int
+    :param rate: upload throughput of each worker, in bytes per second
+    :type rate: float
+    :return: estimated seconds from the first upload starting to the last one
+      finishing
+    :rtype: float
+    """
+    free_at = [0.0] * max(1, workers)
+    for size in sizes:
+        start = heapq.heappop(free_at)
+        heapq.heappush(free_at, start + size / float(rate))
+    return max(free_at)
+
+
+def compare_orders(files, workers, rate):
+    """
+    Estimate the upload makespan of ``files`` for every order in
+    :py:const:`~.UPLOAD_ORDERS`; see :py:func:`~.simulate_makespan`.
+
+    :param files: dict of file path to 3-tuple of (file size in bytes, file
+      modification time as a float timestamp, and file md5sum as a hex string)
+    :type files: dict
+    :param workers: number of concurrent uploads
+    :type workers: int
+    :param rate: upload throughput of each worker, in bytes per second
+    :type rate: float
+    :return: dict of order name to estimated seconds
+    :rtype: dict
+    """
+    return dict(
+        (order, simulate_makespan(
+            [files[p][0] for p in order_files(files, order)], workers, rate
+        ))
+        for order in UPLOAD_ORDERS
+    )
@@ -0,0 +1,367 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import sys
+import pytest
+
+from s3sfe.applier import main, parse_args, logger
+from s3sfe.version import PROJECT_URL, VERSION
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+
+pbm = 's3sfe.applier'
+
+
+class TestMain(object):
+
+    def test_main_simple(self):
+        mock_args = Mock(
+            dry_run=False,
+            verbose=0,
+            summary=False,
+            key_file='kf',
+            upload_workers=1,
+            estimate=False,
+            rate=None,
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            compression=None,
+            PLAN_PATH='/plan'
+        )
+
+        with patch('%s.logger' % pbm, autospec=True) as mocklogger:
+            with patch.multiple(
+                pbm,
+                autospec=True,
+                set_log_info=DEFAULT,
+                set_log_debug=DEFAULT,
+                parse_args=DEFAULT,
+                FileSyncer=DEFAULT,
+                Plan=DEFAULT,
+                read_keyfile=DEFAULT
+            ) as mocks:
+                mocks['parse_args'].return_value = mock_args
+                mocks['read_keyfile'].return_value = 'mykeybinary'
+                m_plan = mocks['Plan'].read.return_value
+                m_plan.bucket_name = 'mybucket'
+                m_plan.prefix = 'pfx'
+                with patch.object(sys, 'argv', ['foo', '-f', 'kf', '/plan']):
+                    main()
+        assert mocks['set_log_info'].mock_calls == []
+        assert mocks['set_log_debug'].mock_calls == []
+        assert mocks['parse_args'].mock_calls == [
+            call(['-f', 'kf', '/plan'])
+        ]
+        assert mocks['Plan'].mock_calls == [call.read('/plan')]
+        assert mocks['read_keyfile'].mock_calls == [call('kf')]
+        assert mocks['FileSyncer'].mock_calls == [
+            call(
+                'mybucket',
+                prefix='pfx',
+                dry_run=False,
+                ssec_key='mykeybinary',
+                upload_workers=1,
+                transfer_profiles=None,
+                max_upload_rate=None,
+                upload_order='path',
+                bundle_threshold=None,
+                bundle_size=67108864,
+                bundle_compact=0.5,
+                upload_journal_path=None,
+                abort_orphaned_uploads=False,
+                copy_duplicates=False,
+                compression=None
+            ),
+            call().apply(m_plan)
+        ]
+        assert mocklogger.mock_calls == []
+
+    def test_main_resumable_uploads(self):
+        mock_args = Mock(
+            dry_run=False,
+            verbose=0,
+            summary=False,
+            key_file='kf',
+            upload_workers=1,
+            estimate=False,
+            rate=None,
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=True,
+            upload_journal=None,
+            abort_orphaned_uploads=True,
+            copy_duplicates=False,
+            compression=None,
+            PLAN_PATH='/plan'
+        )
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            set_log_info=DEFAULT,
+            set_log_debug=DEFAULT,
+            FileSyncer=DEFAULT,
+            Plan=DEFAULT,
+            read_keyfile=DEFAULT,
+            default_journal_path=DEFAULT
+        ) as mocks:
+            mocks['default_journal_path'].return_value = '/default/j'
+            main(mock_args)
+        kwargs = mocks['FileSyncer'].mock_calls[0][2]
+        assert kwargs['upload_journal_path'] == '/default/j'
+        assert kwargs['abort_orphaned_uploads'] is True
+
+    def test_main_summary(self, capsys):
+        mock_args = Mock(
+            dry_run=True,
+            verbose=2,
+            summary=True,
+            key_file='kf',
+            upload_workers=8,
+            estimate=False,
+            rate=None,
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            compression=None,
+            PLAN_PATH='/plan'
+        )
+
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            set_log_info=DEFAULT,
+            set_log_debug=DEFAULT,
+            parse_args=DEFAULT,
+            FileSyncer=DEFAULT,
+            Plan=DEFAULT,
+            read_keyfile=DEFAULT
+        ) as mocks:
+            mocks['read_keyfile'].return_value = 'mykeybinary'
+            m_plan = mocks['Plan'].read.return_value
+            m_plan.bucket_name = 'mybucket'
+            m_plan.prefix = ''
+            mocks['FileSyncer'].return_value.apply.return_value = Mock(
+                summary='foo'
+            )
+            main(mock_args)
+        assert mocks['set_log_info'].mock_calls == []
+        assert mocks['set_log_debug'].mock_calls == [call(logger)]
+        assert mocks['FileSyncer'].mock_calls == [
+            call(
+                'mybucket',
+                prefix='',
+                dry_run=True,
+                ssec_key='mykeybinary',
+                upload_workers=8,
+                transfer_profiles=None,
+                max_upload_rate=None,
+                upload_order='path',
+                bundle_threshold=None,
+                bundle_size=67108864,
+                bundle_compact=0.5,
+                upload_journal_path=None,
+                abort_orphaned_uploads=False,
+                copy_duplicates=False,
+                compression=None
+            ),
+            call().apply(m_plan)
+        ]
+        out, err = capsys.readouterr()
+        assert out == "foo\n"
+
+    def test_main_estimate(self, capsys):
+        mock_args = Mock(
+            dry_run=False,
+            verbose=1,
+            summary=False,
+            key_file=None,
+            upload_workers=1,
+            estimate=True,
+            rate=1024,
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            compression=None,
+            PLAN_PATH='/plan'
+        )
+
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            set_log_info=DEFAULT,
+            set_log_debug=DEFAULT,
+            parse_args=DEFAULT,
+            FileSyncer=DEFAULT,
+            Plan=DEFAULT,
+            read_keyfile=DEFAULT
+        ) as mocks:
+            m_plan = mocks['Plan'].read.return_value
+            m_plan.summary.return_value = 'plansummary'
+            main(mock_args)
+        assert mocks['set_log_info'].mock_calls == [call(logger)]
+        assert mocks['Plan'].mock_calls == [
+            call.read('/plan'),
+            call.read().summary(rate=1024)
+        ]
+        assert mocks['FileSyncer'].mock_calls == []
+        assert mocks['read_keyfile'].mock_calls == []
+        out, err = capsys.readouterr()
+        assert out == "plansummary\n"
+
+
+class TestParseArgs(object):
+
+    def test_parse_args_no_args(self, capsys):
+        with pytest.raises(SystemExit) as excinfo:
+            parse_args([])
+        assert excinfo.value.code == 2
+        out, err = capsys.readouterr()
+        assert (
+            'too few arguments' in err or
+            'the following arguments are required' in err
+        )
+        assert out == ''
+
+    def test_parse_args_no_key_file(self):
+        with pytest.raises(RuntimeError):
+            parse_args(['-v', '/plan'])
+
+    def test_parse_args_estimate_no_key_file(self):
+        res = parse_args(['--estimate', '--rate=10M', '/plan'])
+        assert res.estimate is True
+        assert res.rate == 10485760
+        assert res.key_file is None
+
+    def test_parse_args_basic(self):
+        res = parse_args(['-f', 'kf', '/plan'])
+        assert res.dry_run is False
+        assert res.verbose == 0
+        assert res.summary is False
+        assert res.key_file == 'kf'
+        assert res.upload_workers == 1
+        assert res.estimate is False
+        assert res.rate is None
+        assert res.transfer_profiles is None
+        assert res.upload_order == 'path'
+        assert res.bundle_threshold is None
+        assert res.bundle_size == 67108864
+        assert res.bundle_compact == 0.5
+        assert res.resumable_uploads is False
+        assert res.upload_journal is None
+        assert res.abort_orphaned_uploads is False
+        assert res.copy_duplicates is False
+        assert res.compression is None
+        assert res.PLAN_PATH == '/plan'
+
+    def test_parse_args_upload_workers_zero(self):
+        with pytest.raises(SystemExit):
+            parse_args(['-f', 'kf', '--upload-workers=0', '/plan'])
+
+    def test_parse_args_bundle_invalid(self):
+        for arg in [
+            '--bundle-size=0', '--bundle-compact-ratio=0',
+            '--bundle-compact-ratio=1.01'
+        ]:
+            with pytest.raises(SystemExit):
+                parse_args(['-f', 'kf', arg, '/plan'])
+
+    def test_parse_args_options(self):
+        res = parse_args(
+            ['-f', 'kf', '-d', '-vv', '-s', '--upload-workers=4',
+             '--upload-order', 'largest-first', '--resumable-uploads',
+             '--abort-orphaned-uploads', '--copy-duplicates',
+             '--compress', 'lzma', '/plan']
+        )
+        assert res.dry_run is True
+        assert res.verbose == 2
+        assert res.summary is True
+        assert res.upload_workers == 4
+        assert res.upload_order == 'largest-first'
+        assert res.resumable_uploads is True
+        assert res.abort_orphaned_uploads is True
+        assert res.copy_duplicates is True
+        assert res.compression == 'lzma'
+
+    def test_parse_args_version(self, capsys):
+        with pytest.raises(SystemExit) as excinfo:
+            parse_args(['-V'])
+        assert excinfo.value.code == 0
+        expected = "s3sfe v%s <%s>\n" % (
+            VERSION, PROJECT_URL
+        )
+        out, err = capsys.readouterr()
+        if (sys.version_info[0] < 3 or
+                (sys.version_info[0] == 3 and sys.version_info[1] < 4)):
+            assert out == ''
+            assert err == expected
+        else:
+            assert out == expected
+            assert err == ''
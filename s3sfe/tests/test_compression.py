@@ -0,0 +1,186 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import os
+import sys
+import zlib
+from io import BytesIO
+
+import pytest
+
+from s3sfe.compression import (
+    CompressingReader, byte_entropy, compressor, decompressor,
+    require_codec, should_compress, MIN_COMPRESS_SIZE
+)
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 's3sfe.compression'
+
+TEXT = b'the quick brown fox jumps over the lazy dog\n' * 5000
+
+
+def round_trip(codec, data, read_size=-1):
+    reader = CompressingReader(BytesIO(data), codec)
+    chunks = []
+    while True:
+        chunk = reader.read(read_size)
+        if len(chunk) == 0:
+            break
+        chunks.append(chunk)
+        if read_size < 0:
+            assert reader.read(read_size) == b''
+            break
+    compressed = b''.join(chunks)
+    assert reader.bytes_in == len(data)
+    assert reader.bytes_out == len(compressed)
+    dec = decompressor(codec)
+    res = dec.decompress(compressed)
+    if hasattr(dec, 'flush'):
+        res += dec.flush()
+    return compressed, res
+
+
+class TestRequireCodec(object):
+
+    def test_zlib(self):
+        require_codec('zlib')
+
+    def test_unknown(self):
+        with pytest.raises(ValueError) as exc:
+            require_codec('bz2')
+        assert str(exc.value) == 'Unknown compression codec: bz2'
+
+    def test_zstd_missing(self):
+        with patch.dict('sys.modules', {'zstandard': None}):
+            with pytest.raises(RuntimeError) as exc:
+                require_codec('zstd')
+        assert 'pip install zstandard' in str(exc.value)
+
+    def test_compressor_unknown(self):
+        with pytest.raises(ValueError):
+            compressor('bz2')
+
+    def test_decompressor_unknown(self):
+        with pytest.raises(ValueError):
+            decompressor('bz2')
+
+
+class TestByteEntropy(object):
+
+    def test_empty(self):
+        assert byte_entropy(b'') == 0.0
+
+    def test_single_value(self):
+        assert byte_entropy(b'\x00' * 100) == 0.0
+
+    def test_two_values(self):
+        assert byte_entropy(b'ab' * 50) == pytest.approx(1.0)
+
+    def test_uniform(self):
+        assert byte_entropy(bytes(bytearray(range(256))) * 4) == \
+            pytest.approx(8.0)
+
+    def test_text_random(self):
+        assert byte_entropy(TEXT) < 5
+        assert byte_entropy(os.urandom(65536)) > 7.9
+
+
+class TestShouldCompress(object):
+
+    def test_small(self, tmpdir):
+        p = tmpdir.join('small.txt')
+        p.write_binary(TEXT[:100])
+        assert should_compress(str(p), 100) is False
+
+    def test_text(self, tmpdir):
+        p = tmpdir.join('big.txt')
+        p.write_binary(TEXT)
+        assert should_compress(str(p), len(TEXT)) is True
+
+    def test_extension(self, tmpdir):
+        p = tmpdir.join('big.TAR.GZ')
+        p.write_binary(TEXT)
+        with patch('%s.open' % pbm, create=True) as mock_open:
+            assert should_compress(str(p), len(TEXT)) is False
+        assert mock_open.mock_calls == []
+
+    def test_random(self, tmpdir):
+        p = tmpdir.join('big.bin')
+        p.write_binary(os.urandom(MIN_COMPRESS_SIZE * 2))
+        assert should_compress(str(p), MIN_COMPRESS_SIZE * 2) is False
+
+    def test_unreadable(self, tmpdir):
+        assert should_compress(
+            str(tmpdir.join('missing')), MIN_COMPRESS_SIZE
+        ) is False
+
+
+class TestCompressingReader(object):
+
+    def test_zlib(self):
+        compressed, res = round_trip('zlib', TEXT)
+        assert res == TEXT
+        assert len(compressed) < len(TEXT) / 10
+        assert zlib.decompress(compressed) == TEXT
+
+    def test_zlib_small_reads(self):
+        with patch.object(CompressingReader, 'chunk_size', 1000):
+            compressed, res = round_trip('zlib', TEXT, read_size=7)
+        assert res == TEXT
+
+    def test_lzma(self):
+        compressed, res = round_trip('lzma', TEXT, read_size=8192)
+        assert res == TEXT
+        assert len(compressed) < len(TEXT) / 10
+
+    def test_empty(self):
+        compressed, res = round_trip('zlib', b'')
+        assert res == b''
+
+    def test_zstd(self):
+        pytest.importorskip('zstandard')
+        compressed, res = round_trip('zstd', TEXT, read_size=8192)
+        assert res == TEXT
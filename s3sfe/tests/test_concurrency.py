@@ -0,0 +1,231 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import sys
+import threading
+import time
+
+import pytest
+
+from s3sfe.concurrency import AdaptiveLimiter, backoff
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 's3sfe.concurrency'
+
+
+class Throttled(Exception):
+    pass
+
+
+def complete_window(lim, seconds, nbytes=0):
+    """
+    Complete one full window of requests, taking ``seconds`` in total.
+    """
+    with patch('%s.time.time' % pbm) as mock_time:
+        mock_time.return_value = lim._window_start + seconds
+        for _ in range(lim.limit):
+            lim.release(lim.acquire(), nbytes=nbytes)
+
+
+class TestBackoff(object):
+
+    def test_backoff(self):
+        with patch('%s.random.uniform' % pbm) as m_uniform:
+            m_uniform.return_value = 1.5
+            assert backoff(3) == 1.5
+            backoff(20)
+        assert m_uniform.mock_calls == [call(0, 0.8), call(0, 20.0)]
+
+
+class TestAdaptiveLimiter(object):
+
+    def test_init(self):
+        lim = AdaptiveLimiter('upload', 16)
+        assert lim.name == 'upload'
+        assert lim.max_limit == 16
+        assert lim.limit == 4
+        assert [x[1] for x in lim.history] == [4]
+
+    def test_init_small(self):
+        assert AdaptiveLimiter('x', 1).limit == 1
+        assert AdaptiveLimiter('x', 3).limit == 1
+        assert AdaptiveLimiter('x', 0).max_limit == 1
+        assert AdaptiveLimiter('x', 8, initial=20).limit == 8
+
+    def test_slow_start_then_additive(self):
+        lim = AdaptiveLimiter('x', 64, initial=2)
+        complete_window(lim, 1.0)
+        assert lim.limit == 4
+        complete_window(lim, 1.0)
+        assert lim.limit == 8
+        # throughput stops improving; hold, and leave slow start
+        complete_window(lim, 4.0)
+        assert lim.limit == 8
+        complete_window(lim, 0.5)
+        assert lim.limit == 9
+        assert [x[1] for x in lim.history] == [2, 4, 8, 9]
+
+    def test_probe(self):
+        lim = AdaptiveLimiter('x', 64, initial=4)
+        lim._slow_start = False
+        lim._last_rate = 10.0
+        for _ in range(AdaptiveLimiter.probe_windows - 1):
+            complete_window(lim, 1.0)
+        assert lim.limit == 4
+        complete_window(lim, 1.0)
+        assert lim.limit == 5
+
+    def test_bytes_throughput(self):
+        lim = AdaptiveLimiter('x', 64, initial=2)
+        lim._slow_start = False
+        complete_window(lim, 1.0, nbytes=100)
+        assert lim._last_rate == 200.0
+
+    def test_max_limit(self):
+        lim = AdaptiveLimiter('x', 3, initial=2)
+        complete_window(lim, 1.0)
+        assert lim.limit == 3
+        complete_window(lim, 0.1)
+        assert lim.limit == 3
+
+    def test_throttle_once_per_epoch(self):
+        lim = AdaptiveLimiter('x', 16, initial=16)
+        tokens = [lim.acquire() for _ in range(4)]
+        with patch('%s.logger' % pbm) as mock_logger:
+            lim.release(tokens[0], throttled=True)
+            lim.release(tokens[1], throttled=True)
+            assert lim.limit == 8
+            # a request started after the cut can cut again
+            lim.release(lim.acquire(), throttled=True)
+        assert lim.limit == 4
+        assert mock_logger.warning.mock_calls == [
+            call('Throttled by S3; reducing %s concurrency to %d', 'x', 8),
+            call('Throttled by S3; reducing %s concurrency to %d', 'x', 4)
+        ]
+        assert lim._slow_start is False
+
+    def test_throttle_minimum(self):
+        lim = AdaptiveLimiter('x', 16, initial=1)
+        lim.release(lim.acquire(), throttled=True)
+        assert lim.limit == 1
+
+    def test_run(self):
+        lim = AdaptiveLimiter('x', 4)
+        func = Mock(return_value='res')
+        assert lim.run(func, ('a', 'b'), nbytes=10) == 'res'
+        assert func.mock_calls == [call('a', 'b')]
+        assert lim._in_flight == 0
+
+    def test_run_retry(self):
+        lim = AdaptiveLimiter(
+            'x', 8, initial=8,
+            retryable=lambda ex: isinstance(ex, Throttled)
+        )
+        func = Mock(side_effect=[Throttled(), Throttled(), 'res'])
+        with patch('%s.time.sleep' % pbm) as mock_sleep:
+            with patch('%s.backoff' % pbm) as mock_backoff:
+                mock_backoff.side_effect = [0.1, 0.2]
+                with patch('%s.logger' % pbm):
+                    assert lim.run(func) == 'res'
+        assert len(func.mock_calls) == 3
+        assert mock_backoff.mock_calls == [call(1), call(2)]
+        assert mock_sleep.mock_calls == [call(0.1), call(0.2)]
+        assert lim.limit == 2
+        assert lim._in_flight == 0
+
+    def test_run_too_many_retries(self):
+        lim = AdaptiveLimiter(
+            'x', 8, retryable=lambda ex: True, max_retries=2
+        )
+        func = Mock(side_effect=Throttled())
+        with patch('%s.time.sleep' % pbm):
+            with patch('%s.logger' % pbm):
+                with pytest.raises(Throttled):
+                    lim.run(func)
+        assert len(func.mock_calls) == 3
+        assert lim._in_flight == 0
+
+    def test_run_not_retryable(self):
+        lim = AdaptiveLimiter(
+            'x', 8, retryable=lambda ex: isinstance(ex, Throttled)
+        )
+        func = Mock(side_effect=RuntimeError('foo'))
+        with pytest.raises(RuntimeError):
+            lim.run(func)
+        assert len(func.mock_calls) == 1
+        assert lim._in_flight == 0
+
+    def test_run_no_retryable(self):
+        lim = AdaptiveLimiter('x', 8)
+        func = Mock(side_effect=Throttled())
+        with pytest.raises(Throttled):
+            lim.run(func)
+        assert len(func.mock_calls) == 1
+
+    def test_concurrent_limit(self):
+        lim = AdaptiveLimiter('x', 4, initial=2)
+        lim.improvement = 1000.0
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def work():
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.001)
+            with lock:
+                state['running'] -= 1
+
+        threads = [
+            threading.Thread(target=lambda: [lim.run(work) for _ in range(5)])
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert state['max'] <= max(x[1] for x in lim.history)
+        assert lim._in_flight == 0
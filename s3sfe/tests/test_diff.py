@@ -0,0 +1,341 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+from s3sfe.diff import (
+    ExternalSorter, sorted_items, merge_diff, UPLOAD, UNCHANGED, REMOTE_ONLY,
+    TableColumns, numpy_diff, require_numpy, same_size_mtime
+)
+from s3sfe.metatable import FileMetaTable
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+
+pbm = 's3sfe.diff'
+
+
+class CollidingPath(str):
+    """path that hashes the same as every other CollidingPath"""
+
+    def __hash__(self):
+        return 42
+
+
+class TestExternalSorter(object):
+
+    def test_in_memory(self):
+        s = ExternalSorter(max_items=10)
+        s.extend([('c', 1), ('a', 2), ('b', 3)])
+        assert len(s) == 3
+        assert s.spilled == 0
+        assert list(s) == [('a', 2), ('b', 3), ('c', 1)]
+
+    def test_spill(self, tmpdir):
+        keys = ['/foo/%d' % i for i in range(1000)]
+        random.Random(4).shuffle(keys)
+        s = ExternalSorter(max_items=64, tmpdir=str(tmpdir))
+        for k in keys:
+            s.add(k, (len(k), 1.5, 'md5' + k))
+        assert len(s) == 1000
+        assert s.spilled == 15
+        assert len(os.listdir(str(tmpdir))) == 0
+        assert list(s) == [
+            (k, (len(k), 1.5, 'md5' + k)) for k in sorted(keys)
+        ]
+        s.close()
+        assert s.spilled == 0
+
+    def test_sorted_items_dict(self):
+        s = sorted_items({'b': 1, 'a': 2, 'c': 3}, max_items=2)
+        assert s.spilled == 1
+        assert list(s) == [('a', 2), ('b', 1), ('c', 3)]
+
+    def test_sorted_items_iterable(self):
+        s = sorted_items(iter([('b', 1), ('a', 2)]))
+        assert list(s) == [('a', 2), ('b', 1)]
+
+
+class TestSameSizeMtime(object):
+
+    def test_same(self):
+        assert same_size_mtime(1, 2.5, (1, 2.5, 'a')) is True
+        assert same_size_mtime(1, 2.5, (1, 2.505, 'a')) is True
+
+    def test_different(self):
+        assert same_size_mtime(1, 2.5, None) is False
+        assert same_size_mtime(1, 2.5, (2, 2.5, 'a')) is False
+        assert same_size_mtime(1, 2.5, (1, 2.6, 'a')) is False
+        assert same_size_mtime(1, 2.5, (1, 2.5, None)) is False
+
+
+class TestMergeDiff(object):
+
+    def test_empty(self):
+        assert list(merge_diff([], [])) == []
+
+    def test_diff(self):
+        local = [
+            ('/a', (1, 1.0, 'aaaa')),
+            ('/b', (2, 2.0, 'bbbb')),
+            ('/d', (4, 4.0, 'dddd')),
+            ('/f', (6, 6.0, None))
+        ]
+        remote = [
+            ('/b', (2, 2.5, 'bbbb')),
+            ('/c', (3, 3.0, 'cccc')),
+            ('/d', (4, 4.0, 'DDDD')),
+            ('/e', (5, 5.0, 'eeee'))
+        ]
+        assert list(merge_diff(local, remote)) == [
+            (UPLOAD, '/a', (1, 1.0, 'aaaa'), None),
+            (UNCHANGED, '/b', (2, 2.0, 'bbbb'), (2, 2.5, 'bbbb')),
+            (REMOTE_ONLY, '/c', None, (3, 3.0, 'cccc')),
+            (UPLOAD, '/d', (4, 4.0, 'dddd'), (4, 4.0, 'DDDD')),
+            (REMOTE_ONLY, '/e', None, (5, 5.0, 'eeee')),
+            (UPLOAD, '/f', (6, 6.0, None), None)
+        ]
+
+    def test_size_mtime(self):
+        local = [
+            ('/a', (1, 1.0, 'aaaa')),
+            ('/b', (2, 2.0, 'bbbb')),
+            ('/c', (3, 3.0, 'cccc'))
+        ]
+        remote = [
+            ('/a', (1, 1.0, 'aaaa')),
+            ('/b', (2, 2.5, 'bbbb')),
+            ('/c', (4, 3.0, 'cccc'))
+        ]
+        assert [
+            x[0] for x in merge_diff(local, remote, size_mtime=True)
+        ] == [UNCHANGED, UPLOAD, UPLOAD]
+
+    def test_one_side_empty(self):
+        files = [('/a', (1, 1.0, 'aaaa')), ('/b', (2, 2.0, 'bbbb'))]
+        assert [x[0] for x in merge_diff(files, [])] == [UPLOAD, UPLOAD]
+        assert [x[0] for x in merge_diff([], files)] == [
+            REMOTE_ONLY, REMOTE_ONLY
+        ]
+
+    def test_matches_dict_comparison(self):
+        rand = random.Random(7)
+        local = dict(
+            ('/f/%d' % i, (i, 1.0, 'md5%d' % rand.randint(0, 3)))
+            for i in rand.sample(range(2000), 1200)
+        )
+        remote = dict(
+            ('/f/%d' % i, (i, 1.0, 'md5%d' % rand.randint(0, 3)))
+            for i in rand.sample(range(2000), 1200)
+        )
+        res = list(merge_diff(
+            sorted_items(local, max_items=100),
+            sorted_items(remote, max_items=100)
+        ))
+        assert [r[1] for r in res] == sorted(set(local) | set(remote))
+        assert dict(
+            (r[1], r[2]) for r in res if r[0] == UPLOAD
+        ) == dict(
+            (k, v) for k, v in local.items()
+            if k not in remote or remote[k][2] != v[2]
+        )
+        assert set(r[1] for r in res if r[0] == REMOTE_ONLY) == (
+            set(remote) - set(local)
+        )
+
+
+class TestRequireNumpy(object):
+
+    def test_missing(self):
+        with patch.dict('sys.modules', {'numpy': None}):
+            with pytest.raises(RuntimeError) as excinfo:
+                require_numpy()
+        assert 'requires numpy' in str(excinfo.value)
+
+
+class TestNumpyDiff(object):
+
+    def setup(self):
+        pytest.importorskip('numpy')
+
+    def test_columns(self):
+        np = pytest.importorskip('numpy')
+        table = FileMetaTable([
+            ('/x/a', (1, 1.5, 'd41d8cd98f00b204e9800998ecf8427e')),
+            ('/x/bb', (2, 2.5, 'ABCD'))
+        ])
+        cols = TableColumns(np, table)
+        assert cols.hashes.tolist() == [hash('/x/a'), hash('/x/bb')]
+        assert cols.dirs.tolist() == [0, 0]
+        assert cols.starts.tolist() == [0, 1]
+        assert cols.lengths.tolist() == [1, 2]
+        assert cols.sizes.tolist() == [1, 2]
+        assert cols.mtimes.tolist() == [1.5, 2.5]
+        assert cols.odd.tolist() == [False, True]
+        assert cols.md5sum(0) == 'd41d8cd98f00b204e9800998ecf8427e'
+        assert cols.md5sum(1) == 'ABCD'
+        assert cols.paths(np.array([1, 0])) == ['/x/bb', '/x/a']
+        assert cols.values(np.array([1, 0])) == [
+            (2, 2.5, 'ABCD'), (1, 1.5, 'd41d8cd98f00b204e9800998ecf8427e')
+        ]
+        # the columns are views of the table, not copies
+        assert np.shares_memory(
+            cols.digests, np.frombuffer(table.columns()['md5'], np.uint8)
+        )
+
+    def test_columns_empty(self):
+        np = pytest.importorskip('numpy')
+        cols = TableColumns(np, FileMetaTable())
+        assert len(cols.hashes) == 0
+        assert cols.digests.shape == (0, 2)
+
+    def test_tables(self):
+        local = FileMetaTable([
+            ('/d1/a', (1, 1.0, '0' * 32)),
+            ('/d1/bb', (2, 2.0, '1' * 32)),
+            ('/d2/a', (3, 3.0, '2' * 32)),
+            ('/d2/gone', (3, 3.0, '2' * 32)),
+            ('/d3/c', (4, 4.0, '3' * 32))
+        ])
+        del local['/d2/gone']
+        remote = FileMetaTable([
+            ('/d1/a', (1, 1.0, '0' * 32)),
+            ('/d1/bb', (2, 2.0, '9' * 32)),
+            ('/d2/gone', (3, 3.0, '2' * 32)),
+            ('/d2/a', (3, 3.0, '2' * 32)),
+            ('/d4/a', (5, 5.0, '5' * 32))
+        ])
+        del remote['/d2/a']
+        # the removed row stays in the index ahead of the new one
+        del remote['/d1/a']
+        remote['/d1/a'] = (1, 1.0, '0' * 32)
+        upload, only = numpy_diff(local, remote, remote_only=True)
+        assert sorted(upload) == ['/d1/bb', '/d2/a', '/d3/c']
+        assert sorted(only) == ['/d2/gone', '/d4/a']
+
+    def test_diff(self):
+        local = {
+            '/a': (1, 1.0, '0' * 32),
+            '/b': (2, 2.0, '1' * 32),
+            '/d': (4, 4.0, '2' * 32),
+            '/f': (6, 6.0, None),
+            '/g': (7, 7.0, 'GGGG'),
+            '/h': (8, 8.0, 'a' * 32)
+        }
+        remote = {
+            '/b': (2, 2.5, '1' * 32),
+            '/c': (3, 3.0, '3' * 32),
+            '/d': (4, 4.0, '4' * 32),
+            '/g': (7, 7.0, 'GGGG'),
+            '/h': (8, 8.0, 'A' * 32)
+        }
+        assert sorted(numpy_diff(local, remote)) == ['/a', '/d', '/f', '/h']
+        assert numpy_diff(local, remote, values=True) == {
+            '/a': (1, 1.0, '0' * 32),
+            '/d': (4, 4.0, '2' * 32),
+            '/f': (6, 6.0, None),
+            '/h': (8, 8.0, 'a' * 32)
+        }
+        upload, only = numpy_diff(local, remote, remote_only=True)
+        assert sorted(upload) == ['/a', '/d', '/f', '/h']
+        assert only == ['/c']
+
+    def test_size_mtime(self):
+        local = {
+            '/a': (1, 1.0, '0' * 32),
+            '/b': (2, 2.0, '1' * 32),
+            '/c': (3, 3.0, '2' * 32),
+            '/d': (4, 4.0, None)
+        }
+        remote = {
+            '/a': (1, 1.005, '0' * 32),
+            '/b': (2, 2.5, '1' * 32),
+            '/c': (4, 3.0, '2' * 32),
+            '/d': (4, 4.0, None)
+        }
+        assert numpy_diff(local, remote) == []
+        assert sorted(numpy_diff(local, remote, size_mtime=True)) == [
+            '/b', '/c', '/d'
+        ]
+
+    def test_empty(self):
+        assert numpy_diff({}, {'/a': (1, 1.0, 'a')}) == []
+        assert numpy_diff({'/a': (1, 1.0, 'a')}, {}) == ['/a']
+        assert numpy_diff(
+            {}, {'/a': (1, 1.0, 'a')}, remote_only=True
+        ) == ([], ['/a'])
+
+    def test_hash_collisions(self):
+        paths = [CollidingPath('/f/%d' % i) for i in range(6)]
+        local = dict((p, (1, 1.0, '%032d' % i)) for i, p in enumerate(paths))
+        remote = dict(
+            (p, (1, 1.0, '%032d' % (i % 3))) for i, p in enumerate(paths)
+            if i != 4
+        )
+        assert sorted(numpy_diff(local, remote)) == [
+            '/f/3', '/f/4', '/f/5'
+        ]
+        remote[CollidingPath('/f/9')] = (1, 1.0, 'x')
+        assert numpy_diff(local, remote, remote_only=True)[1] == ['/f/9']
+
+    def test_matches_dict_comparison(self):
+        rand = random.Random(9)
+        local = dict(
+            ('/f/%d' % i, (i, 1.0, '%032x' % rand.randint(0, 3)))
+            for i in rand.sample(range(5000), 3000)
+        )
+        remote = dict(
+            ('/f/%d' % i, (i, 1.0, '%032x' % rand.randint(0, 3)))
+            for i in rand.sample(range(5000), 3000)
+        )
+        upload, only = numpy_diff(local, remote, remote_only=True)
+        assert sorted(upload) == sorted(
+            k for k, v in local.items()
+            if k not in remote or remote[k][2] != v[2]
+        )
+        assert sorted(only) == sorted(set(remote) - set(local))
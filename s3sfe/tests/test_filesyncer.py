@@ -34,9 +34,24 @@ AUTHORS:
 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 ################################################################################
 """
+import os
+import stat
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from hashlib import md5
+
+import pytest
+from botocore.exceptions import ClientError
 
 from s3sfe.filesyncer import FileSyncer
+from s3sfe.hashcache import HashCache
+from s3sfe.metatable import FileMetaTable
+from s3sfe.pathfilter import PathMatcher
+from s3sfe.plan import Plan
+from s3sfe.utils import md5_file
+from s3sfe.walker import scandir
 
 # https://code.google.com/p/mock/issues/detail?id=249
 # py>=3.4 should use unittest.mock not the mock package on pypi
@@ -44,14 +59,24 @@ if (
         sys.version_info[0] < 3 or
         sys.version_info[0] == 3 and sys.version_info[1] < 4
 ):
-    from mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+    from mock import patch, call, Mock, DEFAULT, mock_open, ANY  # noqa
 else:
-    from unittest.mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+    from unittest.mock import patch, call, Mock, DEFAULT, mock_open, ANY  # noqa
 
 pbm = 's3sfe.filesyncer'
 pb = '%s.FileSyncer' % pbm
 
 
+def throttle_error():
+    return ClientError(
+        {
+            'Error': {'Code': 'SlowDown'},
+            'ResponseMetadata': {'HTTPStatusCode': 503}
+        },
+        'PutObject'
+    )
+
+
 class TestInit(object):
 
     def test_init_default(self):
@@ -61,9 +86,18 @@ class TestInit(object):
             cls = FileSyncer('bname')
         assert cls.s3 == m_s3
         assert mock_s3.mock_calls == [
-            call('bname', prefix='', dry_run=False, ssec_key=None)
+            call('bname', prefix='', dry_run=False, ssec_key=None,
+                 head_workers=1, transfer_profiles=ANY,
+                 max_connections=8, head_limiter=cls._head_limiter,
+                 upload_rate=None, download_rate=None, journal=None,
+                 compression=None)
         ]
         assert cls._dry_run is False
+        assert cls._hash_cache is None
+        assert cls._hash_workers == 1
+        assert cls._hash_processes is False
+        assert cls._upload_workers == 1
+        assert cls._rebuild_manifest is False
 
     def test_init_prefix_no_slash(self):
         m_s3 = Mock()
@@ -72,20 +106,113 @@ class TestInit(object):
             cls = FileSyncer('bname', prefix='foo', ssec_key='foo')
         assert cls.s3 == m_s3
         assert mock_s3.mock_calls == [
-            call('bname', prefix='foo', dry_run=False, ssec_key='foo')
+            call('bname', prefix='foo', dry_run=False, ssec_key='foo',
+                 head_workers=1, transfer_profiles=ANY, max_connections=8,
+                 head_limiter=cls._head_limiter, upload_rate=None,
+                 download_rate=None, journal=None,
+                 compression=None)
         ]
 
     def test_init_args(self):
         m_s3 = Mock()
         with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
             mock_s3.return_value = m_s3
-            cls = FileSyncer('bname', prefix='/foo', dry_run=True)
+            cls = FileSyncer(
+                'bname', prefix='/foo', dry_run=True, head_workers=8
+            )
         assert cls.s3 == m_s3
         assert mock_s3.mock_calls == [
-            call('bname', prefix='/foo', dry_run=True, ssec_key=None)
+            call('bname', prefix='/foo', dry_run=True, ssec_key=None,
+                 head_workers=8, transfer_profiles=ANY,
+                 max_connections=8, head_limiter=cls._head_limiter,
+                 upload_rate=None, download_rate=None, journal=None,
+                 compression=None)
         ]
         assert cls._dry_run is True
 
+    def test_init_transfer_profiles(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            FileSyncer(
+                'bname', upload_workers=4,
+                transfer_profiles=[('huge', {'concurrency': 16})]
+            )
+        kwargs = mock_s3.mock_calls[0][2]
+        assert kwargs['max_connections'] == 64
+        assert kwargs['transfer_profiles'].max_concurrency == 16
+
+    def test_init_hash_cache(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with patch('%s.HashCache' % pbm, autospec=True) as mock_hc:
+                cls = FileSyncer('bname', hash_cache_path='/h/c', rehash=True)
+        assert mock_hc.mock_calls == [call('/h/c', rehash=True)]
+        assert cls._hash_cache == mock_hc.return_value
+
+    def test_init_upload_journal(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            with patch('%s.UploadJournal' % pbm, autospec=True) as mock_uj:
+                cls = FileSyncer(
+                    'bname', upload_journal_path='/u/j',
+                    abort_orphaned_uploads=True
+                )
+        assert mock_uj.mock_calls == [call('/u/j')]
+        assert cls._journal == mock_uj.return_value
+        assert mock_s3.mock_calls[0][2]['journal'] == mock_uj.return_value
+        assert cls._abort_orphaned is True
+
+    def test_init_compression(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            with patch('%s.require_codec' % pbm, autospec=True) as mock_req:
+                cls = FileSyncer('bname', compression='lzma')
+        assert mock_req.mock_calls == [call('lzma')]
+        assert mock_s3.mock_calls[0][2]['compression'] == 'lzma'
+        assert cls._compression == 'lzma'
+
+    def test_init_compression_invalid(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with pytest.raises(ValueError) as excinfo:
+                FileSyncer('bname', compression='bz2')
+        assert 'Unknown compression codec: bz2' in str(excinfo.value)
+
+    def test_bytes_sent(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            cls = FileSyncer('bname')
+        mock_s3.return_value.bytes_sent = 123
+        assert cls._bytes_sent() is None
+        cls._compression = 'zlib'
+        assert cls._bytes_sent() == 123
+
+    def test_init_diff_engine_invalid(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with pytest.raises(ValueError) as excinfo:
+                FileSyncer('bname', diff_engine='foo')
+        assert 'Unknown diff engine: foo' in str(excinfo.value)
+
+    def test_init_compare_invalid(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with pytest.raises(ValueError) as excinfo:
+                FileSyncer('bname', compare='foo')
+        assert 'Unknown compare mode: foo' in str(excinfo.value)
+
+    def test_init_upload_order_invalid(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with pytest.raises(ValueError) as excinfo:
+                FileSyncer('bname', upload_order='foo')
+        assert 'Unknown upload order: foo' in str(excinfo.value)
+
+    def test_init_diff_engine_numpy(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with patch('%s.require_numpy' % pbm, autospec=True) as mock_req:
+                mock_req.side_effect = RuntimeError('requires numpy')
+                with pytest.raises(RuntimeError):
+                    FileSyncer('bname', diff_engine='numpy')
+        assert mock_req.mock_calls == [call()]
+
+    def test_init_diff_engine_numpy_compact(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            with patch('%s.require_numpy' % pbm, autospec=True):
+                cls = FileSyncer('bname', diff_engine='numpy')
+        assert cls._compact_metadata is True
+
 
 class TestListAllFiles(object):
 
@@ -102,71 +229,97 @@ class TestListAllFiles(object):
             '/foo/notfile',
             '/foo/bar/one'
         ]
+        st_file = Mock(st_mode=stat.S_IFREG | 0o644)
+        st_dir = Mock(st_mode=stat.S_IFDIR | 0o755)
+        st_fifo = Mock(st_mode=stat.S_IFIFO | 0o644)
+        stats = {
+            '/foo/bar': st_dir,
+            '/foo/baz.txt': st_file,
+            '/foo/notfile': st_fifo,
+            '/foo/bar/one': st_file
+        }
 
-        def se_listdir(_, p):
-            return ['/foo/bar/one', '/foo/bar/two', '/foo/bar/three/four']
-
-        def se_exists(p):
-            if p in [
-                '/foo/bar', '/foo/baz.txt', '/foo/notfile', '/foo/bar/one'
-            ]:
-                return True
-            return False
+        def se_walk(p, exclude=None, onerror=None):
+            return iter([
+                ('/foo/bar/one', 1),
+                ('/foo/bar/two', 2),
+                ('/foo/bar/three/four', 3)
+            ])
 
-        def se_isfile(p):
-            if p == '/foo/baz.txt' or p == '/foo/bar/one':
-                return True
-            return False
+        err = OSError('no such file')
 
-        def se_isdir(p):
-            if p == '/foo/bar':
-                return True
-            return False
+        def se_stat(p):
+            if p not in stats:
+                raise err
+            return stats[p]
 
         with patch('%s.logger' % pbm) as mock_logger:
-            with patch('%s._listdir' % pb, autospec=True) as mock_listdir:
-                mock_listdir.side_effect = se_listdir
-                with patch.multiple(
-                    '%s.os.path' % pbm,
-                    autospec=True,
-                    exists=DEFAULT,
-                    isfile=DEFAULT,
-                    isdir=DEFAULT
-                ) as mock_os:
-                    mock_os['exists'].side_effect = se_exists
-                    mock_os['isfile'].side_effect = se_isfile
-                    mock_os['isdir'].side_effect = se_isdir
+            with patch('%s.walk_files' % pbm, autospec=True) as mock_walk:
+                mock_walk.side_effect = se_walk
+                with patch('%s.os.stat' % pbm, autospec=True) as mock_stat:
+                    mock_stat.side_effect = se_stat
                     res = self.cls._list_all_files(paths)
-        assert sorted(res) == sorted([
-            '/foo/bar/one',
-            '/foo/bar/two',
-            '/foo/bar/three/four',
-            '/foo/baz.txt'
-        ])
-        assert mock_os['exists'].mock_calls == [
-            call(x) for x in paths
-        ]
-        assert mock_os['isfile'].mock_calls == [
-            call('/foo/bar'),
-            call('/foo/baz.txt'),
-            call('/foo/notfile'),
-            call('/foo/bar/one')
-        ]
-        assert mock_os['isdir'].mock_calls == [
-            call('/foo/bar'),
-            call('/foo/notfile')
-        ]
-        assert mock_listdir.mock_calls == [
-            call(self.cls, '/foo/bar')
+        assert res == {
+            '/foo/bar/one': 1,
+            '/foo/bar/two': 2,
+            '/foo/bar/three/four': 3,
+            '/foo/baz.txt': st_file
+        }
+        # /foo/bar/one is beneath /foo/bar, so isn't listed separately
+        assert mock_stat.mock_calls == [call(x) for x in paths[:4]]
+        assert mock_walk.mock_calls == [
+            call('/foo/bar', exclude=None, onerror=ANY)
         ]
         assert mock_logger.mock_calls == [
-            call.info('Listing files under %d paths', 5),
-            call.warning('Skipping non-existent path: %s', '/bar'),
+            call.info('Listing files under %d paths', 4),
+            call.warning('Skipping path that could not be read: %s (%s)',
+                         '/bar', err),
             call.debug('Found %d files under %s', 3, '/foo/bar'),
             call.warning('Skipping unknown path type: %s', '/foo/notfile'),
             call.debug('Done finding candidate files.')
         ]
 
+    def test_exclude(self):
+        paths = ['/foo', '/bar/baz', '/bar/blam', '/x/.cache', '/x/b-dir']
+        st_file = Mock(st_mode=stat.S_IFREG | 0o644)
+        st_dir = Mock(st_mode=stat.S_IFDIR | 0o755)
+        stats = {'/foo': st_dir, '/bar/blam': st_file, '/x/b-dir': st_dir}
+
+        with patch('%s.walk_files' % pbm, autospec=True) as mock_walk:
+            mock_walk.return_value = iter([('/foo/a', 1)])
+            with patch('%s.os.stat' % pbm, autospec=True) as mock_stat:
+                mock_stat.side_effect = lambda p: stats[p]
+                res = self.cls._list_all_files(paths, exclude_paths=[
+                    '/foo/x/', '/bar/b', '**/.cache', '/x/*-dir/'
+                ])
+        assert res == {'/foo/a': 1}
+        assert mock_stat.mock_calls == [call('/foo'), call('/x/b-dir')]
+        assert len(mock_walk.mock_calls) == 1
+        exclude = mock_walk.mock_calls[0][2]['exclude']
+        assert isinstance(exclude, PathMatcher)
+        assert exclude.match('/foo/x/y') == '/foo/x/'
+
+    def test_list_errors(self, tmpdir):
+        tree = tmpdir.join('tree')
+        tree.join('ok', 'a').write('a', ensure=True)
+        tree.join('locked', 'b').write('b', ensure=True)
+
+        def se_scandir(p):
+            if p == str(tree.join('locked')):
+                raise OSError('permission denied')
+            return scandir(p)
+
+        self.cls._list_errors = ['/stale']
+        with patch('s3sfe.walker.scandir') as mock_scandir:
+            mock_scandir.side_effect = se_scandir
+            res = self.cls._list_all_files(
+                [str(tree), str(tmpdir.join('missing'))]
+            )
+        assert sorted(res.keys()) == [str(tree.join('ok', 'a'))]
+        assert sorted(self.cls._list_errors) == sorted([
+            str(tree.join('locked')), str(tmpdir.join('missing'))
+        ])
+
 
 class TestFileMeta(object):
 
@@ -176,88 +329,164 @@ class TestFileMeta(object):
             self.mock_s3 = mock_s3
 
     def test_simple(self):
+        stats = {
+            'a': Mock(st_size=6789, st_mtime=123456789.0123),
+            'b': Mock(st_size=1234, st_mtime=987654321.5432)
+        }
         with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
             mock_md5.side_effect = [
                 'abcd1234a',
                 'abcd1234b'
             ]
-            with patch('%s.os.path.getsize' % pbm, autospec=True) as mock_sz:
-                with patch('%s.os.path.getmtime' % pbm,
-                           autospec=True) as mock_mtime:
-                        mock_sz.side_effect = [6789, 1234]
-                        mock_mtime.side_effect = [
-                            123456789.0123,
-                            987654321.5432
-                        ]
-                        res = self.cls._file_meta(['a', 'b'])
+            with patch('%s.os.stat' % pbm, autospec=True) as mock_stat:
+                res = self.cls._file_meta(stats)
         assert res == {
             'a': (6789, 123456789.0123, 'abcd1234a'),
             'b': (1234, 987654321.5432, 'abcd1234b')
         }
-        assert mock_md5.mock_calls == [call('a'), call('b')]
-        assert mock_sz.mock_calls == [call('a'), call('b')]
-        assert mock_mtime.mock_calls == [call('a'), call('b')]
-
-
-class TestFilterFilelist(object):
-
-    def setup(self):
-        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
-            self.cls = FileSyncer('bname')
-            self.mock_s3 = mock_s3
-
-    def test_simple(self):
-        local_files = [
-            '/foo/one',
-            '/foo/two',
-            '/foo/three',
-            '/foo/bar/one',
-            '/foo/bar/three',
-            '/foo/barzzz',
-        ]
-        exclude_paths = ['/foo/bar/']
-        expected = [
-            '/foo/one',
-            '/foo/two',
-            '/foo/three',
-            '/foo/barzzz'
+        assert sorted(mock_md5.mock_calls) == [
+            call('a', bufsize=None, use_mmap=False),
+            call('b', bufsize=None, use_mmap=False)
+        ]
+        assert mock_stat.mock_calls == []
+
+    def test_s3_files(self):
+        stats = {
+            'a': Mock(st_size=6789, st_mtime=123456789.0123),
+            'b': Mock(st_size=1234, st_mtime=987654321.5432),
+            'c': Mock(st_size=1, st_mtime=1.0),
+            'd': Mock(st_size=2, st_mtime=2.0)
+        }
+        s3_files = {
+            'a': (6789, 123456789.0123, 's3md5a'),
+            'b': (1234, 987654300.0, 's3md5b'),
+            'd': (2, 2.0, None)
+        }
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.side_effect = lambda p, **kw: 'md5' + p
+            res = self.cls._file_meta(stats, s3_files=s3_files)
+        assert res == {
+            'a': (6789, 123456789.0123, 's3md5a'),
+            'b': (1234, 987654321.5432, 'md5b'),
+            'c': (1, 1.0, 'md5c'),
+            'd': (2, 2.0, 'md5d')
+        }
+        assert sorted(mock_md5.mock_calls) == [
+            call('b', bufsize=None, use_mmap=False),
+            call('c', bufsize=None, use_mmap=False),
+            call('d', bufsize=None, use_mmap=False)
         ]
-        res = self.cls._filter_filelist(local_files, exclude_paths)
-        assert res == expected
 
+    def test_compact(self):
+        stats = {
+            'a': Mock(st_size=6789, st_mtime=123456789.0123),
+        }
+        self.cls._compact_metadata = True
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.return_value = 'abcd1234a'
+            res = self.cls._file_meta(stats)
+        assert isinstance(res, FileMetaTable)
+        assert res == {'a': (6789, 123456789.0123, 'abcd1234a')}
+
+    def test_hash_cache(self):
+        stats = {
+            'a': Mock(st_size=6789, st_mtime=123456789.0123),
+            'b': Mock(st_size=1234, st_mtime=987654321.5432)
+        }
 
-class TestListdir(object):
+        def se_get(p, st):
+            if p == 'a':
+                return 'cached_a'
+            return None
 
-    def setup(self):
-        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
-            self.cls = FileSyncer('bname')
-            self.mock_s3 = mock_s3
+        m_hc = Mock(hits=1, misses=1)
+        m_hc.get.side_effect = se_get
+        self.cls._hash_cache = m_hc
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.return_value = 'abcd1234b'
+            res = self.cls._file_meta(stats)
+        assert res == {
+            'a': (6789, 123456789.0123, 'cached_a'),
+            'b': (1234, 987654321.5432, 'abcd1234b')
+        }
+        assert mock_md5.mock_calls == [call('b', bufsize=None, use_mmap=False)]
+        assert sorted(m_hc.get.mock_calls) == [
+            call('a', stats['a']),
+            call('b', stats['b'])
+        ]
+        assert m_hc.mock_calls[2:] == [
+            call.set('b', stats['b'], 'abcd1234b'),
+            call.commit()
+        ]
 
-    def test_simple(self):
+    def test_errors(self):
+        stats = {
+            'a': Mock(st_size=6789, st_mtime=123456789.0123),
+            'c': Mock(st_size=1234, st_mtime=987654321.5432)
+        }
 
-        def se_isfile(p):
-            if p == '/foo/foo2':
-                return False
-            return True
+        def se_md5(p, bufsize=None, use_mmap=False):
+            if p == 'c':
+                raise IOError('vanished')
+            return 'abcd1234a'
 
-        result = [
-            ('/foo', ['bar'], ['foo1', 'foo2']),
-            ('/foo/bar', ['baz', 'blam'], ['foobar1']),
-            ('/foo/bar/baz', [], ['foobarbaz1', 'foobarbaz2'])
-        ]
-        expected = [
-            '/foo/foo1',
-            '/foo/bar/foobar1',
-            '/foo/bar/baz/foobarbaz1',
-            '/foo/bar/baz/foobarbaz2'
-        ]
-        with patch('%s.os.walk' % pbm, autospec=True) as mock_walk:
-            with patch('%s.os.path.isfile' % pbm, autospec=True) as mock_if:
-                mock_walk.return_value = iter(result)
-                mock_if.side_effect = se_isfile
-                res = self.cls._listdir('/foo')
-        assert sorted(res) == sorted(expected)
-        assert mock_walk.mock_calls == [call('/foo')]
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.side_effect = se_md5
+            res = self.cls._file_meta(stats)
+        assert res == {
+            'a': (6789, 123456789.0123, 'abcd1234a')
+        }
+        assert self.cls._meta_errors == ['c']
+
+    def test_threads(self, tmpdir):
+        files = {}
+        for i in range(20):
+            p = tmpdir.join('f%d' % i)
+            p.write('foo%d' % i)
+            files[str(p)] = os.stat(str(p))
+        self.cls._hash_workers = 3
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.side_effect = lambda p, **kw: 'md5-%s' % p
+            res = self.cls._file_meta(files)
+        assert sorted(res.keys()) == sorted(files.keys())
+        for p in files:
+            assert res[p] == (
+                len('foo') + len(p.split('f')[-1]),
+                os.path.getmtime(p), 'md5-%s' % p
+            )
+        assert len(mock_md5.mock_calls) == 20
+        assert self.cls._meta_errors == []
+
+    def test_threads_hash_error(self, tmpdir):
+        paths = []
+        for i in range(5):
+            p = tmpdir.join('f%d' % i)
+            p.write('foo')
+            paths.append(str(p))
+
+        def se_md5(p, **kwargs):
+            if p == paths[2]:
+                raise IOError('vanished')
+            return 'md5'
+
+        self.cls._hash_workers = 2
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.side_effect = se_md5
+            res = self.cls._file_meta(dict((p, os.stat(p)) for p in paths))
+        assert sorted(res.keys()) == sorted(paths[:2] + paths[3:])
+        assert self.cls._meta_errors == [paths[2]]
+
+    def test_processes(self, tmpdir):
+        p = tmpdir.join('foo')
+        p.write('foo')
+        self.cls._hash_workers = 2
+        self.cls._hash_processes = True
+        with patch(
+            '%s.ProcessPoolExecutor' % pbm, wraps=ThreadPoolExecutor
+        ) as mock_ppe:
+            res = self.cls._file_meta({str(p): os.stat(str(p))})
+        assert res[str(p)][2] == 'acbd18db4cc2f85cedef654fccc4a4d8'
+        assert mock_ppe.mock_calls[0] == call(max_workers=2)
 
 
 class TestFilesToUpload(object):
@@ -283,6 +512,206 @@ class TestFilesToUpload(object):
             '/foo/two': (222, 23456.78, 'bbbb')
         }
 
+    def test_merge(self):
+        local_files = {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 23456.78, 'bbbb'),
+            '/foo/three': (333, 34567.89, 'cccc'),
+        }
+        s3_files = {
+            '/foo/one': (444, 45678.9, 'dddd'),
+            '/foo/three': (555, 456789.01, 'cccc'),
+            '/foo/zzz': (666, 567890.12, 'eeee')
+        }
+        self.cls._diff_engine = 'merge'
+        self.cls._diff_max_items = 1
+        res = self.cls._files_to_upload(local_files, s3_files)
+        assert res == {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 23456.78, 'bbbb')
+        }
+
+    def test_remote_only(self):
+        local_files = {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 23456.78, 'bbbb')
+        }
+        s3_files = {
+            '/foo/one': (444, 45678.9, 'dddd'),
+            '/foo/three': (555, 456789.01, 'cccc'),
+            '/foo/four': (666, 567890.12, 'eeee')
+        }
+        self.cls._files_to_upload(local_files, s3_files)
+        assert self.cls._remote_only == []
+        self.cls._delete = True
+        for engine in ['dict', 'merge']:
+            self.cls._diff_engine = engine
+            self.cls._remote_only = []
+            self.cls._files_to_upload(local_files, s3_files)
+            assert sorted(self.cls._remote_only) == [
+                '/foo/four', '/foo/three'
+            ]
+
+    def test_size_mtime(self):
+        local_files = {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 23456.78, 'bbbb'),
+            '/foo/three': (333, 34567.89, 'cccc'),
+            '/foo/four': (444, 45678.9, 'dddd')
+        }
+        s3_files = {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 11111.11, 'bbbb'),
+            '/foo/three': (333, 34567.89, 'CCCC')
+        }
+        for engine in ['dict', 'merge']:
+            self.cls._diff_engine = engine
+            self.cls._compare = 'size-mtime-then-checksum'
+            assert sorted(self.cls._files_to_upload(local_files, s3_files)) \
+                == ['/foo/four', '/foo/three']
+            self.cls._compare = 'size-mtime'
+            assert sorted(self.cls._files_to_upload(local_files, s3_files)) \
+                == ['/foo/four', '/foo/three', '/foo/two']
+
+    def test_merge_same_as_dict(self):
+        local_files = dict(
+            ('/foo/%d' % i, (i, 1234.5, 'md5%d' % (i % 7))) for i in range(500)
+        )
+        s3_files = dict(
+            ('/foo/%d' % i, (i, 1234.5, 'md5%d' % (i % 5)))
+            for i in range(250, 750)
+        )
+        expected = self.cls._files_to_upload(local_files, s3_files)
+        self.cls._diff_engine = 'merge'
+        self.cls._diff_max_items = 64
+        assert self.cls._files_to_upload(local_files, s3_files) == expected
+
+    def test_numpy(self):
+        local_files = {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 23456.78, 'bbbb'),
+            '/foo/three': (333, 34567.89, 'cccc'),
+        }
+        s3_files = {
+            '/foo/one': (444, 45678.9, 'dddd'),
+            '/foo/three': (555, 456789.01, 'cccc')
+        }
+        self.cls._diff_engine = 'numpy'
+        with patch('%s.numpy_diff' % pbm, autospec=True) as mock_diff:
+            mock_diff.return_value = {
+                '/foo/one': (111, 12345.67, 'aaaa'),
+                '/foo/two': (222, 23456.78, 'bbbb')
+            }
+            res = self.cls._files_to_upload(local_files, s3_files)
+        assert mock_diff.mock_calls == [
+            call(local_files, s3_files, remote_only=False, size_mtime=False,
+                 values=True)
+        ]
+        assert res == {
+            '/foo/one': (111, 12345.67, 'aaaa'),
+            '/foo/two': (222, 23456.78, 'bbbb')
+        }
+
+    def test_numpy_remote_only(self):
+        local_files = {'/foo/one': (111, 12345.67, 'aaaa')}
+        s3_files = {'/foo/three': (555, 456789.01, 'cccc')}
+        self.cls._diff_engine = 'numpy'
+        self.cls._delete = True
+        with patch('%s.numpy_diff' % pbm, autospec=True) as mock_diff:
+            mock_diff.return_value = (
+                {'/foo/one': (111, 12345.67, 'aaaa')}, ['/foo/three']
+            )
+            res = self.cls._files_to_upload(local_files, s3_files)
+        assert mock_diff.mock_calls == [
+            call(local_files, s3_files, remote_only=True, size_mtime=False,
+                 values=True)
+        ]
+        assert res == {'/foo/one': (111, 12345.67, 'aaaa')}
+        assert self.cls._remote_only == ['/foo/three']
+
+
+class TestDeleteFiles(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer('bname', delete=True, upload_workers=4)
+            self.mock_s3 = mock_s3
+        self.s3_files = dict(('/x/%d' % i, (1, 1.0, 'a')) for i in range(100))
+
+    def test_delete(self):
+        self.cls._remote_only = [
+            '/foo/bar/a', '/foo/barbaz', '/foo/bar', '/foo/bar/b.tmp',
+            '/foo/bar/c', '/other/x', '/single', '/single/x'
+        ]
+        self.cls._meta_errors = ['/foo/bar/c']
+        self.mock_s3.return_value.delete_files.return_value = ['/single']
+        res = self.cls._delete_files(
+            self.s3_files, ['/foo/bar/', '/single'], ['*.tmp']
+        )
+        assert self.mock_s3.return_value.delete_files.mock_calls == [
+            call(['/foo/bar/a', '/single', '/single/x'], workers=4)
+        ]
+        assert res == (['/foo/bar/a', '/single/x'], ['/single'], 0)
+
+    def test_list_errors(self):
+        # /mnt/disk couldn't be stat'ed (unmounted) and /home/locked couldn't
+        # be listed, so none of their files in S3 are deleted
+        self.cls._remote_only = [
+            '/mnt/disk/a', '/mnt/disk/b/c', '/home/locked', '/home/locked/x',
+            '/home/lockedother', '/home/gone'
+        ]
+        self.cls._list_errors = ['/mnt/disk', '/home/locked']
+        self.mock_s3.return_value.delete_files.return_value = []
+        with patch('%s.logger' % pbm) as mock_logger:
+            res = self.cls._delete_files(
+                self.s3_files, ['/mnt/disk', '/home'], []
+            )
+        assert self.mock_s3.return_value.delete_files.mock_calls == [
+            call(['/home/gone', '/home/lockedother'], workers=4)
+        ]
+        assert res == (['/home/gone', '/home/lockedother'], [], 0)
+        assert mock_logger.warning.mock_calls == [
+            call('Not deleting %d files from S3 that are under paths that '
+                 'could not be read this run', 4)
+        ]
+
+    def test_nothing(self):
+        self.cls._remote_only = ['/other/x']
+        res = self.cls._delete_files(self.s3_files, ['/foo'], [])
+        assert res == ([], [], 0)
+        assert self.mock_s3.return_value.delete_files.mock_calls == []
+
+    def test_max_delete(self):
+        self.cls._max_delete = 2
+        self.cls._remote_only = ['/foo/1', '/foo/2', '/foo/3']
+        with patch('%s.logger' % pbm) as mock_logger:
+            res = self.cls._delete_files(self.s3_files, ['/foo'], [])
+        assert res == ([], [], 3)
+        assert self.mock_s3.return_value.delete_files.mock_calls == []
+        assert mock_logger.error.mock_calls == [
+            call('Refusing to delete %d files from S3: %s', 3,
+                 'more than the maximum of 2')
+        ]
+
+    def test_max_delete_percent(self):
+        self.cls._max_delete_percent = 2.5
+        self.cls._remote_only = ['/foo/1', '/foo/2', '/foo/3']
+        with patch('%s.logger' % pbm) as mock_logger:
+            res = self.cls._delete_files(self.s3_files, ['/foo'], [])
+        assert res == ([], [], 3)
+        assert self.mock_s3.return_value.delete_files.mock_calls == []
+        assert mock_logger.error.mock_calls == [
+            call('Refusing to delete %d files from S3: %s', 3,
+                 '3.0% of files in S3; more than the maximum of 2.5%')
+        ]
+
+    def test_no_limits(self):
+        self.cls._max_delete_percent = None
+        self.cls._remote_only = ['/foo/%d' % i for i in range(10)]
+        self.mock_s3.return_value.delete_files.return_value = []
+        res = self.cls._delete_files({}, ['/foo'], [])
+        assert sorted(res[0]) == sorted(self.cls._remote_only)
+
 
 class TestUploadFiles(object):
 
@@ -306,6 +735,625 @@ class TestUploadFiles(object):
         self.mock_s3.return_value.put_file.side_effect = se_put
         res = self.cls._upload_files(files)
         assert res == (['/foo/two'], 444)
+        assert self.mock_s3.return_value.put_file.mock_calls == [
+            call('/foo/one', 111, 12345.67, 'aaaa'),
+            call('/foo/three', 333, 34567.89, 'cccc'),
+            call('/foo/two', 222, 23456.78, 'bbbb')
+        ]
+
+    def test_upload_files_concurrent(self):
+        files = dict(
+            ('/foo/%d' % i, (i, 1234.5, 'md5%d' % i)) for i in range(100)
+        )
+
+        def se_put(f, sz, mt, md):
+            if sz % 10 == 0:
+                raise RuntimeError()
+            return None
+
+        self.cls._upload_workers = 8
+        self.mock_s3.return_value.put_file.side_effect = se_put
+        res = self.cls._upload_files(files)
+        assert sorted(res[0]) == sorted(
+            ['/foo/%d' % i for i in range(0, 100, 10)]
+        )
+        assert res[1] == sum(i for i in range(100) if i % 10 != 0)
+        assert len(self.mock_s3.return_value.put_file.mock_calls) == 100
+        assert self.cls._upload_busy >= 0.0
+
+    def test_upload_files_largest_first(self):
+        files = {
+            '/foo/one': (100, 12345.67, 'aaaa'),
+            '/foo/two': (400, 23456.78, 'bbbb'),
+            '/foo/three': (100, 34567.89, 'cccc'),
+        }
+        self.cls._upload_order = 'largest-first'
+        with patch('%s._put_file' % pb, autospec=True) as mock_put:
+            with patch('%s.compare_orders' % pbm, autospec=True) as mock_co:
+                mock_put.side_effect = [2.0, 1.0, 1.0]
+                res = self.cls._upload_files(files)
+        assert res == ([], 600)
+        assert mock_put.mock_calls == [
+            call(self.cls, '/foo/two', (400, 23456.78, 'bbbb')),
+            call(self.cls, '/foo/one', (100, 12345.67, 'aaaa')),
+            call(self.cls, '/foo/three', (100, 34567.89, 'cccc'))
+        ]
+        assert self.cls._upload_busy == 4.0
+        # 600 bytes in 4 seconds of uploading
+        assert mock_co.mock_calls == [call(files, 1, 150.0)]
+        assert self.cls._upload_makespans == mock_co.return_value
+
+    def test_upload_files_all_failed(self):
+        self.mock_s3.return_value.put_file.side_effect = RuntimeError()
+        res = self.cls._upload_files({'/foo': (1, 2.0, 'md5')})
+        assert res == (['/foo'], 0)
+        assert self.cls._upload_makespans is None
+
+    def test_put_file_throttled(self):
+        self.mock_s3.return_value.put_file.side_effect = [
+            throttle_error(), None
+        ]
+        with patch('s3sfe.concurrency.time.sleep') as mock_sleep:
+            with patch('s3sfe.concurrency.logger'):
+                self.cls._put_file('/foo', (1, 2.0, 'md5'))
+        assert self.mock_s3.return_value.put_file.mock_calls == [
+            call('/foo', 1, 2.0, 'md5'),
+            call('/foo', 1, 2.0, 'md5')
+        ]
+        assert len(mock_sleep.mock_calls) == 1
+
+    def test_put_file(self):
+        with patch('%s.time.time' % pbm) as mock_time:
+            mock_time.side_effect = [1.0, 3.5, 4.0, 4.0]
+            res = self.cls._put_file('/foo', (1, 2.0, 'md5'))
+        assert res == 2.5
+        assert self.mock_s3.return_value.put_file.mock_calls == [
+            call('/foo', 1, 2.0, 'md5')
+        ]
+
+
+class TestCopies(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer('bname', copy_duplicates=True)
+            self.mock_s3 = mock_s3
+        self.cls.s3.bundled = {'/s3/bundled': ('b1', 0, 100)}
+
+    def test_find_copies(self):
+        files = {
+            '/new/a': (100, 1.0, 'aaaa'),
+            '/new/a2': (100, 2.0, 'aaaa'),
+            '/new/b': (200, 1.0, 'bbbb'),
+            '/new/b2': (200, 2.0, 'bbbb'),
+            '/new/c': (300, 1.0, 'cccc'),
+            '/new/d': (400, 1.0, 'dddd'),
+            '/new/e': (0, 1.0, 'eeee'),
+            '/new/e2': (0, 1.0, 'eeee'),
+            '/new/f': (500, 1.0, None),
+            '/new/f2': (500, 1.0, None),
+            '/s3/d': (400, 1.0, 'dddd')
+        }
+        s3_files = {
+            '/s3/a': (100, 5.0, 'aaaa'),
+            '/s3/bundled': (300, 5.0, 'cccc'),
+            '/s3/c': (301, 5.0, 'cccc'),
+            '/s3/d': (400, 5.0, 'dddd'),
+            '/s3/z': (999, 5.0, 'zzzz')
+        }
+        assert self.cls._find_copies(files, s3_files) == {
+            '/new/a': '/s3/a',
+            '/new/a2': '/s3/a',
+            '/new/b2': '/new/b',
+            '/s3/d': '/new/d'
+        }
+
+    def test_find_copies_no_s3_files(self):
+        files = {
+            '/new/a': (100, 1.0, 'aaaa'),
+            '/new/a2': (100, 2.0, 'aaaa')
+        }
+        assert self.cls._find_copies(files, None) == {'/new/a2': '/new/a'}
+
+    def test_find_copies_bundle_threshold(self):
+        self.cls._bundle_threshold = 200
+        files = {
+            '/new/a': (100, 1.0, 'aaaa'),
+            '/new/a2': (100, 2.0, 'aaaa'),
+            '/new/b': (200, 1.0, 'bbbb'),
+            '/new/b2': (200, 2.0, 'bbbb')
+        }
+        assert self.cls._find_copies(files, {}) == {'/new/b2': '/new/b'}
+
+    def test_copy_file(self):
+        res = self.cls._copy_file('/new', '/old', (100, 1.0, 'aaaa'))
+        assert res is None
+        assert self.cls.s3.mock_calls == [
+            call.copy_file('/old', '/new', 100, 1.0, 'aaaa')
+        ]
+
+    def test_copy_file_error(self):
+        self.cls.s3.copy_file.side_effect = RuntimeError('foo')
+        with patch('%s._put_file' % pb, autospec=True) as mock_put:
+            mock_put.return_value = 2.5
+            res = self.cls._copy_file('/new', '/old', (100, 1.0, 'aaaa'))
+        assert res == 2.5
+        assert mock_put.mock_calls == [
+            call(self.cls, '/new', (100, 1.0, 'aaaa'))
+        ]
+
+    def test_copy_file_upload(self):
+        with patch('%s._put_file' % pb, autospec=True) as mock_put:
+            mock_put.return_value = 2.5
+            res = self.cls._copy_file(
+                '/new', '/old', (100, 1.0, 'aaaa'), upload=True
+            )
+        assert res == 2.5
+        assert self.cls.s3.mock_calls == []
+
+    def test_upload_files(self):
+        files = {
+            '/new/a': (100, 1.0, 'aaaa'),
+            '/new/b': (200, 1.0, 'bbbb'),
+            '/new/b2': (200, 2.0, 'bbbb'),
+            '/new/c': (300, 1.0, 'cccc'),
+            '/new/c2': (300, 2.0, 'cccc'),
+            '/new/d': (400, 1.0, 'dddd')
+        }
+        s3_files = {'/s3/a': (100, 5.0, 'aaaa')}
+
+        def se_put(path, meta):
+            if path == '/new/c':
+                raise RuntimeError('foo')
+            return 1.0
+
+        def se_copy(path, src, meta, upload=False):
+            if upload:
+                return 3.0
+            return None
+
+        with patch('%s._put_file' % pb, autospec=True) as mock_put:
+            with patch('%s._copy_file' % pb, autospec=True) as mock_copy:
+                mock_put.side_effect = lambda s, p, m: se_put(p, m)
+                mock_copy.side_effect = lambda s, p, sr, m, u: se_copy(
+                    p, sr, m, upload=u
+                )
+                res = self.cls._upload_files(files, s3_files=s3_files)
+        assert res == (['/new/c'], 900)
+        assert sorted(c[1][1] for c in mock_put.mock_calls) == [
+            '/new/b', '/new/c', '/new/d'
+        ]
+        assert mock_copy.mock_calls == [
+            call(self.cls, '/new/a', '/s3/a', (100, 1.0, 'aaaa'), False),
+            call(self.cls, '/new/b2', '/new/b', (200, 2.0, 'bbbb'), False),
+            call(self.cls, '/new/c2', '/new/c', (300, 2.0, 'cccc'), True)
+        ]
+        assert self.cls._copied == ['/new/a', '/new/b2']
+        assert self.cls._copied_bytes == 300
+        assert self.cls._upload_busy == 5.0
+
+    def test_upload_files_copy_error(self):
+        files = {
+            '/new/a': (100, 1.0, 'aaaa'),
+            '/new/a2': (100, 2.0, 'aaaa')
+        }
+        with patch('%s._put_file' % pb, autospec=True) as mock_put:
+            with patch('%s._copy_file' % pb, autospec=True) as mock_copy:
+                mock_put.return_value = 1.0
+                mock_copy.side_effect = RuntimeError('foo')
+                res = self.cls._upload_files(files, s3_files={})
+        assert res == (['/new/a2'], 100)
+        assert self.cls._copied == []
+
+    def test_upload_files_disabled(self):
+        self.cls._copy_duplicates = False
+        files = {
+            '/new/a': (100, 1.0, 'aaaa'),
+            '/new/a2': (100, 2.0, 'aaaa')
+        }
+        with patch('%s._put_file' % pb, autospec=True) as mock_put:
+            with patch('%s._find_copies' % pb, autospec=True) as mock_find:
+                mock_put.return_value = 1.0
+                res = self.cls._upload_files(files, s3_files={})
+        assert res == ([], 200)
+        assert len(mock_put.mock_calls) == 2
+        assert mock_find.mock_calls == []
+        assert self.cls._copied is None
+
+
+class TestBundles(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer(
+                'bname', bundle_threshold=100, bundle_size=250
+            )
+            self.mock_s3 = mock_s3
+        self.s3 = mock_s3.return_value
+        self.s3.bundles = {}
+        self.s3.bundled = {}
+
+    def test_upload_files_splits_small(self):
+        files = {
+            '/big': (100, 1.0, 'md5big'),
+            '/small': (99, 2.0, 'md5small'),
+            '/tiny': (1, 3.0, 'md5tiny')
+        }
+        s3_files = {'/small': (99, 1.0, 'old')}
+        with patch.multiple(
+            pb, autospec=True, _put_file=DEFAULT, _upload_bundles=DEFAULT
+        ) as mocks:
+            mocks['_put_file'].return_value = 1.0
+            mocks['_upload_bundles'].return_value = (['/tiny'], 99)
+            res = self.cls._upload_files(files, s3_files=s3_files)
+        assert res == (['/tiny'], 199)
+        assert mocks['_put_file'].mock_calls == [
+            call(self.cls, '/big', (100, 1.0, 'md5big'))
+        ]
+        assert mocks['_upload_bundles'].mock_calls == [
+            call(self.cls, {
+                '/small': (99, 2.0, 'md5small'),
+                '/tiny': (1, 3.0, 'md5tiny')
+            }, s3_files=s3_files)
+        ]
+        assert self.cls._upload_makespans == {
+            'path': 1.0, 'largest-first': 1.0, 'newest-first': 1.0
+        }
+
+    def test_upload_bundles(self):
+        files = dict(
+            ('/f%d' % i, (90, float(i), 'md5%d' % i)) for i in range(7)
+        )
+        self.s3.bundled = {'/f1': ('b1', 0, 90)}
+        self.s3.delete_objects.return_value = ['/f2']
+        s3_files = {
+            '/f0': (1, 1.0, 'old'),
+            '/f1': (1, 1.0, 'old'),
+            '/f2': (1, 1.0, 'old'),
+            '/f3': (1, 1.0, 'old')
+        }
+
+        def se_put(_, paths, fls):
+            assert fls is files
+            if paths[0] == '/f3':
+                raise RuntimeError()
+            return ([p for p in paths if p == '/f6'], 2.0)
+
+        self.cls._upload_busy = 1.0
+        with patch('%s._put_bundle' % pb, autospec=True) as mock_put:
+            mock_put.side_effect = se_put
+            with patch('%s.logger' % pbm) as mock_logger:
+                res = self.cls._upload_bundles(files, s3_files=s3_files)
+        assert sorted(res[0]) == ['/f3', '/f4', '/f5', '/f6']
+        assert res[1] == 270
+        assert mock_put.mock_calls == [
+            call(self.cls, ['/f0', '/f1', '/f2'], files),
+            call(self.cls, ['/f3', '/f4', '/f5'], files),
+            call(self.cls, ['/f6'], files)
+        ]
+        assert self.cls._upload_busy == 5.0
+        # /f1 was already in a bundle and /f3 failed
+        assert self.s3.delete_objects.mock_calls == [
+            call(['/f0', '/f2'], workers=1)
+        ]
+        assert len(mock_logger.error.mock_calls) == 1
+        assert mock_logger.warning.mock_calls == [
+            call('Could not delete object of bundled file %s', '/f2')
+        ]
+
+    def test_put_bundle(self, tmpdir):
+        a = tmpdir.join('a')
+        a.write_binary(b'aaa')
+        b = tmpdir.join('b')
+        b.write_binary(b'bbbb')
+        missing = str(tmpdir.join('missing'))
+        files = {
+            str(a): (3, 1.0, 'md5a'),
+            str(b): (3, 2.0, 'md5b'),
+            missing: (1, 3.0, 'md5m')
+        }
+        with patch('%s.logger' % pbm):
+            with patch('%s.time.time' % pbm) as mock_time:
+                mock_time.side_effect = [1.0, 3.5, 4.0, 4.0]
+                res = self.cls._put_bundle(
+                    [str(a), str(b), missing], files
+                )
+        assert res == ([str(b), missing], 2.5)
+        assert self.s3.put_bundle.mock_calls == [
+            call([(str(a), (3, 1.0, 'md5a'), b'aaa')])
+        ]
+
+    def test_put_bundle_nothing(self, tmpdir):
+        with patch('%s.logger' % pbm):
+            res = self.cls._put_bundle(
+                [str(tmpdir.join('x'))], {str(tmpdir.join('x')): (1, 1, 'm')}
+            )
+        assert res == ([str(tmpdir.join('x'))], 0.0)
+        assert self.s3.put_bundle.mock_calls == []
+
+    def test_compact(self):
+        self.s3.bundles = {'b1': 100, 'b2': 100, 'b3': 200, 'b4': 100}
+        self.s3.bundled = {
+            '/a': ('b1', 60, 40),
+            '/b': ('b1', 0, 10),
+            '/c': ('b2', 40, 60),
+            '/d': ('b3', 0, 150),
+            '/e': ('b4', 90, 10)
+        }
+        self.s3.read_bundle.side_effect = lambda bid: {
+            'b1': b'b' * 10 + b'x' * 50 + b'a' * 40,
+            'b4': b'x' * 90 + b'e' * 10
+        }[bid]
+        s3_files = {
+            '/a': (40, 1.0, 'md5a'),
+            '/b': (10, 2.0, 'md5b'),
+            '/c': (60, 3.0, 'md5c'),
+            '/d': (150, 4.0, 'md5d'),
+            '/e': (10, 5.0, 'md5e')
+        }
+        self.s3.bundles['b5'] = 30
+        self.cls._compact_bundles(s3_files)
+        assert self.s3.read_bundle.mock_calls == [call('b1'), call('b4')]
+        assert self.s3.put_bundle.mock_calls == [
+            call([
+                ('/b', (10, 2.0, 'md5b'), b'b' * 10),
+                ('/a', (40, 1.0, 'md5a'), b'a' * 40),
+                ('/e', (10, 5.0, 'md5e'), b'e' * 10)
+            ])
+        ]
+        assert self.s3.delete_bundles.mock_calls == [
+            call(['b1', 'b4', 'b5'])
+        ]
+        assert self.cls._bundles_changed is True
+
+    def test_compact_splits(self):
+        self.cls._bundle_size = 50
+        self.s3.bundles = {'b1': 100}
+        self.s3.bundled = {'/a': ('b1', 0, 30), '/b': ('b1', 70, 30)}
+        self.s3.read_bundle.return_value = b'a' * 30 + b'x' * 40 + b'b' * 30
+        s3_files = {'/a': (30, 1.0, 'md5a'), '/b': (30, 2.0, 'md5b')}
+        self.cls._bundle_compact = 0.3
+        self.cls._compact_bundles(s3_files)
+        assert self.s3.put_bundle.mock_calls == [
+            call([
+                ('/a', (30, 1.0, 'md5a'), b'a' * 30),
+                ('/b', (30, 2.0, 'md5b'), b'b' * 30)
+            ])
+        ]
+        assert self.s3.delete_bundles.mock_calls == [call(['b1'])]
+
+    def test_compact_nothing(self):
+        self.s3.bundles = {'b1': 100}
+        self.s3.bundled = {'/a': ('b1', 0, 60)}
+        self.cls._compact_bundles({'/a': (60, 1.0, 'md5a')})
+        assert self.s3.read_bundle.mock_calls == []
+        assert self.s3.delete_bundles.mock_calls == []
+        assert self.cls._bundles_changed is False
+
+    def test_compact_dry_run(self):
+        self.cls._dry_run = True
+        self.s3.bundles = {'b1': 100, 'b2': 50}
+        self.s3.bundled = {'/a': ('b1', 0, 10), '/b': ('b1', 50, 20)}
+        with patch('%s.logger' % pbm) as mock_logger:
+            self.cls._compact_bundles({
+                '/a': (10, 1.0, 'md5a'), '/b': (20, 2.0, 'md5b')
+            })
+        assert self.s3.read_bundle.mock_calls == []
+        assert self.s3.put_bundle.mock_calls == []
+        assert self.s3.delete_bundles.mock_calls == []
+        assert self.cls._bundles_changed is False
+        assert mock_logger.warning.mock_calls == [
+            call('DRY RUN; would repack %d files (%d bytes) from bundle %s',
+                 2, 30, 'b1'),
+            call('DRY RUN; would delete empty bundle %s', 'b2')
+        ]
+
+    def test_compact_error(self):
+        self.s3.bundles = {'b1': 100}
+        self.s3.bundled = {'/a': ('b1', 0, 10)}
+        self.s3.read_bundle.side_effect = RuntimeError()
+        with patch('%s.logger' % pbm) as mock_logger:
+            self.cls._compact_bundles({'/a': (10, 1.0, 'md5a')})
+        assert self.s3.delete_bundles.mock_calls == []
+        assert len(mock_logger.error.mock_calls) == 1
+
+    def test_run_compacts(self):
+        with patch('%s.RunStats' % pbm, autospec=True):
+            with patch.multiple(
+                pb,
+                autospec=True,
+                _list_all_files=DEFAULT,
+                _file_meta=DEFAULT,
+                _files_to_upload=DEFAULT,
+                _upload_files=DEFAULT,
+                _s3_files=DEFAULT,
+                _compact_bundles=DEFAULT,
+                _update_manifest=DEFAULT
+            ) as mocks:
+                mocks['_file_meta'].return_value = {}
+                mocks['_upload_files'].return_value = ([], 0)
+                mocks['_s3_files'].return_value = {'a': (1, 2, 'b')}
+                self.cls.run(['/'])
+        assert mocks['_compact_bundles'].mock_calls == [
+            call(self.cls, {'a': (1, 2, 'b')})
+        ]
+
+
+class TestCleanUploads(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            self.cls = FileSyncer('bname')
+        self.cls._journal = Mock()
+        self.cls._journal.uploads.return_value = [
+            ('pre/a', 'uid1', '/a', 100, 1000.5),
+            ('pre/b', 'uid2', '/b', 100, 1000.5),
+            ('pre/c', 'uid3', '/c', 100, 1000.5),
+            ('pre/d', 'uid4', '/d', 100, 1000.5)
+        ]
+        self.stats = {
+            '/a': Mock(st_size=100, st_mtime=1000.5),
+            '/b': Mock(st_size=101, st_mtime=1000.5),
+            '/c': Mock(st_size=100, st_mtime=1002.5)
+        }
+
+    def se_stat(self, path):
+        if path not in self.stats:
+            raise OSError('No such file')
+        return self.stats[path]
+
+    def test_clean(self):
+        with patch('%s.os.stat' % pbm) as mock_stat:
+            mock_stat.side_effect = self.se_stat
+            self.cls._clean_uploads()
+        assert self.cls._journal.mock_calls == [call.uploads('bname')]
+        assert self.cls.s3.mock_calls == [
+            call.abort_upload('pre/b', 'uid2'),
+            call.abort_upload('pre/c', 'uid3'),
+            call.abort_upload('pre/d', 'uid4')
+        ]
+
+    def test_no_journal(self):
+        self.cls._journal = None
+        self.cls._clean_uploads()
+        assert self.cls.s3.mock_calls == []
+
+    def test_orphaned(self):
+        self.cls._abort_orphaned = True
+        self.cls.s3.abort_orphaned_uploads.return_value = 2
+        with patch('%s.os.stat' % pbm) as mock_stat:
+            mock_stat.side_effect = self.se_stat
+            with patch('%s.logger' % pbm, autospec=True) as mock_logger:
+                self.cls._clean_uploads()
+        assert self.cls.s3.mock_calls[-1] == call.abort_orphaned_uploads(
+            keep_ids=set(['uid1']), min_age=86400
+        )
+        assert call.warning(
+            'Aborted %d orphaned multipart uploads', 2
+        ) in mock_logger.mock_calls
+
+    def test_orphaned_no_journal(self):
+        self.cls._journal = None
+        self.cls._abort_orphaned = True
+        self.cls.s3.abort_orphaned_uploads.return_value = 0
+        self.cls._clean_uploads()
+        assert self.cls.s3.mock_calls == [
+            call.abort_orphaned_uploads(keep_ids=set(), min_age=86400)
+        ]
+
+    def test_orphaned_error(self):
+        self.cls._journal = None
+        self.cls._abort_orphaned = True
+        self.cls.s3.abort_orphaned_uploads.side_effect = throttle_error()
+        with patch('%s.logger' % pbm, autospec=True) as mock_logger:
+            self.cls._clean_uploads()
+        assert mock_logger.error.mock_calls == [
+            call('Error aborting orphaned uploads', exc_info=True)
+        ]
+
+
+class TestRefreshMetadata(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer('bname', refresh_metadata=True)
+            self.mock_s3 = mock_s3
+        self.cls.s3.bundled = {'/bundled': ('b1', 0, 10)}
+
+    def test_files_to_refresh(self):
+        local_files = {
+            '/same': (10, 1000.0, 'aaaa'),
+            '/touched': (10, 2000.0, 'bbbb'),
+            '/within-tolerance': (10, 1000.0005, 'cccc'),
+            '/changed': (10, 2000.0, 'NEW'),
+            '/uploading': (10, 2000.0, 'dddd'),
+            '/new': (10, 2000.0, 'eeee'),
+            '/unhashed': (10, 2000.0, None)
+        }
+        s3_files = {
+            '/same': (10, 1000.0, 'aaaa'),
+            '/touched': (10, 1000.0, 'bbbb'),
+            '/within-tolerance': (10, 1000.0, 'cccc'),
+            '/changed': (10, 1000.0, 'OLD'),
+            '/uploading': (10, 1000.0, 'dddd'),
+            '/unhashed': (10, 1000.0, 'ffff')
+        }
+        to_upload = {
+            '/changed': (10, 2000.0, 'NEW'),
+            '/uploading': (10, 2000.0, 'dddd'),
+            '/new': (10, 2000.0, 'eeee')
+        }
+        res = self.cls._files_to_refresh(local_files, s3_files, to_upload)
+        assert res == {'/touched': (10, 2000.0, 'bbbb')}
+
+    def test_refresh_files(self):
+        files = {
+            '/a': (10, 2000.0, 'aaaa'),
+            '/b': (10, 2000.0, 'bbbb'),
+            '/bundled': (10, 2000.0, 'cccc'),
+            '/c': (10, 2000.0, 'dddd')
+        }
+
+        def se_copy(src, path, size_b, mtime, md5sum):
+            if path == '/b':
+                raise RuntimeError('foo')
+
+        self.cls.s3.copy_file.side_effect = se_copy
+        self.cls._upload_workers = 2
+        refreshed, errored = self.cls._refresh_files(files)
+        assert sorted(refreshed) == ['/a', '/bundled', '/c']
+        assert errored == ['/b']
+        assert sorted(self.cls.s3.copy_file.mock_calls) == [
+            call('/a', '/a', 10, 2000.0, 'aaaa'),
+            call('/b', '/b', 10, 2000.0, 'bbbb'),
+            call('/c', '/c', 10, 2000.0, 'dddd')
+        ]
+
+    def test_refresh_files_none(self):
+        assert self.cls._refresh_files({}) == ([], [])
+        assert self.cls.s3.mock_calls == []
+
+    def test_run(self):
+        local_files = {
+            'one': (1, 2, 'three'),
+            'two': (4, 9, 'six'),
+            'three': (6, 9, 'eight')
+        }
+        s3_files = {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six'),
+            'three': (6, 7, 'eight')
+        }
+        with patch('%s.RunStats' % pbm, autospec=True) as mock_stats:
+            with patch.multiple(
+                pb,
+                autospec=True,
+                _list_all_files=DEFAULT,
+                _file_meta=DEFAULT,
+                _files_to_upload=DEFAULT,
+                _upload_files=DEFAULT,
+                _s3_files=DEFAULT,
+                _refresh_files=DEFAULT,
+                _update_manifest=DEFAULT
+            ) as mocks:
+                mocks['_list_all_files'].return_value = {
+                    'one': 1, 'two': 2, 'three': 3}
+                mocks['_file_meta'].return_value = local_files
+                mocks['_files_to_upload'].return_value = {}
+                mocks['_upload_files'].return_value = ([], 0)
+                mocks['_s3_files'].return_value = s3_files
+                mocks['_refresh_files'].return_value = (['two'], ['three'])
+                self.cls.run(['a'])
+        assert mocks['_refresh_files'].mock_calls == [
+            call(self.cls, {'two': (4, 9, 'six')})
+        ]
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, s3_files, {}, [], deleted=None,
+                 refreshed={'two': (4, 9, 'six')})
+        ]
+        kwargs = mock_stats.mock_calls[0][2]
+        assert kwargs['refreshed_files'] == ['two']
+        assert kwargs['refresh_errors'] == ['three']
 
 
 class TestRun(object):
@@ -348,36 +1396,49 @@ class TestRun(object):
                     _file_meta=DEFAULT,
                     _files_to_upload=DEFAULT,
                     _upload_files=DEFAULT,
-                    _filter_filelist=DEFAULT,
-                    _s3_files=DEFAULT
+                    _s3_files=DEFAULT,
+                    _update_manifest=DEFAULT
                 ) as mocks:
-                    mocks['_list_all_files'].return_value = [
-                        'one', 'two', 'three']
+                    mocks['_list_all_files'].return_value = {
+                        'one': 1, 'two': 2, 'three': 3}
                     mocks['_file_meta'].return_value = local_files
                     mocks['_files_to_upload'].return_value = to_upload
                     mocks['_upload_files'].return_value = (['one'], 123)
                     mocks['_s3_files'].return_value = s3_files
                     res = self.cls.run(paths)
         assert mocks['_list_all_files'].mock_calls == [
-            call(self.cls, paths)
+            call(self.cls, paths, exclude_paths=[])
         ]
         assert mocks['_file_meta'].mock_calls == [
-            call(self.cls, ['one', 'two', 'three'])
+            call(self.cls, {'one': 1, 'two': 2, 'three': 3})
         ]
         assert mocks['_s3_files'].mock_calls == [call(self.cls)]
         assert mocks['_files_to_upload'].mock_calls == [
             call(self.cls, local_files, s3_files)
         ]
         assert mocks['_upload_files'].mock_calls == [
-            call(self.cls, to_upload)
+            call(self.cls, to_upload, s3_files=s3_files)
+        ]
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, s3_files, to_upload, ['one'], deleted=None,
+                 refreshed={})
         ]
         assert mock_stats.mock_calls == [
             call(
                 'dt_start', 'dt_meta', 'dt_query', 'dt_calc', 'dt_upload',
-                'dt_end', 3, 2, ['one'], 11, 123, dry_run=False
+                'dt_end', 3, 2, ['one'], 11, 123, dry_run=False,
+                hash_cache_hits=None, hash_cache_misses=None,
+                meta_errors=[], upload_busy_seconds=None, deleted_files=None,
+                delete_errors=None, delete_refused=0,
+                concurrency_history=None, upload_order='path',
+                upload_makespans=None,
+                copied_files=None,
+                copied_size_b=0,
+                refreshed_files=None,
+                refresh_errors=None,
+                wire_size_b=None
             )
         ]
-        assert mocks['_filter_filelist'].mock_calls == []
         assert res == mock_stats.return_value
 
     def test_exclude(self):
@@ -413,41 +1474,665 @@ class TestRun(object):
                     _file_meta=DEFAULT,
                     _files_to_upload=DEFAULT,
                     _upload_files=DEFAULT,
-                    _filter_filelist=DEFAULT,
-                    _s3_files=DEFAULT
+                    _s3_files=DEFAULT,
+                    _update_manifest=DEFAULT
                 ) as mocks:
-                    mocks['_list_all_files'].return_value = [
-                        'one', 'two', 'three']
+                    mocks['_list_all_files'].return_value = {
+                        'one': 1, 'two': 2, 'three': 3}
                     mocks['_file_meta'].return_value = local_files
                     mocks['_files_to_upload'].return_value = to_upload
                     mocks['_upload_files'].return_value = (['one'], 123)
-                    mocks['_filter_filelist'].return_value = ['one', 'two']
                     mocks['_s3_files'].return_value = s3_files
                     res = self.cls.run(paths, exclude_paths=['a', 'b'])
         assert mocks['_list_all_files'].mock_calls == [
-            call(self.cls, paths)
+            call(self.cls, paths, exclude_paths=['a', 'b'])
         ]
         assert mocks['_file_meta'].mock_calls == [
-            call(self.cls, ['one', 'two'])
+            call(self.cls, {'one': 1, 'two': 2, 'three': 3})
         ]
         assert mocks['_s3_files'].mock_calls == [call(self.cls)]
         assert mocks['_files_to_upload'].mock_calls == [
             call(self.cls, local_files, s3_files)
         ]
         assert mocks['_upload_files'].mock_calls == [
-            call(self.cls, to_upload)
-        ]
-        assert mocks['_filter_filelist'].mock_calls == [
-            call(self.cls, ['one', 'two', 'three'], ['a', 'b'])
+            call(self.cls, to_upload, s3_files=s3_files)
         ]
         assert mock_stats.mock_calls == [
             call(
                 'dt_start', 'dt_meta', 'dt_query', 'dt_calc', 'dt_upload',
-                'dt_end', 2, 2, ['one'], 11, 123, dry_run=False
+                'dt_end', 3, 2, ['one'], 11, 123, dry_run=False,
+                hash_cache_hits=None, hash_cache_misses=None,
+                meta_errors=[], upload_busy_seconds=None, deleted_files=None,
+                delete_errors=None, delete_refused=0,
+                concurrency_history=None, upload_order='path',
+                upload_makespans=None,
+                copied_files=None,
+                copied_size_b=0,
+                refreshed_files=None,
+                refresh_errors=None,
+                wire_size_b=None
             )
         ]
         assert res == mock_stats.return_value
 
+    def test_hash_cache(self):
+        local_files = {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'NOTsix')
+        }
+        m_hc = Mock(hits=5, misses=7)
+        self.cls._hash_cache = m_hc
+        with patch('%s.dtnow' % pbm, autospec=True) as mock_dtnow:
+            mock_dtnow.return_value = 'dt'
+            with patch('%s.RunStats' % pbm, autospec=True) as mock_stats:
+                with patch.multiple(
+                    pb,
+                    autospec=True,
+                    _list_all_files=DEFAULT,
+                    _file_meta=DEFAULT,
+                    _files_to_upload=DEFAULT,
+                    _upload_files=DEFAULT,
+                    _s3_files=DEFAULT,
+                    _update_manifest=DEFAULT
+                ) as mocks:
+                    mocks['_list_all_files'].return_value = {
+                        'one': 1, 'two': 2}
+                    mocks['_file_meta'].return_value = local_files
+                    mocks['_files_to_upload'].return_value = {}
+                    mocks['_upload_files'].return_value = ([], 0)
+                    mocks['_s3_files'].return_value = {}
+                    self.cls.run(['a'])
+        assert m_hc.mock_calls == [call.evict(set(['one', 'two']))]
+        assert mock_stats.mock_calls == [
+            call(
+                'dt', 'dt', 'dt', 'dt', 'dt', 'dt', 2, 0, [], 5, 0,
+                dry_run=False, hash_cache_hits=5, hash_cache_misses=7,
+                meta_errors=[], upload_busy_seconds=None, deleted_files=None,
+                delete_errors=None, delete_refused=0,
+                concurrency_history=None, upload_order='path',
+                upload_makespans=None,
+                copied_files=None,
+                copied_size_b=0,
+                refreshed_files=None,
+                refresh_errors=None,
+                wire_size_b=None
+            )
+        ]
+
+    def test_size_mtime(self):
+        local_files = {'one': (1, 2, 'three')}
+        s3_files = {'one': (1, 2, 'three')}
+        self.cls._compare = 'size-mtime'
+        order = []
+        with patch('%s.dtnow' % pbm, autospec=True) as mock_dtnow:
+            mock_dtnow.side_effect = [
+                datetime(2017, 1, 1, 0, 0, s) for s in [0, 1, 3, 6, 6, 8, 9]
+            ]
+            with patch('%s.RunStats' % pbm, autospec=True) as mock_stats:
+                with patch.multiple(
+                    pb,
+                    autospec=True,
+                    _list_all_files=DEFAULT,
+                    _file_meta=DEFAULT,
+                    _files_to_upload=DEFAULT,
+                    _upload_files=DEFAULT,
+                    _s3_files=DEFAULT,
+                    _update_manifest=DEFAULT
+                ) as mocks:
+                    mocks['_list_all_files'].return_value = {'one': 1}
+                    mocks['_file_meta'].side_effect = lambda *a, **kw: (
+                        order.append('meta') or local_files
+                    )
+                    mocks['_files_to_upload'].return_value = {}
+                    mocks['_upload_files'].return_value = ([], 0)
+                    mocks['_s3_files'].side_effect = lambda *a: (
+                        order.append('s3') or s3_files
+                    )
+                    self.cls.run(['a'])
+        assert order == ['s3', 'meta']
+        assert mocks['_file_meta'].mock_calls == [
+            call(self.cls, {'one': 1}, s3_files=s3_files)
+        ]
+        # listing 1s, querying S3 2s, metadata 3s
+        args = mock_stats.mock_calls[0][1]
+        assert args[1] - args[0] == timedelta(seconds=1)
+        assert args[2] - args[1] == timedelta(seconds=3)
+        assert args[3] - args[2] == timedelta(seconds=2)
+
+    def test_delete(self):
+        local_files = {'one': (1, 2, 'three')}
+        s3_files = {'one': (1, 2, 'three'), 'two': (4, 5, 'six')}
+        self.cls._delete = True
+        with patch('%s.dtnow' % pbm, autospec=True) as mock_dtnow:
+            mock_dtnow.return_value = 'dt'
+            with patch('%s.RunStats' % pbm, autospec=True) as mock_stats:
+                with patch.multiple(
+                    pb,
+                    autospec=True,
+                    _list_all_files=DEFAULT,
+                    _file_meta=DEFAULT,
+                    _files_to_upload=DEFAULT,
+                    _upload_files=DEFAULT,
+                    _s3_files=DEFAULT,
+                    _update_manifest=DEFAULT,
+                    _delete_files=DEFAULT
+                ) as mocks:
+                    mocks['_list_all_files'].return_value = {'one': 1}
+                    mocks['_file_meta'].return_value = local_files
+                    mocks['_files_to_upload'].return_value = {}
+                    mocks['_upload_files'].return_value = ([], 0)
+                    mocks['_s3_files'].return_value = s3_files
+                    mocks['_delete_files'].return_value = (['two'], [], 0)
+                    self.cls.run(['a'], exclude_paths=['b'])
+        assert mocks['_delete_files'].mock_calls == [
+            call(self.cls, s3_files, ['a'], ['b'])
+        ]
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, s3_files, {}, [], deleted=['two'],
+                 refreshed={})
+        ]
+        assert mock_stats.mock_calls == [
+            call(
+                'dt', 'dt', 'dt', 'dt', 'dt', 'dt', 1, 0, [], 1, 0,
+                dry_run=False, hash_cache_hits=None, hash_cache_misses=None,
+                meta_errors=[], upload_busy_seconds=None,
+                deleted_files=['two'], delete_errors=[], delete_refused=0,
+                concurrency_history=None, upload_order='path',
+                upload_makespans=None,
+                copied_files=None,
+                copied_size_b=0,
+                refreshed_files=None,
+                refresh_errors=None,
+                wire_size_b=None
+            )
+        ]
+
+
+class TestRunPipeline(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer(
+                'bname', pipeline=True, hash_workers=2, upload_workers=3
+            )
+            self.mock_s3 = mock_s3
+
+    def make_files(self, tmpdir):
+        paths = {}
+        for name in ['a', 'b', 'c']:
+            p = tmpdir.join('src', name)
+            p.write('foo%s' % name, ensure=True)
+            paths[name] = str(p)
+        return paths
+
+    def test_run(self, tmpdir):
+        paths = self.make_files(tmpdir)
+        s3_files = {
+            paths['a']: (4, 1.0, md5(b'fooa').hexdigest()),
+            paths['b']: (4, 1.0, 'changed')
+        }
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _s3_files=DEFAULT,
+            _update_manifest=DEFAULT
+        ) as mocks:
+            mocks['_s3_files'].return_value = s3_files
+            res = self.cls.run([str(tmpdir.join('src'))])
+        m_put = self.mock_s3.return_value.put_file
+        assert sorted(c[1][0] for c in m_put.mock_calls) == [
+            paths['b'], paths['c']
+        ]
+        for c in m_put.mock_calls:
+            assert c[1][1] == 4
+            assert c[1][3] == md5(
+                ('foo%s' % os.path.basename(c[1][0])).encode()
+            ).hexdigest()
+        to_upload = mocks['_update_manifest'].mock_calls[0][1][2]
+        assert sorted(to_upload.keys()) == [paths['b'], paths['c']]
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, s3_files, to_upload, [], deleted=None)
+        ]
+        assert res.total_files == 3
+        assert res.total_bytes == 12
+        assert res.files_uploaded == 2
+        assert res.bytes_uploaded == 8
+        assert res.error_files == []
+        assert res.meta_error_files == []
+        assert [x[0] for x in res.stage_times] == [
+            'scan', 'S3 query', 'cache check', 'hash', 'compare', 'upload'
+        ]
+        for _, start, end in res.stage_times:
+            assert start <= end
+
+    def test_size_mtime(self, tmpdir):
+        paths = self.make_files(tmpdir)
+        st = dict((k, os.stat(v)) for k, v in paths.items())
+        s3_files = {
+            paths['a']: (4, st['a'].st_mtime, 'trusted'),
+            paths['b']: (4, 1.0, md5(b'foob').hexdigest())
+        }
+        self.cls._compare = 'size-mtime-then-checksum'
+        with patch('%s.md5_file' % pbm, wraps=md5_file) as mock_md5:
+            with patch.multiple(
+                pb,
+                autospec=True,
+                _s3_files=DEFAULT,
+                _update_manifest=DEFAULT
+            ) as mocks:
+                mocks['_s3_files'].return_value = s3_files
+                res = self.cls.run([str(tmpdir.join('src'))])
+        assert sorted(c[1][0] for c in mock_md5.mock_calls) == [
+            paths['b'], paths['c']
+        ]
+        m_put = self.mock_s3.return_value.put_file
+        assert [c[1][0] for c in m_put.mock_calls] == [paths['c']]
+        assert res.total_files == 3
+        # with size-mtime, b is uploaded too, though its md5sum is the same
+        self.cls._compare = 'size-mtime'
+        m_put.reset_mock()
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _s3_files=DEFAULT,
+            _update_manifest=DEFAULT
+        ) as mocks:
+            mocks['_s3_files'].return_value = s3_files
+            self.cls.run([str(tmpdir.join('src'))])
+        assert sorted(c[1][0] for c in m_put.mock_calls) == [
+            paths['b'], paths['c']
+        ]
+
+    def test_delete(self, tmpdir):
+        paths = self.make_files(tmpdir)
+        src = str(tmpdir.join('src'))
+        s3_files = {
+            paths['a']: (4, 1.0, md5(b'fooa').hexdigest()),
+            src + '/gone': (4, 1.0, 'x'),
+            '/elsewhere': (4, 1.0, 'y')
+        }
+        self.cls._delete = True
+        self.mock_s3.return_value.delete_files.return_value = []
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _s3_files=DEFAULT,
+            _update_manifest=DEFAULT
+        ) as mocks:
+            mocks['_s3_files'].return_value = s3_files
+            res = self.cls.run([src])
+        assert self.mock_s3.return_value.delete_files.mock_calls == [
+            call([src + '/gone'], workers=3)
+        ]
+        to_upload = mocks['_update_manifest'].mock_calls[0][1][2]
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, s3_files, to_upload, [], deleted=[src + '/gone'])
+        ]
+        assert res.deleted_files == [src + '/gone']
+
+    def test_errors(self, tmpdir):
+        paths = self.make_files(tmpdir)
+
+        def se_md5(p, **kwargs):
+            if p == paths['a']:
+                raise IOError('vanished')
+            return 'md5'
+
+        def se_put(path, size, mtime, md5sum):
+            if path == paths['b']:
+                raise RuntimeError('foo')
+
+        self.mock_s3.return_value.put_file.side_effect = se_put
+        with patch('%s.md5_file' % pbm, autospec=True) as mock_md5:
+            mock_md5.side_effect = se_md5
+            with patch.multiple(
+                pb,
+                autospec=True,
+                _s3_files=DEFAULT,
+                _update_manifest=DEFAULT
+            ) as mocks:
+                mocks['_s3_files'].return_value = {}
+                res = self.cls.run([str(tmpdir.join('src'))])
+        assert res.total_files == 3
+        assert res.files_uploaded == 2
+        assert res.bytes_uploaded == 4
+        assert res.error_files == [paths['b']]
+        assert res.meta_error_files == [paths['a']]
+
+    def test_s3_error(self, tmpdir):
+        self.make_files(tmpdir)
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _s3_files=DEFAULT,
+            _update_manifest=DEFAULT
+        ) as mocks:
+            mocks['_s3_files'].side_effect = RuntimeError('s3 error')
+            with pytest.raises(RuntimeError) as exc:
+                self.cls.run([str(tmpdir.join('src'))])
+        assert str(exc.value) == 's3 error'
+        assert self.mock_s3.return_value.put_file.mock_calls == []
+        assert mocks['_update_manifest'].mock_calls == []
+
+    def test_hash_cache(self, tmpdir):
+        paths = self.make_files(tmpdir)
+        old = time.time() - 60
+        for p in paths.values():
+            os.utime(p, (old, old))
+        self.cls._hash_cache = HashCache(str(tmpdir.join('hc.sqlite')))
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _s3_files=DEFAULT,
+            _update_manifest=DEFAULT
+        ) as mocks:
+            mocks['_s3_files'].return_value = {}
+            res1 = self.cls.run([str(tmpdir.join('src'))])
+            res2 = self.cls.run([str(tmpdir.join('src'))])
+        assert res1.hash_cache_misses == 3
+        assert res2.hash_cache_hits == 3
+        assert res2.files_uploaded == 3
+
+    def test_processes(self, tmpdir):
+        paths = self.make_files(tmpdir)
+        self.cls._hash_processes = True
+        with patch(
+            '%s.ProcessPoolExecutor' % pbm, wraps=ThreadPoolExecutor
+        ) as mock_ppe:
+            with patch.multiple(
+                pb,
+                autospec=True,
+                _s3_files=DEFAULT,
+                _update_manifest=DEFAULT
+            ) as mocks:
+                mocks['_s3_files'].return_value = {}
+                res = self.cls.run([paths['a']])
+        assert mock_ppe.mock_calls[0] == call(max_workers=2)
+        assert res.files_uploaded == 1
+
+
+class TestPlan(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer('bname', prefix='pfx', delete=True)
+            self.mock_s3 = mock_s3
+
+    def test_plan(self):
+        local_files = {'one': (1, 2, 'three'), 'two': (4, 5, 'NOTsix')}
+        s3_files = {'one': (1, 2, 'three'), 'two': (4, 5, 'six'),
+                    'gone': (7, 8, 'nine')}
+        to_upload = {'two': (4, 5, 'NOTsix')}
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _list_all_files=DEFAULT,
+            _file_meta=DEFAULT,
+            _files_to_upload=DEFAULT,
+            _upload_files=DEFAULT,
+            _s3_files=DEFAULT,
+            _update_manifest=DEFAULT,
+            _paths_to_delete=DEFAULT
+        ) as mocks:
+            mocks['_list_all_files'].return_value = {'one': 1, 'two': 2}
+            mocks['_file_meta'].return_value = local_files
+            mocks['_files_to_upload'].return_value = to_upload
+            mocks['_s3_files'].return_value = s3_files
+            mocks['_paths_to_delete'].return_value = (['gone'], 0)
+            res = self.cls.plan(['a'], exclude_paths=['b'])
+        assert mocks['_file_meta'].mock_calls == [
+            call(self.cls, {'one': 1, 'two': 2})
+        ]
+        assert mocks['_files_to_upload'].mock_calls == [
+            call(self.cls, local_files, s3_files)
+        ]
+        assert mocks['_paths_to_delete'].mock_calls == [
+            call(self.cls, s3_files, ['a'], ['b'])
+        ]
+        assert mocks['_upload_files'].mock_calls == []
+        assert mocks['_update_manifest'].mock_calls == []
+        assert self.mock_s3.return_value.mock_calls == []
+        assert res.bucket_name == 'bname'
+        assert res.prefix == 'pfx'
+        assert res.uploads == to_upload
+        assert res.deletes == ['gone']
+
+    def test_plan_size_mtime(self):
+        self.cls._delete = False
+        self.cls._compare = 'size-mtime'
+        s3_files = {'one': (1, 2, 'three')}
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _list_all_files=DEFAULT,
+            _file_meta=DEFAULT,
+            _files_to_upload=DEFAULT,
+            _s3_files=DEFAULT,
+            _paths_to_delete=DEFAULT
+        ) as mocks:
+            mocks['_list_all_files'].return_value = {'one': 1}
+            mocks['_file_meta'].return_value = {}
+            mocks['_files_to_upload'].return_value = {}
+            mocks['_s3_files'].return_value = s3_files
+            res = self.cls.plan(['a'])
+        assert mocks['_file_meta'].mock_calls == [
+            call(self.cls, {'one': 1}, s3_files=s3_files)
+        ]
+        assert mocks['_paths_to_delete'].mock_calls == []
+        assert res.uploads == {}
+        assert res.deletes == []
+
+
+class TestApply(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer('bname', upload_workers=2)
+            self.mock_s3 = mock_s3
+
+    def test_apply(self, tmpdir):
+        same = tmpdir.join('same')
+        same.write('abc')
+        changed = tmpdir.join('changed')
+        changed.write('abcd')
+        back = tmpdir.join('back')
+        back.write('x')
+        st = os.stat(str(same))
+        plan = Plan('bname', uploads={
+            str(same): (3, st.st_mtime, 'md5same'),
+            str(changed): (3, st.st_mtime, 'md5changed'),
+            str(tmpdir.join('missing')): (1, 1.0, 'md5missing')
+        }, deletes=[str(tmpdir.join('gone')), str(back)])
+        s3_files = {'foo': (1, 2, 'bar')}
+        self.mock_s3.return_value.delete_files.return_value = []
+        with patch('%s.dtnow' % pbm, autospec=True) as mock_dtnow:
+            mock_dtnow.return_value = 'dt'
+            with patch('%s.RunStats' % pbm, autospec=True) as mock_stats:
+                with patch.multiple(
+                    pb,
+                    autospec=True,
+                    _upload_files=DEFAULT,
+                    _s3_files=DEFAULT,
+                    _update_manifest=DEFAULT
+                ) as mocks:
+                    mocks['_s3_files'].return_value = s3_files
+                    mocks['_upload_files'].return_value = ([], 3)
+                    res = self.cls.apply(plan)
+        to_upload = {str(same): (3, st.st_mtime, 'md5same')}
+        assert mocks['_upload_files'].mock_calls == [
+            call(self.cls, to_upload, s3_files=s3_files)
+        ]
+        assert self.mock_s3.return_value.delete_files.mock_calls == [
+            call([str(tmpdir.join('gone'))], workers=2)
+        ]
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, s3_files, to_upload, [],
+                 deleted=[str(tmpdir.join('gone'))])
+        ]
+        skipped = [
+            str(changed), str(tmpdir.join('missing')), str(back)
+        ]
+        assert len(mock_stats.mock_calls) == 1
+        assert res == mock_stats.return_value
+        args, kwargs = mock_stats.mock_calls[0][1:]
+        assert args[6:] == (3, 1, [], 7, 3)
+        assert sorted(kwargs.pop('skipped_files')) == sorted(skipped)
+        assert kwargs == {
+            'dry_run': False,
+            'upload_busy_seconds': None,
+            'deleted_files': [str(tmpdir.join('gone'))],
+            'delete_errors': [],
+            'concurrency_history': {'upload': self.cls._upload_limiter.history},
+            'upload_order': 'path',
+            'upload_makespans': None,
+            'copied_files': None,
+            'copied_size_b': 0,
+            'wire_size_b': None
+        }
+
+    def test_apply_no_deletes(self):
+        plan = Plan('bname')
+        with patch('%s.RunStats' % pbm, autospec=True) as mock_stats:
+            with patch.multiple(
+                pb,
+                autospec=True,
+                _upload_files=DEFAULT,
+                _s3_files=DEFAULT,
+                _update_manifest=DEFAULT
+            ) as mocks:
+                mocks['_s3_files'].return_value = {}
+                mocks['_upload_files'].return_value = ([], 0)
+                self.cls.apply(plan)
+        assert self.mock_s3.return_value.delete_files.mock_calls == []
+        assert mocks['_update_manifest'].mock_calls == [
+            call(self.cls, {}, {}, [], deleted=None)
+        ]
+        assert mock_stats.mock_calls[0][2]['skipped_files'] == []
+
+
+class TestUpdateManifest(object):
+
+    def setup(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True) as mock_s3:
+            self.cls = FileSyncer('bname')
+            self.mock_s3 = mock_s3
+
+    def test_update(self):
+        self.cls.s3.manifest_loaded = True
+        s3_files = {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six')
+        }
+        uploaded = {
+            'two': (4, 5, 'NOTsix'),
+            'three': (6, 7, 'eight'),
+            'four': (8, 9, 'ten')
+        }
+        self.cls._update_manifest(s3_files, uploaded, ['four'])
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call({
+                'one': (1, 2, 'three'),
+                'two': (4, 5, 'NOTsix'),
+                'three': (6, 7, 'eight')
+            })
+        ]
+        assert s3_files == {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six')
+        }
+
+    def test_update_deleted(self):
+        self.cls.s3.manifest_loaded = True
+        s3_files = {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six')
+        }
+        self.cls._update_manifest(s3_files, {}, [], deleted=['two'])
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call({'one': (1, 2, 'three')})
+        ]
+        assert len(s3_files) == 2
+
+    def test_update_refreshed(self):
+        self.cls.s3.manifest_loaded = True
+        s3_files = {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six')
+        }
+        self.cls._update_manifest(
+            s3_files, {}, [], refreshed={'two': (4, 9, 'six')}
+        )
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call({'one': (1, 2, 'three'), 'two': (4, 9, 'six')})
+        ]
+
+    def test_update_deleted_compact(self):
+        self.cls.s3.manifest_loaded = True
+        s3_files = FileMetaTable({
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six')
+        })
+        self.cls._update_manifest(
+            s3_files, {'three': (6, 7, 'eight')}, [], deleted=['two']
+        )
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call(s3_files)
+        ]
+        assert s3_files == {
+            'one': (1, 2, 'three'),
+            'three': (6, 7, 'eight')
+        }
+
+    def test_update_compact(self):
+        self.cls.s3.manifest_loaded = True
+        s3_files = FileMetaTable({
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'six')
+        })
+        uploaded = {
+            'two': (4, 5, 'NOTsix'),
+            'three': (6, 7, 'eight')
+        }
+        self.cls._update_manifest(s3_files, uploaded, [])
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call(s3_files)
+        ]
+        # updated in place rather than copied
+        assert s3_files == {
+            'one': (1, 2, 'three'),
+            'two': (4, 5, 'NOTsix'),
+            'three': (6, 7, 'eight')
+        }
+
+    def test_no_changes(self):
+        self.cls.s3.manifest_loaded = True
+        self.cls._update_manifest(
+            {'one': (1, 2, 'three')}, {'two': (1, 2, 'x')}, ['two']
+        )
+        assert self.mock_s3.return_value.put_manifest.mock_calls == []
+
+    def test_bundles_changed(self):
+        self.cls.s3.manifest_loaded = True
+        self.cls._bundles_changed = True
+        self.cls._update_manifest({'one': (1, 2, 'three')}, {}, [])
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call({'one': (1, 2, 'three')})
+        ]
+
+    def test_not_loaded(self):
+        self.cls.s3.manifest_loaded = False
+        self.cls._update_manifest({'one': (1, 2, 'three')}, {}, [])
+        assert self.mock_s3.return_value.put_manifest.mock_calls == [
+            call({'one': (1, 2, 'three')})
+        ]
+
+    def test_error(self):
+        self.cls.s3.manifest_loaded = False
+        self.mock_s3.return_value.put_manifest.side_effect = RuntimeError()
+        with patch('%s.logger' % pbm) as mock_logger:
+            self.cls._update_manifest({}, {}, [])
+        assert len(mock_logger.error.mock_calls) == 1
+
 
 class TestRestore(object):
 
@@ -458,12 +2143,12 @@ class TestRestore(object):
 
     def test_simple(self):
         s3files = {
-            '/foo': {},
-            '/bar/baz/blarg1': {},
-            '/bar/baz/blarg2': {},
-            '/bar/baz/blarg/quux': {},
-            '/baz': {},
-            '/blam': {}
+            '/foo': {'size_b': '1'},
+            '/bar/baz/blarg1': {'size_b': '2'},
+            '/bar/baz/blarg2': {'size_b': '3'},
+            '/bar/baz/blarg/quux': {'size_b': '4'},
+            '/baz': {'size_b': '5'},
+            '/blam': {'size_b': '6'}
         }
         restore_paths = [
             '/foo',
@@ -487,26 +2172,26 @@ class TestRestore(object):
         ]
         assert ms3.mock_calls == [
             call.get_filelist(),
-            call.get_file('/foo', '/l/p'),
-            call.get_file('/bar/baz/blarg1', '/l/p'),
-            call.get_file('/bar/baz/blarg2', '/l/p'),
-            call.get_file('/bar/baz/blarg/quux', '/l/p'),
+            call.get_file('/foo', '/l/p', size_b=1),
+            call.get_file('/bar/baz/blarg1', '/l/p', size_b=2),
+            call.get_file('/bar/baz/blarg2', '/l/p', size_b=3),
+            call.get_file('/bar/baz/blarg/quux', '/l/p', size_b=4),
         ]
 
     def test_error(self):
 
-        def se_get(fpath, local_prefix):
+        def se_get(fpath, local_prefix, size_b=None):
             if fpath == '/bar/baz/blarg1':
                 raise RuntimeError('foo')
             return None
 
         s3files = {
-            '/foo': {},
-            '/bar/baz/blarg1': {},
-            '/bar/baz/blarg2': {},
-            '/bar/baz/blarg/quux': {},
-            '/baz': {},
-            '/blam': {}
+            '/foo': {'size_b': '1'},
+            '/bar/baz/blarg1': {'size_b': '2'},
+            '/bar/baz/blarg2': {'size_b': '3'},
+            '/bar/baz/blarg/quux': {'size_b': '4'},
+            '/baz': {'size_b': '5'},
+            '/blam': {'size_b': '6'}
         }
         restore_paths = [
             '/foo',
@@ -531,11 +2216,59 @@ class TestRestore(object):
         ]
         assert ms3.mock_calls == [
             call.get_filelist(),
-            call.get_file('/foo', '/l/p'),
-            call.get_file('/bar/baz/blarg1', '/l/p'),
-            call.get_file('/bar/baz/blarg2', '/l/p'),
-            call.get_file('/bar/baz/blarg/quux', '/l/p'),
+            call.get_file('/foo', '/l/p', size_b=1),
+            call.get_file('/bar/baz/blarg1', '/l/p', size_b=2),
+            call.get_file('/bar/baz/blarg2', '/l/p', size_b=3),
+            call.get_file('/bar/baz/blarg/quux', '/l/p', size_b=4),
+        ]
+
+    def test_concurrent(self):
+        s3files = dict(
+            ('/f/%d' % i, {'size_b': '%d' % i}) for i in range(50)
+        )
+        self.cls._download_workers = 8
+        ms3 = self.mock_s3.return_value
+        ms3.get_filelist.return_value = s3files
+
+        def se_get(fpath, local_prefix, size_b=None):
+            if size_b % 10 == 0:
+                raise RuntimeError('foo')
+
+        ms3.get_file.side_effect = se_get
+        with patch('%s._make_restore_file_list' % pb,
+                   autospec=True) as mock_mrfl:
+            mock_mrfl.return_value = sorted(s3files.keys())
+            res = self.cls.restore('/l/p', ['/f'])
+        assert sorted(res) == sorted('/f/%d' % i for i in range(0, 50, 10))
+        assert len(ms3.get_file.mock_calls) == 50
+
+    def test_get_file_throttled(self):
+        ms3 = self.mock_s3.return_value
+        ms3.get_file.side_effect = [throttle_error(), None]
+        with patch('s3sfe.concurrency.time.sleep') as mock_sleep:
+            with patch('s3sfe.concurrency.logger'):
+                self.cls._get_file('/foo', '/l/p', 123)
+        assert ms3.get_file.mock_calls == [
+            call('/foo', '/l/p', size_b=123),
+            call('/foo', '/l/p', size_b=123)
         ]
+        assert len(mock_sleep.mock_calls) == 1
+
+
+class TestConcurrencyHistory(object):
+
+    def test_none(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            cls = FileSyncer('bname')
+        assert cls._concurrency_history() is None
+
+    def test_history(self):
+        with patch('%s.S3Wrapper' % pbm, autospec=True):
+            cls = FileSyncer('bname', upload_workers=8, head_workers=4)
+        assert cls._concurrency_history() == {
+            'HEAD': cls._head_limiter.history,
+            'upload': cls._upload_limiter.history
+        }
 
 
 class TestMakeRestoreFileList(object):
@@ -587,8 +2320,22 @@ class TestS3Files(object):
             }
         }
         self.mock_s3.return_value.get_filelist.return_value = s3files
+        self.cls._rebuild_manifest = True
         res = self.cls._s3_files()
         assert res == {
             '/foo': (0, 0.0, None),
             '/bar': (1234, 1234.5678, 'foobar')
         }
+        assert self.mock_s3.return_value.get_filelist.mock_calls == [
+            call(rebuild_manifest=True)
+        ]
+        assert s3files == {}
+
+    def test_compact(self):
+        self.mock_s3.return_value.get_filelist.return_value = {
+            '/bar': {'size_b': '1234', 'mtime': '1234.5678', 'md5sum': 'foo'}
+        }
+        self.cls._compact_metadata = True
+        res = self.cls._s3_files()
+        assert isinstance(res, FileMetaTable)
+        assert res == {'/bar': (1234, 1234.5678, 'foo')}
@@ -0,0 +1,175 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import os
+import sys
+import threading
+
+from s3sfe.hashcache import HashCache, default_cache_path, stat_ns
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 's3sfe.hashcache'
+
+
+def fake_stat(dev=1, ino=2, size=3, mtime=1000.5, ctime=1001.5):
+    return Mock(
+        st_dev=dev, st_ino=ino, st_size=size, st_mtime=mtime, st_ctime=ctime,
+        st_mtime_ns=int(mtime * 1000000000),
+        st_ctime_ns=int(ctime * 1000000000)
+    )
+
+
+class TestDefaultCachePath(object):
+
+    def test_xdg(self):
+        with patch.dict('%s.os.environ' % pbm, {'XDG_CACHE_HOME': '/xdg'}):
+            assert default_cache_path() == '/xdg/s3sfe/hashcache.sqlite'
+
+    def test_home(self):
+        with patch.dict('%s.os.environ' % pbm, {'XDG_CACHE_HOME': ''}):
+            with patch('%s.os.path.expanduser' % pbm) as mock_eu:
+                mock_eu.return_value = '/home/me'
+                res = default_cache_path()
+        assert res == '/home/me/.cache/s3sfe/hashcache.sqlite'
+
+
+class TestStatNs(object):
+
+    def test_ns(self):
+        assert stat_ns(fake_stat(mtime=2.5), 'mtime') == 2500000000
+
+    def test_no_ns(self):
+        st = Mock(spec_set=['st_mtime'], st_mtime=2.5)
+        assert stat_ns(st, 'mtime') == 2500000000
+
+
+class TestHashCache(object):
+
+    def test_creates_directory(self, tmpdir):
+        path = str(tmpdir.join('a', 'b', 'cache.sqlite'))
+        HashCache(path).close()
+        assert os.path.exists(path)
+
+    def test_miss_then_hit(self, tmpdir):
+        path = str(tmpdir.join('cache.sqlite'))
+        st = fake_stat()
+        c = HashCache(path)
+        assert c.get('/foo', st) is None
+        c.set('/foo', st, 'abcd')
+        c.close()
+        c = HashCache(path)
+        assert c.get('/foo', st) == 'abcd'
+        assert c.hits == 1
+        assert c.misses == 0
+
+    def test_stale(self, tmpdir):
+        c = HashCache(str(tmpdir.join('cache.sqlite')))
+        c.set('/foo', fake_stat(), 'abcd')
+        assert c.get('/foo', fake_stat(size=4)) is None
+        assert c.get('/foo', fake_stat(ino=9)) is None
+        assert c.get('/foo', fake_stat(mtime=1000.6)) is None
+        assert c.get('/foo', fake_stat(ctime=1001.6)) is None
+        assert c.get('/foo', fake_stat()) == 'abcd'
+        assert c.hits == 1
+        assert c.misses == 4
+
+    def test_rehash(self, tmpdir):
+        path = str(tmpdir.join('cache.sqlite'))
+        c = HashCache(path)
+        c.set('/foo', fake_stat(), 'abcd')
+        c.close()
+        c = HashCache(path, rehash=True)
+        assert c.get('/foo', fake_stat()) is None
+        c.set('/foo', fake_stat(), 'efgh')
+        c.close()
+        assert HashCache(path).get('/foo', fake_stat()) == 'efgh'
+
+    def test_set_recently_modified(self, tmpdir):
+        c = HashCache(str(tmpdir.join('cache.sqlite')))
+        with patch('%s.time.time' % pbm) as mock_time:
+            mock_time.return_value = 1001.0
+            c.set('/foo', fake_stat(), 'abcd')
+        assert c.get('/foo', fake_stat()) is None
+
+    def test_commit_every(self, tmpdir):
+        c = HashCache(str(tmpdir.join('cache.sqlite')))
+        c.commit_every = 2
+        with patch.object(c, 'commit') as mock_commit:
+            c.set('/foo', fake_stat(), 'abcd')
+            assert mock_commit.mock_calls == []
+            c.set('/bar', fake_stat(), 'abcd')
+            assert mock_commit.mock_calls == [call()]
+
+    def test_evict(self, tmpdir):
+        exists = tmpdir.join('exists')
+        exists.write('foo')
+        c = HashCache(str(tmpdir.join('cache.sqlite')))
+        c.set(str(exists), fake_stat(), 'aaaa')
+        c.set('/current', fake_stat(), 'bbbb')
+        c.set(str(tmpdir.join('gone')), fake_stat(), 'cccc')
+        assert c.evict(set(['/current'])) == 1
+        assert c.get(str(exists), fake_stat()) == 'aaaa'
+        assert c.get('/current', fake_stat()) == 'bbbb'
+        assert c.get(str(tmpdir.join('gone')), fake_stat()) is None
+
+    def test_threads(self, tmpdir):
+        c = HashCache(str(tmpdir.join('cache.sqlite')))
+        c.commit_every = 7
+
+        def work(n):
+            for i in range(50):
+                path = '/t%d/%d' % (n, i)
+                c.get(path, fake_stat())
+                c.set(path, fake_stat(), 'sum%d' % i)
+
+        threads = [threading.Thread(target=work, args=(n, )) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        c.commit()
+        assert c.misses == 200
+        assert c.get('/t3/49', fake_stat()) == 'sum49'
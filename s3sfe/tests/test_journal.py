@@ -0,0 +1,148 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import os
+import sys
+import threading
+
+from s3sfe.journal import UploadJournal, default_journal_path
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 's3sfe.journal'
+
+
+class TestDefaultJournalPath(object):
+
+    def test_xdg(self):
+        with patch.dict('%s.os.environ' % pbm, {'XDG_CACHE_HOME': '/xdg'}):
+            assert default_journal_path() == '/xdg/s3sfe/uploads.sqlite'
+
+    def test_home(self):
+        with patch.dict('%s.os.environ' % pbm, {'XDG_CACHE_HOME': ''}):
+            with patch('%s.os.path.expanduser' % pbm) as mock_eu:
+                mock_eu.return_value = '/home/me'
+                res = default_journal_path()
+        assert res == '/home/me/.cache/s3sfe/uploads.sqlite'
+
+
+class TestUploadJournal(object):
+
+    def test_creates_directory(self, tmpdir):
+        path = str(tmpdir.join('a', 'b', 'uploads.sqlite'))
+        UploadJournal(path).close()
+        assert os.path.exists(path)
+
+    def test_get_missing(self, tmpdir):
+        j = UploadJournal(str(tmpdir.join('uploads.sqlite')))
+        assert j.get('bkt', 'foo') is None
+
+    def test_start_parts_persist(self, tmpdir):
+        path = str(tmpdir.join('uploads.sqlite'))
+        j = UploadJournal(path)
+        j.start('bkt', 'pre/foo', 'uid1', '/foo', 8, 20, 1000.5, 'abcd')
+        j.add_part('uid1', 1, '"e1"')
+        j.add_part('uid1', 3, '"e3"')
+        j.add_part('uid1', 1, '"e1b"')
+        j.close()
+        j = UploadJournal(path)
+        assert j.get('bkt', 'pre/foo') == {
+            'upload_id': 'uid1',
+            'path': '/foo',
+            'part_size': 8,
+            'size': 20,
+            'mtime': 1000.5,
+            'md5': 'abcd',
+            'parts': {1: '"e1b"', 3: '"e3"'}
+        }
+        assert j.get('otherbkt', 'pre/foo') is None
+
+    def test_start_replaces(self, tmpdir):
+        j = UploadJournal(str(tmpdir.join('uploads.sqlite')))
+        j.start('bkt', 'foo', 'uid1', '/foo', 8, 20, 1000.5, 'abcd')
+        j.add_part('uid1', 1, '"e1"')
+        j.start('bkt', 'foo', 'uid2', '/foo', 8, 30, 1001.5, 'ef01')
+        res = j.get('bkt', 'foo')
+        assert res['upload_id'] == 'uid2'
+        assert res['size'] == 30
+        assert res['parts'] == {}
+
+    def test_finish(self, tmpdir):
+        j = UploadJournal(str(tmpdir.join('uploads.sqlite')))
+        j.start('bkt', 'foo', 'uid1', '/foo', 8, 20, 1000.5, 'abcd')
+        j.add_part('uid1', 1, '"e1"')
+        j.start('bkt', 'bar', 'uid2', '/bar', 8, 20, 1000.5, 'abcd')
+        j.finish('bkt', 'foo')
+        j.finish('bkt', 'baz')
+        assert j.get('bkt', 'foo') is None
+        assert j.get('bkt', 'bar') is not None
+        assert j._conn.execute('SELECT COUNT(*) FROM parts').fetchone()[0] == 0
+
+    def test_uploads(self, tmpdir):
+        j = UploadJournal(str(tmpdir.join('uploads.sqlite')))
+        j.start('bkt', 'foo', 'uid1', '/foo', 8, 20, 1000.5, 'abcd')
+        j.start('bkt', 'bar', 'uid2', '/bar', 8, 30, 1001.5, 'abcd')
+        j.start('other', 'baz', 'uid3', '/baz', 8, 30, 1001.5, 'abcd')
+        assert j.uploads('bkt') == [
+            ('bar', 'uid2', '/bar', 30, 1001.5),
+            ('foo', 'uid1', '/foo', 20, 1000.5)
+        ]
+
+    def test_threads(self, tmpdir):
+        j = UploadJournal(str(tmpdir.join('uploads.sqlite')))
+        j.start('bkt', 'foo', 'uid1', '/foo', 8, 400, 1000.5, 'abcd')
+
+        def worker(n):
+            for i in range(10):
+                j.add_part('uid1', n * 10 + i + 1, '"e%d"' % i)
+
+        threads = [
+            threading.Thread(target=worker, args=(n, )) for n in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(j.get('bkt', 'foo')['parts']) == 50
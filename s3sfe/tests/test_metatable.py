@@ -0,0 +1,157 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+from hashlib import md5
+
+import pytest
+
+from s3sfe.metatable import FileMetaTable
+
+
+def digest(i):
+    return md5(str(i).encode('ascii')).hexdigest()
+
+
+class TestFileMetaTable(object):
+
+    def test_empty(self):
+        t = FileMetaTable()
+        assert len(t) == 0
+        assert list(t) == []
+        assert '/foo' not in t
+        with pytest.raises(KeyError):
+            t['/foo']
+
+    def test_set_get(self):
+        t = FileMetaTable()
+        t['/foo/bar'] = (123, 1489000000.123456, digest(1))
+        t['/foo/baz'] = (0, 0.5, digest(2))
+        t['relative'] = (7, 2.0, digest(3))
+        assert len(t) == 3
+        assert t['/foo/bar'] == (123, 1489000000.123456, digest(1))
+        assert t['/foo/baz'] == (0, 0.5, digest(2))
+        assert t['relative'] == (7, 2.0, digest(3))
+        assert t._dirs == ['/foo/', '']
+        assert len(t._md5) == 48
+
+    def test_replace(self):
+        t = FileMetaTable()
+        t['/foo/bar'] = (123, 1.0, digest(1))
+        t['/foo/bar'] = (456, 2.0, digest(2))
+        assert len(t) == 1
+        assert t['/foo/bar'] == (456, 2.0, digest(2))
+
+    def test_delete(self):
+        expected = {}
+        t = FileMetaTable()
+        for i in range(100):
+            expected['/d%d/f%d' % (i % 3, i)] = (i, 1.0, digest(i))
+            t['/d%d/f%d' % (i % 3, i)] = (i, 1.0, digest(i))
+        for i in range(0, 100, 2):
+            del t['/d%d/f%d' % (i % 3, i)]
+            del expected['/d%d/f%d' % (i % 3, i)]
+        with pytest.raises(KeyError):
+            del t['/d0/f0']
+        assert len(t) == 50
+        assert '/d0/f0' not in t
+        assert dict(t.items()) == expected
+        assert sorted(t) == sorted(expected)
+        t['/d0/f0'] = (7, 7.0, 'odd')
+        assert t['/d0/f0'] == (7, 7.0, 'odd')
+        assert len(t) == 51
+        for i in range(100, 1000):
+            t['/d/f%d' % i] = (i, 1.0, digest(i))
+        assert len(t) == 951
+        assert '/d0/f2' not in t
+        assert t['/d1/f1'] == (1, 1.0, digest(1))
+
+    def test_odd_md5(self):
+        t = FileMetaTable()
+        t['/a'] = (1, 1.0, None)
+        t['/b'] = (1, 1.0, 'abcd')
+        t['/c'] = (1, 1.0, digest(1).upper())
+        t['/d'] = (1, 1.0, 'z' * 32)
+        assert t['/a'][2] is None
+        assert t['/b'][2] == 'abcd'
+        assert t['/c'][2] == digest(1).upper()
+        assert t['/d'][2] == 'z' * 32
+        t['/b'] = (1, 1.0, digest(2))
+        assert t['/b'][2] == digest(2)
+        assert 1 not in t._odd_md5
+
+    def test_many(self):
+        expected = {}
+        t = FileMetaTable()
+        for i in range(5000):
+            path = '/home/u/d%d/s%d/f%d' % (i % 13, i % 7, i)
+            expected[path] = (i, 1489000000.0 + i / 7.0, digest(i))
+            t[path] = expected[path]
+        assert len(t) == 5000
+        assert len(t._slots) == 16384
+        assert len(t._dirs) == 91
+        assert dict(t.items()) == expected
+        assert sorted(t) == sorted(expected)
+        assert sorted(t.keys()) == sorted(expected.keys())
+        for k, v in expected.items():
+            assert k in t
+            assert t[k] == v
+        assert '/home/u/d1/s1/nope' not in t
+        assert '/nope/f1' not in t
+        assert t.get('/nope') is None
+
+    def test_init_items(self):
+        d = {'/a/b': (1, 2.0, digest(1)), '/c': (3, 4.0, digest(2))}
+        assert dict(FileMetaTable(d).items()) == d
+        assert dict(FileMetaTable(d.items()).items()) == d
+        assert FileMetaTable(d) == d
+
+    def test_unicode_and_bytes(self):
+        t = FileMetaTable()
+        path = u'/f\xf6\xf6/b\xe4r'
+        t[path] = (1, 1.0, digest(1))
+        assert list(t) == [path]
+        b = FileMetaTable()
+        b[b'/foo/bar'] = (1, 1.0, digest(1))
+        assert list(b) == [b'/foo/bar']
+        assert b[b'/foo/bar'] == (1, 1.0, digest(1))
+
+    def test_double_slash(self):
+        t = FileMetaTable()
+        t['/a//b'] = (1, 1.0, digest(1))
+        t['/a/b'] = (2, 1.0, digest(1))
+        assert sorted(t) == ['/a//b', '/a/b']
+        assert t['/a//b'][0] == 1
@@ -0,0 +1,272 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import re
+
+import pytest
+
+from s3sfe.pathfilter import (
+    PrefixMatcher, PathMatcher, minimal_paths, glob_to_regex, MAX_GROUPS
+)
+
+
+class TestPrefixMatcher(object):
+
+    def test_minimal(self):
+        m = PrefixMatcher([
+            '/foo/bar/', '/foo/bar/baz', '/a', '/foo/b', '/x/', '/a'
+        ])
+        assert m.prefixes == ['/a', '/foo/b', '/x/']
+        assert len(m) == 3
+
+    def test_empty(self):
+        m = PrefixMatcher([])
+        assert m.match('/foo') is None
+        assert m.match_dir('/foo') is None
+
+    def test_match(self):
+        m = PrefixMatcher(['/foo/bar/', '/foo/baz', '/zzz'])
+        assert m.match('/foo/bar/one') == '/foo/bar/'
+        assert m.match('/foo/barzzz') is None
+        assert m.match('/foo/bazzz') == '/foo/baz'
+        assert m.match('/foo/bar') is None
+        assert m.match('/a') is None
+        assert m.match('/zzzz') == '/zzz'
+
+    def test_match_same_as_startswith(self):
+        prefixes = ['/a/b', '/a/b-c/', '/a/bc', '/b/', '/a/b/c', '/c']
+        m = PrefixMatcher(prefixes)
+        for p in [
+            '/a/b', '/a/b/', '/a/b-c/d', '/a/bb', '/b', '/b/x', '/c/x',
+            '/a', '/a/a', '/a/b-c', '/0'
+        ]:
+            assert (m.match(p) is not None) == any(
+                p.startswith(x) for x in prefixes
+            )
+
+    def test_match_dir(self):
+        m = PrefixMatcher(['/foo/bar/', '/foo/ba', '/x/y'])
+        assert m.match_dir('/foo/bar') == '/foo/ba'
+        assert m.match_dir('/x/y') == '/x/y'
+        assert m.match_dir('/x/y/') == '/x/y'
+        assert m.match_dir('/x') is None
+
+
+class TestMinimalPaths(object):
+
+    def test_minimal_paths(self):
+        assert minimal_paths([
+            '/data/sub', '/data', '/data-x', '/data/', '/etc/foo', '/etc/foo'
+        ]) == ['/data-x', '/data', '/etc/foo']
+
+    def test_root(self):
+        assert minimal_paths(['/etc', '/', '/home/foo']) == ['/']
+
+    def test_empty(self):
+        assert minimal_paths([]) == []
+
+
+class TestGlobToRegex(object):
+
+    def check(self, pattern, path):
+        return re.match(glob_to_regex(pattern), path) is not None
+
+    def test_translate(self):
+        assert glob_to_regex('*.tmp') == r'(?:.*/)?[^/]*\.tmp(?:/.*)?$'
+        assert glob_to_regex('/a/b?c') == r'/a/b[^/]c(?:/.*)?$'
+        assert glob_to_regex('build/*/') == r'(?:.*/)?build/[^/]*/.*$'
+
+    def test_star(self):
+        assert self.check('*.log', '/var/log/foo.log')
+        assert self.check('*.log', '/var/foo.log/bar')
+        assert not self.check('*.log', '/var/foo.logs')
+        assert not self.check('/var/*.log', '/var/log/foo.log')
+        assert self.check('/var/*.log', '/var/foo.log')
+
+    def test_double_star(self):
+        assert self.check('/var/**/*.log', '/var/foo.log')
+        assert self.check('/var/**/*.log', '/var/a/b/foo.log')
+        assert not self.check('/var/**/*.log', '/usr/var/foo.log')
+        assert self.check('**/tmp/*.o', '/a/tmp/x.o')
+        assert self.check('/home/**', '/home/foo/bar')
+        assert not self.check('/home/**', '/home')
+        assert self.check('/a**z', '/a/b/z')
+
+    def test_anchoring(self):
+        assert self.check('foo/*.o', '/x/y/foo/bar.o')
+        assert not self.check('foo/*.o', '/x/y/foo/baz/bar.o')
+        assert not self.check('foo/*.o', '/x/yfoo/bar.o')
+
+    def test_dir_only(self):
+        assert self.check('/a/*/', '/a/b/c')
+        assert not self.check('/a/*/', '/a/b')
+
+    def test_char_class(self):
+        assert self.check('/a/[bc]d', '/a/cd')
+        assert not self.check('/a/[bc]d', '/a/dd')
+        assert self.check('/a/[!bc]d', '/a/dd')
+        assert not self.check('/a/[!bc]d', '/a/bd')
+        assert self.check('/a/[]]', '/a/]')
+        assert self.check('/a/[b', '/a/[b')
+
+
+class TestPathMatcher(object):
+
+    def setup(self):
+        self.patterns = [
+            '/etc/shadow',
+            '/home/foo/Downloads/',
+            '*.tmp',
+            '**/.cache/**',
+            '**/node_modules',
+            '/var/**/*.log',
+            '*.tar.gz',
+            're:.*/core\\.\\d+$',
+        ]
+        self.m = PathMatcher(self.patterns)
+
+    def test_len(self):
+        assert len(self.m) == 8
+
+    def test_fast_paths(self):
+        assert self.m._extensions == {'.tmp': '*.tmp'}
+        assert self.m._names == {'node_modules': '**/node_modules'}
+        assert self.m._dir_names == {'.cache': '**/.cache/**'}
+        assert self.m._prefixes.prefixes == [
+            '/etc/shadow', '/home/foo/Downloads/'
+        ]
+        assert [list(n.values()) for n, _ in self.m._globs] == [
+            ['*.tar.gz']
+        ]
+        assert list(self.m._anchored.keys()) == ['/var/']
+        assert list(self.m._anchored['/var/'][0][0].values()) == [
+            '/var/**/*.log'
+        ]
+        assert [list(n.values()) for n, _ in self.m._regexes] == [
+            ['re:.*/core\\.\\d+$']
+        ]
+
+    def test_match(self):
+        for path, expected in [
+            ('/etc/shadow-', '/etc/shadow'),
+            ('/etc/passwd', None),
+            ('/home/foo/Downloads/x', '/home/foo/Downloads/'),
+            ('/a/b.tmp', '*.tmp'),
+            ('/a/b.tmp/c', '*.tmp'),
+            ('/a/.tmp', '*.tmp'),
+            ('/a/.tmp/c', '*.tmp'),
+            ('/a/b.tmpx', None),
+            ('/h/.cache/x', '**/.cache/**'),
+            ('/h/.cache', None),
+            ('/x/node_modules/y/z', '**/node_modules'),
+            ('/x/node_modules', '**/node_modules'),
+            ('/var/a/b/c.log', '/var/**/*.log'),
+            ('/var/c.log', '/var/**/*.log'),
+            ('/a/x.tar.gz', '*.tar.gz'),
+            ('/a/x.gz', None),
+            ('/x/core.123', 're:.*/core\\.\\d+$'),
+            ('/x/core.12a', None),
+        ]:
+            assert self.m.match(path) == expected
+
+    def test_match_dir(self):
+        for path, expected in [
+            ('/home/foo/Downloads', '/home/foo/Downloads/'),
+            ('/home/foo', None),
+            ('/h/.cache', '**/.cache/**'),
+            ('/h/.cache/', '**/.cache/**'),
+            ('/x/node_modules', '**/node_modules'),
+            ('/a/b.tmp', '*.tmp'),
+            ('/var/a', None),
+            ('/var/a.log', '/var/**/*.log'),
+            ('/x/core.1', None),
+        ]:
+            assert self.m.match_dir(path) == expected
+
+    def test_extension_dotfile_matches_regex(self):
+        # the extension fast path must agree with the pattern's regex
+        regex = re.compile(glob_to_regex('*.tmp'))
+        for path in ['/a/.tmp', '/a/b.tmp', '/a/.b.tmp', '/a/.tmpx', '/a/tmp']:
+            assert (self.m.match(path) == '*.tmp') == \
+                (regex.match(path) is not None), path
+
+    def test_anchored(self):
+        m = PathMatcher(['/a/b*/c', '/a/b/*.d', '/a/[xy]', '/a/b/c?/'])
+        assert sorted(m._anchored.keys()) == ['/a/', '/a/b/']
+        assert m.match('/a/bb/c') == '/a/b*/c'
+        assert m.match('/a/b/c') == '/a/b*/c'
+        assert m.match('/a/b/e.d') == '/a/b/*.d'
+        assert m.match('/a/y/z') == '/a/[xy]'
+        assert m.match('/a/b/cd') is None
+        assert m.match('/a/b/cd/e') == '/a/b/c?/'
+        assert m.match('/a/z') is None
+        assert m.match('/q/a/b/c') is None
+        assert m.match_dir('/a/b/cd') == '/a/b/c?/'
+        assert m.match_dir('/a/x') == '/a/[xy]'
+        assert m.match_dir('/a/b') is None
+
+    def test_empty(self):
+        m = PathMatcher([])
+        assert m.match('/foo') is None
+        assert m.match_dir('/foo') is None
+
+    def test_regex_groups(self):
+        m = PathMatcher(['re:/(a)(?P<x>b)', 're:/c(d)?', '/e/[fg]'])
+        assert m.match('/ab') == 're:/(a)(?P<x>b)'
+        assert m.match('/cd') == 're:/c(d)?'
+        assert m.match('/e/g') == '/e/[fg]'
+
+    def test_invalid(self):
+        with pytest.raises(RuntimeError) as exc:
+            PathMatcher(['re:/foo(', '/bar'])
+        assert "Invalid exclude pattern 're:/foo('" in str(exc.value)
+
+    def test_many_patterns(self):
+        # more patterns than one regex can hold groups for on py27
+        globs = ['*/g%d/*.x' % i for i in range(250)]
+        regexes = ['re:/r%d(a|b)$' % i for i in range(250)]
+        m = PathMatcher(globs + regexes)
+        assert len(m._globs) == 3
+        assert len(m._regexes) == 6
+        for names, regex in m._globs + m._regexes:
+            assert regex.groups <= MAX_GROUPS
+        for i in [0, 48, 49, 50, 99, 100, 249]:
+            assert m.match('/a/g%d/f.x' % i) == '*/g%d/*.x' % i
+            assert m.match_dir('/a/g%d/f.x' % i) == '*/g%d/*.x' % i
+            assert m.match('/r%db' % i) == 're:/r%d(a|b)$' % i
+        assert m.match('/a/g250/f.x') is None
+        assert m.match('/r250a') is None
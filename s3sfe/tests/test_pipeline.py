@@ -0,0 +1,152 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import sys
+import threading
+
+import pytest
+
+from s3sfe.pipeline import Pipeline
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+
+pbm = 's3sfe.pipeline'
+
+
+class TestPipeline(object):
+
+    def test_run(self):
+        results = []
+        lock = threading.Lock()
+        pl = Pipeline(queue_size=2)
+
+        def produce():
+            for i in range(100):
+                split.put(i)
+
+        def do_split(i):
+            if i % 2 == 0:
+                double.put(i)
+            else:
+                collect.put(i)
+
+        def do_double(i):
+            collect.put(i * 2)
+
+        def do_collect(i):
+            with lock:
+                results.append(i)
+
+        src = pl.source('produce', produce)
+        split = pl.stage('split', do_split, workers=3)
+        double = pl.stage('double', do_double, workers=4)
+        collect = pl.stage('collect', do_collect, workers=2)
+        src.feeds(split)
+        split.feeds(double, collect)
+        double.feeds(collect)
+        pl.run()
+        assert sorted(results) == sorted(
+            i * 2 if i % 2 == 0 else i for i in range(100)
+        )
+        assert [s.items for s in pl.stages] == [1, 100, 50, 100]
+        assert [x[0] for x in pl.stage_times] == [
+            'produce', 'split', 'double', 'collect'
+        ]
+        for _, start, end in pl.stage_times:
+            assert start <= end
+        assert pl.failed is False
+
+    def test_empty(self):
+        pl = Pipeline()
+        src = pl.source('produce', lambda: None)
+        m_func = Mock()
+        stage = pl.stage('consume', m_func, workers=3)
+        src.feeds(stage)
+        pl.run()
+        assert m_func.mock_calls == []
+        assert stage.start_dt == stage.end_dt
+        assert stage.end_dt is not None
+
+    def test_failure_drains(self):
+        seen = []
+        pl = Pipeline(queue_size=1)
+
+        def produce():
+            for i in range(50):
+                fail.put(i)
+
+        def do_fail(i):
+            if i == 3:
+                raise RuntimeError('foo')
+            after.put(i)
+
+        src = pl.source('produce', produce)
+        fail = pl.stage('fail', do_fail, workers=2)
+        after = pl.stage('after', seen.append)
+        src.feeds(fail)
+        fail.feeds(after)
+        with patch('%s.logger' % pbm) as mock_logger:
+            with pytest.raises(RuntimeError) as exc:
+                pl.run()
+        assert str(exc.value) == 'foo'
+        assert pl.failed is True
+        assert 3 not in seen
+        assert len(seen) < 49
+        assert len(mock_logger.error.mock_calls) == 1
+
+    def test_source_failure(self):
+        pl = Pipeline()
+
+        def produce():
+            stage.put(1)
+            raise ValueError('bar')
+
+        m_func = Mock()
+        src = pl.source('produce', produce)
+        stage = pl.stage('consume', m_func)
+        src.feeds(stage)
+        with patch('%s.logger' % pbm):
+            with pytest.raises(ValueError):
+                pl.run()
@@ -0,0 +1,144 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import gzip
+import json
+from datetime import timedelta
+
+import pytest
+
+from s3sfe.plan import Plan
+
+MD5A = 'd41d8cd98f00b204e9800998ecf8427e'
+MD5B = '0cc175b9c0f1b6a831c399e269772661'
+
+
+class TestPlan(object):
+
+    def setup(self):
+        self.plan = Plan(
+            'bkt', prefix='pfx',
+            uploads={
+                '/b': (2048, 1234.5, MD5B),
+                u'/a/\xe9': (1024, 1000.25, MD5A)
+            },
+            deletes=['/z', '/y'],
+            created=1500000000.0
+        )
+
+    def test_defaults(self):
+        p = Plan('bkt')
+        assert p.prefix == ''
+        assert p.uploads == {}
+        assert p.deletes == []
+        assert p.created > 1500000000.0
+
+    def test_upload_bytes(self):
+        assert self.plan.upload_bytes == 3072
+
+    def test_estimate(self):
+        assert self.plan.estimate(1024) == timedelta(seconds=3)
+
+    def test_summary(self):
+        s = self.plan.summary()
+        assert s.startswith('s3sfe plan for s3://bkt/pfx, created ')
+        assert 'Upload 2 files; 3.1 kB\nDelete 2 files\n' in s
+        assert 'Estimated' not in s
+
+    def test_summary_rate(self):
+        s = self.plan.summary(rate=1024)
+        assert 'Estimated upload time at 1.0 kB/s: 0:00:03\n' in s
+
+    def test_round_trip(self, tmpdir):
+        path = str(tmpdir.join('plan.gz'))
+        self.plan.write(path)
+        p = Plan.read(path)
+        assert p.bucket_name == 'bkt'
+        assert p.prefix == 'pfx'
+        assert p.created == 1500000000.0
+        assert p.uploads == self.plan.uploads
+        assert p.deletes == ['/y', '/z']
+
+    def _lines(self, path):
+        with gzip.open(path, 'rb') as fh:
+            return fh.read().decode('utf-8').splitlines()
+
+    def _write_lines(self, path, lines):
+        with gzip.open(path, 'wb') as fh:
+            fh.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def test_read_not_plan(self, tmpdir):
+        path = str(tmpdir.join('plan.gz'))
+        self._write_lines(path, [json.dumps({'foo': 'bar'})])
+        with pytest.raises(ValueError) as excinfo:
+            Plan.read(path)
+        assert 'not an s3sfe plan' in str(excinfo.value)
+
+    def test_read_version(self, tmpdir):
+        path = str(tmpdir.join('plan.gz'))
+        self._write_lines(path, [json.dumps({
+            'format': 's3sfe-plan', 'version': 99
+        })])
+        with pytest.raises(ValueError) as excinfo:
+            Plan.read(path)
+        assert 'unknown version 99' in str(excinfo.value)
+
+    def test_read_truncated(self, tmpdir):
+        path = str(tmpdir.join('plan.gz'))
+        self.plan.write(path)
+        self._write_lines(path, self._lines(path)[:-1])
+        with pytest.raises(ValueError) as excinfo:
+            Plan.read(path)
+        assert 'truncated' in str(excinfo.value)
+
+    def test_read_modified(self, tmpdir):
+        path = str(tmpdir.join('plan.gz'))
+        self.plan.write(path)
+        lines = self._lines(path)
+        lines[1] = lines[1].replace('1024', '1025')
+        self._write_lines(path, lines)
+        with pytest.raises(ValueError) as excinfo:
+            Plan.read(path)
+        assert 'checksum mismatch' in str(excinfo.value)
+
+    def test_read_after_checksum(self, tmpdir):
+        path = str(tmpdir.join('plan.gz'))
+        self.plan.write(path)
+        self._write_lines(path, self._lines(path) + ['["d", "/x"]'])
+        with pytest.raises(ValueError) as excinfo:
+            Plan.read(path)
+        assert 'data after checksum' in str(excinfo.value)
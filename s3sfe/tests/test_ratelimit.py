@@ -0,0 +1,163 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import sys
+from datetime import datetime
+
+import pytest
+
+from s3sfe.ratelimit import parse_rate, RateSchedule, TokenBucket
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 's3sfe.ratelimit'
+
+
+class TestParseRate(object):
+
+    def test_per_second(self):
+        assert parse_rate('50MB/s') == 52428800
+
+    def test_plain(self):
+        assert parse_rate(' 10K ') == 10240
+
+    def test_unlimited(self):
+        assert parse_rate('Unlimited') is None
+
+    def test_zero(self):
+        with pytest.raises(ValueError):
+            parse_rate('0/s')
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_rate('fast')
+
+
+class TestRateSchedule(object):
+
+    def test_parse_constant(self):
+        res = RateSchedule.parse('1M')
+        assert res.windows == []
+        assert res.default == 1048576
+
+    def test_parse_windows(self):
+        res = RateSchedule.parse(
+            '10K/s@09:00-18:30, 1K@22:00-06:00, unlimited@12:00-13:00'
+        )
+        assert res.windows == [
+            (540, 1110, 10240),
+            (1320, 360, 1024),
+            (720, 780, None)
+        ]
+        assert res.default is None
+
+    def test_parse_invalid_window(self):
+        with pytest.raises(ValueError):
+            RateSchedule.parse('10K@9-17')
+
+    def test_parse_invalid_time(self):
+        with pytest.raises(ValueError):
+            RateSchedule.parse('10K@09:00-25:00')
+
+    def test_rate_at(self):
+        s = RateSchedule(
+            windows=[(540, 1080, 100), (1320, 360, 10)], default=1000
+        )
+        assert s.rate_at(datetime(2017, 1, 1, 8, 59)) == 1000
+        assert s.rate_at(datetime(2017, 1, 1, 9, 0)) == 100
+        assert s.rate_at(datetime(2017, 1, 1, 17, 59)) == 100
+        assert s.rate_at(datetime(2017, 1, 1, 18, 0)) == 1000
+        assert s.rate_at(datetime(2017, 1, 1, 23, 0)) == 10
+        assert s.rate_at(datetime(2017, 1, 1, 0, 0)) == 10
+        assert s.rate_at(datetime(2017, 1, 1, 6, 0)) == 1000
+
+
+class TestTokenBucket(object):
+
+    def setup(self):
+        self.dt = datetime(2017, 1, 1, 12, 0)
+        with patch('%s.time.time' % pbm) as m_time:
+            m_time.return_value = 100.0
+            self.cls = TokenBucket(RateSchedule(default=1000))
+
+    def consume(self, now, nbytes):
+        with patch.multiple(
+            pbm, dtnow=DEFAULT, time=DEFAULT
+        ) as mocks:
+            mocks['dtnow'].return_value = self.dt
+            mocks['time'].time.return_value = now
+            self.cls.consume(nbytes)
+        return mocks['time'].sleep.mock_calls
+
+    def test_consume_debt(self):
+        assert self.consume(100.0, 500) == [call(0.5)]
+        # 0.5s later the debt is repaid, and this goes into debt again
+        assert self.consume(100.5, 250) == [call(0.25)]
+
+    def test_consume_burst(self):
+        self.consume(100.0, 0)
+        # tokens accumulate up to one second's worth
+        assert self.consume(110.0, 800) == []
+        assert self.consume(110.0, 400) == [call(0.2)]
+
+    def test_consume_concurrent_debt(self):
+        assert self.consume(100.0, 1000) == [call(1.0)]
+        # a second transfer waits for the first one's bytes too
+        assert self.consume(100.0, 1000) == [call(2.0)]
+
+    def test_consume_ignores_negative(self):
+        assert self.consume(100.0, -1000) == []
+        assert self.cls._rate is None
+
+    def test_unlimited(self):
+        self.cls.schedule = RateSchedule()
+        assert self.consume(100.0, 10000000) == []
+
+    def test_rate_change(self):
+        assert self.consume(100.0, 500) == [call(0.5)]
+        self.cls.schedule = RateSchedule(default=100)
+        # debt and tokens are reset at the new rate
+        assert self.consume(100.0, 50) == [call(0.5)]
+        assert self.cls._rate == 100
@@ -64,6 +64,9 @@ class TestMain(object):
             FILELIST_PATH=None,
             BUCKET_NAME='mybucket',
             LOCAL_PREFIX='/',
+            transfer_profiles=None,
+            download_workers=1,
+            max_download_rate=None,
             PATH=['/some/path', '/other/path']
         )
 
@@ -107,7 +110,10 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                transfer_profiles=None,
+                download_workers=1,
+                max_download_rate=None
             ),
             call().restore('/', ['/some/path', '/other/path'])
         ]
@@ -122,6 +128,9 @@ class TestMain(object):
             FILELIST_PATH=None,
             BUCKET_NAME='mybucket',
             LOCAL_PREFIX='/',
+            transfer_profiles=None,
+            download_workers=1,
+            max_download_rate=None,
             PATH=['/foo']
         )
 
@@ -151,7 +160,10 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                transfer_profiles=None,
+                download_workers=1,
+                max_download_rate=None
             ),
             call().restore('/', ['/foo'])
         ]
@@ -165,6 +177,9 @@ class TestMain(object):
             FILELIST_PATH=None,
             BUCKET_NAME='mybucket',
             LOCAL_PREFIX='/',
+            transfer_profiles=None,
+            download_workers=1,
+            max_download_rate=None,
             PATH=['/foo']
         )
 
@@ -193,7 +208,10 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                transfer_profiles=None,
+                download_workers=1,
+                max_download_rate=None
             ),
             call().restore('/', ['/foo'])
         ]
@@ -207,6 +225,9 @@ class TestMain(object):
             FILELIST_PATH=None,
             BUCKET_NAME='mybucket',
             LOCAL_PREFIX='/',
+            transfer_profiles=None,
+            download_workers=1,
+            max_download_rate=None,
             PATH=['/foo']
         )
 
@@ -235,7 +256,10 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                transfer_profiles=None,
+                download_workers=1,
+                max_download_rate=None
             ),
             call().restore('/', ['/foo'])
         ]
@@ -249,6 +273,9 @@ class TestMain(object):
             FILELIST_PATH='/flp',
             BUCKET_NAME='mybucket',
             LOCAL_PREFIX='/',
+            transfer_profiles=None,
+            download_workers=1,
+            max_download_rate=None,
             PATH=[]
         )
 
@@ -279,7 +306,10 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                transfer_profiles=None,
+                download_workers=1,
+                max_download_rate=None
             ),
             call().restore('/', ['/fl1', '/fl2'])
         ]
@@ -333,6 +363,36 @@ class TestParseArgs(object):
         assert res.BUCKET_NAME == 'bktname'
         assert res.LOCAL_PREFIX == '/foo/bar'
         assert res.PATH == ['/baz']
+        assert res.transfer_profiles is None
+        assert res.download_workers == 1
+        assert res.max_download_rate is None
+
+    def test_parse_args_download_workers(self):
+        res = parse_args([
+            '-f', 'kf', '--download-workers=16', 'bktname', '/foo/bar', '/baz'
+        ])
+        assert res.download_workers == 16
+
+    def test_parse_args_download_workers_zero(self):
+        with pytest.raises(SystemExit):
+            parse_args([
+                '-f', 'kf', '--download-workers=0', 'bktname', '/foo/bar'
+            ])
+
+    def test_parse_args_max_download_rate(self):
+        res = parse_args([
+            '-f', 'kf', '--max-download-rate=50MB/s', 'bktname', '/foo/bar',
+            '/baz'
+        ])
+        assert res.max_download_rate.windows == []
+        assert res.max_download_rate.default == 52428800
+
+    def test_parse_args_transfer_profile(self):
+        res = parse_args([
+            '-f', 'kf', '--transfer-profile=huge:concurrency=32', 'bktname',
+            '/foo/bar', '/baz'
+        ])
+        assert res.transfer_profiles == [('huge', {'concurrency': 32})]
 
     def test_parse_args_dry_run(self):
         res = parse_args(['-f', 'kf', '-d', 'bktname', '/foo/bar', '/path'])
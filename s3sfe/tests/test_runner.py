@@ -64,7 +64,38 @@ class TestMain(object):
             FILELIST_PATH='/foo/bar',
             summary=False,
             key_file='kf',
-            exclude_file=None
+            exclude_file=None,
+            hash_cache=None,
+            no_hash_cache=False,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
         )
 
         m_summary = Mock()
@@ -79,8 +110,10 @@ class TestMain(object):
                 read_filelist=DEFAULT,
                 parse_args=DEFAULT,
                 FileSyncer=DEFAULT,
-                read_keyfile=DEFAULT
+                read_keyfile=DEFAULT,
+                default_cache_path=DEFAULT
             ) as mocks:
+                mocks['default_cache_path'].return_value = '/def/hc'
                 mocks['parse_args'].return_value = mock_args
                 mocks['FileSyncer'].return_value.run.return_value = m_summary
                 mocks['read_keyfile'].return_value = 'mykeybinary'
@@ -105,7 +138,35 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                hash_cache_path='/def/hc',
+                rehash=False,
+                hash_bufsize=None,
+                hash_mmap=False,
+                hash_workers=1,
+                hash_processes=False,
+                upload_workers=1,
+                rebuild_manifest=False,
+                head_workers=1,
+                pipeline=False,
+                compact_metadata=False,
+                diff_engine='dict',
+                diff_max_items=1000000,
+                delete=False,
+                max_delete=None,
+                max_delete_percent=50.0,
+                compare='checksum',
+                transfer_profiles=None,
+                max_upload_rate=None,
+                upload_order='path',
+                bundle_threshold=None,
+                bundle_size=67108864,
+                bundle_compact=0.5,
+                upload_journal_path=None,
+                abort_orphaned_uploads=False,
+                copy_duplicates=False,
+                refresh_metadata=False,
+                compression=None
             ),
             call().run(
                 mocks['read_filelist'].return_value,
@@ -115,6 +176,75 @@ class TestMain(object):
         assert m_summary.mock_calls == []
         assert mocklogger.mock_calls == []
 
+    def test_main_plan(self, capsys):
+        mock_args = Mock(
+            dry_run=False,
+            verbose=0,
+            prefix=None,
+            BUCKET_NAME='mybucket',
+            FILELIST_PATH='/foo/bar',
+            summary=True,
+            key_file='kf',
+            exclude_file=None,
+            hash_cache=None,
+            no_hash_cache=False,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan='/tmp/plan'
+        )
+
+        with patch('%s.logger' % pbm, autospec=True):
+            with patch.multiple(
+                pbm,
+                autospec=True,
+                set_log_info=DEFAULT,
+                set_log_debug=DEFAULT,
+                read_filelist=DEFAULT,
+                parse_args=DEFAULT,
+                FileSyncer=DEFAULT,
+                read_keyfile=DEFAULT,
+                default_cache_path=DEFAULT
+            ) as mocks:
+                mocks['default_cache_path'].return_value = '/def/hc'
+                m_plan = mocks['FileSyncer'].return_value.plan.return_value
+                m_plan.summary.return_value = 'plansummary'
+                mocks['read_keyfile'].return_value = 'mykeybinary'
+                main(mock_args)
+        assert mocks['FileSyncer'].return_value.mock_calls == [
+            call.plan(mocks['read_filelist'].return_value, exclude_paths=[]),
+            call.plan().write('/tmp/plan'),
+            call.plan().summary()
+        ]
+        out, err = capsys.readouterr()
+        assert err == ''
+        assert out == "plansummary\n"
+
     def test_main_args(self):
         mock_args = Mock(
             dry_run=False,
@@ -124,7 +254,38 @@ class TestMain(object):
             FILELIST_PATH='/foo/bar',
             summary=False,
             key_file='kf',
-            exclude_file=None
+            exclude_file=None,
+            hash_cache=None,
+            no_hash_cache=False,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
         )
 
         m_summary = Mock()
@@ -139,8 +300,10 @@ class TestMain(object):
                 read_filelist=DEFAULT,
                 parse_args=DEFAULT,
                 FileSyncer=DEFAULT,
-                read_keyfile=DEFAULT
+                read_keyfile=DEFAULT,
+                default_cache_path=DEFAULT
             ) as mocks:
+                mocks['default_cache_path'].return_value = '/def/hc'
                 mocks['parse_args'].return_value = mock_args
                 mocks['FileSyncer'].return_value.run.return_value = m_summary
                 mocks['read_keyfile'].return_value = 'mykeybinary'
@@ -156,7 +319,38 @@ class TestMain(object):
             FILELIST_PATH='/foo/bar',
             summary=False,
             key_file='kf',
-            exclude_file='/foo/exc'
+            exclude_file='/foo/exc',
+            hash_cache='/hc',
+            no_hash_cache=False,
+            rehash=True,
+            hash_bufsize=1024,
+            hash_mmap=True,
+            hash_workers=4,
+            hash_processes=True,
+            upload_workers=16,
+            rebuild_manifest=True,
+            head_workers=64,
+            pipeline=True,
+            compact_metadata=True,
+            diff_engine='merge',
+            diff_max_items=5000,
+            delete=True,
+            max_delete=100,
+            max_delete_percent=10.0,
+            compare='size-mtime-then-checksum',
+            transfer_profiles=[('huge', {'concurrency': 16})],
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
         )
 
         m_summary = Mock()
@@ -170,8 +364,10 @@ class TestMain(object):
             read_filelist=DEFAULT,
             parse_args=DEFAULT,
             FileSyncer=DEFAULT,
-            read_keyfile=DEFAULT
+            read_keyfile=DEFAULT,
+            default_cache_path=DEFAULT
         ) as mocks:
+            mocks['default_cache_path'].return_value = '/def/hc'
             mocks['parse_args'].return_value = mock_args
             mocks['FileSyncer'].return_value.run.return_value = m_summary
             mocks['read_keyfile'].return_value = 'mykeybinary'
@@ -189,7 +385,35 @@ class TestMain(object):
                 'mybucket',
                 prefix=None,
                 dry_run=False,
-                ssec_key='mykeybinary'
+                ssec_key='mykeybinary',
+                hash_cache_path='/hc',
+                rehash=True,
+                hash_bufsize=1024,
+                hash_mmap=True,
+                hash_workers=4,
+                hash_processes=True,
+                upload_workers=16,
+                rebuild_manifest=True,
+                head_workers=64,
+                pipeline=True,
+                compact_metadata=True,
+                diff_engine='merge',
+                diff_max_items=5000,
+                delete=True,
+                max_delete=100,
+                max_delete_percent=10.0,
+                compare='size-mtime-then-checksum',
+                transfer_profiles=[('huge', {'concurrency': 16})],
+                max_upload_rate=None,
+                upload_order='path',
+                bundle_threshold=None,
+                bundle_size=67108864,
+                bundle_compact=0.5,
+                upload_journal_path=None,
+                abort_orphaned_uploads=False,
+                copy_duplicates=False,
+                refresh_metadata=False,
+                compression=None
             ),
             call().run(
                 ['/foo1', '/foo2'],
@@ -197,6 +421,182 @@ class TestMain(object):
             )
         ]
 
+    def test_main_resumable_uploads(self):
+        mock_args = Mock(
+            dry_run=False,
+            verbose=0,
+            prefix=None,
+            BUCKET_NAME='mybucket',
+            FILELIST_PATH='/foo/bar',
+            summary=False,
+            key_file='kf',
+            exclude_file=None,
+            hash_cache='/hc',
+            no_hash_cache=True,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=True,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
+        )
+
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            set_log_info=DEFAULT,
+            set_log_debug=DEFAULT,
+            read_filelist=DEFAULT,
+            parse_args=DEFAULT,
+            FileSyncer=DEFAULT,
+            read_keyfile=DEFAULT,
+            default_journal_path=DEFAULT
+        ) as mocks:
+            mocks['default_journal_path'].return_value = '/default/j'
+            main(mock_args)
+        kwargs = mocks['FileSyncer'].mock_calls[0][2]
+        assert kwargs['upload_journal_path'] == '/default/j'
+        assert kwargs['abort_orphaned_uploads'] is False
+        mock_args.upload_journal = '/u/j'
+        mock_args.abort_orphaned_uploads = True
+        mock_args.copy_duplicates = True
+        mock_args.refresh_metadata = True
+        mock_args.compression = 'lzma'
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            set_log_info=DEFAULT,
+            set_log_debug=DEFAULT,
+            read_filelist=DEFAULT,
+            parse_args=DEFAULT,
+            FileSyncer=DEFAULT,
+            read_keyfile=DEFAULT,
+            default_journal_path=DEFAULT
+        ) as mocks:
+            main(mock_args)
+        kwargs = mocks['FileSyncer'].mock_calls[0][2]
+        assert kwargs['upload_journal_path'] == '/u/j'
+        assert kwargs['abort_orphaned_uploads'] is True
+        assert kwargs['copy_duplicates'] is True
+        assert kwargs['refresh_metadata'] is True
+        assert kwargs['compression'] == 'lzma'
+        assert mocks['default_journal_path'].mock_calls == []
+
+    def test_main_no_hash_cache(self):
+        mock_args = Mock(
+            dry_run=False,
+            verbose=0,
+            prefix=None,
+            BUCKET_NAME='mybucket',
+            FILELIST_PATH='/foo/bar',
+            summary=False,
+            key_file='kf',
+            exclude_file=None,
+            hash_cache='/hc',
+            no_hash_cache=True,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
+        )
+
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            set_log_info=DEFAULT,
+            set_log_debug=DEFAULT,
+            read_filelist=DEFAULT,
+            parse_args=DEFAULT,
+            FileSyncer=DEFAULT,
+            read_keyfile=DEFAULT,
+            default_cache_path=DEFAULT
+        ) as mocks:
+            mocks['read_keyfile'].return_value = 'mykeybinary'
+            main(mock_args)
+        assert mocks['FileSyncer'].mock_calls[0] == call(
+            'mybucket',
+            prefix=None,
+            dry_run=False,
+            ssec_key='mykeybinary',
+            hash_cache_path=None,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            upload_journal_path=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None
+        )
+        assert mocks['default_cache_path'].mock_calls == []
+
     def test_main_verbose(self):
         mock_args = Mock(
             dry_run=False,
@@ -206,7 +606,38 @@ class TestMain(object):
             FILELIST_PATH='/foo/bar',
             summary=False,
             key_file='kf',
-            exclude_file=None
+            exclude_file=None,
+            hash_cache=None,
+            no_hash_cache=False,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
         )
 
         m_summary = Mock()
@@ -220,8 +651,10 @@ class TestMain(object):
             read_filelist=DEFAULT,
             parse_args=DEFAULT,
             FileSyncer=DEFAULT,
-            read_keyfile=DEFAULT
+            read_keyfile=DEFAULT,
+            default_cache_path=DEFAULT
         ) as mocks:
+            mocks['default_cache_path'].return_value = '/def/hc'
             mocks['parse_args'].return_value = mock_args
             mocks['FileSyncer'].return_value.run.return_value = m_summary
             mocks['read_keyfile'].return_value = 'mykeybinary'
@@ -237,7 +670,38 @@ class TestMain(object):
             FILELIST_PATH='/foo/bar',
             summary=False,
             key_file='kf',
-            exclude_file=None
+            exclude_file=None,
+            hash_cache=None,
+            no_hash_cache=False,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
         )
 
         m_summary = Mock()
@@ -251,8 +715,10 @@ class TestMain(object):
             read_filelist=DEFAULT,
             parse_args=DEFAULT,
             FileSyncer=DEFAULT,
-            read_keyfile=DEFAULT
+            read_keyfile=DEFAULT,
+            default_cache_path=DEFAULT
         ) as mocks:
+            mocks['default_cache_path'].return_value = '/def/hc'
             mocks['parse_args'].return_value = mock_args
             mocks['FileSyncer'].return_value.run.return_value = m_summary
             mocks['read_keyfile'].return_value = 'mykeybinary'
@@ -268,7 +734,38 @@ class TestMain(object):
             FILELIST_PATH='/foo/bar',
             summary=True,
             key_file='kf',
-            exclude_file=None
+            exclude_file=None,
+            hash_cache=None,
+            no_hash_cache=False,
+            rehash=False,
+            hash_bufsize=None,
+            hash_mmap=False,
+            hash_workers=1,
+            hash_processes=False,
+            upload_workers=1,
+            rebuild_manifest=False,
+            head_workers=1,
+            pipeline=False,
+            compact_metadata=False,
+            diff_engine='dict',
+            diff_max_items=1000000,
+            delete=False,
+            max_delete=None,
+            max_delete_percent=50.0,
+            compare='checksum',
+            transfer_profiles=None,
+            max_upload_rate=None,
+            upload_order='path',
+            bundle_threshold=None,
+            bundle_size=67108864,
+            bundle_compact=0.5,
+            resumable_uploads=False,
+            upload_journal=None,
+            abort_orphaned_uploads=False,
+            copy_duplicates=False,
+            refresh_metadata=False,
+            compression=None,
+            plan=None
         )
 
         m_summary = Mock(summary='foo')
@@ -282,8 +779,10 @@ class TestMain(object):
                 read_filelist=DEFAULT,
                 parse_args=DEFAULT,
                 FileSyncer=DEFAULT,
-                read_keyfile=DEFAULT
+                read_keyfile=DEFAULT,
+                default_cache_path=DEFAULT
             ) as mocks:
+                mocks['default_cache_path'].return_value = '/def/hc'
                 mocks['parse_args'].return_value = mock_args
                 mocks['FileSyncer'].return_value.run.return_value = m_summary
                 mocks['read_keyfile'].return_value = 'mykeybinary'
@@ -331,6 +830,37 @@ class TestParseArgs(object):
         assert res.summary is False
         assert res.key_file == 'kf'
         assert res.exclude_file is None
+        assert res.hash_cache is None
+        assert res.no_hash_cache is False
+        assert res.rehash is False
+        assert res.hash_bufsize is None
+        assert res.hash_mmap is False
+        assert res.hash_workers == 1
+        assert res.hash_processes is False
+        assert res.upload_workers == 1
+        assert res.rebuild_manifest is False
+        assert res.head_workers == 1
+        assert res.pipeline is False
+        assert res.compact_metadata is False
+        assert res.diff_engine == 'dict'
+        assert res.diff_max_items == 1000000
+        assert res.delete is False
+        assert res.max_delete is None
+        assert res.max_delete_percent == 50.0
+        assert res.compare == 'checksum'
+        assert res.plan is None
+        assert res.transfer_profiles is None
+        assert res.max_upload_rate is None
+        assert res.upload_order == 'path'
+        assert res.bundle_threshold is None
+        assert res.bundle_size == 67108864
+        assert res.bundle_compact == 0.5
+        assert res.resumable_uploads is False
+        assert res.upload_journal is None
+        assert res.abort_orphaned_uploads is False
+        assert res.copy_duplicates is False
+        assert res.refresh_metadata is False
+        assert res.compression is None
 
     def test_parse_args_verbose1(self):
         res = parse_args(['-f', 'kf', '-v', 'bktname', '/foo/bar'])
@@ -348,6 +878,236 @@ class TestParseArgs(object):
         res = parse_args(['-f', 'kf', '-e', '/exc/f', 'bktname', '/foo/bar'])
         assert res.exclude_file == '/exc/f'
 
+    def test_parse_args_hash_cache(self):
+        res = parse_args([
+            '-f', 'kf', '--hash-cache=/h/c', '--rehash', 'bktname', '/foo/bar'
+        ])
+        assert res.hash_cache == '/h/c'
+        assert res.rehash is True
+
+    def test_parse_args_no_hash_cache(self):
+        res = parse_args(['-f', 'kf', '--no-hash-cache', 'bktname', '/foo/bar'])
+        assert res.no_hash_cache is True
+
+    def test_parse_args_hash_buffer(self):
+        res = parse_args([
+            '-f', 'kf', '--hash-buffer-size=4M', '--hash-mmap', 'bktname',
+            '/foo/bar'
+        ])
+        assert res.hash_bufsize == 4194304
+        assert res.hash_mmap is True
+
+    def test_parse_args_hash_workers(self):
+        res = parse_args([
+            '-f', 'kf', '--hash-workers=8', '--hash-processes', 'bktname',
+            '/foo/bar'
+        ])
+        assert res.hash_workers == 8
+        assert res.hash_processes is True
+
+    def test_parse_args_upload_workers(self):
+        res = parse_args(
+            ['-f', 'kf', '--upload-workers=32', 'bktname', '/foo/bar']
+        )
+        assert res.upload_workers == 32
+
+    def test_parse_args_workers_invalid(self):
+        for opt in ['--upload-workers', '--hash-workers', '--head-workers']:
+            for val in ['0', '-1']:
+                with pytest.raises(SystemExit):
+                    parse_args(
+                        ['-f', 'kf', '%s=%s' % (opt, val), 'bktname', '/foo']
+                    )
+
+    def test_parse_args_hash_buffer_zero(self):
+        with pytest.raises(SystemExit):
+            parse_args(
+                ['-f', 'kf', '--hash-buffer-size=0', 'bktname', '/foo/bar']
+            )
+
+    def test_parse_args_rebuild_manifest(self):
+        res = parse_args(
+            ['-f', 'kf', '--rebuild-manifest', 'bktname', '/foo/bar']
+        )
+        assert res.rebuild_manifest is True
+
+    def test_parse_args_head_workers(self):
+        res = parse_args(['-f', 'kf', '--head-workers=50', 'bktname', '/foo'])
+        assert res.head_workers == 50
+
+    def test_parse_args_pipeline(self):
+        res = parse_args(['-f', 'kf', '--pipeline', 'bktname', '/foo'])
+        assert res.pipeline is True
+
+    def test_parse_args_compact_metadata(self):
+        res = parse_args(['-f', 'kf', '--compact-metadata', 'bktname', '/foo'])
+        assert res.compact_metadata is True
+
+    def test_parse_args_diff_engine(self):
+        res = parse_args([
+            '-f', 'kf', '--diff-engine=merge', '--diff-max-entries', '10',
+            'bktname', '/foo'
+        ])
+        assert res.diff_engine == 'merge'
+        assert res.diff_max_items == 10
+
+    def test_parse_args_delete(self):
+        res = parse_args([
+            '-f', 'kf', '--delete', '--max-delete=10',
+            '--max-delete-percent', '2.5', 'bktname', '/foo'
+        ])
+        assert res.delete is True
+        assert res.max_delete == 10
+        assert res.max_delete_percent == 2.5
+
+    def test_parse_args_compare(self):
+        res = parse_args(
+            ['-f', 'kf', '--compare=size-mtime', 'bktname', '/foo']
+        )
+        assert res.compare == 'size-mtime'
+
+    def test_parse_args_transfer_profile(self):
+        res = parse_args([
+            '-f', 'kf', '--transfer-profile', 'small:concurrency=2',
+            '--transfer-profile=huge:chunksize=1M', 'bktname', '/foo'
+        ])
+        assert res.transfer_profiles == [
+            ('small', {'concurrency': 2}), ('huge', {'chunksize': 1048576})
+        ]
+
+    def test_parse_args_transfer_profile_invalid(self):
+        with pytest.raises(SystemExit):
+            parse_args([
+                '-f', 'kf', '--transfer-profile', 'tiny:concurrency=2',
+                'bktname', '/foo'
+            ])
+
+    def test_parse_args_max_upload_rate(self):
+        res = parse_args([
+            '-f', 'kf', '--max-upload-rate', '1MB/s@09:00-17:00,2M',
+            'bktname', '/foo'
+        ])
+        assert res.max_upload_rate.windows == [(540, 1020, 1048576)]
+        assert res.max_upload_rate.default == 2097152
+
+    def test_parse_args_max_upload_rate_invalid(self):
+        with pytest.raises(SystemExit):
+            parse_args([
+                '-f', 'kf', '--max-upload-rate', '1M@9am', 'bktname', '/foo'
+            ])
+
+    def test_parse_args_upload_order(self):
+        res = parse_args([
+            '-f', 'kf', '--upload-order=largest-first', 'bktname', '/foo'
+        ])
+        assert res.upload_order == 'largest-first'
+
+    def test_parse_args_upload_order_pipeline(self):
+        with pytest.raises(RuntimeError):
+            parse_args([
+                '-f', 'kf', '--upload-order=newest-first', '--pipeline',
+                'bktname', '/foo'
+            ])
+
+    def test_parse_args_bundle(self):
+        res = parse_args([
+            '-f', 'kf', '--bundle-threshold=16K', '--bundle-size', '1M',
+            '--bundle-compact-ratio=0.25', 'bktname', '/foo'
+        ])
+        assert res.bundle_threshold == 16384
+        assert res.bundle_size == 1048576
+        assert res.bundle_compact == 0.25
+
+    def test_parse_args_bundle_invalid(self):
+        for arg in [
+            '--bundle-size=0', '--bundle-compact-ratio=0',
+            '--bundle-compact-ratio=-0.5', '--bundle-compact-ratio=1.5',
+            '--bundle-compact-ratio=x'
+        ]:
+            with pytest.raises(SystemExit):
+                parse_args(['-f', 'kf', arg, 'bktname', '/foo'])
+        res = parse_args(
+            ['-f', 'kf', '--bundle-compact-ratio=1', 'bktname', '/foo']
+        )
+        assert res.bundle_compact == 1.0
+
+    def test_parse_args_bundle_pipeline(self):
+        with pytest.raises(RuntimeError):
+            parse_args([
+                '-f', 'kf', '--bundle-threshold=16K', '--pipeline',
+                'bktname', '/foo'
+            ])
+
+    def test_parse_args_copy_duplicates_pipeline(self):
+        with pytest.raises(RuntimeError) as exc:
+            parse_args([
+                '-f', 'kf', '--copy-duplicates', '--pipeline',
+                'bktname', '/foo'
+            ])
+        assert str(exc.value) == 'Error: --copy-duplicates cannot be used ' \
+            'with --pipeline.'
+
+    def test_parse_args_resumable_uploads(self):
+        res = parse_args([
+            '-f', 'kf', '--resumable-uploads', '--upload-journal=/u/j',
+            '--abort-orphaned-uploads', 'bktname', '/foo'
+        ])
+        assert res.resumable_uploads is True
+        assert res.upload_journal == '/u/j'
+        assert res.abort_orphaned_uploads is True
+
+    def test_parse_args_copy_duplicates(self):
+        res = parse_args([
+            '-f', 'kf', '--copy-duplicates', 'bktname', '/foo'
+        ])
+        assert res.copy_duplicates is True
+
+    def test_parse_args_refresh_metadata(self):
+        res = parse_args([
+            '-f', 'kf', '--refresh-metadata', 'bktname', '/foo'
+        ])
+        assert res.refresh_metadata is True
+
+    def test_parse_args_refresh_metadata_pipeline(self):
+        with pytest.raises(RuntimeError) as exc:
+            parse_args([
+                '-f', 'kf', '--refresh-metadata', '--pipeline',
+                'bktname', '/foo'
+            ])
+        assert str(exc.value) == 'Error: --refresh-metadata cannot be used ' \
+            'with --pipeline.'
+
+    def test_parse_args_refresh_metadata_plan(self):
+        with pytest.raises(RuntimeError) as exc:
+            parse_args([
+                '-f', 'kf', '--refresh-metadata', '--plan=/p',
+                'bktname', '/foo'
+            ])
+        assert str(exc.value) == 'Error: --refresh-metadata cannot be used ' \
+            'with --plan.'
+
+    def test_parse_args_compress(self):
+        res = parse_args(['-f', 'kf', '--compress', 'zlib', 'bktname', '/foo'])
+        assert res.compression == 'zlib'
+
+    def test_parse_args_compress_unknown(self):
+        with pytest.raises(SystemExit):
+            parse_args(['-f', 'kf', '--compress', 'bz2', 'bktname', '/foo'])
+
+    def test_parse_args_plan(self):
+        res = parse_args(['-f', 'kf', '--plan', '/tmp/p', 'bktname', '/foo'])
+        assert res.plan == '/tmp/p'
+
+    def test_parse_args_plan_pipeline(self):
+        with pytest.raises(RuntimeError):
+            parse_args([
+                '-f', 'kf', '--plan', '/tmp/p', '--pipeline', 'bktname', '/foo'
+            ])
+
+    def test_parse_args_diff_engine_invalid(self):
+        with pytest.raises(SystemExit):
+            parse_args(['-f', 'kf', '--diff-engine=foo', 'bktname', '/foo'])
+
     def test_parse_args_prefix(self):
         res = parse_args(
             ['-f', 'kf', '--s3-prefix=foo/bar', 'bktname', '/foo/bar']
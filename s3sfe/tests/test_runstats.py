@@ -144,6 +144,286 @@ class TestRunStats(object):
     def test_error_files(self):
         assert self.stats.error_files == ['foo']
 
+    def test_upload_throughput(self):
+        assert self.stats.upload_throughput == 789 / 5.0
+
+    def test_upload_throughput_zero_time(self):
+        self.stats._end_dt = self.stats._upload_dt
+        assert self.stats.upload_throughput is None
+
+    def test_upload_concurrency(self):
+        assert self.stats.upload_concurrency is None
+        self.stats._upload_busy_seconds = 20.0
+        assert self.stats.upload_concurrency == 4.0
+
+    def test_upload_concurrency_zero_time(self):
+        self.stats._upload_busy_seconds = 20.0
+        self.stats._end_dt = self.stats._upload_dt
+        assert self.stats.upload_concurrency is None
+
+    def test_summary_upload_concurrency(self):
+        self.stats._upload_busy_seconds = 20.0
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Upload throughput: 157 Bytes/s; effective concurrency 4.0\n" \
+            in res
+
+    def test_meta_error_files(self):
+        assert self.stats.meta_error_files == []
+
+    def test_summary_meta_errors(self):
+        self.stats._meta_errors = ['/b', '/a']
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "foo\n\n2 files could not be read:\n/a\n/b\n" in res
+
+    def test_hash_cache(self):
+        assert self.stats.hash_cache_hits is None
+        assert self.stats.hash_cache_misses is None
+
+    def test_summary_hash_cache(self):
+        self.stats._hash_cache_hits = 1234
+        self.stats._hash_cache_misses = 5
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Hash cache: 1,234 hits; 5 misses\n" in res
+
+    def test_deletes(self):
+        assert self.stats.deleted_files is None
+        assert self.stats.delete_error_files == []
+        assert self.stats.delete_refused == 0
+
+    def test_summary_deletes(self):
+        self.stats._deleted_files = ['/a', '/b']
+        self.stats._delete_errors = ['/d', '/c']
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Deleted 2 files from S3\n" in res
+        assert "foo\n\n2 files failed deleting:\n/c\n/d\n" in res
+        assert 'Would delete' not in res
+
+    def test_summary_deletes_dry_run(self):
+        self.stats._dry_run = True
+        self.stats._deleted_files = ['/b', '/a']
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "\nWould delete 2 files from S3:\n/a\n/b\n" \
+            "-- DRY RUN - NO FILES ACTUALLY UPLOADED --\n" in res
+
+    def test_summary_delete_refused(self):
+        self.stats._deleted_files = []
+        self.stats._delete_refused = 1234
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Deleted 0 files from S3\n" in res
+        assert "\nRefused to delete 1234 files from S3; more than the " \
+            "maximum allowed\n" in res
+
+    def test_skipped_files(self):
+        assert self.stats.skipped_files == []
+
+    def test_summary_skipped_files(self):
+        self.stats._skipped_files = ['/b', '/a']
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "foo\n\n2 files changed since planning and were " \
+            "skipped:\n/a\n/b\n" in res
+
+    def test_concurrency_history(self):
+        assert self.stats.concurrency_history is None
+        self.stats._concurrency_history = {
+            'upload': [(self.dt_s, 2), (self.dt_q, 4)]
+        }
+        assert self.stats.concurrency_history == {
+            'upload': [(timedelta(0), 2), (timedelta(seconds=3), 4)]
+        }
+
+    def test_summary_concurrency_history(self):
+        self.stats._concurrency_history = {
+            'upload': [
+                (self.dt_s, 2), (self.dt_m, 4), (self.dt_q, 8),
+                (self.dt_c, 4), (self.dt_u, 5), (self.dt_e, 2)
+            ],
+            'HEAD': [(self.dt_s, 16)]
+        }
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "HEAD concurrency: 16-16; final 16; reduced 0 times\n" \
+            "Upload concurrency: 2-8; final 2; reduced 2 times\n" in res
+
+    def test_upload_makespans(self):
+        assert self.stats.upload_makespans is None
+        self.stats._upload_makespans = {'path': 3661.4, 'largest-first': 60.6}
+        assert self.stats.upload_makespans == {
+            'path': timedelta(seconds=3661),
+            'largest-first': timedelta(seconds=61)
+        }
+
+    def test_summary_upload_makespans(self):
+        self.stats._upload_order = 'path'
+        self.stats._upload_makespans = {
+            'path': 3661.4, 'largest-first': 60.6, 'newest-first': 3661.0
+        }
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Estimated upload time by order: largest-first 0:01:01; " \
+            "newest-first 1:01:01; path 1:01:01 (used)\n" in res
+
+    def test_copied(self):
+        assert self.stats.copied_files is None
+        assert self.stats.bytes_copied == 0
+
+    def test_summary_copied(self):
+        self.stats._copied_files = ['/a', '/b']
+        self.stats._copied_size_b = 2048
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Copied 2 files within S3 instead of uploading; 2.0 kB\n" in res
+
+    def test_summary_none_copied(self):
+        self.stats._copied_files = []
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert 'Copied' not in res
+
+    def test_bytes_sent(self):
+        assert self.stats.bytes_sent is None
+
+    def test_summary_bytes_sent(self):
+        self.stats._wire_size_b = 200
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Sent 200 Bytes to S3 after compression (25.3% of uploaded)\n" \
+            in res
+
+    def test_summary_bytes_sent_nothing_uploaded(self):
+        self.stats._wire_size_b = 0
+        self.stats._uploaded_size_b = 0
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert 'Sent' not in res
+
+    def test_refreshed(self):
+        assert self.stats.refreshed_files is None
+        assert self.stats.refresh_error_files == []
+
+    def test_summary_refreshed(self):
+        self.stats._refreshed_files = ['/a', '/b']
+        self.stats._refresh_errors = ['/d', '/c']
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Uploaded 10 files; 789 Bytes\n" \
+            "Refreshed metadata of 2 files in S3\n" in res
+        assert "\n2 files failed refreshing metadata:\n/c\n/d\n" in res
+
+    def test_stage_times(self):
+        assert self.stats.stage_times is None
+        self.stats._stage_times = [
+            ('scan', self.dt_s, self.dt_q),
+            ('upload', self.dt_m, self.dt_e)
+        ]
+        assert self.stats.stage_times == [
+            ('scan', timedelta(0), timedelta(seconds=3)),
+            ('upload', timedelta(seconds=1), timedelta(seconds=15))
+        ]
+
+    def test_summary_stage_times(self):
+        self.stats._stage_times = [
+            ('scan', self.dt_s, self.dt_q),
+            ('upload', self.dt_m, self.dt_e)
+        ]
+        with patch.multiple(
+            pbm,
+            autospec=True,
+            getuser=DEFAULT,
+            node=DEFAULT
+        ):
+            res = self.stats.summary
+        assert "Total Run Time: 0:00:15\n" \
+            "Pipeline Stages (start - end):\n" \
+            "  scan: 0:00:00 - 0:00:03\n" \
+            "  upload: 0:00:01 - 0:00:15\n" \
+            "\n" \
+            "Backed-up files" in res
+        assert 'Time Listing Files' not in res
+
     def test_summary_errors(self):
         expected = dedent("""
         s3sfe v%s run report
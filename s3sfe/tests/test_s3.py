@@ -34,9 +34,29 @@ AUTHORS:
 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 ################################################################################
 """
+import gzip
+import json
 import sys
+import threading
+import zlib
+from datetime import datetime
+from io import BytesIO
 
-from s3sfe.s3 import S3Wrapper
+import boto3
+import pytest
+from boto3.exceptions import S3UploadFailedError
+from botocore.awsrequest import AWSResponse
+from botocore.stub import Stubber
+from botocore.exceptions import (
+    ClientError, ConnectTimeoutError, ReadTimeoutError
+)
+
+from s3sfe.s3 import (
+    S3Wrapper, is_throttle_error, is_congestion_error, make_limiter
+)
+from s3sfe.journal import UploadJournal
+from s3sfe.ratelimit import RateSchedule
+from s3sfe.transfer import TransferProfiles
 from s3sfe.version import VERSION
 
 # https://code.google.com/p/mock/issues/detail?id=249
@@ -45,9 +65,11 @@ if (
         sys.version_info[0] < 3 or
         sys.version_info[0] == 3 and sys.version_info[1] < 4
 ):
-    from mock import patch, call, Mock, PropertyMock, MagicMock  # noqa
+    from mock import patch, call, Mock, PropertyMock, MagicMock, ANY  # noqa
 else:
-    from unittest.mock import patch, call, Mock, PropertyMock, MagicMock  # noqa
+    from unittest.mock import (  # noqa
+        patch, call, Mock, PropertyMock, MagicMock, ANY
+    )
 
 pbm = 's3sfe.s3'
 pb = '%s.S3Wrapper' % pbm
@@ -64,10 +86,15 @@ class TestInit(object):
         assert cls._bucket_name == 'bname'
         assert cls._prefix == ''
         assert cls._dry_run is False
+        assert cls._head_workers == 1
+        assert cls._config.max_pool_connections == 10
+        assert cls._transfer.profiles == TransferProfiles().profiles
+        assert cls._upload_bucket is None
+        assert cls._download_bucket is None
         assert cls._key == 'foo'
         assert cls._keymd5 == 'bar'
-        assert m_boto_r.mock_calls == [call('s3')]
-        assert m_boto_c.mock_calls == [call('s3')]
+        assert m_boto_r.mock_calls == [call('s3', config=cls._config)]
+        assert m_boto_c.mock_calls == [call('s3', config=cls._config)]
         assert m_ek.mock_calls == [call(cls, None)]
         assert cls._s3 == m_boto_r.return_value
         assert cls._s3client == m_boto_c.return_value
@@ -78,19 +105,48 @@ class TestInit(object):
                 with patch('%s._encode_key' % pb, autospec=True) as m_ek:
                     m_ek.return_value = ('foo', 'bar')
                     cls = S3Wrapper(
-                        'bktname', prefix='/', dry_run=True, ssec_key='foobar'
+                        'bktname', prefix='/', dry_run=True, ssec_key='foobar',
+                        head_workers=16
                     )
         assert cls._bucket_name == 'bktname'
         assert cls._prefix == '/'
         assert cls._dry_run is True
+        assert cls._head_workers == 16
+        assert cls._config.max_pool_connections == 16
         assert cls._key == 'foo'
         assert cls._keymd5 == 'bar'
-        assert m_boto_r.mock_calls == [call('s3')]
-        assert m_boto_c.mock_calls == [call('s3')]
+        assert m_boto_r.mock_calls == [call('s3', config=cls._config)]
+        assert m_boto_c.mock_calls == [call('s3', config=cls._config)]
         assert m_ek.mock_calls == [call(cls, 'foobar')]
         assert cls._s3 == m_boto_r.return_value
         assert cls._s3client == m_boto_c.return_value
 
+    def test_init_transfer(self):
+        profiles = TransferProfiles()
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True):
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('foo', 'bar')
+                    cls = S3Wrapper(
+                        'bktname', head_workers=16,
+                        transfer_profiles=profiles, max_connections=64
+                    )
+        assert cls._transfer is profiles
+        assert cls._config.max_pool_connections == 64
+
+    def test_init_rates(self):
+        up = RateSchedule(default=100)
+        down = RateSchedule(default=200)
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True):
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('foo', 'bar')
+                    cls = S3Wrapper(
+                        'bktname', upload_rate=up, download_rate=down
+                    )
+        assert cls._upload_bucket.schedule is up
+        assert cls._download_bucket.schedule is down
+
 
 class TestEncodeKey(object):
 
@@ -133,33 +189,597 @@ class TestGetFileList(object):
 
     def test_get_filelist_empty_prefix(self):
         with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
-            m_meta.side_effect = [{'meta': '1'}, {'meta': '2'}]
-            res = self.cls.get_filelist()
+            with patch('%s._read_manifest' % pb, autospec=True) as m_rm:
+                m_rm.return_value = None
+                m_meta.side_effect = [{'meta': '1'}, {'meta': '2'}]
+                res = self.cls.get_filelist()
         assert res == {
             '/foo/key/1': {'meta': '1'},
             '/foo/key/2': {'meta': '2'}
         }
         assert self.mock_res.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().Bucket('bname'),
             call().Bucket().objects.all(),
         ]
+        assert m_rm.mock_calls == [call(self.cls)]
+        assert self.cls.manifest_loaded is False
 
     def test_get_filelist_prefix(self):
         self.cls._prefix = '/foo'
         with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
-            m_meta.side_effect = [{'meta': '1'}, {'meta': '2'}]
-            res = self.cls.get_filelist()
+            with patch('%s._read_manifest' % pb, autospec=True) as m_rm:
+                m_rm.return_value = None
+                m_meta.side_effect = [{'meta': '1'}, {'meta': '2'}]
+                res = self.cls.get_filelist()
         assert res == {
             '/key/1': {'meta': '1'},
             '/key/2': {'meta': '2'}
         }
         assert self.mock_res.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().Bucket('bname'),
             call().Bucket().objects.filter(Prefix='/foo'),
         ]
 
+    def test_get_filelist_manifest(self):
+        self.cls.manifest_loaded = False
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('%s._read_manifest' % pb, autospec=True) as m_rm:
+                m_rm.return_value = {'/foo': {'meta': '1'}}
+                res = self.cls.get_filelist()
+        assert res == {'/foo': {'meta': '1'}}
+        assert self.cls.manifest_loaded is True
+        assert m_meta.mock_calls == []
+        assert self.mock_res.mock_calls == [call('s3', config=self.cls._config)]
+
+    def test_get_filelist_rebuild_manifest(self):
+        self.cls._prefix = '/foo'
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('%s._read_manifest' % pb, autospec=True) as m_rm:
+                m_meta.side_effect = [{'meta': '1'}, {'meta': '2'}]
+                res = self.cls.get_filelist(rebuild_manifest=True)
+        assert res == {
+            '/key/1': {'meta': '1'},
+            '/key/2': {'meta': '2'}
+        }
+        assert m_rm.mock_calls == []
+        assert self.cls.manifest_loaded is False
+
+    def test_get_filelist_rebuild_compressed(self):
+        self.cls._prefix = '/foo'
+        self.cls.compressed = {'/old': 'zlib'}
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('%s._read_manifest' % pb, autospec=True):
+                m_meta.side_effect = [
+                    {'size_b': '1', 'codec': 'lzma'}, {'size_b': '2'}
+                ]
+                self.cls.get_filelist(rebuild_manifest=True)
+        assert self.cls.compressed == {'/key/1': 'lzma'}
+
+    def test_get_filelist_skips_manifest_key(self):
+        self.cls._prefix = '/foo'
+        m_man = Mock(key='/foo/.s3sfe-manifest.json.gz')
+        bkt = self.mock_res.return_value.Bucket.return_value
+        bkt.objects.filter.return_value = [m_man] + list(
+            bkt.objects.filter.return_value
+        )
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('%s._read_manifest' % pb, autospec=True) as m_rm:
+                m_rm.return_value = None
+                m_meta.side_effect = [{'meta': '1'}, {'meta': '2'}]
+                res = self.cls.get_filelist()
+        assert res == {
+            '/key/1': {'meta': '1'},
+            '/key/2': {'meta': '2'}
+        }
+        assert m_meta.mock_calls == [
+            call(self.cls, '/foo/key/1'),
+            call(self.cls, '/foo/key/2')
+        ]
+
+    def test_get_filelist_bundles(self):
+        self.cls._prefix = '/foo'
+        self.cls.bundled = {'/stale': ('x', 0, 1)}
+        bkt = self.mock_res.return_value.Bucket.return_value
+        bkt.objects.filter.return_value = list(
+            bkt.objects.filter.return_value
+        ) + [
+            Mock(key='/foo/.s3sfe-bundles/2017-b'),
+            Mock(key='/foo/.s3sfe-bundles/2016-a')
+        ]
+        indexes = {
+            '2016-a': {
+                '/key/1': [3, 1.0, 'old1', 0],
+                '/key/3': [4, 2.0, 'old3', 3],
+                '/key/4': [5, 3.0, 'md54', 7]
+            },
+            '2017-b': {'/key/3': [6, 4.0, 'md53', 0]}
+        }
+
+        def se_read(_, bid, start=None, end=None):
+            return json.dumps(indexes[bid]).encode('utf-8')
+
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('%s.read_bundle' % pb, autospec=True) as m_read:
+                with patch('%s._read_tombstones' % pb,
+                           autospec=True) as m_tomb:
+                    m_meta.side_effect = [
+                        {'meta': '1'}, {'meta': '2'},
+                        {'bundle_index_offset': '6'},
+                        {'bundle_index_offset': '12'}
+                    ]
+                    m_read.side_effect = se_read
+                    m_tomb.return_value = {}
+                    res = self.cls.get_filelist(rebuild_manifest=True)
+        assert res == {
+            '/key/1': {'meta': '1'},
+            '/key/2': {'meta': '2'},
+            '/key/3': {'size_b': '6', 'mtime': '4.0', 'md5sum': 'md53'},
+            '/key/4': {'size_b': '5', 'mtime': '3.0', 'md5sum': 'md54'}
+        }
+        assert m_read.mock_calls == [
+            call(self.cls, '2016-a', start=12),
+            call(self.cls, '2017-b', start=6)
+        ]
+        assert self.cls.bundles == {'2016-a': 12, '2017-b': 6}
+        assert self.cls.bundled == {
+            '/key/3': ('2017-b', 0, 6),
+            '/key/4': ('2016-a', 7, 5)
+        }
+        assert self.cls.dead == {}
+
+    def test_get_filelist_bundles_dead(self):
+        self.cls._prefix = '/foo'
+        bkt = self.mock_res.return_value.Bucket.return_value
+        bkt.objects.filter.return_value = [
+            Mock(key='/foo/.s3sfe-bundle-tombstones.json.gz'),
+            Mock(key='/foo/.s3sfe-bundles/2016-a'),
+            Mock(key='/foo/.s3sfe-bundles/2017-b')
+        ]
+        indexes = {
+            '2016-a': {
+                '/key/3': [4, 2.0, 'old3', 3],
+                '/key/4': [5, 3.0, 'md54', 7]
+            },
+            '2017-b': {
+                '/key/3': [6, 4.0, 'md53', 0],
+                '/key/5': [1, 5.0, 'md55', 6]
+            }
+        }
+
+        def se_read(_, bid, start=None, end=None):
+            return json.dumps(indexes[bid]).encode('utf-8')
+
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('%s.read_bundle' % pb, autospec=True) as m_read:
+                with patch('%s._read_tombstones' % pb,
+                           autospec=True) as m_tomb:
+                    m_meta.side_effect = [
+                        {'bundle_index_offset': '12'},
+                        {'bundle_index_offset': '7'}
+                    ]
+                    m_read.side_effect = se_read
+                    m_tomb.return_value = {
+                        '2016-a': set(['/key/3', '/key/4']),
+                        '2017-b': set(['/key/3']),
+                        '2015-gone': set(['/key/9'])
+                    }
+                    res = self.cls.get_filelist(rebuild_manifest=True)
+        # /key/3 was rebundled, then deleted; /key/4 was deleted
+        assert res == {
+            '/key/5': {'size_b': '1', 'mtime': '5.0', 'md5sum': 'md55'}
+        }
+        assert self.cls.bundled == {'/key/5': ('2017-b', 6, 1)}
+        assert self.cls.dead == {
+            '2016-a': set(['/key/3', '/key/4']),
+            '2017-b': set(['/key/3'])
+        }
+        assert self.cls._dead_changed is True
+
+
+def gzipped_json(data):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fh:
+        fh.write(json.dumps(data).encode('utf-8'))
+    return buf.getvalue()
+
+
+class TestManifest(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', prefix='pre')
+        self.mock_client = m_boto_c.return_value
+
+    def test_read(self):
+        self.mock_client.get_object.return_value = {
+            'Body': BytesIO(gzipped_json({
+                'version': 1,
+                'files': {
+                    '/foo': [123, 456.789, 'abcd'],
+                    '/bar': [0, 0.0, None]
+                }
+            }))
+        }
+        res = self.cls._read_manifest()
+        assert res == {
+            '/foo': {'size_b': '123', 'mtime': '456.789', 'md5sum': 'abcd'},
+            '/bar': {'size_b': '0', 'mtime': '0.0', 'md5sum': None}
+        }
+        assert self.mock_client.mock_calls == [
+            call.get_object(
+                Bucket='bname',
+                Key='pre/.s3sfe-manifest.json.gz',
+                SSECustomerAlgorithm='AES256',
+                SSECustomerKey='key',
+                SSECustomerKeyMD5='md5'
+            )
+        ]
+
+    def test_read_missing(self):
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey'}}, 'GetObject'
+        )
+        assert self.cls._read_manifest() is None
+
+    def test_read_client_error(self):
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied'}}, 'GetObject'
+        )
+        with pytest.raises(ClientError):
+            self.cls._read_manifest()
+
+    def test_read_corrupt(self):
+        self.mock_client.get_object.return_value = {
+            'Body': BytesIO(b'not gzip')
+        }
+        assert self.cls._read_manifest() is None
+
+    def test_read_bad_version(self):
+        self.mock_client.get_object.return_value = {
+            'Body': BytesIO(gzipped_json({'version': 99, 'files': {}}))
+        }
+        assert self.cls._read_manifest() is None
+
+    def test_put(self):
+        self.cls.put_manifest({'/foo': (123, 456.789, 'abcd')})
+        assert len(self.mock_client.put_object.mock_calls) == 1
+        kwargs = self.mock_client.put_object.mock_calls[0][2]
+        body = kwargs.pop('Body')
+        assert kwargs == {
+            'Bucket': 'bname',
+            'Key': 'pre/.s3sfe-manifest.json.gz',
+            'ACL': 'private',
+            'SSECustomerAlgorithm': 'AES256',
+            'SSECustomerKey': 'key',
+            'SSECustomerKeyMD5': 'md5',
+            'Metadata': {'UploadedBy': 's3sfe-%s' % VERSION}
+        }
+        with gzip.GzipFile(fileobj=BytesIO(body), mode='rb') as fh:
+            assert json.loads(fh.read().decode('utf-8')) == {
+                'version': 1,
+                'bundles': {},
+                'dead': {},
+                'compressed': {},
+                'files': {'/foo': [123, 456.789, 'abcd']}
+            }
+
+    def test_put_round_trip(self):
+        self.cls.put_manifest({'/foo': (123, 456.789, 'abcd')})
+        body = self.mock_client.put_object.mock_calls[0][2]['Body']
+        self.mock_client.get_object.return_value = {'Body': BytesIO(body)}
+        assert self.cls._read_manifest() == {
+            '/foo': {'size_b': '123', 'mtime': '456.789', 'md5sum': 'abcd'}
+        }
+
+    def test_put_compressed_round_trip(self):
+        self.cls.compressed = {'/foo': 'zlib', '/gone': 'lzma'}
+        self.cls.put_manifest({
+            '/foo': (123, 456.789, 'abcd'),
+            '/bar': (5, 1.0, 'efgh')
+        })
+        body = self.mock_client.put_object.mock_calls[0][2]['Body']
+        with gzip.GzipFile(fileobj=BytesIO(body), mode='rb') as fh:
+            data = json.loads(fh.read().decode('utf-8'))
+        assert data['compressed'] == {'/foo': 'zlib'}
+        self.cls.compressed = {}
+        self.mock_client.get_object.return_value = {'Body': BytesIO(body)}
+        self.cls._read_manifest()
+        assert self.cls.compressed == {'/foo': 'zlib'}
+
+    def test_put_dry_run(self):
+        self.cls._dry_run = True
+        self.cls.put_manifest({'/foo': (123, 456.789, 'abcd')})
+        assert self.mock_client.put_object.mock_calls == []
+
+    def test_put_dead(self):
+        self.cls.bundles = {'b1': 300}
+        self.cls.dead = {'b1': set(['/y', '/x'])}
+        self.cls._dead_changed = True
+        self.cls.put_manifest({'/foo': (123, 456.789, 'abcd')})
+        assert [
+            c[2]['Key'] for c in self.mock_client.put_object.mock_calls
+        ] == [
+            'pre/.s3sfe-bundle-tombstones.json.gz',
+            'pre/.s3sfe-manifest.json.gz'
+        ]
+        assert self.cls._dead_changed is False
+        tombs, body = [
+            c[2]['Body'] for c in self.mock_client.put_object.mock_calls
+        ]
+        self.mock_client.get_object.return_value = {'Body': BytesIO(tombs)}
+        assert self.cls._read_tombstones() == {'b1': set(['/x', '/y'])}
+        self.cls.dead = {}
+        self.mock_client.get_object.return_value = {'Body': BytesIO(body)}
+        self.cls._read_manifest()
+        assert self.cls.dead == {'b1': set(['/x', '/y'])}
+        # unchanged tombstones aren't rewritten
+        self.mock_client.put_object.reset_mock()
+        self.cls.put_manifest({'/foo': (123, 456.789, 'abcd')})
+        assert len(self.mock_client.put_object.mock_calls) == 1
+
+    def test_read_tombstones_missing(self):
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey'}}, 'GetObject'
+        )
+        assert self.cls._read_tombstones() == {}
+
+    def test_read_tombstones_corrupt(self):
+        self.mock_client.get_object.return_value = {
+            'Body': BytesIO(b'not gzip')
+        }
+        assert self.cls._read_tombstones() == {}
+
+    def test_read_bundled(self):
+        self.cls.bundles = {'old': 1}
+        self.mock_client.get_object.return_value = {
+            'Body': BytesIO(gzipped_json({
+                'version': 1,
+                'bundles': {'b1': 300},
+                'files': {
+                    '/foo': [123, 456.789, 'abcd', 'b1', 100],
+                    '/bar': [5, 1.0, 'efgh']
+                }
+            }))
+        }
+        res = self.cls._read_manifest()
+        assert res == {
+            '/foo': {'size_b': '123', 'mtime': '456.789', 'md5sum': 'abcd'},
+            '/bar': {'size_b': '5', 'mtime': '1.0', 'md5sum': 'efgh'}
+        }
+        assert self.cls.bundles == {'b1': 300}
+        assert self.cls.bundled == {'/foo': ('b1', 100, 123)}
+
+    def test_put_bundled_round_trip(self):
+        self.cls.bundles = {'b1': 300}
+        self.cls.bundled = {'/foo': ('b1', 100, 123)}
+        self.cls.put_manifest({
+            '/foo': (123, 456.789, 'abcd'),
+            '/bar': (5, 1.0, 'efgh')
+        })
+        body = self.mock_client.put_object.mock_calls[0][2]['Body']
+        with gzip.GzipFile(fileobj=BytesIO(body), mode='rb') as fh:
+            assert json.loads(fh.read().decode('utf-8')) == {
+                'version': 1,
+                'bundles': {'b1': 300},
+                'dead': {},
+                'compressed': {},
+                'files': {
+                    '/foo': [123, 456.789, 'abcd', 'b1', 100],
+                    '/bar': [5, 1.0, 'efgh']
+                }
+            }
+        self.cls.bundles = {}
+        self.cls.bundled = {}
+        self.mock_client.get_object.return_value = {'Body': BytesIO(body)}
+        self.cls._read_manifest()
+        assert self.cls.bundles == {'b1': 300}
+        assert self.cls.bundled == {'/foo': ('b1', 100, 123)}
+
+
+def throttle_error():
+    return ClientError(
+        {
+            'Error': {'Code': 'SlowDown'},
+            'ResponseMetadata': {'HTTPStatusCode': 503}
+        },
+        'HeadObject'
+    )
+
+
+class TestIsThrottleError(object):
+
+    def test_slowdown(self):
+        assert is_throttle_error(throttle_error()) is True
+
+    def test_503(self):
+        assert is_throttle_error(ClientError(
+            {
+                'Error': {'Code': 'Foo'},
+                'ResponseMetadata': {'HTTPStatusCode': 503}
+            },
+            'HeadObject'
+        )) is True
+
+    def test_other_client_error(self):
+        assert is_throttle_error(ClientError(
+            {
+                'Error': {'Code': 'AccessDenied'},
+                'ResponseMetadata': {'HTTPStatusCode': 403}
+            },
+            'HeadObject'
+        )) is False
+
+    def test_other_exception(self):
+        assert is_throttle_error(RuntimeError('SlowDown')) is False
+
+    def test_upload_failed_chained(self):
+        # as raised by boto3's managed upload_file
+        try:
+            try:
+                raise throttle_error()
+            except ClientError as e:
+                raise S3UploadFailedError('Failed to upload: %s' % e)
+        except S3UploadFailedError as ex:
+            if sys.version_info[0] > 2:
+                assert isinstance(ex.__context__, ClientError)
+            assert is_throttle_error(ex) is True
+
+    def test_upload_failed_message(self):
+        # without exception chaining, the code is read from the message
+        ex = S3UploadFailedError(
+            'Failed to upload /An error occurred (Foo)/x to b/k: An error '
+            'occurred (SlowDown) when calling the PutObject operation '
+            '(reached max retries: 4): Please reduce your request rate.'
+        )
+        assert is_throttle_error(ex) is True
+        assert is_throttle_error(S3UploadFailedError(
+            'Failed to upload /x to b/k: An error occurred (AccessDenied) '
+            'when calling the PutObject operation: Access Denied'
+        )) is False
+
+    def test_upload_failed_other(self):
+        try:
+            try:
+                raise ClientError(
+                    {
+                        'Error': {'Code': 'AccessDenied'},
+                        'ResponseMetadata': {'HTTPStatusCode': 403}
+                    },
+                    'PutObject'
+                )
+            except ClientError as e:
+                raise S3UploadFailedError('Failed to upload: %s' % e)
+        except S3UploadFailedError as ex:
+            assert is_throttle_error(ex) is False
+
+
+class TestIsCongestionError(object):
+
+    def test_throttle(self):
+        assert is_congestion_error(throttle_error()) is True
+
+    def test_timeouts(self):
+        assert is_congestion_error(
+            ReadTimeoutError(endpoint_url='https://s3')
+        ) is True
+        assert is_congestion_error(
+            ConnectTimeoutError(endpoint_url='https://s3')
+        ) is True
+
+    def test_other_exception(self):
+        assert is_congestion_error(RuntimeError('timeout')) is False
+
+    def test_request_timeout(self):
+        assert is_congestion_error(ClientError(
+            {
+                'Error': {'Code': 'RequestTimeout'},
+                'ResponseMetadata': {'HTTPStatusCode': 400}
+            },
+            'PutObject'
+        )) is True
+
+
+class TestMakeLimiter(object):
+
+    def test_make_limiter(self):
+        lim = make_limiter('HEAD', 16, initial=8)
+        assert lim.name == 'HEAD'
+        assert lim.max_limit == 16
+        assert lim.limit == 8
+        assert lim.max_retries == S3Wrapper.max_throttle_retries
+        assert lim._retryable is is_congestion_error
+
+    def test_put_file_slowdown(self, tmpdir):
+        # a real client, stubbed to answer SlowDown twice; boto3's managed
+        # upload wraps that in S3UploadFailedError, which must still make
+        # the limiter back off and retry
+        p = tmpdir.join('foo')
+        p.write('foo')
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True):
+                cls = S3Wrapper('bname', ssec_key=b'k' * 32)
+        cls._s3client = boto3.client(
+            's3', region_name='us-east-1', aws_access_key_id='a',
+            aws_secret_access_key='b'
+        )
+        stubber = Stubber(cls._s3client)
+        for _ in range(2):
+            stubber.add_client_error(
+                'put_object', service_error_code='SlowDown',
+                http_status_code=503
+            )
+        stubber.add_response('put_object', {})
+        lim = make_limiter('upload', 8)
+        with stubber:
+            with patch('s3sfe.concurrency.time.sleep') as mock_sleep:
+                lim.run(cls.put_file, (str(p), 3, 1.0, 'fmd5'))
+        stubber.assert_no_pending_responses()
+        assert len(mock_sleep.mock_calls) == 2
+        # backed off to one upload in flight
+        assert [x[1] for x in lim.history][:2] == [2, 1]
+
+
+class TestGetMetadataConcurrent(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True):
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', head_workers=8)
+
+    def test_concurrent(self):
+        keys = ['k%d' % i for i in range(100)]
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            m_meta.side_effect = lambda _, k: {'key': k}
+            res = list(self.cls._get_metadata_concurrent(iter(keys)))
+        assert sorted(res) == sorted((k, {'key': k}) for k in keys)
+
+    def test_throttled(self):
+        keys = ['k%d' % i for i in range(20)]
+        throttled = set()
+        lock = threading.Lock()
+
+        def se_meta(_, k):
+            with lock:
+                if k in ['k3', 'k7'] and k not in throttled:
+                    throttled.add(k)
+                    raise throttle_error()
+            return {'key': k}
+
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('s3sfe.concurrency.time.sleep') as m_sleep:
+                with patch('s3sfe.concurrency.logger') as m_logger:
+                    m_meta.side_effect = se_meta
+                    res = list(self.cls._get_metadata_concurrent(iter(keys)))
+        assert sorted(res) == sorted((k, {'key': k}) for k in keys)
+        assert len(m_meta.mock_calls) == 22
+        assert len(m_sleep.mock_calls) == 2
+        assert len(m_logger.warning.mock_calls) >= 1
+        limits = [limit for _, limit in self.cls._head_limiter.history]
+        assert any(b < a for a, b in zip(limits, limits[1:]))
+        assert max(limits) <= 8
+
+    def test_throttled_too_many_times(self):
+        self.cls._head_limiter.max_retries = 2
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            with patch('s3sfe.concurrency.time.sleep'):
+                m_meta.side_effect = throttle_error()
+                with pytest.raises(ClientError):
+                    list(self.cls._get_metadata_concurrent(iter(['k1'])))
+        assert len(m_meta.mock_calls) == 3
+
+    def test_other_error(self):
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            m_meta.side_effect = RuntimeError('foo')
+            with pytest.raises(RuntimeError):
+                list(self.cls._get_metadata_concurrent(iter(['k1', 'k2'])))
+
 
 class TestGetMetadata(object):
 
@@ -177,7 +797,7 @@ class TestGetMetadata(object):
         }
         assert self.cls._get_metadata('/key/one') == {'foo': 'bar'}
         assert self.mock_client.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().head_object(
                 Bucket='bname',
                 Key='/key/one',
@@ -214,23 +834,22 @@ class TestPutFile(object):
 
     def setup(self):
         with patch('%s.boto3.resource' % pbm, autospec=True) as m_boto_r:
-            with patch('%s.boto3.client' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
                 with patch('%s._encode_key' % pb, autospec=True) as m_ek:
                     m_ek.return_value = ('key', 'md5')
                     self.cls = S3Wrapper('bname')
-        mock_bucket = Mock()
-        m_boto_r.return_value.Bucket.return_value = mock_bucket
         self.mock_res = m_boto_r
+        self.mock_client = m_boto_c
 
     def test_put(self):
         with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
             m_kfp.return_value = '/key/for/path'
             self.cls.put_file('/f/path', 1234, 5678, 'fmd5')
-        assert self.mock_res.mock_calls == [
-            call('s3'),
-            call().Bucket('bname'),
-            call().Bucket().upload_file(
+        assert self.mock_client.mock_calls == [
+            call('s3', config=self.cls._config),
+            call().upload_file(
                 '/f/path',
+                'bname',
                 '/key/for/path',
                 ExtraArgs={
                     'ACL': 'private',
@@ -243,9 +862,11 @@ class TestPutFile(object):
                         'mtime': '%s' % 5678,
                         'md5sum': 'fmd5'
                     }
-                }
+                },
+                Config=self.cls._transfer.config_for(1234)
             ),
         ]
+        assert self.mock_res.mock_calls == [call('s3', config=self.cls._config)]
         assert m_kfp.mock_calls == [call(self.cls, '/f/path')]
 
     def test_dry_run(self):
@@ -253,24 +874,850 @@ class TestPutFile(object):
         with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
             m_kfp.return_value = '/key/for/path'
             self.cls.put_file('/f/path', 1234, 5678, 'fmd5')
-        assert self.mock_res.mock_calls == [
-            call('s3'),
-            call().Bucket('bname')
+        assert self.mock_client.mock_calls == [
+            call('s3', config=self.cls._config)
         ]
         assert m_kfp.mock_calls == [call(self.cls, '/f/path')]
 
+    def test_put_rate_limited(self):
+        bucket = Mock()
+        self.cls._upload_bucket = bucket
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            m_kfp.return_value = '/key/for/path'
+            self.cls.put_file('/f/path', 1234, 5678, 'fmd5')
+        kwargs = self.mock_client.mock_calls[1][2]
+        assert kwargs['Callback'] == bucket.consume
+
+    def test_put_bundled(self):
+        self.cls.bundled = {'/f/path': ('b1', 0, 10), '/other': ('b1', 10, 5)}
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            m_kfp.return_value = '/key/for/path'
+            self.cls.put_file('/f/path', 1234, 5678, 'fmd5')
+        assert self.cls.bundled == {'/other': ('b1', 10, 5)}
+
+    def test_put_bytes_sent(self):
+        self.cls.compressed = {'/f/path': 'zlib'}
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            m_kfp.return_value = '/key/for/path'
+            self.cls.put_file('/f/path', 1234, 5678, 'fmd5')
+            self.cls.put_file('/f/path', 1000, 5678, 'fmd5')
+        assert self.cls.bytes_sent == 2234
+        assert self.cls.compressed == {}
+
+    def test_put_compressed(self, tmpdir):
+        text = b'the quick brown fox jumps over the lazy dog\n' * 5000
+        p = tmpdir.join('big.txt')
+        p.write_binary(text)
+        uploaded = []
+
+        def se_upload(fileobj, *args, **kwargs):
+            uploaded.append(fileobj.read())
+
+        self.cls._compression = 'zlib'
+        self.mock_client.return_value.upload_fileobj.side_effect = se_upload
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            m_kfp.return_value = '/key/for/path'
+            self.cls.put_file(str(p), len(text), 5678, 'fmd5')
+        assert self.mock_client.mock_calls == [
+            call('s3', config=self.cls._config),
+            call().upload_fileobj(
+                ANY,
+                'bname',
+                '/key/for/path',
+                ExtraArgs={
+                    'ACL': 'private',
+                    'SSECustomerAlgorithm': 'AES256',
+                    'SSECustomerKey': 'key',
+                    'SSECustomerKeyMD5': 'md5',
+                    'Metadata': {
+                        'UploadedBy': 's3sfe-%s' % VERSION,
+                        'size_b': '%s' % len(text),
+                        'mtime': '%s' % 5678,
+                        'md5sum': 'fmd5',
+                        'codec': 'zlib'
+                    }
+                },
+                Config=self.cls._transfer.config_for(len(text))
+            ),
+        ]
+        assert zlib.decompress(uploaded[0]) == text
+        assert self.cls.compressed == {str(p): 'zlib'}
+        assert self.cls.bytes_sent == len(uploaded[0])
+
+    def test_put_compression_skipped(self):
+        self.cls._compression = 'zlib'
+        self.cls.compressed = {'/f/path': 'zlib'}
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            with patch('%s.should_compress' % pbm, autospec=True) as m_sc:
+                m_kfp.return_value = '/key/for/path'
+                m_sc.return_value = False
+                self.cls.put_file('/f/path', 1234, 5678, 'fmd5')
+        assert m_sc.mock_calls == [call('/f/path', 1234)]
+        assert self.mock_client.mock_calls[1][0] == '().upload_file'
+        assert self.cls.compressed == {}
+        assert self.cls.bytes_sent == 1234
+
+
+class TestCopyFile(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', prefix='pre')
+        self.mock_client = m_boto_c.return_value
+
+    def test_copy(self):
+        self.cls.bundled = {'/f/new': ('b1', 0, 1234), '/o': ('b1', 5, 1)}
+        self.cls.copy_file('/f/old', '/f/new', 1234, 5678, 'fmd5')
+        assert self.mock_client.mock_calls == [
+            call.copy(
+                {'Bucket': 'bname', 'Key': 'pre/f/old'},
+                'bname',
+                'pre/f/new',
+                ExtraArgs={
+                    'ACL': 'private',
+                    'MetadataDirective': 'REPLACE',
+                    'SSECustomerAlgorithm': 'AES256',
+                    'SSECustomerKey': 'key',
+                    'SSECustomerKeyMD5': 'md5',
+                    'CopySourceSSECustomerAlgorithm': 'AES256',
+                    'CopySourceSSECustomerKey': 'key',
+                    'CopySourceSSECustomerKeyMD5': 'md5',
+                    'Metadata': {
+                        'UploadedBy': 's3sfe-%s' % VERSION,
+                        'size_b': '1234',
+                        'mtime': '5678',
+                        'md5sum': 'fmd5'
+                    }
+                },
+                Config=self.cls._transfer.config_for(1234)
+            )
+        ]
+        assert self.cls.bundled == {'/o': ('b1', 5, 1)}
+
+    def test_copy_compressed(self):
+        self.cls.compressed = {'/f/old': 'lzma'}
+        self.cls.copy_file('/f/old', '/f/new', 1234, 5678, 'fmd5')
+        kwargs = self.mock_client.mock_calls[0][2]
+        assert kwargs['ExtraArgs']['Metadata']['codec'] == 'lzma'
+        assert self.cls.compressed == {'/f/old': 'lzma', '/f/new': 'lzma'}
+
+    def test_copy_uncompressed_over_compressed(self):
+        self.cls.compressed = {'/f/new': 'lzma'}
+        self.cls.copy_file('/f/old', '/f/new', 1234, 5678, 'fmd5')
+        kwargs = self.mock_client.mock_calls[0][2]
+        assert 'codec' not in kwargs['ExtraArgs']['Metadata']
+        assert self.cls.compressed == {}
+
+    def test_dry_run(self):
+        self.cls._dry_run = True
+        self.cls.copy_file('/f/old', '/f/new', 1234, 5678, 'fmd5')
+        assert self.mock_client.mock_calls == []
+
+
+def no_such_upload(op='UploadPart'):
+    return ClientError(
+        {
+            'Error': {'Code': 'NoSuchUpload'},
+            'ResponseMetadata': {'HTTPStatusCode': 404}
+        },
+        op
+    )
+
+
+class TestPutFileResumable(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', prefix='pre')
+        self.mock_client = m_boto_c.return_value
+        self.mock_client.create_multipart_upload.return_value = {
+            'UploadId': 'uid1'
+        }
+        self.bodies = {}
+
+        def se_upload_part(**kwargs):
+            self.bodies[kwargs['PartNumber']] = kwargs['Body'].read()
+            return {'ETag': '"e%d"' % kwargs['PartNumber']}
+
+        self.mock_client.upload_part.side_effect = se_upload_part
+        self.cls._transfer = Mock()
+        self.config = Mock(
+            multipart_threshold=10, multipart_chunksize=8, max_concurrency=2
+        )
+        self.cls._transfer.config_for.return_value = self.config
+
+    def setup_files(self, tmpdir):
+        self.path = str(tmpdir.join('f'))
+        with open(self.path, 'wb') as fh:
+            fh.write(b'0123456789abcdefghij')
+        self.journal = UploadJournal(str(tmpdir.join('uploads.sqlite')))
+        self.cls._journal = self.journal
+
+    def parts_uploaded(self):
+        return sorted(self.bodies.items())
+
+    def test_below_threshold(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.cls.put_file(self.path, 9, 1000.5, 'fmd5')
+        assert self.mock_client.upload_file.call_count == 1
+        assert self.mock_client.create_multipart_upload.mock_calls == []
+
+    def test_no_journal(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.cls._journal = None
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.upload_file.call_count == 1
+        assert self.mock_client.create_multipart_upload.mock_calls == []
+
+    def test_new_upload(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.cls.bundled = {self.path: ('b1', 0, 20)}
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.upload_file.mock_calls == []
+        assert self.mock_client.create_multipart_upload.mock_calls == [
+            call(
+                Bucket='bname',
+                Key='pre' + self.path,
+                ACL='private',
+                SSECustomerAlgorithm='AES256',
+                SSECustomerKey='key',
+                SSECustomerKeyMD5='md5',
+                Metadata={
+                    'UploadedBy': 's3sfe-%s' % VERSION,
+                    'size_b': '20',
+                    'mtime': '1000.5',
+                    'md5sum': 'fmd5'
+                }
+            )
+        ]
+        assert self.parts_uploaded() == [
+            (1, b'01234567'), (2, b'89abcdef'), (3, b'ghij')
+        ]
+        kwargs = self.mock_client.upload_part.mock_calls[0][2]
+        assert kwargs['UploadId'] == 'uid1'
+        assert kwargs['SSECustomerKey'] == 'key'
+        assert self.mock_client.complete_multipart_upload.mock_calls == [
+            call(
+                Bucket='bname',
+                Key='pre' + self.path,
+                UploadId='uid1',
+                MultipartUpload={'Parts': [
+                    {'PartNumber': 1, 'ETag': '"e1"'},
+                    {'PartNumber': 2, 'ETag': '"e2"'},
+                    {'PartNumber': 3, 'ETag': '"e3"'}
+                ]}
+            )
+        ]
+        assert self.journal.get('bname', 'pre' + self.path) is None
+        assert self.cls.bundled == {}
+        assert self.cls.bytes_sent == 20
+
+    def test_interrupted(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.config.max_concurrency = 1
+
+        def se_upload_part(**kwargs):
+            if kwargs['PartNumber'] == 2:
+                raise RuntimeError('killed')
+            return {'ETag': '"e%d"' % kwargs['PartNumber']}
+
+        self.mock_client.upload_part.side_effect = se_upload_part
+        with pytest.raises(RuntimeError):
+            self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.complete_multipart_upload.mock_calls == []
+        entry = self.journal.get('bname', 'pre' + self.path)
+        assert entry['upload_id'] == 'uid1'
+        assert entry['part_size'] == 8
+        # parts already queued still complete and are recorded
+        assert entry['parts'] == {1: '"e1"', 3: '"e3"'}
+
+    def test_resume(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'fmd5'
+        )
+        self.journal.add_part('uid0', 1, '"x1"')
+        self.journal.add_part('uid0', 3, '"x3"')
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.create_multipart_upload.mock_calls == []
+        assert self.parts_uploaded() == [(2, b'89abcdef')]
+        assert self.mock_client.upload_part.mock_calls[0][2][
+            'UploadId'] == 'uid0'
+        assert self.mock_client.complete_multipart_upload.mock_calls == [
+            call(
+                Bucket='bname',
+                Key='pre' + self.path,
+                UploadId='uid0',
+                MultipartUpload={'Parts': [
+                    {'PartNumber': 1, 'ETag': '"x1"'},
+                    {'PartNumber': 2, 'ETag': '"e2"'},
+                    {'PartNumber': 3, 'ETag': '"x3"'}
+                ]}
+            )
+        ]
+        assert self.journal.get('bname', 'pre' + self.path) is None
+        # only the part uploaded in this run is counted
+        assert self.cls.bytes_sent == 8
+
+    def test_resume_mtime_tolerance(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'fmd5'
+        )
+        self.journal.add_part('uid0', 1, '"x1"')
+        self.cls.put_file(self.path, 20, 1000.505, 'fmd5')
+        assert self.mock_client.abort_multipart_upload.mock_calls == []
+        assert self.mock_client.create_multipart_upload.mock_calls == []
+        assert self.parts_uploaded() == [(2, b'89abcdef'), (3, b'ghij')]
+
+    def test_resume_mtime_changed(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'fmd5'
+        )
+        self.cls.put_file(self.path, 20, 1001.5, 'fmd5')
+        assert self.mock_client.abort_multipart_upload.mock_calls == [
+            call(Bucket='bname', Key='pre' + self.path, UploadId='uid0')
+        ]
+        assert self.mock_client.create_multipart_upload.call_count == 1
+
+    def test_resume_changed(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'oldmd5'
+        )
+        self.journal.add_part('uid0', 1, '"x1"')
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.abort_multipart_upload.mock_calls == [
+            call(Bucket='bname', Key='pre' + self.path, UploadId='uid0')
+        ]
+        assert self.mock_client.create_multipart_upload.call_count == 1
+        assert self.parts_uploaded() == [
+            (1, b'01234567'), (2, b'89abcdef'), (3, b'ghij')
+        ]
+        kwargs = self.mock_client.complete_multipart_upload.mock_calls[0][2]
+        assert kwargs['UploadId'] == 'uid1'
+
+    def test_resume_no_such_upload(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'fmd5'
+        )
+        self.journal.add_part('uid0', 1, '"x1"')
+
+        def se_upload_part(**kwargs):
+            if kwargs['UploadId'] == 'uid0':
+                raise no_such_upload()
+            return {'ETag': '"e%d"' % kwargs['PartNumber']}
+
+        self.mock_client.upload_part.side_effect = se_upload_part
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.create_multipart_upload.call_count == 1
+        kwargs = self.mock_client.complete_multipart_upload.mock_calls[0][2]
+        assert kwargs['UploadId'] == 'uid1'
+        assert len(kwargs['MultipartUpload']['Parts']) == 3
+        assert self.journal.get('bname', 'pre' + self.path) is None
+
+    def test_resume_other_error(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'fmd5'
+        )
+        self.mock_client.upload_part.side_effect = throttle_error()
+        with pytest.raises(ClientError):
+            self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.mock_client.create_multipart_upload.mock_calls == []
+        assert self.journal.get('bname', 'pre' + self.path) is not None
+
+    def test_part_size_max_parts(self, tmpdir):
+        self.setup_files(tmpdir)
+        self.cls.max_parts = 2
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert self.parts_uploaded() == [
+            (1, b'0123456789'), (2, b'abcdefghij')
+        ]
+
+    def test_rate_limited(self, tmpdir):
+        self.setup_files(tmpdir)
+        bucket = Mock()
+        self.cls._upload_bucket = bucket
+        self.cls.put_file(self.path, 20, 1000.5, 'fmd5')
+        assert sorted(bucket.consume.mock_calls) == [
+            call(4), call(8), call(8)
+        ]
+
+    def test_streamed_body(self, tmpdir):
+        # a real client must be able to size, checksum and send the part
+        # body straight from the file slice
+        self.setup_files(tmpdir)
+        self.cls._s3client = boto3.client(
+            's3', region_name='us-east-1', aws_access_key_id='a',
+            aws_secret_access_key='b'
+        )
+        sent = []
+
+        def se_send(request, **kwargs):
+            body = request.body
+            sent.append(body.read() if hasattr(body, 'read') else body)
+            raw = Mock()
+            raw.stream.return_value = iter([b''])
+            return AWSResponse(request.url, 200, {'ETag': '"e1"'}, raw)
+
+        self.cls._s3client.meta.events.register(
+            'before-send.s3.UploadPart', se_send
+        )
+        self.journal.start(
+            'bname', 'pre' + self.path, 'uid0', self.path, 8, 20, 1000.5,
+            'fmd5'
+        )
+        self.journal.add_part('uid0', 1, '"x1"')
+        self.journal.add_part('uid0', 2, '"x2"')
+        entry = self.journal.get('bname', 'pre' + self.path)
+        with patch.object(
+            self.cls._s3client, 'complete_multipart_upload'
+        ) as mock_complete:
+            self.cls._upload_parts(
+                self.path, 'pre' + self.path, 20, entry, self.config
+            )
+        assert mock_complete.call_count == 1
+        assert len(sent) == 1
+        assert b'ghij' in sent[0]
+        assert b'0123' not in sent[0]
+
+
+class TestAbortUploads(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', prefix='pre')
+        self.mock_client = m_boto_c.return_value
+        self.cls._journal = Mock()
+
+    def test_abort(self):
+        assert self.cls.abort_upload('pre/foo', 'uid1') is True
+        assert self.mock_client.abort_multipart_upload.mock_calls == [
+            call(Bucket='bname', Key='pre/foo', UploadId='uid1')
+        ]
+        assert self.cls._journal.mock_calls == [call.finish('bname', 'pre/foo')]
+
+    def test_abort_no_such_upload(self):
+        self.mock_client.abort_multipart_upload.side_effect = no_such_upload(
+            'AbortMultipartUpload'
+        )
+        assert self.cls.abort_upload('pre/foo', 'uid1') is True
+        assert self.cls._journal.mock_calls == [call.finish('bname', 'pre/foo')]
+
+    def test_abort_error(self):
+        self.mock_client.abort_multipart_upload.side_effect = throttle_error()
+        with patch('%s.logger' % pbm, autospec=True) as mock_logger:
+            assert self.cls.abort_upload('pre/foo', 'uid1') is False
+        assert self.cls._journal.mock_calls == []
+        assert mock_logger.error.call_count == 1
+
+    def test_abort_dry_run(self):
+        self.cls._dry_run = True
+        assert self.cls.abort_upload('pre/foo', 'uid1') is True
+        assert self.mock_client.abort_multipart_upload.mock_calls == []
+        assert self.cls._journal.mock_calls == []
+
+    def test_abort_orphaned(self):
+        pages = [
+            {'Uploads': [
+                {
+                    'Key': 'pre/a', 'UploadId': 'keep',
+                    'Initiated': datetime(2017, 1, 1)
+                },
+                {
+                    'Key': 'pre/b', 'UploadId': 'old',
+                    'Initiated': datetime(2017, 1, 1)
+                },
+            ]},
+            {'Uploads': [
+                {
+                    'Key': 'pre/c', 'UploadId': 'new',
+                    'Initiated': datetime(2017, 1, 1, 23, 30)
+                },
+                {
+                    'Key': 'pre/d', 'UploadId': 'old2',
+                    'Initiated': datetime(2017, 1, 1, 22, 30)
+                },
+            ]},
+            {}
+        ]
+        self.mock_client.get_paginator.return_value.paginate.return_value = \
+            pages
+        with patch('%s.time.time' % pbm) as mock_time:
+            # 2017-01-02 00:00:00 UTC
+            mock_time.return_value = 1483315200
+            with patch('%s.abort_upload' % pb, autospec=True) as mock_abort:
+                mock_abort.side_effect = [True, False]
+                res = self.cls.abort_orphaned_uploads(
+                    keep_ids=set(['keep']), min_age=3600
+                )
+        assert res == 1
+        assert self.mock_client.get_paginator.mock_calls == [
+            call('list_multipart_uploads'),
+            call().paginate(Bucket='bname', Prefix='pre/')
+        ]
+        assert mock_abort.mock_calls == [
+            call(self.cls, 'pre/b', 'old'),
+            call(self.cls, 'pre/d', 'old2')
+        ]
+
+
+class TestBundles(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True) as m_boto_r:
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', prefix='pre')
+        self.mock_client = m_boto_c.return_value
+        self.mock_res = m_boto_r.return_value
+
+    def test_put_bundle(self):
+        self.cls.bundles = {'old': 10}
+        self.cls.bundled = {'/a': ('old', 0, 3), '/c': ('old', 3, 7)}
+        bodies = []
+
+        def se_upload(fobj, bucket, key, **kwargs):
+            bodies.append(fobj.read())
+
+        self.mock_client.upload_fileobj.side_effect = se_upload
+        with patch('%s.dtnow' % pbm) as m_dtnow:
+            with patch('%s.uuid4' % pbm) as m_uuid:
+                m_dtnow.return_value = datetime(2017, 3, 4, 5, 6, 7)
+                m_uuid.return_value.hex = '0123456789abcdef'
+                res = self.cls.put_bundle([
+                    ('/a', (3, 1.5, 'md5a'), b'aaa'),
+                    ('/b', (0, 2.5, 'md5b'), b''),
+                    ('/d', (4, 3.5, 'md5d'), b'dddd')
+                ])
+        assert res == '20170304050607-0123456789ab'
+        assert self.mock_client.upload_fileobj.mock_calls == [
+            call(
+                ANY, 'bname', 'pre/.s3sfe-bundles/20170304050607-0123456789ab',
+                ExtraArgs={
+                    'ACL': 'private',
+                    'SSECustomerAlgorithm': 'AES256',
+                    'SSECustomerKey': 'key',
+                    'SSECustomerKeyMD5': 'md5',
+                    'Metadata': {
+                        'UploadedBy': 's3sfe-%s' % VERSION,
+                        'bundle_index_offset': '7'
+                    }
+                },
+                Config=self.cls._transfer.config_for(len(bodies[0]))
+            )
+        ]
+        assert bodies[0][:7] == b'aaadddd'
+        assert json.loads(bodies[0][7:].decode('utf-8')) == {
+            '/a': [3, 1.5, 'md5a', 0],
+            '/b': [0, 2.5, 'md5b', 3],
+            '/d': [4, 3.5, 'md5d', 3]
+        }
+        assert self.cls.bundles == {'old': 10, res: 7}
+        assert self.cls.bundled == {
+            '/a': (res, 0, 3),
+            '/b': (res, 3, 0),
+            '/c': ('old', 3, 7),
+            '/d': (res, 3, 4)
+        }
+
+    def test_put_bundle_rate_limited(self):
+        bucket = Mock()
+        self.cls._upload_bucket = bucket
+        self.cls.put_bundle([('/a', (3, 1.5, 'md5a'), b'aaa')])
+        kwargs = self.mock_client.upload_fileobj.mock_calls[0][2]
+        assert kwargs['Callback'] == bucket.consume
+
+    def test_put_bundle_dry_run(self):
+        self.cls._dry_run = True
+        self.cls.put_bundle([('/a', (3, 1.5, 'md5a'), b'aaa')])
+        assert self.mock_client.upload_fileobj.mock_calls == []
+        assert self.cls.bundles == {}
+        assert self.cls.bundled == {}
+
+    def test_read_bundle(self):
+        self.mock_client.get_object.return_value = {
+            'Body': BytesIO(b'data')
+        }
+        assert self.cls.read_bundle('b1') == b'data'
+        self.cls.read_bundle('b1', start=10)
+        self.cls.read_bundle('b1', start=10, end=19)
+        kwargs = dict(
+            Bucket='bname', Key='pre/.s3sfe-bundles/b1',
+            SSECustomerAlgorithm='AES256', SSECustomerKey='key',
+            SSECustomerKeyMD5='md5'
+        )
+        assert self.mock_client.get_object.mock_calls == [
+            call(**kwargs),
+            call(Range='bytes=10-', **kwargs),
+            call(Range='bytes=10-19', **kwargs)
+        ]
+
+    def test_delete_bundles(self):
+        self.cls.bundles = {'b1': 1, 'b2': 2, 'b3': 3}
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            m_del.return_value = ['pre/.s3sfe-bundles/b2']
+            res = self.cls.delete_bundles(['b2', 'b1'])
+        assert res == ['b2']
+        assert m_del.mock_calls == [
+            call(self.cls, ['pre/.s3sfe-bundles/b1', 'pre/.s3sfe-bundles/b2'])
+        ]
+        assert self.cls.bundles == {'b2': 2, 'b3': 3}
+
+    def test_delete_bundles_dry_run(self):
+        self.cls._dry_run = True
+        self.cls.bundles = {'b1': 1}
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            assert self.cls.delete_bundles(['b1']) == []
+        assert m_del.mock_calls == []
+        assert self.cls.bundles == {'b1': 1}
+
+    def test_delete_files_bundled(self):
+        self.cls.bundled = {'/a': ('b1', 0, 3), '/c': ('b1', 3, 4)}
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            m_del.return_value = []
+            assert self.cls.delete_files(['/a', '/b']) == []
+        assert m_del.mock_calls == [call(self.cls, ['pre/b'])]
+        assert self.cls.bundled == {'/c': ('b1', 3, 4)}
+
+    def test_delete_files_all_bundled(self):
+        self.cls.bundled = {'/a': ('b1', 0, 3)}
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            assert self.cls.delete_files(['/a']) == []
+        assert m_del.mock_calls == []
+        assert self.cls.bundled == {}
+
+    def test_forget_bundled(self):
+        self.cls.bundles = {'b1': 7, 'b2': 1}
+        self.cls.bundled = {
+            '/a': ('b1', 0, 3), '/c': ('b1', 3, 4), '/d': ('b2', 0, 1)
+        }
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            m_del.return_value = []
+            self.cls.delete_files(['/a'])
+        assert self.cls.dead == {'b1': set(['/a'])}
+        assert self.cls._dead_changed is True
+        self.mock_client.upload_fileobj.side_effect = None
+        bid = self.cls.put_bundle([('/c', (4, 1.0, 'md5c'), b'cccc')])
+        assert self.cls.bundled['/c'] == (bid, 0, 4)
+        assert self.cls.dead == {'b1': set(['/a', '/c'])}
+        self.cls._dead_changed = False
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            m_del.return_value = []
+            self.cls.delete_bundles(['b1', 'b2'])
+        assert self.cls.dead == {}
+        assert self.cls._dead_changed is True
+
+    def test_deleted_not_rebuilt(self):
+        # a bundled file that is deleted must not come back when the
+        # manifest is rebuilt from the bundles
+        objects = {}
+
+        def se_upload(fobj, bucket, key, ExtraArgs=None, **kwargs):
+            objects[key] = (fobj.read(), ExtraArgs['Metadata'])
+
+        def se_put(Bucket=None, Key=None, Body=None, Metadata=None, **kw):
+            objects[Key] = (Body, Metadata)
+
+        def se_get(Bucket=None, Key=None, Range=None, **kwargs):
+            if Key not in objects:
+                raise ClientError(
+                    {'Error': {'Code': 'NoSuchKey'}}, 'GetObject'
+                )
+            body = objects[Key][0]
+            if Range is not None:
+                body = body[int(Range[6:-1]):]
+            return {'Body': BytesIO(body)}
+
+        self.mock_client.upload_fileobj.side_effect = se_upload
+        self.mock_client.put_object.side_effect = se_put
+        self.mock_client.get_object.side_effect = se_get
+        self.cls.put_bundle([
+            ('/a', (3, 1.5, 'md5a'), b'aaa'),
+            ('/b', (2, 2.5, 'md5b'), b'bb')
+        ])
+        with patch('%s._delete_batch' % pb, autospec=True) as m_del:
+            m_del.return_value = []
+            self.cls.delete_files(['/a'])
+        self.cls.put_manifest({'/b': (2, 2.5, 'md5b')})
+        bkt = self.mock_res.Bucket.return_value
+        bkt.objects.filter.return_value = [
+            Mock(key=k) for k in sorted(objects.keys())
+        ]
+        with patch('%s._get_metadata' % pb, autospec=True) as m_meta:
+            m_meta.side_effect = lambda _, k: objects[k][1]
+            res = self.cls.get_filelist(rebuild_manifest=True)
+        assert res == {
+            '/b': {'size_b': '2', 'mtime': '2.5', 'md5sum': 'md5b'}
+        }
+        assert list(self.cls.bundled.keys()) == ['/b']
+
+    def test_get_file_bundled(self, tmpdir):
+        self.cls.bundled = {'/x/a': ('b1', 10, 3)}
+        self.cls._download_bucket = Mock()
+        with patch('%s.read_bundle' % pb, autospec=True) as m_read:
+            m_read.return_value = b'abc'
+            self.cls.get_file('/x/a', local_prefix=str(tmpdir))
+        assert m_read.mock_calls == [call(self.cls, 'b1', start=10, end=12)]
+        assert tmpdir.join('x', 'a').read_binary() == b'abc'
+        assert self.cls._download_bucket.mock_calls == [call.consume(3)]
+        assert self.mock_res.Bucket.return_value.mock_calls == []
+
+    def test_get_file_bundled_empty(self, tmpdir):
+        self.cls.bundled = {'/x/a': ('b1', 10, 0)}
+        with patch('%s.read_bundle' % pb, autospec=True) as m_read:
+            self.cls.get_file('/x/a', local_prefix=str(tmpdir))
+        assert m_read.mock_calls == []
+        assert tmpdir.join('x', 'a').read_binary() == b''
+
+
+class TestDeleteFiles(object):
+
+    def setup(self):
+        with patch('%s.boto3.resource' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
+                with patch('%s._encode_key' % pb, autospec=True) as m_ek:
+                    m_ek.return_value = ('key', 'md5')
+                    self.cls = S3Wrapper('bname', prefix='pre')
+        self.mock_client = m_boto_c.return_value
+
+    def test_delete(self):
+        self.cls.delete_batch_size = 3
+        self.mock_client.delete_objects.side_effect = [
+            {'Deleted': []},
+            {'Errors': [
+                {'Key': 'pre/f/4', 'Code': 'AccessDenied', 'Message': 'no'}
+            ]}
+        ]
+        res = self.cls.delete_files(['/f/%d' % i for i in range(5)])
+        assert res == ['/f/4']
+        assert self.mock_client.delete_objects.mock_calls == [
+            call(Bucket='bname', Delete={
+                'Objects': [
+                    {'Key': 'pre/f/0'}, {'Key': 'pre/f/1'}, {'Key': 'pre/f/2'}
+                ],
+                'Quiet': True
+            }),
+            call(Bucket='bname', Delete={
+                'Objects': [{'Key': 'pre/f/3'}, {'Key': 'pre/f/4'}],
+                'Quiet': True
+            })
+        ]
+
+    def test_concurrent(self):
+        self.cls.delete_batch_size = 10
+        self.mock_client.delete_objects.return_value = {}
+        res = self.cls.delete_files(
+            ['/f/%d' % i for i in range(95)], workers=4
+        )
+        assert res == []
+        calls = self.mock_client.delete_objects.mock_calls
+        assert len(calls) == 10
+        keys = []
+        for c in calls:
+            keys.extend(o['Key'] for o in c[2]['Delete']['Objects'])
+        assert sorted(keys) == sorted('pre/f/%d' % i for i in range(95))
+
+    def test_dry_run(self):
+        self.cls._dry_run = True
+        with patch('%s.logger' % pbm) as m_logger:
+            res = self.cls.delete_files(['/f/2', '/f/1'])
+        assert res == []
+        assert self.mock_client.delete_objects.mock_calls == []
+        assert m_logger.warning.mock_calls == [
+            call('DRY RUN; would delete %s', 'pre/f/1'),
+            call('DRY RUN; would delete %s', 'pre/f/2')
+        ]
+
+    def test_bundled(self):
+        self.cls.bundled = {'/f/1': ('b1', 0, 5), '/f/3': ('b1', 5, 5)}
+        self.mock_client.delete_objects.return_value = {}
+        res = self.cls.delete_files(['/f/1', '/f/2'])
+        assert res == []
+        assert self.cls.bundled == {'/f/3': ('b1', 5, 5)}
+        assert self.mock_client.delete_objects.mock_calls == [
+            call(Bucket='bname', Delete={
+                'Objects': [{'Key': 'pre/f/2'}], 'Quiet': True
+            })
+        ]
+
+    def test_dry_run_bundled(self):
+        self.cls._dry_run = True
+        self.cls.bundled = {'/f/1': ('b1', 0, 5), '/f/3': ('b1', 5, 5)}
+        with patch('%s.logger' % pbm) as m_logger:
+            res = self.cls.delete_files(['/f/1', '/f/2'])
+        assert res == []
+        assert self.cls.bundled == {
+            '/f/1': ('b1', 0, 5), '/f/3': ('b1', 5, 5)
+        }
+        assert self.mock_client.delete_objects.mock_calls == []
+        assert m_logger.warning.mock_calls == [
+            call('DRY RUN; would forget bundled file %s', '/f/1'),
+            call('DRY RUN; would delete %s', 'pre/f/2')
+        ]
+
+    def test_throttled(self):
+        self.mock_client.delete_objects.side_effect = [
+            throttle_error(),
+            {'Errors': [{'Key': 'pre/f/1', 'Code': 'SlowDown'}]},
+            {}
+        ]
+        with patch('%s.time.sleep' % pbm) as m_sleep:
+            res = self.cls.delete_files(['/f/1', '/f/2'])
+        assert res == []
+        assert len(m_sleep.mock_calls) == 2
+        calls = self.mock_client.delete_objects.mock_calls
+        assert calls[1] == calls[0]
+        assert calls[2] == call(Bucket='bname', Delete={
+            'Objects': [{'Key': 'pre/f/1'}], 'Quiet': True
+        })
+
+    def test_throttled_too_many_times(self):
+        self.cls.max_throttle_retries = 2
+        self.mock_client.delete_objects.side_effect = throttle_error()
+        with patch('%s.time.sleep' % pbm):
+            res = self.cls.delete_files(['/f/1'])
+        assert res == ['/f/1']
+        assert len(self.mock_client.delete_objects.mock_calls) == 3
+
+    def test_other_error(self):
+        self.mock_client.delete_objects.side_effect = RuntimeError('foo')
+        res = self.cls.delete_files(['/f/1', '/f/2'])
+        assert res == ['/f/1', '/f/2']
+        assert len(self.mock_client.delete_objects.mock_calls) == 1
+
 
 class TestGetFile(object):
 
     def setup(self):
         with patch('%s.boto3.resource' % pbm, autospec=True) as m_boto_r:
-            with patch('%s.boto3.client' % pbm, autospec=True):
+            with patch('%s.boto3.client' % pbm, autospec=True) as m_boto_c:
                 with patch('%s._encode_key' % pb, autospec=True) as m_ek:
                     m_ek.return_value = ('key', 'md5')
                     self.cls = S3Wrapper('bname')
         mock_bucket = Mock()
         m_boto_r.return_value.Bucket.return_value = mock_bucket
         self.mock_res = m_boto_r
+        self.mock_client = m_boto_c.return_value
 
     def test_put(self):
         with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
@@ -280,7 +1727,7 @@ class TestGetFile(object):
                     m_exists.return_value = True
                     self.cls.get_file('/f/path')
         assert self.mock_res.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().Bucket('bname'),
             call().Bucket().download_file(
                 '/key/for/path',
@@ -289,7 +1736,8 @@ class TestGetFile(object):
                     'SSECustomerAlgorithm': 'AES256',
                     'SSECustomerKey': 'key',
                     'SSECustomerKeyMD5': 'md5'
-                }
+                },
+                Config=self.cls._transfer.config_for(None)
             ),
         ]
         assert m_kfp.mock_calls == [call(self.cls, '/f/path')]
@@ -305,7 +1753,7 @@ class TestGetFile(object):
                     m_exists.return_value = True
                     self.cls.get_file('/f/path')
         assert self.mock_res.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().Bucket('bname')
         ]
         assert m_kfp.mock_calls == [call(self.cls, '/f/path')]
@@ -320,7 +1768,7 @@ class TestGetFile(object):
                     m_exists.return_value = False
                     self.cls.get_file('/f/path', local_prefix='/foo')
         assert self.mock_res.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().Bucket('bname'),
             call().Bucket().download_file(
                 '/key/for/path',
@@ -329,7 +1777,8 @@ class TestGetFile(object):
                     'SSECustomerAlgorithm': 'AES256',
                     'SSECustomerKey': 'key',
                     'SSECustomerKeyMD5': 'md5'
-                }
+                },
+                Config=self.cls._transfer.config_for(None)
             ),
         ]
         assert m_kfp.mock_calls == [call(self.cls, '/f/path')]
@@ -344,7 +1793,7 @@ class TestGetFile(object):
                     m_exists.return_value = False
                     self.cls.get_file('f/path', local_prefix='/foo')
         assert self.mock_res.mock_calls == [
-            call('s3'),
+            call('s3', config=self.cls._config),
             call().Bucket('bname'),
             call().Bucket().download_file(
                 '/key/for/path',
@@ -353,13 +1802,53 @@ class TestGetFile(object):
                     'SSECustomerAlgorithm': 'AES256',
                     'SSECustomerKey': 'key',
                     'SSECustomerKeyMD5': 'md5'
-                }
+                },
+                Config=self.cls._transfer.config_for(None)
             ),
         ]
         assert m_kfp.mock_calls == [call(self.cls, 'f/path')]
         assert m_exists.mock_calls == [call('/foo/f')]
         assert m_mkdirs.mock_calls == [call('/foo/f')]
 
+    def test_get_rate_limited(self):
+        bucket = Mock()
+        self.cls._download_bucket = bucket
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            with patch('%s.os.path.exists' % pbm, autospec=True) as m_exists:
+                m_kfp.return_value = '/key/for/path'
+                m_exists.return_value = True
+                self.cls.get_file('/f/path', size_b=1234)
+        kwargs = self.mock_res.mock_calls[2][2]
+        assert kwargs['Callback'] == bucket.consume
+        assert kwargs['Config'] == self.cls._transfer.config_for(1234)
+
+    def test_get_compressed(self, tmpdir):
+        text = b'the quick brown fox jumps over the lazy dog\n' * 5000
+        body = zlib.compress(text)
+        bucket = Mock()
+        self.cls._download_bucket = bucket
+        self.cls.download_chunk_size = 1000
+        self.cls.compressed = {'/f/path': 'zlib'}
+        self.mock_client.get_object.return_value = {'Body': BytesIO(body)}
+        with patch('%s._key_for_path' % pb, autospec=True) as m_kfp:
+            m_kfp.return_value = '/key/for/path'
+            self.cls.get_file('/f/path', local_prefix=str(tmpdir))
+        assert self.mock_client.mock_calls == [
+            call.get_object(
+                Bucket='bname',
+                Key='/key/for/path',
+                SSECustomerAlgorithm='AES256',
+                SSECustomerKey='key',
+                SSECustomerKeyMD5='md5'
+            )
+        ]
+        assert self.mock_res.mock_calls == [
+            call('s3', config=self.cls._config),
+            call().Bucket('bname')
+        ]
+        assert tmpdir.join('f', 'path').read_binary() == text
+        assert sum(c[1][0] for c in bucket.consume.mock_calls) == len(body)
+
 
 class TestPathForKey(object):
 
@@ -0,0 +1,97 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import pytest
+
+from s3sfe.scheduling import order_files, simulate_makespan, compare_orders
+
+FILES = {
+    '/a': (10, 300.0, 'md5a'),
+    '/b': (1000, 100.0, 'md5b'),
+    '/c': (10, 200.0, 'md5c'),
+    '/d': (500, 400.0, 'md5d'),
+    '/e': (10, 300.0, 'md5e')
+}
+
+
+class TestOrderFiles(object):
+
+    def test_path(self):
+        assert order_files(FILES) == ['/a', '/b', '/c', '/d', '/e']
+
+    def test_largest_first(self):
+        assert order_files(FILES, 'largest-first') == [
+            '/b', '/d', '/a', '/c', '/e'
+        ]
+
+    def test_newest_first(self):
+        assert order_files(FILES, 'newest-first') == [
+            '/d', '/a', '/e', '/c', '/b'
+        ]
+
+    def test_invalid(self):
+        with pytest.raises(ValueError) as excinfo:
+            order_files(FILES, 'random')
+        assert 'Unknown upload order: random' in str(excinfo.value)
+
+
+class TestSimulateMakespan(object):
+
+    def test_one_worker(self):
+        assert simulate_makespan([10, 20, 30], 1, 10) == 6.0
+
+    def test_big_file_last(self):
+        assert simulate_makespan([10, 10, 10, 10, 40], 2, 10) == 6.0
+
+    def test_big_file_first(self):
+        assert simulate_makespan([40, 10, 10, 10, 10], 2, 10) == 4.0
+
+    def test_no_files(self):
+        assert simulate_makespan([], 4, 10) == 0.0
+
+    def test_zero_workers(self):
+        assert simulate_makespan([10, 10], 0, 10) == 2.0
+
+
+class TestCompareOrders(object):
+
+    def test_compare(self):
+        assert compare_orders(FILES, 2, 10) == {
+            'path': 100.0,
+            'largest-first': 100.0,
+            'newest-first': 103.0
+        }
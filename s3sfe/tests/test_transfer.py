@@ -0,0 +1,111 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import pytest
+
+from s3sfe.transfer import (
+    TransferProfiles, parse_transfer_profile, DEFAULT_PROFILES, MB, GB
+)
+
+
+class TestParseTransferProfile(object):
+
+    def test_parse(self):
+        assert parse_transfer_profile(
+            'huge:chunksize=256M, concurrency=16,io_queue=50'
+        ) == ('huge', {
+            'chunksize': 256 * MB, 'concurrency': 16, 'io_queue': 50
+        })
+
+    def test_parse_sizes(self):
+        assert parse_transfer_profile('small:max_size=1M,threshold=2k') == (
+            'small', {'max_size': MB, 'threshold': 2048}
+        )
+
+    def test_unknown_class(self):
+        with pytest.raises(ValueError) as excinfo:
+            parse_transfer_profile('tiny:concurrency=1')
+        assert 'one of: small, medium, huge' in str(excinfo.value)
+
+    def test_no_class(self):
+        with pytest.raises(ValueError):
+            parse_transfer_profile('concurrency=1')
+
+    def test_unknown_setting(self):
+        with pytest.raises(ValueError) as excinfo:
+            parse_transfer_profile('small:foo=1')
+        assert 'Invalid transfer setting "foo=1"' in str(excinfo.value)
+
+    def test_invalid_value(self):
+        with pytest.raises(ValueError):
+            parse_transfer_profile('small:concurrency=x')
+
+
+class TestTransferProfiles(object):
+
+    def test_defaults(self):
+        t = TransferProfiles()
+        assert t.profiles == DEFAULT_PROFILES
+        assert t.max_concurrency == 8
+        small = t.config_for(4096)
+        assert small.multipart_threshold == 64 * MB
+        assert small.max_request_concurrency == 1
+        assert small.use_threads is False
+        medium = t.config_for(64 * MB + 1)
+        assert medium.multipart_chunksize == 16 * MB
+        assert medium.max_request_concurrency == 4
+        assert medium.use_threads is True
+        huge = t.config_for(100 * GB)
+        assert huge.multipart_chunksize == 128 * MB
+        assert huge.max_io_queue == 1000
+        assert t.config_for(None) is huge
+        assert t.config_for(64 * MB) is small
+        assert t.config_for(4 * GB) is medium
+
+    def test_overrides(self):
+        t = TransferProfiles([
+            ('small', {'max_size': MB}),
+            ('huge', {'concurrency': 16, 'max_size': 5}),
+            ('huge', {'chunksize': 256 * MB})
+        ])
+        assert t.max_concurrency == 16
+        assert t.config_for(MB + 1) is t.config_for(GB)
+        huge = t.config_for(5 * GB)
+        assert huge.max_request_concurrency == 16
+        assert huge.multipart_chunksize == 256 * MB
+        # defaults are not modified
+        assert DEFAULT_PROFILES[2][1]['concurrency'] == 8
@@ -36,16 +36,21 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 """
 
 import sys
+import os
+import mmap
 import pytest
 import logging
+from hashlib import md5
 from textwrap import dedent
 from freezegun import freeze_time
 from datetime import datetime
 
 from s3sfe.utils import (
     set_log_info, set_log_debug, set_log_level_format,
-    read_filelist, read_keyfile, dtnow, md5_file
+    read_filelist, read_keyfile, dtnow, md5_file, hash_bufsize, parse_size,
+    positive_int, positive_size, fraction, run_bounded, FileSlice, _buffers
 )
+from concurrent.futures import ThreadPoolExecutor
 
 # https://code.google.com/p/mock/issues/detail?id=249
 # py>=3.4 should use unittest.mock not the mock package on pypi
@@ -60,29 +65,206 @@ else:
 pbm = 's3sfe.utils'
 
 
+class TestHashBufsize(object):
+
+    def test_small(self):
+        assert hash_bufsize(0) == 65536
+        assert hash_bufsize(1048575) == 65536
+
+    def test_medium(self):
+        assert hash_bufsize(1048576) == 262144
+
+    def test_large(self):
+        assert hash_bufsize(67108864) == 1048576
+
+
 class TestMd5File(object):
 
-    def test_md5_file(self):
-        data = ('a' * 128) + ('b' * 128) + ('c' * 30)
-        with patch(
-            '%s.open' % pbm, mock_open(read_data=data), create=True
-        ) as m_open:
-            with patch('%s.md5' % pbm, autospec=True) as mock_md5:
-                mock_md5.return_value.hexdigest.return_value = 'abc123'
-                res = md5_file('/foo/bar')
-        assert res == 'abc123'
-        assert m_open.mock_calls == [
-            call('/foo/bar', 'rb'),
-            call().__enter__(),
-            call().read(128),
-            call().read(128),
-            call().__exit__(None, None, None)
-        ]
-        assert mock_md5.mock_calls == [
-            call(),
-            call().update(data),
-            call().hexdigest()
-        ]
+    def test_md5_file(self, tmpdir):
+        data = os.urandom(300000)
+        p = tmpdir.join('foo')
+        p.write(data, mode='wb')
+        assert md5_file(str(p)) == md5(data).hexdigest()
+
+    def test_md5_file_empty(self, tmpdir):
+        p = tmpdir.join('foo')
+        p.write('')
+        assert md5_file(str(p)) == md5().hexdigest()
+
+    def test_md5_file_bufsize(self, tmpdir):
+        data = os.urandom(1000)
+        p = tmpdir.join('foo')
+        p.write(data, mode='wb')
+        with patch('%s.hash_bufsize' % pbm, autospec=True) as mock_hb:
+            assert md5_file(str(p), bufsize=7) == md5(data).hexdigest()
+        assert mock_hb.mock_calls == []
+
+    def test_md5_file_bufsize_invalid(self, tmpdir):
+        p = tmpdir.join('foo')
+        p.write('foo')
+        for bufsize in [0, -1]:
+            with pytest.raises(ValueError):
+                md5_file(str(p), bufsize=bufsize)
+
+    def test_md5_file_reuses_buffer(self, tmpdir):
+        p = tmpdir.join('foo')
+        p.write('foo')
+        md5_file(str(p), bufsize=128)
+        buf = _buffers.buf
+        md5_file(str(p), bufsize=64)
+        assert _buffers.buf is buf
+        md5_file(str(p), bufsize=len(buf) + 1)
+        assert _buffers.buf is not buf
+
+    def test_md5_file_mmap(self, tmpdir):
+        data = os.urandom(4096)
+        p = tmpdir.join('foo')
+        p.write(data, mode='wb')
+        with patch('%s.LARGE_FILE_SIZE' % pbm, 1024):
+            with patch('%s.mmap.mmap' % pbm, wraps=mmap.mmap) as mock_mmap:
+                res = md5_file(str(p), use_mmap=True)
+        assert res == md5(data).hexdigest()
+        assert len(mock_mmap.mock_calls) == 1
+
+    def test_md5_file_mmap_small(self, tmpdir):
+        data = os.urandom(512)
+        p = tmpdir.join('foo')
+        p.write(data, mode='wb')
+        with patch('%s.LARGE_FILE_SIZE' % pbm, 1024):
+            with patch('%s.mmap.mmap' % pbm, wraps=mmap.mmap) as mock_mmap:
+                res = md5_file(str(p), use_mmap=True)
+        assert res == md5(data).hexdigest()
+        assert mock_mmap.mock_calls == []
+
+
+class TestParseSize(object):
+
+    def test_parse_size(self):
+        assert parse_size('65536') == 65536
+        assert parse_size('64K') == 65536
+        assert parse_size('8MB') == 8388608
+        assert parse_size('1GiB') == 1073741824
+        assert parse_size(' 1.5m ') == 1572864
+        assert parse_size('3B') == 3
+
+    def test_parse_size_invalid(self):
+        for v in ['', 'b', '1i', 'M', '5X']:
+            with pytest.raises(ValueError):
+                parse_size(v)
+
+    def test_positive_size(self):
+        assert positive_size('1') == 1
+        assert positive_size('4M') == 4194304
+        for v in ['0', '0K', '0.0001']:
+            with pytest.raises(ValueError):
+                positive_size(v)
+
+    def test_positive_int(self):
+        assert positive_int('1') == 1
+        assert positive_int('32') == 32
+        for v in ['0', '-3', 'x']:
+            with pytest.raises(ValueError):
+                positive_int(v)
+
+    def test_fraction(self):
+        assert fraction('0.5') == 0.5
+        assert fraction('1') == 1.0
+        for v in ['0', '-0.1', '1.5', 'x']:
+            with pytest.raises(ValueError):
+                fraction(v)
+
+
+class TestRunBounded(object):
+
+    def test_run_bounded(self):
+        submitted = []
+
+        def func(x):
+            submitted.append(x)
+            if x == 3:
+                raise RuntimeError('foo')
+            return x * 2
+
+        jobs = (('t%d' % i, func, (i, )) for i in range(10))
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            res = list(run_bounded(pool, jobs, 3))
+        assert sorted(t for t, _ in res) == ['t%d' % i for i in range(10)]
+        for tag, fut in res:
+            if tag == 't3':
+                with pytest.raises(RuntimeError):
+                    fut.result()
+            else:
+                assert fut.result() == int(tag[1:]) * 2
+
+    def test_run_bounded_max_pending(self):
+        m_exec = Mock()
+        futs = [Mock(name='f%d' % i) for i in range(3)]
+        m_exec.submit.side_effect = futs
+
+        def se_wait(pending, return_when=None):
+            return set([list(pending.keys())[0]]), set()
+
+        jobs = [('a', 'func', (1, )), ('b', 'func', (2, )), ('c', 'func', ())]
+        with patch('%s.wait' % pbm) as mock_wait:
+            mock_wait.side_effect = se_wait
+            gen = run_bounded(m_exec, jobs, 2)
+            assert next(gen) == ('a', futs[0])
+            assert m_exec.submit.mock_calls == [
+                call('func', 1), call('func', 2)
+            ]
+            assert list(gen) == [('b', futs[1]), ('c', futs[2])]
+
+
+class TestFileSlice(object):
+
+    def setup_file(self, tmpdir):
+        p = tmpdir.join('f')
+        p.write_binary(b'0123456789abcdefghij')
+        return str(p)
+
+    def test_read(self, tmpdir):
+        path = self.setup_file(tmpdir)
+        with FileSlice(path, 8, 8) as fs:
+            assert len(fs) == 8
+            assert fs.read(3) == b'89a'
+            assert fs.tell() == 3
+            assert fs.read() == b'bcdef'
+            assert fs.read(1) == b''
+            assert fs.tell() == 8
+
+    def test_last_partial(self, tmpdir):
+        path = self.setup_file(tmpdir)
+        with FileSlice(path, 16, 8) as fs:
+            assert len(fs) == 4
+            assert fs.read(100) == b'ghij'
+            assert fs.read() == b''
+
+    def test_past_end(self, tmpdir):
+        path = self.setup_file(tmpdir)
+        with FileSlice(path, 30, 8) as fs:
+            assert len(fs) == 0
+            assert fs.read() == b''
+
+    def test_seek(self, tmpdir):
+        path = self.setup_file(tmpdir)
+        with FileSlice(path, 8, 8) as fs:
+            assert fs.seek(0, os.SEEK_END) == 8
+            assert fs.read() == b''
+            assert fs.seek(2) == 2
+            assert fs.read(2) == b'ab'
+            assert fs.seek(-1, os.SEEK_CUR) == 3
+            assert fs.read() == b'bcdef'
+            assert fs.seek(-100) == 0
+            assert fs.seek(100) == 8
+            assert fs.seek(0) == 0
+            assert fs.read() == b'89abcdef'
+
+    def test_close(self, tmpdir):
+        path = self.setup_file(tmpdir)
+        fs = FileSlice(path, 0, 8)
+        with fs:
+            pass
+        assert fs._fh.closed is True
 
 
 class TestDtnow(object):
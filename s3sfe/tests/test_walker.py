@@ -0,0 +1,171 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import os
+import stat
+import sys
+
+from s3sfe.pathfilter import PrefixMatcher
+from s3sfe.walker import walk_files
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT, mock_open  # noqa
+
+pbm = 's3sfe.walker'
+
+
+class TestWalkFiles(object):
+
+    def test_walk_files(self, tmpdir):
+        tmpdir.join('a').write('a')
+        tmpdir.join('b', 'c').write('cc', ensure=True)
+        tmpdir.join('b', 'd', 'e').write('eee', ensure=True)
+        tmpdir.join('empty').mkdir()
+        res = dict(walk_files(str(tmpdir)))
+        assert sorted(res.keys()) == [
+            str(tmpdir.join('a')),
+            str(tmpdir.join('b', 'c')),
+            str(tmpdir.join('b', 'd', 'e'))
+        ]
+        assert res[str(tmpdir.join('b', 'd', 'e'))].st_size == 3
+        assert stat.S_ISREG(res[str(tmpdir.join('a'))].st_mode)
+
+    def test_symlinks(self, tmpdir):
+        tmpdir.join('real', 'f').write('foo', ensure=True)
+        tmpdir.join('top').mkdir()
+        os.symlink(str(tmpdir.join('real')), str(tmpdir.join('top', 'dir')))
+        os.symlink(
+            str(tmpdir.join('real', 'f')), str(tmpdir.join('top', 'file'))
+        )
+        os.symlink(
+            str(tmpdir.join('missing')), str(tmpdir.join('top', 'broken'))
+        )
+        res = dict(walk_files(str(tmpdir.join('top'))))
+        # matches os.walk + os.path.isfile: links to files are followed,
+        # links to directories and broken links are not
+        assert list(res.keys()) == [str(tmpdir.join('top', 'file'))]
+        assert res[str(tmpdir.join('top', 'file'))].st_size == 3
+
+    def test_matches_os_walk(self, tmpdir):
+        for i in range(30):
+            tmpdir.join('d%d' % (i % 4), 's%d' % (i % 3), 'f%d' % i).write(
+                'x', ensure=True
+            )
+        expected = []
+        for root, _, files in os.walk(str(tmpdir)):
+            for f in files:
+                p = os.path.join(root, f)
+                if os.path.isfile(p):
+                    expected.append(p)
+        res = [p for p, _ in walk_files(str(tmpdir))]
+        assert sorted(res) == sorted(expected)
+
+    def test_exclude(self, tmpdir):
+        tmpdir.join('a').write('a')
+        tmpdir.join('ab').write('a')
+        tmpdir.join('b', 'c').write('c', ensure=True)
+        tmpdir.join('b', 'd', 'e').write('e', ensure=True)
+        tmpdir.join('c', 'd').write('d', ensure=True)
+        exclude = PrefixMatcher([
+            str(tmpdir.join('ab')), str(tmpdir.join('b', 'd')) + '/',
+            str(tmpdir.join('c'))
+        ])
+        with patch('%s.scandir' % pbm, wraps=os.scandir) as mock_scandir:
+            res = [p for p, _ in walk_files(str(tmpdir), exclude=exclude)]
+        assert sorted(res) == [
+            str(tmpdir.join('a')), str(tmpdir.join('b', 'c'))
+        ]
+        # excluded directories are never listed
+        assert sorted(mock_scandir.mock_calls) == [
+            call(str(tmpdir)), call(str(tmpdir.join('b')))
+        ]
+
+    def test_unreadable_dir(self, tmpdir):
+        tmpdir.join('a').write('a')
+        tmpdir.join('b', 'c').write('c', ensure=True)
+
+        def se_scandir(p):
+            if p == str(tmpdir.join('b')):
+                raise OSError('permission denied')
+            return os.scandir(p)
+
+        with patch('%s.scandir' % pbm) as mock_scandir:
+            with patch('%s.logger' % pbm) as mock_logger:
+                mock_scandir.side_effect = se_scandir
+                res = [p for p, _ in walk_files(str(tmpdir))]
+        assert res == [str(tmpdir.join('a'))]
+        assert len(mock_logger.warning.mock_calls) == 1
+
+    def test_unreadable_dir_onerror(self, tmpdir):
+        tmpdir.join('b', 'c').write('c', ensure=True)
+        err = OSError('permission denied')
+        errors = []
+
+        def se_scandir(p):
+            if p == str(tmpdir.join('b')):
+                raise err
+            return os.scandir(p)
+
+        with patch('%s.scandir' % pbm) as mock_scandir:
+            mock_scandir.side_effect = se_scandir
+            res = list(walk_files(
+                str(tmpdir), onerror=lambda p, ex: errors.append((p, ex))
+            ))
+        assert res == []
+        assert errors == [(str(tmpdir.join('b')), err)]
+
+    def test_vanished(self):
+        e1 = Mock(path='/foo/a')
+        e1.is_dir.return_value = False
+        e1.stat.side_effect = OSError('no such file')
+        st = Mock(st_mode=stat.S_IFREG | 0o644)
+        e2 = Mock(path='/foo/b')
+        e2.is_dir.return_value = False
+        e2.stat.return_value = st
+        with patch('%s.scandir' % pbm) as mock_scandir:
+            mock_scandir.return_value = iter([e1, e2])
+            res = list(walk_files('/foo'))
+        assert res == [('/foo/b', st)]
+        assert mock_scandir.mock_calls == [call('/foo')]
+        assert e1.is_dir.mock_calls == [call(follow_symlinks=False)]
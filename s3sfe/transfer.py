@@ -0,0 +1,165 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+
+from boto3.s3.transfer import TransferConfig
+
+from s3sfe.utils import parse_size
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+#: Default transfer settings for each file size class, smallest first. Each
+#: class applies to files up to and including its ``max_size`` bytes (the last
+#: class has no limit). ``threshold`` is the size at which a file is uploaded
+#: or downloaded in parts of ``chunksize`` bytes, ``concurrency`` the number of
+#: parts transferred at once per file, and ``io_queue`` the maximum number of
+#: downloaded parts queued for writing to disk.
+DEFAULT_PROFILES = [
+    ('small', {
+        'max_size': 64 * MB, 'threshold': 64 * MB, 'chunksize': 8 * MB,
+        'concurrency': 1, 'io_queue': 100
+    }),
+    ('medium', {
+        'max_size': 4 * GB, 'threshold': 64 * MB, 'chunksize': 16 * MB,
+        'concurrency': 4, 'io_queue': 100
+    }),
+    ('huge', {
+        'max_size': None, 'threshold': 64 * MB, 'chunksize': 128 * MB,
+        'concurrency': 8, 'io_queue': 1000
+    })
+]
+
+#: Settings that are sizes in bytes, and so accept suffixes like "8M"
+_SIZE_SETTINGS = ['max_size', 'threshold', 'chunksize']
+
+#: Settings that are plain integers
+_INT_SETTINGS = ['concurrency', 'io_queue']
+
+
+def parse_transfer_profile(value):
+    """
+    Parse a transfer profile override from the command line, in the form
+    ``CLASS:SETTING=VALUE[,SETTING=VALUE...]``, i.e.
+    ``huge:chunksize=256M,concurrency=16``.
+
+    :param value: override string
+    :type value: str
+    :return: 2-tuple of (size class name, dict of settings)
+    :rtype: tuple
+    """
+    names = [n for n, _ in DEFAULT_PROFILES]
+    name, sep, rest = value.partition(':')
+    if sep == '' or name not in names:
+        raise ValueError(
+            'Invalid transfer profile "%s"; must be CLASS:SETTING=VALUE,... '
+            'where CLASS is one of: %s' % (value, ', '.join(names))
+        )
+    settings = {}
+    for item in rest.split(','):
+        k, sep, v = item.partition('=')
+        k = k.strip()
+        if sep == '' or k not in _SIZE_SETTINGS + _INT_SETTINGS:
+            raise ValueError(
+                'Invalid transfer setting "%s"; must be one of: %s' % (
+                    item, ', '.join(_SIZE_SETTINGS + _INT_SETTINGS)
+                )
+            )
+        if k in _SIZE_SETTINGS:
+            settings[k] = parse_size(v)
+        else:
+            settings[k] = int(v)
+    return name, settings
+
+
+class TransferProfiles(object):
+    """
+    The boto3 :py:class:`~boto3.s3.transfer.TransferConfig` to use for each
+    file, by size class. Small files want no multipart and no per-file
+    threads, since there are many of them in flight at once; huge files want
+    large parts, transferred concurrently.
+    """
+
+    def __init__(self, overrides=None):
+        """
+        :param overrides: list of (size class name, settings dict) 2-tuples,
+          as returned by :py:func:`~.parse_transfer_profile`, overriding
+          :py:data:`~.DEFAULT_PROFILES`; later entries win
+        :type overrides: list
+        """
+        self.profiles = [(n, dict(s)) for n, s in DEFAULT_PROFILES]
+        for name, settings in (overrides or []):
+            dict(self.profiles)[name].update(settings)
+        # the largest class always covers every size
+        self.profiles[-1][1]['max_size'] = None
+        self._configs = []
+        for name, s in self.profiles:
+            logger.debug('Transfer profile %s: %s', name, s)
+            self._configs.append((s['max_size'], TransferConfig(
+                multipart_threshold=s['threshold'],
+                multipart_chunksize=s['chunksize'],
+                max_concurrency=s['concurrency'],
+                max_io_queue=s['io_queue'],
+                use_threads=(s['concurrency'] > 1)
+            )))
+
+    @property
+    def max_concurrency(self):
+        """
+        Return the largest per-file concurrency of any size class.
+
+        :rtype: int
+        """
+        return max(s['concurrency'] for _, s in self.profiles)
+
+    def config_for(self, size_b):
+        """
+        Return the TransferConfig for a file of the given size.
+
+        :param size_b: file size in bytes, or None if unknown, in which case
+          the largest size class is used
+        :type size_b: int
+        :rtype: boto3.s3.transfer.TransferConfig
+        """
+        if size_b is not None:
+            for max_size, config in self._configs:
+                if max_size is None or size_b <= max_size:
+                    return config
+        return self._configs[-1][1]
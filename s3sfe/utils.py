@@ -35,31 +35,226 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 ################################################################################
 """
 
+from concurrent.futures import FIRST_COMPLETED, wait
 from datetime import datetime
 from hashlib import md5
+import io
 import logging
+import mmap
 import os
+import re
+import threading
 
 logger = logging.getLogger(__name__)
 
+_size_re = re.compile(r'^(\d+(?:\.\d+)?)\s*(?:([KMGTP])I?)?B?$', re.I)
 
-def md5_file(path):
+
+#: Files at least this large are hashed with a 1 MiB buffer (or mmap'ed, if
+#: ``use_mmap`` is True).
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+#: Files smaller than this are hashed with a 64 KiB buffer.
+SMALL_FILE_SIZE = 1024 * 1024
+
+_buffers = threading.local()
+
+
+def hash_bufsize(size):
+    """
+    Choose a read buffer size for hashing a file of ``size`` bytes. Small
+    files are read in one or two calls; large files use a buffer big enough
+    that per-call overhead is negligible next to the hashing itself.
+
+    :param size: file size in bytes
+    :type size: int
+    :return: buffer size in bytes
+    :rtype: int
+    """
+    if size < SMALL_FILE_SIZE:
+        return 64 * 1024
+    if size < LARGE_FILE_SIZE:
+        return 256 * 1024
+    return 1024 * 1024
+
+
+def _get_buffer(bufsize):
+    """
+    Return a writable memoryview of ``bufsize`` bytes, backed by a buffer that
+    is reused for all hashing done by the current thread.
+
+    :param bufsize: required buffer size in bytes
+    :type bufsize: int
+    :return: view of the thread's reusable buffer
+    :rtype: memoryview
+    """
+    buf = getattr(_buffers, 'buf', None)
+    if buf is None or len(buf) < bufsize:
+        buf = bytearray(bufsize)
+        _buffers.buf = buf
+    return memoryview(buf)[:bufsize]
+
+
+def md5_file(path, bufsize=None, use_mmap=False):
     """
     Return the MD5 sum of the contents of the file at ``path``.
 
+    The file is read with ``readinto`` into a per-thread reusable buffer,
+    sized by :py:func:`~.hash_bufsize` unless ``bufsize`` is given. If
+    ``use_mmap`` is True, files of at least :py:const:`~.LARGE_FILE_SIZE`
+    bytes are instead memory-mapped and hashed in one call; note that a file
+    truncated while mapped will crash the process with ``SIGBUS``, so this
+    is only safe for files that are not being written to.
+
     :param path: path to the file
     :type path: str
+    :param bufsize: read buffer size in bytes; chosen from the file size if
+      None
+    :type bufsize: int
+    :param use_mmap: whether to mmap large files instead of reading them
+    :type use_mmap: bool
     :return: md5sum of the file at the given path, as a hex digest
     :rtype: str
     """
-    with open(path, 'rb') as fh:
-        m = md5()
+    if bufsize is not None and bufsize < 1:
+        # a zero-length buffer would read nothing, giving every file the md5
+        # of an empty file
+        raise ValueError('Invalid hash buffer size: %s' % bufsize)
+    m = md5()
+    with io.open(path, 'rb', buffering=0) as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if use_mmap and size >= LARGE_FILE_SIZE:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                m.update(mm)
+            finally:
+                mm.close()
+            return m.hexdigest()
+        if bufsize is None:
+            bufsize = hash_bufsize(size)
+        view = _get_buffer(bufsize)
         while True:
-            data = fh.read(128)
-            if not data:
+            count = fh.readinto(view)
+            if not count:
                 break
-            m.update(data)
-        return m.hexdigest()
+            m.update(view[:count])
+    return m.hexdigest()
+
+
+def run_bounded(executor, jobs, max_pending):
+    """
+    Generator that submits jobs to ``executor`` while keeping at most
+    ``max_pending`` of them outstanding, yielding a 2-tuple of (tag, completed
+    future) for each job as it finishes (in completion order). This keeps
+    memory bounded when there are far more jobs than workers.
+
+    :param executor: executor to submit jobs to
+    :type executor: concurrent.futures.Executor
+    :param jobs: iterable of (tag, callable, args tuple) 3-tuples; ``tag`` is
+      an arbitrary value passed back with the job's future
+    :type jobs: iterable
+    :param max_pending: maximum number of submitted but unfinished jobs
+    :type max_pending: int
+    :return: generator of (tag, future) 2-tuples
+    :rtype: generator
+    """
+    pending = {}
+    for tag, func, args in jobs:
+        pending[executor.submit(func, *args)] = tag
+        if len(pending) < max_pending:
+            continue
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield pending.pop(fut), fut
+    while len(pending) > 0:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield pending.pop(fut), fut
+
+
+class FileSlice(object):
+    """
+    Read-only, seekable file-like object over ``size`` bytes of a file
+    starting at ``start``, so that one part of a file can be passed as a
+    request body and streamed from disk rather than read into memory.
+    Positions passed to :py:meth:`~.seek` and returned by :py:meth:`~.tell`
+    are relative to the start of the slice.
+    """
+
+    def __init__(self, path, start, size):
+        """
+        :param path: path to the file
+        :type path: str
+        :param start: offset in the file of the first byte of the slice
+        :type start: int
+        :param size: maximum length of the slice; it is truncated at the end
+          of the file
+        :type size: int
+        """
+        self._fh = open(path, 'rb')
+        self._fh.seek(0, os.SEEK_END)
+        self._start = start
+        self._size = max(0, min(size, self._fh.tell() - start))
+        self._pos = 0
+        self._fh.seek(start)
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        """
+        Return up to ``size`` bytes from the current position, or all the rest
+        of the slice if ``size`` is negative. An empty result means the end of
+        the slice.
+
+        :param size: maximum number of bytes to return
+        :type size: int
+        :rtype: bytes
+        """
+        remaining = self._size - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self._fh.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Move to a position in the slice, clamped to its bounds.
+
+        :param offset: offset relative to ``whence``
+        :type offset: int
+        :param whence: one of ``os.SEEK_SET``, ``os.SEEK_CUR`` or
+          ``os.SEEK_END``
+        :type whence: int
+        :return: new position from the start of the slice
+        :rtype: int
+        """
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+        self._fh.seek(self._start + self._pos)
+        return self._pos
+
+    def tell(self):
+        """
+        :return: current position from the start of the slice
+        :rtype: int
+        """
+        return self._pos
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def dtnow():
@@ -142,3 +337,71 @@ def read_keyfile(path):
         raise RuntimeError('Key file must be 32 bytes; %s is %d bytes' % (
             path, len(key)))
     return key
+
+
+def parse_size(value):
+    """
+    Parse a human-readable byte size such as ``65536``, ``64K``, ``8MB`` or
+    ``1GiB`` into an integer number of bytes. Suffixes are binary (powers of
+    1024) regardless of whether they include an ``i``.
+
+    :param value: size string
+    :type value: str
+    :return: size in bytes
+    :rtype: int
+    """
+    m = _size_re.match(value.strip())
+    if m is None:
+        raise ValueError('Invalid size: %s' % value)
+    power = 0
+    if m.group(2) is not None:
+        power = 'KMGTP'.index(m.group(2).upper()) + 1
+    return int(float(m.group(1)) * (1024 ** power))
+
+
+def positive_size(value):
+    """
+    Parse a human-readable byte size like :py:func:`~.parse_size`, requiring
+    it to be at least one byte; for use as an argparse ``type``.
+
+    :param value: size string
+    :type value: str
+    :return: size in bytes
+    :rtype: int
+    """
+    size = parse_size(value)
+    if size < 1:
+        raise ValueError('Size must be at least 1 byte: %s' % value)
+    return size
+
+
+def positive_int(value):
+    """
+    Parse an integer that must be at least 1, such as a number of workers;
+    for use as an argparse ``type``.
+
+    :param value: integer string
+    :type value: str
+    :return: parsed integer
+    :rtype: int
+    """
+    res = int(value)
+    if res < 1:
+        raise ValueError('Must be at least 1: %s' % value)
+    return res
+
+
+def fraction(value):
+    """
+    Parse a ratio that must be greater than 0 and at most 1; for use as an
+    argparse ``type``.
+
+    :param value: number string
+    :type value: str
+    :return: parsed ratio
+    :rtype: float
+    """
+    res = float(value)
+    if not 0 < res <= 1:
+        raise ValueError('Must be greater than 0 and at most 1: %s' % value)
+    return res
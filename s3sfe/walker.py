@@ -0,0 +1,103 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/s3sfe>
+
+################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of s3sfe, also known as s3sfe.
+
+    s3sfe is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    s3sfe is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with s3sfe.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/s3sfe> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+################################################################################
+"""
+
+import logging
+import stat
+
+try:
+    from os import scandir
+except ImportError:  # python < 3.5
+    from scandir import scandir
+
+logger = logging.getLogger(__name__)
+
+
+def walk_files(top, exclude=None, onerror=None):
+    """
+    Generator that recursively walks the directory ``top`` with
+    :py:func:`os.scandir`, yielding a 2-tuple of (path, stat result) for every
+    regular file (or symlink to a regular file) beneath it. Symlinks to
+    directories are not followed, matching :py:func:`os.walk`.
+
+    If ``exclude`` is given, files whose paths it matches are skipped, and
+    directories whose entire contents it matches are never descended into.
+
+    The stat result comes from the ``DirEntry``, so each file costs at most
+    one ``stat`` call (and none at all for the type check, on platforms that
+    return the file type from ``readdir``). Directories that can't be read
+    and files that vanish before they're stat'ed are logged and skipped; like
+    :py:func:`os.walk`, ``onerror`` (if given) is called for each directory
+    that can't be read, so the caller can tell a directory it couldn't list
+    from an empty one.
+
+    :param top: path to the directory to walk
+    :type top: str
+    :param exclude: paths to exclude
+    :type exclude: s3sfe.pathfilter.PathMatcher
+    :param onerror: called with (directory path, exception) for each
+      directory that can't be listed
+    :type onerror: ``callable``
+    :return: generator of (path, stat result) 2-tuples
+    :rtype: generator
+    """
+    stack = [top]
+    while len(stack) > 0:
+        d = stack.pop()
+        try:
+            entries = list(scandir(d))
+        except OSError as ex:
+            logger.warning('Unable to list directory %s: %s', d, ex)
+            if onerror is not None:
+                onerror(d, ex)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if exclude is not None and exclude.match_dir(entry.path):
+                        logger.debug('Excluding directory %s', entry.path)
+                    else:
+                        stack.append(entry.path)
+                    continue
+                if exclude is not None and exclude.match(entry.path):
+                    logger.debug('Excluding %s', entry.path)
+                    continue
+                st = entry.stat()
+            except OSError as ex:
+                logger.debug('Skipping %s: %s', entry.path, ex)
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield entry.path, st
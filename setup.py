@@ -43,6 +43,8 @@ with open('README.rst') as file:
 
 requires = [
     'boto3',
+    'futures; python_version < "3.0"',
+    'scandir; python_version < "3.5"',
     'humanize'
 ]
 
@@ -78,11 +80,16 @@ setup(
                 'S3, using server-side encryption with customer-provided keys.',
     long_description=long_description,
     install_requires=requires,
+    extras_require={
+        'numpy': ['numpy'],
+        'zstd': ['zstandard']
+    },
     keywords="aws s3 backup encrypted sync",
     classifiers=classifiers,
     entry_points="""
     [console_scripts]
     s3sfe = s3sfe.runner:main
     s3sfe-restore = s3sfe.restorer:main
+    s3sfe-apply = s3sfe.applier:main
     """
 )